@@ -2,6 +2,9 @@ from __future__ import print_function
 from math import *
 from stretch_body.stepper import *
 from stretch_body.device import Device
+from stretch_body.base_odometry import BaseOdometry
+from stretch_body.robot_startup import start_devices
+from stretch_body.trajectory import StepperTrajectory, StepperJointAdapter
 from stretch_body.hello_utils import *
 import logging
 import numpy
@@ -15,10 +18,10 @@ class Base(Device):
         self.left_wheel = Stepper(usb='/dev/hello-motor-left-wheel')
         self.right_wheel = Stepper(usb='/dev/hello-motor-right-wheel')
         self.status = {'timestamp_pc':0,'x':0,'y':0,'theta':0,'x_vel':0,'y_vel':0,'theta_vel':0, 'pose_time_s':0,'effort': [0, 0], 'left_wheel': self.left_wheel.status, 'right_wheel': self.right_wheel.status, 'translation_force': 0, 'rotation_torque': 0}
-        self.first_step=True
         wheel_circumference_m = self.params['wheel_diameter_m'] * pi
         self.meters_per_motor_rad = (wheel_circumference_m / (2.0 * pi)) / self.params['gr']
         self.wheel_separation_m = self.params['wheel_separation_m']
+        self.odometry = BaseOdometry(self.wheel_separation_m)
 
         # Default controller params
         self.stiffness=1.0
@@ -26,16 +29,29 @@ class Base(Device):
         self.accel_mr=self.translate_to_motor_rad(self.params['motion']['default']['accel_m'])
         self.i_contact_l, self.i_contact_r=self.translation_force_to_motor_current(self.params['contact_thresh_N'])
         self.fast_motion_allowed = True
+        self.trajectory = StepperTrajectory(StepperJointAdapter.from_base(self))
+        self.rotation_trajectory = StepperTrajectory(StepperJointAdapter.from_base(self, rotate=True))
     # ###########  Device Methods #############
 
     def startup(self):
-        return self.left_wheel.startup() and self.right_wheel.startup()
+        p = self.robot_params['robot_startup'] #The wheels are on independent boards, so start together
+        report = start_devices({'left_wheel': self.left_wheel, 'right_wheel': self.right_wheel}, parallel=bool(p['parallel']),
+                               timeout=p['timeout_s'], logger=self.logger)
+        return report['total']['success']
 
 
     def stop(self):
+        self.trajectory.stop()
+        self.rotation_trajectory.stop()
         self.left_wheel.stop()
         self.right_wheel.stop()
 
+    def apply_params(self):
+        """Recompute the settings derived from params at init (eg, after a reload, see params_watcher.py)"""
+        self.vel_mr=self.translate_to_motor_rad(self.params['motion']['default']['vel_m'])
+        self.accel_mr=self.translate_to_motor_rad(self.params['motion']['default']['accel_m'])
+        self.i_contact_l, self.i_contact_r=self.translation_force_to_motor_current(self.params['contact_thresh_N'])
+
     def pretty_print(self):
         print('----------Base------')
         print('X (m)',self.status['x'])
@@ -48,6 +64,8 @@ class Base(Device):
         print('Translation Force (N)',self.status['translation_force'])
         print('Rotation Torque (Nm)', self.status['rotation_torque'])
         print('Timestamp PC (s):', self.status['timestamp_pc'])
+        print('Odometry rate (Hz)', self.odometry.status['rate_hz'])
+        print('Odometry steps with IMU', self.odometry.status['n_imu_fused'])
         print('-----Left-Wheel-----')
         self.left_wheel.pretty_print()
         print('-----Right-Wheel-----')
@@ -259,24 +277,23 @@ class Base(Device):
         something.
         """
         if self.robot_params['robot_sentry']['base_max_velocity']:
-            x_lift=robot.lift.status['pos']
-            x_arm =robot.arm.status['pos']
-            x_wrist =robot.end_of_arm.motors['wrist_yaw'].status['pos']
-
-            if ((x_lift < self.params['sentry_max_velocity']['max_lift_height_m']) and
-                    (x_arm < self.params['sentry_max_velocity']['max_arm_extension_m']) and
-                    (x_wrist > self.params['sentry_max_velocity']['min_wrist_yaw_rad'])):
-                if not self.fast_motion_allowed:
-                    self.logger.debug('Fast motion turned on')
-                self.fast_motion_allowed = True
-            else:
-                if self.fast_motion_allowed:
-                    self.logger.debug('Fast motion turned off')
-                self.fast_motion_allowed = False
+            self.step_fast_motion_allowed(robot.lift.status['pos'], robot.arm.status['pos'],
+                                          robot.end_of_arm.motors['wrist_yaw'].status['pos'])
 
         self.left_wheel.step_sentry(robot)
         self.right_wheel.step_sentry(robot)
 
+    def step_fast_motion_allowed(self, x_lift, x_arm, x_wrist):
+        """Update fast_motion_allowed from the lift, arm and wrist yaw positions. Returns True if it changed"""
+        allowed = ((x_lift < self.params['sentry_max_velocity']['max_lift_height_m']) and
+                   (x_arm < self.params['sentry_max_velocity']['max_arm_extension_m']) and
+                   (x_wrist > self.params['sentry_max_velocity']['min_wrist_yaw_rad']))
+        changed = allowed != self.fast_motion_allowed
+        if changed:
+            self.logger.debug('Fast motion turned on' if allowed else 'Fast motion turned off')
+        self.fast_motion_allowed = allowed
+        return changed
+
     # ###################################################
     def push_command(self):
         self.left_wheel.push_command()
@@ -285,6 +302,7 @@ class Base(Device):
     def pull_status(self):
         """
         Computes base odometery based on stepper positions / velocities
+        See BaseOdometry
         """
         self.left_wheel.pull_status()
         self.right_wheel.pull_status()
@@ -301,124 +319,17 @@ class Base(Device):
         self.status['translation_force'] = self.motor_current_to_translation_force(self.left_wheel.status['current'],self.right_wheel.status['current'])
         self.status['rotation_torque'] = self.motor_current_to_rotation_torque(self.left_wheel.status['current'],self.right_wheel.status['current'])
 
-        if self.first_step:
-            # Upon the first step, simply set the initial pose, since
-            # no movement has yet been recorded.
-            self.first_step = False
-
-            self.p0 = p0
-            self.p1 = p1
-
-            self.t0_s = t0
-            self.t1_s = t1
-
-            self.status['x'] = 0.0
-            self.status['y'] = 0.0
-            self.status['theta'] = 0.0
-
-            self.status['x_vel'] = 0.0
-            self.status['y_vel'] = 0.0
-            self.status['theta_vel'] = 0.0
-
-        else:
-            ######################################################
-            # The odometry related was wrtten starting on January 14,
-            # 2019 whle looking at the following BSD-3-Clause licensed
-            # code for reference.
-
-            # https://github.com/merose/diff_drive/blob/master/src/diff_drive/odometry.py
-
-            # The code uses standard calculations. The reference code
-            # specifically cites a document with the following link,
-            # which appears to be broken.
-
-            # https://chess.eecs.berkeley.edu/eecs149/documentation/differentialDrive.pdf
-
-            # There are many sources on the internet for these
-            # equations. For example, the following document is
-            # helpful:
-
-            # http://www8.cs.umu.se/kurser/5DV122/HT13/material/Hellstrom-ForwardKinematics.pdf
-
-            prev_t0_s = self.t0_s
-            prev_t1_s = self.t1_s
-            t0_s = t0
-            t1_s = t1
-
-            delta_t0_s = t0_s - prev_t0_s
-            delta_t1_s = t1_s - prev_t1_s
-
-            if (delta_t0_s > 0.0) and (delta_t1_s > 0.0):
-                # update if time has passed for both motor readings, otherwise do nothing
-
-                average_delta_t_s = (delta_t0_s + delta_t1_s) / 2.0
-
-                # update the times, since both motors have new readings
-                self.prev_t0_s = self.t0_s
-                self.prev_t1_s = self.t1_s
-                self.t0_s = t0_s
-                self.t1_s = t1_s
-
-                # need to check on wrap around / rollover for wheel positions
-                self.prev_p0 = self.p0
-                self.prev_p1 = self.p1
-                self.p0 = p0
-                self.p1 = p1
-
-                # Transform the wheel rotations so that left and right
-                # wheel distances in meters have the convention that
-                # positive values for each wheel corresponds with forward
-                # motion of the mobile base.
-                prev_left_m = self.prev_p0 * self.meters_per_motor_rad
-                left_m = self.p0 * self.meters_per_motor_rad
-
-                prev_right_m = self.prev_p1 * self.meters_per_motor_rad
-                right_m = self.p1 * self.meters_per_motor_rad
-
-                delta_left_m = left_m - prev_left_m
-                delta_right_m = right_m - prev_right_m
-
-                delta_travel = (delta_right_m + delta_left_m) / 2.0
-                delta_theta = (delta_right_m - delta_left_m) / self.wheel_separation_m
-
-                prev_x = self.status['x']
-                prev_y = self.status['y']
-                prev_theta = self.status['theta']
-
-                if delta_left_m == delta_right_m:
-                    # delta_theta is 0.0, which would result in a divide
-                    # by zero error and corresponds with an infinite
-                    # radius of curvature (0 curvature).
-                    delta_x = delta_travel * cos(prev_theta)
-                    delta_y = delta_travel * sin(prev_theta)
-                else:
-                    # calculate the instantaneous center of curvature (ICC)
-                    icc_radius = delta_travel / delta_theta
-                    icc_x = prev_x - (icc_radius * sin(prev_theta))
-                    icc_y = prev_y + (icc_radius * cos(prev_theta))
-
-                    # calculate the change in position based on the ICC
-                    delta_x = ((cos(delta_theta) * (prev_x - icc_x))
-                               - (sin(delta_theta) * (prev_y - icc_y))
-                               + icc_x - prev_x)
-
-                    delta_y = ((sin(delta_theta) * (prev_x - icc_x))
-                               + (cos(delta_theta) * (prev_y - icc_y))
-                               + icc_y - prev_y)
-
-                # update the estimated total time passed since odometry started
-                self.status['pose_time_s'] = self.status['pose_time_s'] + average_delta_t_s
-
-                # update the robot's velocity estimates
-                self.status['x_vel'] = delta_travel / average_delta_t_s
-                self.status['y_vel'] = 0.0
-                self.status['theta_vel'] = delta_theta / average_delta_t_s
-
-                # update the robot's pose estimates
-                self.status['x'] = prev_x + delta_x
-                self.status['y'] = prev_y + delta_y
-                self.status['theta'] = (prev_theta + delta_theta) % (2.0 * pi)
+        # Wheel distances are positive for forward motion of the base
+        if self.odometry.step(t0, p0 * self.meters_per_motor_rad, t1, p1 * self.meters_per_motor_rad, self.status['timestamp_pc']):
+            for k in ['x', 'y', 'theta', 'x_vel', 'y_vel', 'theta_vel', 'pose_time_s']:
+                self.status[k] = self.odometry.status[k]
 
+    def pose_at(self, t):
+        """
+        Odometry pose (x, y, theta) at PC time t (eg, time.time() when a camera frame was captured)
+        Returns None if t is older than the pose history (base_odometry.history_s)
+        """
+        return self.odometry.pose_at(t)
 
     # ################################
 
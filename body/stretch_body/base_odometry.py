@@ -0,0 +1,366 @@
+from __future__ import print_function
+from stretch_body.device import Device
+import threading
+import time
+import math
+import numpy as np
+
+
+def wrap_angle(x):
+    """Wrap an angle to [-pi, pi)"""
+    return (x + math.pi) % (2.0 * math.pi) - math.pi
+
+
+def arc_step(x, y, theta, delta_travel, delta_theta):
+    """
+    Pose after driving delta_travel along an arc that turns by delta_theta (differential drive, constant curvature)
+    Same as stepping about the instantaneous center of curvature (ICC), but without the special case for straight motion
+    """
+    # The ICC form was written on January 14, 2019 while looking at the following BSD-3-Clause licensed
+    # code for reference: https://github.com/merose/diff_drive/blob/master/src/diff_drive/odometry.py
+    # See also http://www8.cs.umu.se/kurser/5DV122/HT13/material/Hellstrom-ForwardKinematics.pdf
+    h = delta_theta / 2.0
+    s = math.sin(h) / h if abs(h) > 1e-9 else 1.0 - h * h / 6.0
+    return (x + delta_travel * s * math.cos(theta + h),
+            y + delta_travel * s * math.sin(theta + h),
+            theta + delta_theta)
+
+
+def _arc_sinc(h):
+    """sin(h) / h, elementwise, as in arc_step"""
+    h_safe = np.where(np.abs(h) > 1e-9, h, 1.0)
+    return np.where(np.abs(h) > 1e-9, np.sin(h_safe) / h_safe, 1.0 - h * h / 6.0)
+
+
+def _integrated_samples(t_left, t_right):
+    """
+    Indices of the samples BaseOdometry.step integrates: the first, then each next one where both wheels have a newer timestamp
+    Timestamps must be non-decreasing (as they are from DeviceTimestamp)
+    """
+    n = len(t_left)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    # First sample after i where both wheels have advanced past sample i
+    nxt = np.maximum(np.searchsorted(t_left, t_left, side='right'), np.searchsorted(t_right, t_right, side='right'))
+    irregular = np.flatnonzero(nxt != np.arange(1, n + 1))
+    if len(irregular) == 0:
+        return np.arange(n)
+    # Follow the chain from sample 0, jumping over runs where every sample is integrated
+    keep = np.zeros(n, dtype=bool)
+    i = 0
+    while i < n:
+        k = np.searchsorted(irregular, i)
+        j = irregular[k] if k < len(irregular) else n
+        if j > i:
+            keep[i:j] = True
+            i = j
+        else:
+            keep[i] = True
+            i = nxt[i]
+    return np.flatnonzero(keep)
+
+
+def batch_odometry(t_left, pos_left, t_right, pos_right, meters_per_motor_rad, wheel_separation_m):
+    """
+    Wheel odometry over recorded wheel status, as BaseOdometry.step (without the IMU) would integrate it, but vectorized
+
+    t_left, t_right: arrays of N wheel status timestamps (s)
+    pos_left, pos_right: arrays of N wheel positions (motor rad, the wheel status 'pos')
+    meters_per_motor_rad, wheel_separation_m: geometry of the base (see Base). Either may be an array of M
+        candidate geometries, in which case each returned pose array has shape (M, number of poses)
+
+    Returns dict of
+        index: indices of the samples that were integrated (those where both wheels have a new reading)
+        t: timestamp of each pose, the mean of the wheels'
+        x, y, theta: pose (theta not wrapped)
+    """
+    t_left = np.asarray(t_left, dtype=np.float64)
+    t_right = np.asarray(t_right, dtype=np.float64)
+    idx = _integrated_samples(t_left, t_right)
+    mpr = np.asarray(meters_per_motor_rad, dtype=np.float64)
+    sep = np.asarray(wheel_separation_m, dtype=np.float64)
+    if mpr.ndim or sep.ndim:
+        mpr = mpr.reshape(-1, 1)
+        sep = sep.reshape(-1, 1)
+    left_m = np.asarray(pos_left, dtype=np.float64)[idx] * mpr
+    right_m = np.asarray(pos_right, dtype=np.float64)[idx] * mpr
+    delta_left = np.diff(left_m, axis=-1)
+    delta_right = np.diff(right_m, axis=-1)
+    delta_travel = (delta_right + delta_left) / 2.0
+    delta_theta = (delta_right - delta_left) / sep
+    delta_travel, delta_theta = np.broadcast_arrays(delta_travel, delta_theta)
+    zero = np.zeros(delta_theta.shape[:-1] + (1,))
+    theta = np.concatenate([zero, np.cumsum(delta_theta, axis=-1)], axis=-1)
+    h = delta_theta / 2.0
+    d = delta_travel * _arc_sinc(h)
+    x = np.concatenate([zero, np.cumsum(d * np.cos(theta[..., :-1] + h), axis=-1)], axis=-1)
+    y = np.concatenate([zero, np.cumsum(d * np.sin(theta[..., :-1] + h), axis=-1)], axis=-1)
+    return {'index': idx, 't': (t_left[idx] + t_right[idx]) / 2.0, 'x': x, 'y': y, 'theta': theta}
+
+
+def sweep_odometry(t_left, pos_left, t_right, pos_right, gr, wheel_diameters_m, wheel_separations_m,
+                   truth_t, truth_x, truth_y, truth_theta, max_elements=20000000):
+    """
+    Evaluate candidate base geometries (eg, to tune wheel_diameter_m and wheel_separation_m) against ground truth poses
+
+    The recorded wheel status (see batch_odometry) is integrated for every combination of wheel_diameters_m and
+    wheel_separations_m. Each odometry track is aligned with the ground truth at its first pose, and compared at the
+    ground truth times truth_t (same clock as the wheel timestamps, within the recording).
+    gr: wheel gear ratio (base.gr)
+    max_elements: bounds memory use, by integrating candidates in chunks of at most this many poses
+
+    Returns dict of
+        wheel_diameter_m, wheel_separation_m: (D, S) grids of the candidates
+        pos_rms_m, theta_rms_rad: (D, S) RMS position and heading errors
+        best: (wheel_diameter_m, wheel_separation_m) with the least position error
+    """
+    dd, ss = np.meshgrid(np.asarray(wheel_diameters_m, dtype=np.float64), np.asarray(wheel_separations_m, dtype=np.float64), indexing='ij')
+    mpr = (dd.ravel() * math.pi / (2.0 * math.pi)) / gr #As Base.meters_per_motor_rad
+    sep = ss.ravel()
+    truth_t = np.asarray(truth_t, dtype=np.float64)
+    truth_x = np.asarray(truth_x, dtype=np.float64)
+    truth_y = np.asarray(truth_y, dtype=np.float64)
+    truth_theta = np.asarray(truth_theta, dtype=np.float64)
+    pos_rms = np.zeros(len(mpr))
+    theta_rms = np.zeros(len(mpr))
+    chunk = max(1, int(max_elements // max(1, len(t_left))))
+    for a in range(0, len(mpr), chunk):
+        o = batch_odometry(t_left, pos_left, t_right, pos_right, mpr[a:a + chunk], sep[a:a + chunk])
+        for k in range(o['x'].shape[0]):
+            x = np.interp(truth_t, o['t'], o['x'][k])
+            y = np.interp(truth_t, o['t'], o['y'][k])
+            th = np.interp(truth_t, o['t'], o['theta'][k])
+            # Align with the ground truth at its first pose
+            r = truth_theta[0] - th[0]
+            c, s = math.cos(r), math.sin(r)
+            xa = truth_x[0] + c * (x - x[0]) - s * (y - y[0])
+            ya = truth_y[0] + s * (x - x[0]) + c * (y - y[0])
+            tha = th + r
+            pos_rms[a + k] = np.sqrt(np.mean((xa - truth_x) ** 2 + (ya - truth_y) ** 2))
+            theta_rms[a + k] = np.sqrt(np.mean(((tha - truth_theta + math.pi) % (2.0 * math.pi) - math.pi) ** 2))
+    i = int(np.argmin(pos_rms))
+    return {'wheel_diameter_m': dd, 'wheel_separation_m': ss,
+            'pos_rms_m': pos_rms.reshape(dd.shape), 'theta_rms_rad': theta_rms.reshape(dd.shape),
+            'best': (float(dd.ravel()[i]), float(ss.ravel()[i]))}
+
+
+class ClockSync:
+    """
+    Maps the timestamps of a device to the PC clock (time.time())
+
+    A status packet is always read some time after the device stamped it, so the
+    offset (pc - device) with the least transport delay is the smallest seen.
+    The estimate is allowed to grow by max_drift (s/s) to follow clock drift.
+    """
+    def __init__(self, max_drift=1e-4):
+        self.max_drift = max_drift
+        self.offset = None
+        self.t_last = None
+
+    def update(self, t_device, t_pc):
+        o = t_pc - t_device
+        if self.offset is None:
+            self.offset = o
+        else:
+            self.offset = min(self.offset + self.max_drift * max(0.0, t_device - self.t_last), o)
+        self.t_last = t_device
+        return t_device + self.offset
+
+    def to_pc(self, t_device):
+        return t_device + self.offset
+
+
+class BaseOdometry(Device):
+    """
+    Wheel odometry of the mobile base, with the yaw rate of the IMU fused into theta
+
+    Steps on every new pair of wheel readings, so poses are integrated at the rate the wheel status is pulled
+    (the Robot pulls it in its own thread at base_odometry.rate_hz).
+    The change in heading over a step is a blend of the wheels' and the gyro's:
+        delta_theta = imu.gyro_weight * gz * dt + (1 - imu.gyro_weight) * delta_theta_wheels
+    The gyro (z, counter-clockwise positive) is used only while its readings are fresh (imu.max_age_s), and
+    only while the wheels move (faster than imu.still_vel_m). While they are still, gz is averaged (over about
+    imu.bias_tau_s) into the gyro bias, which is subtracted from gz once moving, so a parked base keeps its heading.
+    With imu.heading_gain > 0, theta is also slowly pulled toward the IMU heading (relative to where it
+    was at reset) to bound gyro drift. This is off by default, as the magnetometer is unreliable indoors.
+
+    Poses are stamped on the PC clock (time.time()) and kept for base_odometry.history_s in a ring buffer,
+    so pose_at(t) can return the pose at the time of, eg, a camera frame.
+
+    batch_odometry repeats the wheel integration offline over recorded wheel status, and sweep_odometry
+    uses it to evaluate candidate base geometries against ground truth.
+    """
+    def __init__(self, wheel_separation_m):
+        Device.__init__(self, 'base_odometry')
+        self.wheel_separation_m = wheel_separation_m
+        self.lock = threading.Lock()
+        self.imu_status = None
+        self.n_history = int(math.ceil(self.params['history_s'] * self.params['history_max_rate_hz']))
+        self.history = np.zeros((self.n_history, 4)) #t, x, y, theta (unwrapped)
+        self.status = {'timestamp_pc': 0, 'x': 0.0, 'y': 0.0, 'theta': 0.0, 'x_vel': 0.0, 'y_vel': 0.0, 'theta_vel': 0.0,
+                       'pose_time_s': 0.0, 'n_step': 0, 'n_imu_fused': 0, 'rate_hz': 0.0, 'gz_bias': 0.0}
+        self.gz_bias = 0.0 #Kept over reset, as it is a property of the gyro
+        self.reset()
+
+    def reset(self):
+        """Restart odometry at the origin"""
+        with self.lock:
+            self.first_step = True
+            self.clock_left = ClockSync()
+            self.clock_right = ClockSync()
+            self.x = 0.0
+            self.y = 0.0
+            self.theta = 0.0
+            self.heading0 = None
+            self.imu_ts = None
+            self.imu_ts_pc = None
+            self.n = 0 #Number of poses in history
+            self.idx = 0 #Next history row to write
+            for k in ['x', 'y', 'theta', 'x_vel', 'y_vel', 'theta_vel', 'pose_time_s']:
+                self.status[k] = 0.0
+
+    def set_imu(self, imu_status):
+        """Fuse the IMU (status dict of pimu.IMU) into theta, or None for wheels only"""
+        self.imu_status = imu_status
+
+    def pretty_print(self):
+        print('----------Base Odometry------')
+        print('X (m)', self.status['x'])
+        print('Y (m)', self.status['y'])
+        print('Theta (rad)', self.status['theta'])
+        print('X_vel (m/s)', self.status['x_vel'])
+        print('Theta_vel (rad/s)', self.status['theta_vel'])
+        print('Pose time (s)', self.status['pose_time_s'])
+        print('Steps', self.status['n_step'])
+        print('Steps with IMU', self.status['n_imu_fused'])
+        print('Gyro bias (rad/s)', self.status['gz_bias'])
+        print('Rate (Hz)', self.status['rate_hz'])
+        print('History (s) %.2f' % (self.get_history_span()))
+
+    # ###################################################
+
+    def _imu_yaw_rate(self, t_pc):
+        """Latest fresh gyro z rate, or None"""
+        s = self.imu_status
+        if s is None or not self.params['imu']['enabled']:
+            return None
+        if s['timestamp'] != self.imu_ts:
+            self.imu_ts = s['timestamp']
+            self.imu_ts_pc = t_pc
+        if self.imu_ts_pc is None or t_pc - self.imu_ts_pc > self.params['imu']['max_age_s']:
+            return None
+        return s['gz']
+
+    def step(self, t_left, left_m, t_right, right_m, t_pc=None):
+        """
+        Integrate new wheel readings
+        t_left, t_right: device timestamps of the readings (s)
+        left_m, right_m: distance travelled by each wheel (m), positive forward
+        t_pc: time the readings were pulled (defaults to now)
+        Returns True if the pose was updated (both wheels have a new reading)
+        """
+        t_pc = time.time() if t_pc is None else t_pc
+        with self.lock:
+            tl = self.clock_left.update(t_left, t_pc)
+            tr = self.clock_right.update(t_right, t_pc)
+            t = (tl + tr) / 2.0
+            if self.first_step:
+                self.first_step = False
+                self.t_left, self.t_right, self.left_m, self.right_m, self.t = t_left, t_right, left_m, right_m, t
+                if self.imu_status is not None:
+                    self.heading0 = self.imu_status['heading']
+                self._record(t)
+                return True
+            dt_left = t_left - self.t_left
+            dt_right = t_right - self.t_right
+            if dt_left <= 0.0 or dt_right <= 0.0:
+                return False
+            dt = (dt_left + dt_right) / 2.0
+
+            delta_left = left_m - self.left_m
+            delta_right = right_m - self.right_m
+            delta_travel = (delta_right + delta_left) / 2.0
+            delta_theta = (delta_right - delta_left) / self.wheel_separation_m
+            gz = self._imu_yaw_rate(t_pc)
+            if gz is not None and max(abs(delta_left), abs(delta_right)) <= self.params['imu']['still_vel_m'] * dt:
+                # Wheels still: the base isn't turning, so the gyro reads its bias. Track it rather than integrate it
+                self.gz_bias = self.gz_bias + min(1.0, dt / self.params['imu']['bias_tau_s']) * (gz - self.gz_bias)
+                self.status['gz_bias'] = self.gz_bias
+            elif gz is not None:
+                w = self.params['imu']['gyro_weight']
+                delta_theta = w * (gz - self.gz_bias) * dt + (1.0 - w) * delta_theta
+                if self.params['imu']['heading_gain'] > 0 and self.heading0 is not None:
+                    err = wrap_angle(self.imu_status['heading'] - self.heading0 - self.theta)
+                    delta_theta = delta_theta + min(1.0, self.params['imu']['heading_gain'] * dt) * err
+                self.status['n_imu_fused'] += 1
+
+            self.x, self.y, self.theta = arc_step(self.x, self.y, self.theta, delta_travel, delta_theta)
+            self.t_left, self.t_right, self.left_m, self.right_m = t_left, t_right, left_m, right_m
+            self.status['rate_hz'] = 0.9 * self.status['rate_hz'] + 0.1 / dt if self.status['rate_hz'] else 1.0 / dt
+            self.status['pose_time_s'] = self.status['pose_time_s'] + dt
+            self.status['x_vel'] = delta_travel / dt
+            self.status['y_vel'] = 0.0
+            self.status['theta_vel'] = delta_theta / dt
+            self._record(max(t, self.t)) #PC times of successive readings can't go backward
+            self.t = max(t, self.t)
+            return True
+
+    def _record(self, t):
+        self.status['x'] = self.x
+        self.status['y'] = self.y
+        self.status['theta'] = self.theta % (2.0 * math.pi)
+        self.status['timestamp_pc'] = t
+        self.status['n_step'] += 1
+        self.history[self.idx] = (t, self.x, self.y, self.theta)
+        self.idx = (self.idx + 1) % self.n_history
+        self.n = min(self.n + 1, self.n_history)
+
+    # ###################################################
+
+    def get_history(self):
+        """
+        Returns the pose history, oldest first, as arrays t (PC time, s), x, y and theta (rad, not wrapped)
+        """
+        with self.lock:
+            h = np.roll(self.history, -self.idx, axis=0)[self.n_history - self.n:].copy()
+        return h[:, 0], h[:, 1], h[:, 2], h[:, 3]
+
+    def get_history_span(self):
+        with self.lock:
+            if self.n == 0:
+                return 0.0
+            return self.history[(self.idx - 1) % self.n_history, 0] - self.history[(self.idx - self.n) % self.n_history, 0]
+
+    def pose_at(self, t):
+        """
+        Pose at PC time t (eg, the capture time of a camera frame), interpolated from the history
+        Times a little past the latest pose (up to max_extrapolation_s) are extrapolated at the current velocity
+        Returns (x, y, theta) with theta in [0, 2pi), or None if t isn't covered by the history
+        """
+        with self.lock:
+            if self.n == 0:
+                return None
+            newest = (self.idx - 1) % self.n_history
+            t1, x1, y1, th1 = self.history[newest]
+            if t >= t1:
+                dt = t - t1
+                if dt > self.params['max_extrapolation_s']:
+                    return None
+                x, y, th = arc_step(x1, y1, th1, self.status['x_vel'] * dt, self.status['theta_vel'] * dt)
+                return x, y, th % (2.0 * math.pi)
+            # Binary search of the ring buffer, in order of age
+            lo = 0
+            hi = self.n - 1
+            first = self.idx - self.n
+            if t < self.history[first % self.n_history, 0]:
+                return None
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if self.history[(first + mid) % self.n_history, 0] <= t:
+                    lo = mid
+                else:
+                    hi = mid
+            a = self.history[(first + lo) % self.n_history]
+            b = self.history[(first + hi) % self.n_history]
+        f = (t - a[0]) / (b[0] - a[0]) if b[0] > a[0] else 1.0
+        return (a[1] + f * (b[1] - a[1]), a[2] + f * (b[2] - a[2]), (a[3] + f * (b[3] - a[3])) % (2.0 * math.pi))
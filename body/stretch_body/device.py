@@ -1,7 +1,9 @@
 from __future__ import print_function
 from stretch_body.robot_params import RobotParams
 import stretch_body.hello_utils as hello_utils
+import stretch_body.logging_queue as logging_queue
 import time
+import threading
 import logging, logging.config
 
 
@@ -23,18 +25,49 @@ class DeviceTimestamp:
         return self.ts_start+s
 
 
+_logging_lock = threading.Lock()
+_logging_configured = False
+# Loggers that existed when stretch_body was imported. Only these are disabled by 'disable_existing_loggers',
+# as when logging was configured on import
+_loggers_at_import = list(logging.Logger.manager.loggerDict.keys())
+
+
+def configure_logging():
+    """
+    Configure logging from the 'logging' params (and start the logging queue if enabled)
+    Done once, by the first Device created rather than on import, so importing stretch_body creates no log file and
+    RobotParams.set_logging_level() applies up to then
+    """
+    global _logging_configured
+    with _logging_lock:
+        if _logging_configured:
+            return
+        _logging_configured = True
+        robot_params = RobotParams.get_params()[1]
+        logging_params = dict(robot_params['logging'], disable_existing_loggers=False)
+        logging.config.dictConfig(logging_params)
+        if robot_params['logging'].get('disable_existing_loggers', True):
+            for name in _loggers_at_import:
+                logger = logging.Logger.manager.loggerDict.get(name)
+                if isinstance(logger, logging.Logger) and name not in logging_params.get('loggers', {}):
+                    logger.disabled = True
+        if robot_params.get('logging_queue', {}).get('enabled'):
+            logging_queue.start(robot_params['logging_queue'])
+
+
 class Device:
-    logging_params = RobotParams.get_params()[1]['logging']
-    logging.config.dictConfig(logging_params)
     """
     Generic base class for all custom Stretch hardware
     """
     def __init__(self, name=''):
+        configure_logging()
         self.name = name
         self.user_params, self.robot_params = RobotParams.get_params()
         self.params = self.robot_params.get(self.name, {})
         self.logger = logging.getLogger(self.name)
         self.timestamp = DeviceTimestamp()
+        self.status_cond = threading.Condition()
+        self.status_seq = 0
 
     # ########### Primary interface #############
 
@@ -60,6 +93,44 @@ class Device:
         print('----- {0} ------ '.format(self.name))
         hello_utils.pretty_print_dict("params", self.params)
 
+    # ########### Status events #############
+
+    def notify_status(self):
+        """
+        Signal that new status data is available. Wakes any thread blocked in wait_until
+        """
+        with self.status_cond:
+            self.status_seq += 1
+            self.status_cond.notify_all()
+
+    def wait_until(self, predicate, timeout=None, poll_s=0.1):
+        """
+        Block until predicate() is True, evaluated on status newer than the call, or until timeout.
+        Wakes within one status update of the predicate becoming True.
+        If no other thread (eg, a Robot status thread) updates the status within poll_s,
+        the status is pulled from this thread instead.
+
+        predicate: callable returning bool (eg, lambda: self.status['stalled'])
+        timeout: seconds, or None to wait forever
+        Returns True if the predicate was met, False on timeout
+        """
+        ts = time.time()
+        with self.status_cond:
+            seq = self.status_seq
+        while timeout is None or time.time() - ts < timeout:
+            with self.status_cond:
+                if self.status_seq == seq:
+                    wait_s = poll_s if timeout is None else max(0.0, min(poll_s, timeout - (time.time() - ts)))
+                    self.status_cond.wait(wait_s)
+                fresh = self.status_seq != seq
+            if not fresh:
+                self.pull_status()
+            with self.status_cond:
+                seq = self.status_seq
+            if predicate():
+                return True
+        return False
+
     def write_device_params(self,device_name, params):
         rp=hello_utils.read_fleet_yaml(self.user_params['factory_params'])
         rp[device_name]=params
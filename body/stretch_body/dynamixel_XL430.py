@@ -7,6 +7,7 @@ from dynamixel_sdk.robotis_def import *
 import dynamixel_sdk.port_handler as prh
 import dynamixel_sdk.packet_handler as pch
 import threading
+import os
 from stretch_body.device import Device
 import serial
 
@@ -105,6 +106,45 @@ BAUD_MAP = {
 class DynamixelCommError(Exception):
     pass
 
+# Virtual buses keyed by usb name (see stretch_body.dynamixel_sim)
+sim_buses = {}
+
+def create_port_handler(usb):
+    """Returns a PortHandler for usb, or a simulated one if a virtual bus is registered on that name"""
+    if usb in sim_buses:
+        return sim_buses[usb].create_port_handler(usb)
+    return prh.PortHandler(usb)
+
+def get_usb_latency_timer(usb):
+    """Returns the USB-serial (FTDI) latency timer of usb in ms, or None if not available"""
+    if usb in sim_buses:
+        return sim_buses[usb].latency_timer_ms
+    fn = '/sys/bus/usb-serial/devices/%s/latency_timer' % os.path.basename(os.path.realpath(usb))
+    try:
+        with open(fn, 'r') as f:
+            return int(f.read())
+    except (IOError, ValueError):
+        return None
+
+def set_usb_latency_timer(usb, latency_ms):
+    """Sets the USB-serial (FTDI) latency timer of usb (eg, /dev/hello-dynamixel-head) in ms via sysfs
+
+    Returns
+    -------
+    bool
+        True if the latency timer was set, else False (eg, no permission to write sysfs)
+    """
+    if usb in sim_buses:
+        sim_buses[usb].latency_timer_ms = latency_ms
+        return True
+    fn = '/sys/bus/usb-serial/devices/%s/latency_timer' % os.path.basename(os.path.realpath(usb))
+    try:
+        with open(fn, 'w') as f:
+            f.write(str(int(latency_ms)))
+        return True
+    except IOError:
+        return False
+
 
 class DynamixelXL430():
     """
@@ -124,7 +164,7 @@ class DynamixelXL430():
         self.packet_handler=None
         try:
             if port_handler is None:
-                self.port_handler = prh.PortHandler(usb)
+                self.port_handler = create_port_handler(usb)
                 self.port_handler.openPort()
                 self.port_handler.setBaudRate(baud)
             else:
@@ -151,7 +191,7 @@ class DynamixelXL430():
             the baud rate the Dynamixel is communicating at
         """
         for b in BAUD_MAP.keys():
-            port_h = prh.PortHandler(usb)
+            port_h = create_port_handler(usb)
             port_h.openPort()
             port_h.setBaudRate(b)
             packet_h = pch.PacketHandler(2.0)
@@ -394,6 +434,14 @@ class DynamixelXL430():
             dxl_comm_result, dxl_error =   self.packet_handler.write1ByteTxRx(self.port_handler, self.dxl_id, XL430_ADDR_TORQUE_ENABLE, 0)
         self.handle_comm_result('XL430_ADDR_TORQUE_ENABLE', dxl_comm_result, dxl_error)
 
+    def get_return_delay_time(self):
+        if not self.hw_valid:
+            return 0
+        with self.pt_lock:
+            p, dxl_comm_result, dxl_error = self.packet_handler.read1ByteTxRx(self.port_handler, self.dxl_id, XL430_ADDR_RETURN_DELAY_TIME)
+        self.handle_comm_result('XL430_ADDR_RETURN_DELAY_TIME', dxl_comm_result, dxl_error)
+        return p
+
     def set_return_delay_time(self,x):
         if not self.hw_valid:
             return
@@ -496,6 +544,23 @@ class DynamixelXL430():
             dxl_comm_result, dxl_error =   self.packet_handler.write4ByteTxRx(self.port_handler, self.dxl_id, XL430_ADDR_GOAL_POSITION, x)
         self.handle_comm_result('XL430_ADDR_GOAL_POSITION', dxl_comm_result, dxl_error)
 
+    def reg_go_to_pos(self, x):
+        """Stage a goal position with REG_WRITE. It takes effect on the next action() on the bus"""
+        if not self.hw_valid:
+            return
+        data = [DXL_LOBYTE(DXL_LOWORD(x)), DXL_HIBYTE(DXL_LOWORD(x)), DXL_LOBYTE(DXL_HIWORD(x)), DXL_HIBYTE(DXL_HIWORD(x))]
+        with self.pt_lock:
+            dxl_comm_result, dxl_error = self.packet_handler.regWriteTxRx(self.port_handler, self.dxl_id, XL430_ADDR_GOAL_POSITION, 4, data)
+        self.handle_comm_result('XL430_ADDR_GOAL_POSITION', dxl_comm_result, dxl_error)
+
+    def action(self):
+        """Broadcast ACTION so every servo on the bus applies its staged command at once"""
+        if not self.hw_valid:
+            return
+        with self.pt_lock:
+            dxl_comm_result = self.packet_handler.action(self.port_handler, BROADCAST_ID)
+        self.handle_comm_result('ACTION', dxl_comm_result, 0)
+
     def set_vel(self, x):
         with self.pt_lock:
             dxl_comm_result, dxl_error = self.packet_handler.write4ByteTxRx(self.port_handler, self.dxl_id,
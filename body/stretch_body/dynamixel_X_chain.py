@@ -6,7 +6,7 @@ import time
 # /opt/ros/melodic/lib/python2.7/dist-packages/dynamixel_sdk/
 from dynamixel_sdk.robotis_def import *
 from stretch_body.dynamixel_XL430 import *
-from stretch_body.dynamixel_hello_XL430 import DynamixelCommErrorStats
+from stretch_body.dynamixel_hello_XL430 import DynamixelCommErrorStats, DynamixelStatusScheduler
 import dynamixel_sdk.port_handler as prh
 import dynamixel_sdk.packet_handler as pch
 import dynamixel_sdk.group_sync_read as gsr
@@ -25,11 +25,13 @@ class DynamixelXChain(Device):
 
         try:
             prh.LATENCY_TIMER = self.params['dxl_latency_timer']
-            self.port_handler = prh.PortHandler(usb)
+            self.port_handler = create_port_handler(usb)
             self.port_handler.openPort()
             self.port_handler.setBaudRate(int(self.params['baud']))
             self.packet_handler = pch.PacketHandler(2.0)
             self.hw_valid = True
+            if self.params.get('usb_latency_timer_ms', 0) and not set_usb_latency_timer(usb, self.params['usb_latency_timer_ms']):
+                self.logger.warning('Unable to set USB latency timer of %s to %d ms' % (usb, self.params['usb_latency_timer_ms']))
         except serial.SerialException as e:
             self.packet_handler = None
             self.port_handler = None
@@ -40,7 +42,7 @@ class DynamixelXChain(Device):
         self.motors = {}
         self.readers={}
         self.comm_errors = DynamixelCommErrorStats(name, logger=self.logger)
-        self.status_mux_id = 0
+        self.status_scheduler = DynamixelStatusScheduler(name)
 
     def add_motor(self,m):
         self.motors[m.name]=m
@@ -91,6 +93,16 @@ class DynamixelXChain(Device):
             self.motors[mk].stop()
         self.hw_valid = False
 
+    def action(self):
+        """
+        Apply the commands staged on the servos of the chain (eg, with stage_move_to) simultaneously
+        """
+        if not self.hw_valid:
+            return
+        with self.pt_lock:
+            dxl_comm_result = self.packet_handler.action(self.port_handler, BROADCAST_ID)
+        if dxl_comm_result != COMM_SUCCESS:
+            self.comm_errors.add_error(rx=False, gsr=False)
 
     def pull_status(self):
         if not self.hw_valid:
@@ -106,32 +118,32 @@ class DynamixelXChain(Device):
                 if vel == None and self.params['retry_on_comm_failure']:
                     vel = self.sync_read(self.readers['vel'])
 
-                if self.status_mux_id == 0:
+                # Slow registers are read for the whole chain when any motor needs them
+                fields = self.status_scheduler.select(list(self.motors.values()))
+                if 'effort' in fields:
                     effort = self.sync_read(self.readers['effort'])
                     if effort == None and self.params['retry_on_comm_failure']:
                         effort = self.sync_read(self.readers['effort'])
                 else:
                     effort = None
 
-                if self.status_mux_id == 1:
+                if 'temp' in fields:
                     temp = self.sync_read(self.readers['temp'])
                     if temp == None and self.params['retry_on_comm_failure']:
                         temp = self.sync_read(self.readers['temp'])
                 else:
                     temp = None
 
-                if self.status_mux_id == 2:
+                if 'hardware_error' in fields:
                     hardware_error = self.sync_read(self.readers['hardware_error'])
                     if hardware_error == None and self.params['retry_on_comm_failure']:
                         hardware_error = self.sync_read(self.readers['hardware_error'])
                 else:
                     hardware_error = None
 
-                self.status_mux_id = (self.status_mux_id + 1) % 3
-
                 idx = 0
                 # Build dictionary of status data and push to each motor status
-                # None may indicate comm error or the field wasn't read on this mux cycle
+                # None may indicate comm error or the field wasn't scheduled on this cycle
                 for mk in self.motors.keys():
                     data = {'ts': time.time()}
                     if pos is not None:
@@ -142,18 +154,9 @@ class DynamixelXChain(Device):
                         data['v'] = vel[idx]
                     else:
                         data['v'] = self.motors[mk].status['vel_ticks']
-                    if effort is not None:
-                        data['eff'] = effort[idx]
-                    else:
-                        data['eff'] = self.motors[mk].status['effort_ticks']
-                    if temp is not None:
-                        data['temp'] = temp[idx]
-                    else:
-                        data['temp'] = self.motors[mk].status['temp']
-                    if hardware_error is not None:
-                        data['err'] = hardware_error[idx]
-                    else:
-                        data['err'] = self.motors[mk].status['hardware_error']
+                    data['eff'] = effort[idx] if effort is not None else None
+                    data['temp'] = temp[idx] if temp is not None else None
+                    data['err'] = hardware_error[idx] if hardware_error is not None else None
                     self.motors[mk].pull_status(data)
                     idx = idx + 1
             else:
@@ -164,6 +167,8 @@ class DynamixelXChain(Device):
             self.comm_errors.add_error(rx=True, gsr=True)
             self.port_handler.ser.reset_output_buffer()
             self.port_handler.ser.reset_input_buffer()
+            return
+        self.notify_status()
 
     def pretty_print(self):
         print('--- Dynamixel X Chain ---')
@@ -0,0 +1,271 @@
+from __future__ import print_function
+import time
+
+from dynamixel_sdk.robotis_def import *
+import dynamixel_sdk.port_handler as prh
+import dynamixel_sdk.group_sync_read as gsr
+from stretch_body.dynamixel_XL430 import *
+from stretch_body.device import Device
+import stretch_body.hello_utils as hello_utils
+
+
+class DynamixelBusTuner(Device):
+    """
+    Find the fastest reliable configuration of a Dynamixel chain (eg, head or end_of_arm) and persist it
+
+    The tuner steps the chain up through the candidate baud rates. At each step every servo is migrated
+    with set_baud_rate, the chain is pinged and a group sync read benchmark measures the achieved
+    status rate and comm error rate. The first rate that fails (or loses a servo) is rolled back,
+    using identify_baud_rate to find any servo that stopped answering, and the last good rate is kept.
+    Return delay time and the USB latency timer are set before stepping so the benchmark measures the final
+    configuration. If the chain can't be recovered the original settings are restored.
+    Saving also raises robot.dxl_status_rate_hz to what the tuned chains allow (see get_status_rate).
+
+    Chain must not be in use by another process (eg, a running Robot) while tuning.
+    """
+    def __init__(self, chain_name, motor_names):
+        Device.__init__(self, name='dxl_bus_tuner')
+        self.chain_name = chain_name
+        self.motor_names = motor_names
+        self.chain_params = self.robot_params[chain_name]
+        self.usb = self.robot_params[motor_names[0]]['usb_name']
+        self.ids = [self.robot_params[m]['id'] for m in motor_names]
+        self.port_handler = None
+        self.packet_handler = None
+        self.motors = []
+        self.status = {'baud': None, 'usb_latency_timer_ms': None, 'return_delay_time': None, 'results': {}}
+
+    # ###########  Bus access #############
+
+    def open(self, baud):
+        """Open the port at baud, or switch an open port to baud"""
+        if self.port_handler is None:
+            self.port_handler = create_port_handler(self.usb)
+            self.port_handler.openPort()
+            self.packet_handler = pch.PacketHandler(2.0)
+            self.motors = [DynamixelXL430(dxl_id=i, usb=self.usb, port_handler=self.port_handler, baud=baud, logger=self.logger) for i in self.ids]
+        self.port_handler.setBaudRate(baud)
+        for m in self.motors:
+            m.baud = baud
+
+    def close(self):
+        if self.port_handler is not None:
+            self.port_handler.closePort()
+            self.port_handler = None
+            self.motors = []
+
+    def ping_all(self, retries=3):
+        for m in self.motors:
+            if not any([m.do_ping(verbose=False) for _ in range(retries)]):
+                self.logger.warning('Servo ID %d not answering at %d baud' % (m.dxl_id, self.port_handler.getBaudRate()))
+                return False
+        return True
+
+    def find_bus_baud(self):
+        """Return the baud rate shared by all servos on the chain, or None if they differ or are missing"""
+        bauds = [DynamixelXL430.identify_baud_rate(i, self.usb) for i in self.ids]
+        self.logger.debug('Chain %s servo baud rates: %s' % (self.chain_name, str(bauds)))
+        if -1 in bauds or len(set(bauds)) != 1:
+            return None
+        return bauds[0]
+
+    def migrate(self, baud):
+        """Move every servo to baud and verify they answer. Returns False if any servo is lost"""
+        self.logger.info('Migrating %s to %d baud' % (self.chain_name, baud))
+        try:
+            for m in self.motors:
+                if not m.set_baud_rate(baud):
+                    return False
+        except DynamixelCommError:
+            return False
+        self.open(baud)
+        return self.ping_all()
+
+    def rollback(self, baud, retries=3):
+        """Return every servo to baud, searching all rates for any that stopped answering"""
+        self.logger.warning('Rolling back %s to %d baud' % (self.chain_name, baud))
+        for attempt in range(self.params['rollback_attempts']):
+            for m in self.motors:
+                self.open(baud)
+                if any([m.do_ping(verbose=False) for _ in range(retries)]):
+                    continue
+                b = -1
+                for _ in range(retries):
+                    b = DynamixelXL430.identify_baud_rate(m.dxl_id, self.usb)
+                    if b != -1:
+                        break
+                if b == -1 or b == baud:
+                    continue
+                self.open(b)
+                for _ in range(retries): #A lost reply doesn't mean the write was lost, so check before retrying
+                    try:
+                        if m.set_baud_rate(baud):
+                            break
+                    except DynamixelCommError:
+                        pass
+                    if DynamixelXL430.identify_baud_rate(m.dxl_id, self.usb) == baud:
+                        break
+            self.open(baud)
+            if self.ping_all():
+                return True
+        self.logger.error('Unable to recover all servos on %s to %d baud' % (self.chain_name, baud))
+        return False
+
+    def configure(self, return_delay_time, usb_latency_timer_ms):
+        try:
+            for m in self.motors:
+                m.disable_torque() #EEPROM
+                m.set_return_delay_time(return_delay_time)
+        except DynamixelCommError:
+            return False
+        if set_usb_latency_timer(self.usb, usb_latency_timer_ms):
+            prh.LATENCY_TIMER = usb_latency_timer_ms #SDK packet timeouts can now be shortened to match
+            self.status['usb_latency_timer_ms'] = usb_latency_timer_ms
+        else:
+            self.logger.warning('Unable to set USB latency timer of %s. Check permissions on sysfs.' % self.usb)
+            self.status['usb_latency_timer_ms'] = None
+        return True
+
+    # ###########  Benchmark #############
+
+    def measure(self, duration_s=None):
+        """Run group sync reads of position and velocity, as the DXL status thread does
+
+        Returns
+        -------
+        dict
+            status rate (Hz) and comm error rate (errors per read cycle)
+        """
+        duration_s = self.params['test_duration_s'] if duration_s is None else duration_s
+        readers = [gsr.GroupSyncRead(self.port_handler, self.packet_handler, XL430_ADDR_PRESENT_POSITION, 4),
+                   gsr.GroupSyncRead(self.port_handler, self.packet_handler, XL430_ADDR_PRESENT_VELOCITY, 4)]
+        for r in readers:
+            for i in self.ids:
+                r.addParam(i)
+        n_cycles = 0
+        n_errors = 0
+        ts = time.time()
+        while time.time() - ts < duration_s:
+            for r in readers:
+                if r.txRxPacket() != COMM_SUCCESS:
+                    n_errors = n_errors + 1
+                    self.port_handler.clearPort()
+            n_cycles = n_cycles + 1
+        dt = time.time() - ts
+        result = {'rate_hz': n_cycles / dt, 'error_rate': n_errors / float(n_cycles * len(readers))}
+        self.logger.info('%s at %d baud: %.1f Hz, error rate %.4f' % (self.chain_name, self.port_handler.getBaudRate(),
+                                                                       result['rate_hz'], result['error_rate']))
+        return result
+
+    # ###########  Tuning #############
+
+    def tune(self, save=True):
+        """Find the highest reliable baud rate, configure the chain and optionally save to the user YAML
+
+        Returns
+        -------
+        dict or None
+            The tuned settings and benchmark results, or None if the chain couldn't be tuned
+        """
+        prh.LATENCY_TIMER = self.chain_params['dxl_latency_timer']
+        start_baud = self.find_bus_baud()
+        if start_baud is None:
+            self.logger.error('Servos on %s are not all answering at a common baud rate. Unable to tune.' % self.chain_name)
+            return None
+        self.open(start_baud)
+        orig_return_delay = [m.get_return_delay_time() for m in self.motors]
+        orig_latency = get_usb_latency_timer(self.usb)
+
+        if not self.configure(self.params['return_delay_time'], self.params['usb_latency_timer_ms']):
+            self.logger.error('Unable to configure %s' % self.chain_name)
+            self.close()
+            return None
+
+        results = {}
+        good_baud = start_baud
+        results[good_baud] = self.measure()
+        if results[good_baud]['error_rate'] > self.params['max_error_rate']:
+            self.logger.error('%s is unreliable at its current settings. Restoring.' % self.chain_name)
+            self.restore(start_baud, orig_return_delay, orig_latency)
+            return None
+
+        for b in sorted([x for x in self.params['bauds'] if x > start_baud]):
+            if not self.migrate(b):
+                recovered = self.rollback(good_baud)
+                if not recovered:
+                    self.restore(start_baud, orig_return_delay, orig_latency)
+                    return None
+                break
+            results[b] = self.measure()
+            if results[b]['error_rate'] > self.params['max_error_rate']:
+                if not self.rollback(good_baud):
+                    self.restore(start_baud, orig_return_delay, orig_latency)
+                    return None
+                break
+            good_baud = b
+
+        self.close()
+        self.status['baud'] = good_baud
+        self.status['return_delay_time'] = self.params['return_delay_time']
+        self.status['results'] = results
+        self.logger.info('Tuned %s to %d baud: %.1f Hz' % (self.chain_name, good_baud, results[good_baud]['rate_hz']))
+        if save:
+            self.save()
+        return self.status
+
+    def restore(self, baud, return_delay, latency):
+        """Best effort return to the settings found before tuning"""
+        self.logger.warning('Restoring original settings of %s' % self.chain_name)
+        if self.rollback(baud):
+            for m, r in zip(self.motors, return_delay):
+                m.disable_torque()
+                m.set_return_delay_time(r)
+        if latency is not None:
+            set_usb_latency_timer(self.usb, latency)
+        self.close()
+
+    def save(self):
+        """Write the tuned settings, and the measured status rate, to stretch_re1_user_params.yaml"""
+        rate_hz = self.status['results'][self.status['baud']]['rate_hz']
+        p = {self.chain_name: {'baud': self.status['baud'], 'measured_status_rate_hz': round(rate_hz, 1)}}
+        if self.status['usb_latency_timer_ms'] is not None:
+            p[self.chain_name]['dxl_latency_timer'] = self.status['usb_latency_timer_ms']
+            p[self.chain_name]['usb_latency_timer_ms'] = self.status['usb_latency_timer_ms']
+        for m in self.motor_names:
+            p[m] = {'baud': self.status['baud'], 'return_delay_time': self.status['return_delay_time']}
+        up = hello_utils.read_fleet_yaml('stretch_re1_user_params.yaml')
+        hello_utils.overwrite_dict(up, p)
+        status_rate_hz = self.get_status_rate(up)
+        if status_rate_hz is not None:
+            hello_utils.overwrite_dict(up, {'robot': {'dxl_status_rate_hz': status_rate_hz}})
+            self.logger.info('Set robot.dxl_status_rate_hz to %.1f Hz' % status_rate_hz)
+        hello_utils.write_fleet_yaml('stretch_re1_user_params.yaml', up)
+        self.logger.info('Saved %s bus settings to stretch_re1_user_params.yaml' % self.chain_name)
+
+    def get_status_rate(self, user_params):
+        """
+        Rate (Hz) for the DXL status thread, which reads the head and tool chains in turn, from their measured
+        status rates. Scaled by status_rate_margin, as the thread also reads effort, temperature and errors.
+        Returns None if this chain isn't read by the thread, or the other chain hasn't been measured yet
+        """
+        chains = ['head', user_params.get('robot', {}).get('tool', self.robot_params['robot']['tool'])]
+        if self.chain_name not in chains:
+            return None
+        rates = []
+        for c in chains:
+            r = user_params.get(c, {}).get('measured_status_rate_hz', self.robot_params.get(c, {}).get('measured_status_rate_hz'))
+            if r is None:
+                self.logger.info('Chain %s not tuned yet. robot.dxl_status_rate_hz is set once it is.' % c)
+                return None
+            rates.append(r)
+        return round(self.params['status_rate_margin'] / sum([1.0 / r for r in rates]), 1)
+
+    def pretty_print(self):
+        print('---- Dynamixel Bus Tuner %s ----' % self.chain_name)
+        print('USB', self.usb)
+        print('Baud', self.status['baud'])
+        print('USB latency timer (ms)', self.status['usb_latency_timer_ms'])
+        print('Return delay time', self.status['return_delay_time'])
+        for b in sorted(self.status['results'].keys()):
+            r = self.status['results'][b]
+            print('  %8d baud: %6.1f Hz, error rate %.4f' % (b, r['rate_hz'], r['error_rate']))
@@ -4,7 +4,6 @@ from stretch_body.device import Device
 import time
 from stretch_body.hello_utils import *
 import termios
-import numpy
 
 class DynamixelCommErrorStats(Device):
     def __init__(self, name, logger):
@@ -21,10 +20,10 @@ class DynamixelCommErrorStats(Device):
     def add_error(self,rx=True, gsr=False):
         t = time.time()
         if type(self.rate_log)==type(None): #First error
-            self.rate_log=numpy.array([0.0] * self.n_log)
+            self.rate_log=[0.0] * self.n_log
         self.rate_log[self.log_idx]=1/(t-self.ts_error_last)
         self.log_idx = (self.log_idx + 1) % self.n_log
-        self.status['error_rate_avg_hz'] = numpy.average(self.rate_log)
+        self.status['error_rate_avg_hz'] = sum(self.rate_log)/len(self.rate_log)
         if rx:
             self.status['n_rx']+=1
         else:
@@ -48,6 +47,61 @@ class DynamixelCommErrorStats(Device):
 
 
 
+class DynamixelStatusScheduler(Device):
+    """
+    Decide which of the slow status registers (effort, temp, hardware_error) to read on a cycle.
+    Position and velocity are read every cycle.
+
+    Each field has a freshness budget (max_age_s) that tightens to max_age_active_s when the motor state calls for it:
+        effort: the motor is moving, homing, or stalled at high effort (eg, for the stall overload sentry)
+        temp: the motor is within warn_margin_C of its temperature limit
+        hardware_error: the motor is stalled at high effort
+    Fields that are due because of state are always read. Other due fields are read most-overdue
+    first, up to max_reads_per_cycle.
+    """
+    fields = ['effort', 'temp', 'hardware_error']
+
+    def __init__(self, name):
+        Device.__init__(self, name='dxl_status_scheduler')
+        self.name = name
+        self.status = {'n_read': dict([(f, 0) for f in self.fields])}
+
+    def is_active(self, field, motor):
+        if field == 'effort':
+            return motor.is_homing or not motor.status['stalled'] or motor.ts_over_eff_start is not None
+        if field == 'temp':
+            return motor.status['temp'] >= motor.params['temperature_limit'] - self.params['temp']['warn_margin_C']
+        if field == 'hardware_error':
+            return motor.ts_over_eff_start is not None
+        return False
+
+    def select(self, motors):
+        """Return the list of fields to read this cycle for a group of DynamixelHelloXL430 read together"""
+        ts = time.time()
+        urgent = []
+        routine = []
+        for f in self.fields:
+            overdue = None
+            for m in motors:
+                age = ts - m.ts_status[f]
+                active = self.is_active(f, m)
+                max_age = self.params[f]['max_age_active_s'] if active else self.params[f]['max_age_s']
+                if age >= max_age:
+                    if active:
+                        overdue = float('inf')
+                        break
+                    overdue = max(overdue, age / max(max_age, 1e-6)) if overdue is not None else age / max(max_age, 1e-6)
+            if overdue == float('inf'):
+                urgent.append(f)
+            elif overdue is not None:
+                routine.append((overdue, f))
+        routine.sort(reverse=True)
+        selected = urgent + [f for _, f in routine[:self.params['max_reads_per_cycle']]]
+        for f in selected:
+            self.status['n_read'][f] += 1
+        return selected
+
+
 class DynamixelHelloXL430(Device):
     """
     Abstract the Dynamixel X-Series to handle calibration, radians, etc
@@ -57,7 +111,8 @@ class DynamixelHelloXL430(Device):
         self.chain = chain
         self.status={'timestamp_pc':0,'comm_errors':0,'pos':0,'vel':0,'effort':0,'temp':0,'shutdown':0, 'hardware_error':0,
                      'input_voltage_error':0,'overheating_error':0,'motor_encoder_error':0,'electrical_shock_error':0,'overload_error':0,
-                     'stalled':0,'stall_overload':0,'pos_ticks':0,'vel_ticks':0,'effort_ticks':0}
+                     'stalled':0,'stall_overload':0,'pos_ticks':0,'vel_ticks':0,'effort_ticks':0,
+                     'staleness':{'effort':0,'temp':0,'hardware_error':0}}
 
         #Share bus resource amongst many XL430s
         self.motor = DynamixelXL430(dxl_id=self.params['id'],
@@ -81,9 +136,10 @@ class DynamixelHelloXL430(Device):
         self.soft_motion_limits = {'collision': [None, None], 'user': [None, None],'hard': [wr_min,wr_max],'current': [wr_min,wr_max]}
 
         self.is_homing=False
-        self.status_mux_id = 0
         self.was_runstopped = False
         self.comm_errors = DynamixelCommErrorStats(name,logger=self.logger)
+        self.status_scheduler = DynamixelStatusScheduler(name)
+        self.ts_status = dict([(f, 0.0) for f in DynamixelStatusScheduler.fields])
 
     # ###########  Device Methods #############
 
@@ -188,32 +244,30 @@ class DynamixelHelloXL430(Device):
                     v = self.motor.get_vel()
                 vel_valid = self.motor.last_comm_success
 
-                if self.status_mux_id == 0:
+                fields = self.status_scheduler.select([self])
+                if 'effort' in fields:
                     eff = self.motor.get_load()
                     if not self.motor.last_comm_success and self.params['retry_on_comm_failure']:
                         eff = self.motor.get_load()
                     eff_valid = self.motor.last_comm_success
                 else:
-                    eff = self.status['effort_ticks']
+                    eff = None
 
-                if self.status_mux_id == 1:
+                if 'temp' in fields:
                     temp = self.motor.get_temp()
                     if not self.motor.last_comm_success and self.params['retry_on_comm_failure']:
                         temp = self.motor.get_temp()
                     temp_valid = self.motor.last_comm_success
                 else:
-                    temp = self.status['temp']
+                    temp = None
 
-                if self.status_mux_id == 2:
+                if 'hardware_error' in fields:
                     err = self.motor.get_hardware_error()
                     if not self.motor.last_comm_success and self.params['retry_on_comm_failure']:
                         err = self.motor.get_hardware_error()
                     err_valid = self.motor.last_comm_success
                 else:
-                    err = self.status['hardware_error']
-
-                self.status_mux_id = (self.status_mux_id + 1) % 3
-
+                    err = None
 
                 if not pos_valid or not vel_valid or not eff_valid or not temp_valid or not err_valid:
                     raise DynamixelCommError
@@ -232,6 +286,7 @@ class DynamixelHelloXL430(Device):
             ts = data['ts']
             err = data['err']
 
+        #Fields not scheduled on this cycle are None
         #Now update status dictionary
         if pos_valid:
             self.status['pos_ticks'] = x
@@ -239,17 +294,21 @@ class DynamixelHelloXL430(Device):
         if vel_valid:
             self.status['vel_ticks'] = v
             self.status['vel'] = self.ticks_to_rad_per_sec(float(v))
-        if eff_valid:
+        if eff_valid and eff is not None:
             self.status['effort_ticks'] = eff
             self.status['effort'] = self.ticks_to_pct_load(float(eff))
-        if temp_valid:
+            self.ts_status['effort'] = ts
+        if temp_valid and temp is not None:
             self.status['temp'] = float(temp)
-        if err_valid:
+            self.ts_status['temp'] = ts
+        if err_valid and err is not None:
             self.status['hardware_error'] = err
+            self.ts_status['hardware_error'] = ts
 
         self.status['timestamp_pc'] = ts
+        for f in self.ts_status.keys():
+            self.status['staleness'][f] = ts - self.ts_status[f]
 
-        self.status['hardware_error'] = err
         self.status['input_voltage_error'] = self.status['hardware_error'] & 1 != 0
         self.status['overheating_error'] = self.status['hardware_error'] & 4 != 0
         self.status['motor_encoder_error'] = self.status['hardware_error'] & 8 != 0
@@ -272,6 +331,7 @@ class DynamixelHelloXL430(Device):
         else:
             self.ts_over_eff_start=None
             self.status['stall_overload'] = False
+        self.notify_status()
 
     def mark_zero(self):
         if not self.hw_valid:
@@ -298,6 +358,7 @@ class DynamixelHelloXL430(Device):
         print('Effort (%)', self.status['effort'])
         print('Effort (ticks)', self.status['effort_ticks'])
         print('Temp', self.status['temp'])
+        print('Staleness (s)', self.status['staleness'])
         print('Comm Errors', self.motor.comm_errors)
         print('Hardware Error', self.status['hardware_error'])
         print('Hardware Error: Input Voltage Error: ',self.status['input_voltage_error'])
@@ -315,14 +376,21 @@ class DynamixelHelloXL430(Device):
 
     def step_sentry(self, robot):
 
-        if self.hw_valid and self.robot_params['robot_sentry']['dynamixel_stop_on_runstop'] and self.params['enable_runstop']:
-            is_runstopped = robot.pimu.status['runstop_event']
-            if is_runstopped is not self.was_runstopped:
+        if self.robot_params['robot_sentry']['dynamixel_stop_on_runstop']:
+            self.step_runstop(robot.pimu.status['runstop_event'])
+
+    def step_runstop(self, is_runstopped):
+        """Disable torque when the runstop is activated, and re-enable it when released. Returns True on a change"""
+        if self.hw_valid and self.params['enable_runstop']:
+            changed = is_runstopped is not self.was_runstopped
+            if changed:
                 if is_runstopped:
                     self.disable_torque()
                 else:
                     self.enable_torque()
             self.was_runstopped = is_runstopped
+            return changed
+        return False
 
     # #####################################
 
@@ -359,6 +427,24 @@ class DynamixelHelloXL430(Device):
             self.comm_errors.add_error(rx=False, gsr=False)
 
 
+    def stage_move_to(self, x_des):
+        """
+        As move_to, but the goal is only applied on the next action() to the chain (see DynamixelXChain.action)
+        Motion uses the profile velocity and acceleration last set
+        """
+        if not self.hw_valid:
+            return
+        if self.params['req_calibration'] and not self.is_calibrated:
+            self.logger.warning('Dynamixel not calibrated: %s' % self.name)
+            return
+        try:
+            x_des = min(max(self.get_soft_motion_limits()[0], x_des), self.get_soft_motion_limits()[1])
+            t_des = self.world_rad_to_ticks(x_des)
+            t_des = max(self.params['range_t'][0], min(self.params['range_t'][1], t_des))
+            self.motor.reg_go_to_pos(t_des)
+        except (termios.error, DynamixelCommError):
+            self.comm_errors.add_error(rx=False, gsr=False)
+
     def set_motion_params(self,v_des=None,a_des=None):
         try:
             if not self.hw_valid:
@@ -496,12 +582,7 @@ class DynamixelHelloXL430(Device):
 
         print('Moving to first hardstop...')
         self.set_pwm(self.params['pwm_homing'][0])
-        ts=time.time()
-        time.sleep(1.0)
-        timeout=False
-        while self.motor.is_moving() and not timeout:
-            timeout=time.time()-ts>15.0
-            time.sleep(0.5)
+        timeout = not self.wait_for_hardstop(timeout=15.0)
         time.sleep(delay_at_stop)
         self.set_pwm(0)
 
@@ -530,12 +611,7 @@ class DynamixelHelloXL430(Device):
             #Measure the range and write to YAML
             print('Moving to second hardstop...')
             self.set_pwm(self.params['pwm_homing'][1])
-            ts = time.time()
-            time.sleep(1.0)
-            timeout = False
-            while self.motor.is_moving() and not timeout:
-                timeout = time.time() - ts > 15.0
-                time.sleep(0.5)
+            timeout = not self.wait_for_hardstop(timeout=15.0)
             time.sleep(delay_at_stop)
             self.set_pwm(0)
 
@@ -563,9 +639,32 @@ class DynamixelHelloXL430(Device):
         if move_to_zero:
             print('Moving to calibrated zero: (rad)')
             self.move_to(0)
-            time.sleep(3.0)
+            self.wait_until_at_pos(0, timeout=3.0)
         self.is_homing=False
 
+    def wait_for_hardstop(self, timeout=15.0):
+        """
+        Wait (up to 1s) for motion to start and then for it to stall against a hardstop
+        Returns False on timeout
+        """
+        return self.wait_until_stopped(timeout=timeout, start_timeout=1.0)
+
+    def wait_until_stopped(self, timeout=15.0, start_timeout=0.25):
+        """
+        Wait (up to start_timeout) for a commanded motion to start and then for the joint to come to rest
+        Returns False on timeout
+        """
+        ts = time.time()
+        self.wait_until(lambda: not self.status['stalled'], timeout=min(start_timeout, timeout))
+        return self.wait_until(lambda: self.status['stalled'], timeout=max(0.0, timeout - (time.time() - ts)))
+
+    def wait_until_at_pos(self, x_r, timeout=3.0, tolerance_r=0.05):
+        """
+        Wait for the joint to come to rest within tolerance_r of x_r (rad)
+        Returns False on timeout
+        """
+        return self.wait_until(lambda: self.status['stalled'] and abs(self.status['pos'] - x_r) < tolerance_r, timeout=timeout)
+
 # ##########################################
 
     def ticks_to_world_rad_per_sec(self,t):
@@ -0,0 +1,569 @@
+from __future__ import print_function
+import math
+import random
+import struct
+import threading
+import time
+
+from dynamixel_sdk.robotis_def import *
+import dynamixel_sdk.port_handler as prh
+import dynamixel_sdk.packet_handler as pch
+from dynamixel_sdk.protocol2_packet_handler import PKT_ID, PKT_LENGTH_L, PKT_LENGTH_H, PKT_INSTRUCTION, PKT_PARAMETER0
+from dynamixel_sdk.protocol2_packet_handler import ERRNUM_INSTRUCTION, ERRNUM_CRC, ERRNUM_ACCESS
+from stretch_body.dynamixel_XL430 import *
+import stretch_body.dynamixel_XL430 as dxl_XL430
+
+# #########################
+# Virtual Dynamixel Protocol 2.0 bus
+#
+# A DynamixelSimBus holds a chain of virtual XL430 servos. Registering a bus against a usb name
+# (eg, /dev/hello-dynamixel-head) causes DynamixelXL430 / DynamixelXChain to open a DynamixelSimPortHandler
+# instead of the serial port. The Dynamixel SDK packet handlers run unmodified on top of it, so
+# group sync read, retry and homing code paths are exercised byte for byte.
+#
+# Supported instructions: PING, READ, WRITE, REG_WRITE, ACTION, REBOOT, CLEAR, SYNC_READ, SYNC_WRITE,
+# BULK_READ, BULK_WRITE. Other instructions return an instruction error.
+
+XL430_MODEL_NUMBER = 1060
+XL430_FIRMWARE_VERSION = 45
+XL430_CONTROL_TABLE_SIZE = XL430_ADDR_HELLO_CALIBRATED + 1
+XL430_EEPROM_END = XL430_ADDR_TORQUE_ENABLE
+
+XL430_TICKS_PER_REV = 4096
+XL430_VEL_UNIT = 0.229 * XL430_TICKS_PER_REV / 60.0 #ticks/s per velocity unit (0.229 rpm)
+XL430_ACCEL_UNIT = 214.577 * XL430_TICKS_PER_REV / 3600.0 #ticks/s^2 per accel unit (214.577 rev/min^2)
+XL430_PWM_MAX = 885
+XL430_NO_LOAD_VEL = 265 #velocity units at full PWM
+
+ERRNUM_NONE = 0
+
+# Width and signedness of registers that the motion model reads and writes
+_REG_FORMAT = {1: 'B', 2: 'h', 4: 'i'}
+_REG_WIDTH = {XL430_ADDR_MODEL_NUMBER: 2, XL430_ADDR_ID: 1, XL430_ADDR_BAUD_RATE: 1, XL430_ADDR_RETURN_DELAY_TIME: 1,
+              XL430_ADDR_DRIVE_MODE: 1, XL430_ADDR_OPERATING_MODE: 1, XL430_ADDR_HOMING_OFFSET: 4,
+              XL430_ADDR_MOVING_THRESHOLD: 4, XL430_ADDR_PWM_LIMIT: 2, XL430_ADDR_VELOCITY_LIMIT: 4,
+              XL430_ADDR_MAX_POS_LIMIT: 4, XL430_ADDR_MIN_POS_LIMIT: 4, XL430_ADDR_SHUTDOWN: 1,
+              XL430_ADDR_TORQUE_ENABLE: 1, XL430_ADDR_STATUS_RETURN_LEVEL: 1, XL430_ADDR_HARDWARE_ERROR_STATUS: 1,
+              XL430_ADDR_GOAL_PWM: 2, XL430_ADDR_GOAL_VEL: 4, XL430_ADDR_PROFILE_ACCELERATION: 4,
+              XL430_ADDR_PROFILE_VELOCITY: 4, XL430_ADDR_GOAL_POSITION: 4, XL430_ADDR_REALTIME_TICK: 2,
+              XL430_ADDR_MOVING: 1, XL430_ADDR_MOVING_STATUS: 1, XL430_ADDR_PRESENT_PWM: 2,
+              XL430_ADDR_PRESENT_LOAD: 2, XL430_ADDR_PRESENT_VELOCITY: 4, XL430_ADDR_PRESENT_POSITION: 4,
+              XL430_ADDR_VELOCITY_TRAJECTORY: 4, XL430_ADDR_POSITION_TRAJECTORY: 4,
+              XL430_ADDR_PRESENT_INPUT_VOLTATE: 2, XL430_ADDR_PRESENT_TEMPERATURE: 1,
+              XL430_ADDR_TEMPERATURE_LIMIT: 1, XL430_ADDR_MAX_VOLTAGE_LIMIT: 2, XL430_ADDR_MIN_VOLTAGE_LIMIT: 2}
+
+# Factory defaults of the XL430-W250 control table
+_XL430_DEFAULTS = {XL430_ADDR_MODEL_NUMBER: XL430_MODEL_NUMBER, XL430_ADDR_BAUD_RATE: BAUD_MAP[57600],
+                   XL430_ADDR_RETURN_DELAY_TIME: 250, XL430_ADDR_OPERATING_MODE: 3, XL430_ADDR_MOVING_THRESHOLD: 10,
+                   XL430_ADDR_TEMPERATURE_LIMIT: 72, XL430_ADDR_MAX_VOLTAGE_LIMIT: 140,
+                   XL430_ADDR_MIN_VOLTAGE_LIMIT: 60, XL430_ADDR_PWM_LIMIT: XL430_PWM_MAX,
+                   XL430_ADDR_VELOCITY_LIMIT: XL430_NO_LOAD_VEL, XL430_ADDR_MAX_POS_LIMIT: 4095,
+                   XL430_ADDR_MIN_POS_LIMIT: 0, XL430_ADDR_SHUTDOWN: 52, XL430_ADDR_STATUS_RETURN_LEVEL: 2,
+                   XL430_ADDR_PRESENT_INPUT_VOLTATE: 120, XL430_ADDR_PRESENT_TEMPERATURE: 35}
+
+
+class DynamixelSimXL430():
+    """
+    Virtual XL430-W250: a control table plus a simple motion model
+
+    The motion model tracks the raw (un-offset) position in ticks. It supports
+    velocity (1), position (3), extended position (4) and PWM (16) operating modes.
+    Optional hard stops (raw ticks) clamp the motion and load the motor as a real
+    hardstop would, which is what homing relies on.
+    """
+    def __init__(self, dxl_id, baud=57600, pos_ticks=0, hard_stops=None, return_delay_time=0):
+        self.table = bytearray(XL430_CONTROL_TABLE_SIZE)
+        self.x = float(pos_ticks)
+        self.v = 0.0
+        self.pwm = 0.0
+        self.load = 0.0
+        self.hard_stops = hard_stops
+        self.registered = None
+        self.t_boot = time.time()
+        self.factory_reset()
+        self.set_reg(XL430_ADDR_ID, dxl_id)
+        self.set_reg(XL430_ADDR_BAUD_RATE, BAUD_MAP[baud])
+        self.set_reg(XL430_ADDR_RETURN_DELAY_TIME, return_delay_time)
+        self.update_present()
+
+    def factory_reset(self):
+        self.table[:] = bytearray(XL430_CONTROL_TABLE_SIZE)
+        self.table[XL430_ADDR_FIRMWARE_VERSION] = XL430_FIRMWARE_VERSION
+        self.table[XL430_ADDR_PROTOCOL_VERSION] = 2
+        self.table[XL430_ADDR_ID] = 1
+        for addr, val in _XL430_DEFAULTS.items():
+            self.set_reg(addr, val)
+
+    def reboot(self):
+        """Reset RAM to defaults. EEPROM (including homing offset) is retained, the calibrated flag is not."""
+        self.table[XL430_EEPROM_END:] = bytearray(XL430_CONTROL_TABLE_SIZE - XL430_EEPROM_END)
+        for addr, val in _XL430_DEFAULTS.items():
+            if addr >= XL430_EEPROM_END:
+                self.set_reg(addr, val)
+        self.v = 0.0
+        self.registered = None
+        self.t_boot = time.time()
+        self.update_present()
+
+    @property
+    def dxl_id(self):
+        return self.table[XL430_ADDR_ID]
+
+    @property
+    def baud(self):
+        for b, idx in BAUD_MAP.items():
+            if idx == self.table[XL430_ADDR_BAUD_RATE]:
+                return b
+        return None
+
+    def get_reg(self, addr):
+        n = _REG_WIDTH[addr]
+        return struct.unpack('<' + _REG_FORMAT[n], bytes(self.table[addr:addr + n]))[0]
+
+    def set_reg(self, addr, val):
+        n = _REG_WIDTH[addr]
+        val = int(val)
+        if n == 1:
+            self.table[addr] = val & 0xFF
+        else:
+            lim = 1 << (8 * n - 1)
+            val = max(-lim, min(lim - 1, val))
+            self.table[addr:addr + n] = struct.pack('<' + _REG_FORMAT[n], val)
+
+    def set_hardware_error(self, bits):
+        """Inject a hardware error (eg, 32 for overload). Torque is disabled until reboot, as on the real servo."""
+        self.set_reg(XL430_ADDR_HARDWARE_ERROR_STATUS, bits)
+        if bits & self.get_reg(XL430_ADDR_SHUTDOWN):
+            self.set_reg(XL430_ADDR_TORQUE_ENABLE, 0)
+
+    # ###########  Control table access #############
+
+    def read(self, addr, length):
+        if addr + length > XL430_CONTROL_TABLE_SIZE:
+            return ERRNUM_ACCESS, []
+        return ERRNUM_NONE, list(self.table[addr:addr + length])
+
+    def write(self, addr, data):
+        if addr + len(data) > XL430_CONTROL_TABLE_SIZE:
+            return ERRNUM_ACCESS
+        if addr < XL430_EEPROM_END and self.table[XL430_ADDR_TORQUE_ENABLE]:
+            return ERRNUM_ACCESS #EEPROM is locked while torque is enabled
+        if addr <= XL430_ADDR_TORQUE_ENABLE < addr + len(data):
+            if data[XL430_ADDR_TORQUE_ENABLE - addr] and self.table[XL430_ADDR_HARDWARE_ERROR_STATUS] & self.table[XL430_ADDR_SHUTDOWN]:
+                return ERRNUM_ACCESS #Shutdown until reboot
+        goal_x = addr <= XL430_ADDR_GOAL_POSITION < addr + len(data)
+        torque_was_enabled = self.table[XL430_ADDR_TORQUE_ENABLE]
+        self.table[addr:addr + len(data)] = bytearray(data)
+        if self.table[XL430_ADDR_TORQUE_ENABLE] and not torque_was_enabled and not goal_x:
+            self.set_reg(XL430_ADDR_GOAL_POSITION, self.get_reg(XL430_ADDR_PRESENT_POSITION)) #Hold position on torque enable
+        if goal_x and self.get_reg(XL430_ADDR_OPERATING_MODE) == 3:
+            g = max(self.get_reg(XL430_ADDR_MIN_POS_LIMIT), min(self.get_reg(XL430_ADDR_MAX_POS_LIMIT), self.get_reg(XL430_ADDR_GOAL_POSITION)))
+            self.set_reg(XL430_ADDR_GOAL_POSITION, g)
+        self.update_present()
+        return ERRNUM_NONE
+
+    def clear_multiturn(self):
+        """Reset the turn count so the present position is within [0, 4096)"""
+        x = int(round(self.x))
+        self.x -= (x - x % XL430_TICKS_PER_REV)
+        self.update_present()
+
+    # ###########  Motion model #############
+
+    def step(self, dt):
+        """Advance the motion model by dt seconds"""
+        if dt <= 0:
+            return
+        mode = self.get_reg(XL430_ADDR_OPERATING_MODE)
+        offset = self.get_reg(XL430_ADDR_HOMING_OFFSET)
+        v_max = XL430_NO_LOAD_VEL * XL430_VEL_UNIT
+        a_prof = self.get_reg(XL430_ADDR_PROFILE_ACCELERATION) * XL430_ACCEL_UNIT
+        a_max = a_prof if a_prof > 0 else 100 * v_max
+        self.pwm = 0.0
+        if not self.table[XL430_ADDR_TORQUE_ENABLE]:
+            v_des = 0.0
+            a_max = 100 * v_max
+        elif mode == 16:
+            lim = self.get_reg(XL430_ADDR_PWM_LIMIT)
+            self.pwm = max(-lim, min(lim, self.get_reg(XL430_ADDR_GOAL_PWM)))
+            v_des = v_max * self.pwm / float(XL430_PWM_MAX)
+            a_max = 100 * v_max
+        elif mode == 1:
+            v_des = self.get_reg(XL430_ADDR_GOAL_VEL) * XL430_VEL_UNIT
+        elif mode in (3, 4):
+            v_prof = self.get_reg(XL430_ADDR_PROFILE_VELOCITY) * XL430_VEL_UNIT
+            v_lim = min(v_max, v_prof) if v_prof > 0 else v_max
+            err = (self.get_reg(XL430_ADDR_GOAL_POSITION) - offset) - self.x
+            v_des = math.copysign(min(v_lim, math.sqrt(2 * a_max * abs(err))), err)
+            if abs(err) < 1.0:
+                v_des = 0.0
+                self.x += err
+        else:
+            v_des = 0.0
+        dv = max(-a_max * dt, min(a_max * dt, v_des - self.v))
+        self.v += dv
+        if mode in (3, 4) and self.table[XL430_ADDR_TORQUE_ENABLE]:
+            err = (self.get_reg(XL430_ADDR_GOAL_POSITION) - offset) - self.x
+            if abs(self.v * dt) >= abs(err) and err * self.v >= 0: #Don't overshoot the goal
+                self.x += err
+                self.v = 0.0
+            else:
+                self.x += self.v * dt
+            self.pwm = max(-XL430_PWM_MAX, min(XL430_PWM_MAX, 2.0 * err))
+        else:
+            self.x += self.v * dt
+        self.load = 100.0 * self.v / v_max #Load of moving the joint in 0.1%
+        if self.hard_stops is not None:
+            if self.x <= self.hard_stops[0] or self.x >= self.hard_stops[1]:
+                self.x = max(self.hard_stops[0], min(self.hard_stops[1], self.x))
+                self.v = 0.0
+                self.load = 1000.0 * self.pwm / XL430_PWM_MAX #Stalled against the stop
+        self.update_present()
+
+    def update_present(self):
+        offset = self.get_reg(XL430_ADDR_HOMING_OFFSET)
+        vel = int(round(self.v / XL430_VEL_UNIT))
+        self.set_reg(XL430_ADDR_PRESENT_POSITION, int(round(self.x)) + offset)
+        self.set_reg(XL430_ADDR_PRESENT_VELOCITY, vel)
+        self.set_reg(XL430_ADDR_PRESENT_LOAD, int(round(self.load)))
+        self.set_reg(XL430_ADDR_PRESENT_PWM, int(round(self.pwm)))
+        self.set_reg(XL430_ADDR_MOVING, abs(vel) > self.get_reg(XL430_ADDR_MOVING_THRESHOLD))
+        self.set_reg(XL430_ADDR_REALTIME_TICK, int((time.time() - self.t_boot) * 1000) % 32768)
+        in_position = abs(self.get_reg(XL430_ADDR_GOAL_POSITION) - self.get_reg(XL430_ADDR_PRESENT_POSITION)) <= 1
+        self.set_reg(XL430_ADDR_MOVING_STATUS, 1 if in_position else 0)
+
+
+class DynamixelSimBus():
+    """
+    A half duplex Dynamixel Protocol 2.0 bus with a chain of DynamixelSimXL430
+
+    baud: rate used to compute wire time of each packet
+    latency_timer_ms: USB-serial latency timer. Applied once per status packet that does not fill a 62 byte USB frame
+    packet_loss: probability that any instruction or status packet is dropped on the wire
+    packet_corrupt: probability that a status packet arrives with a bad CRC
+    packet_loss_at_baud: additional loss probability by baud rate, eg {4000000: 0.5}, to model signal integrity limits
+    realtime: if True, status bytes become readable only after their wire time has elapsed and the motion
+        model runs on the wall clock. If False, the bus keeps its own clock, advanced by wire time and step()
+    """
+    def __init__(self, baud=57600, latency_timer_ms=1, packet_loss=0.0, packet_corrupt=0.0, realtime=True, seed=None,
+                 packet_loss_at_baud=None):
+        self.baud = baud
+        self.latency_timer_ms = latency_timer_ms
+        self.packet_loss = packet_loss
+        self.packet_loss_at_baud = {} if packet_loss_at_baud is None else packet_loss_at_baud
+        self.packet_corrupt = packet_corrupt
+        self.realtime = realtime
+        self.servos = {}
+        self.lock = threading.RLock()
+        self.rand = random.Random(seed)
+        self.packet_handler = pch.PacketHandler(2.0)
+        self.t_sim = 0.0
+        self.t_last_update = self.now()
+        self.status = {'n_instruction': 0, 'n_status': 0, 'n_lost': 0, 'n_corrupt': 0, 'n_crc_error': 0,
+                       'bytes_tx': 0, 'bytes_rx': 0, 'wire_time_s': 0.0}
+
+    def add_servo(self, dxl_id, **kwargs):
+        """Add a DynamixelSimXL430 to the chain. kwargs are passed to DynamixelSimXL430"""
+        with self.lock:
+            kwargs.setdefault('baud', self.baud)
+            s = DynamixelSimXL430(dxl_id, **kwargs)
+            self.servos[dxl_id] = s
+            return s
+
+    def get_servo(self, dxl_id):
+        with self.lock:
+            for s in self.servos.values():
+                if s.dxl_id == dxl_id:
+                    return s
+        return None
+
+    def create_port_handler(self, usb):
+        return DynamixelSimPortHandler(usb, self)
+
+    def now(self):
+        return time.time() if self.realtime else self.t_sim
+
+    def step(self, dt):
+        """Advance the bus clock by dt seconds (realtime=False only)"""
+        with self.lock:
+            self.t_sim += dt
+            self.update()
+
+    def update(self):
+        with self.lock:
+            t = self.now()
+            dt = t - self.t_last_update
+            self.t_last_update = t
+            for s in self.servos.values():
+                s.step(dt)
+
+    def reset_status(self):
+        with self.lock:
+            for k in self.status.keys():
+                self.status[k] = 0 if type(self.status[k]) == int else 0.0
+
+    def pretty_print(self):
+        print('---- Dynamixel Sim Bus ----')
+        print('Baud', self.baud)
+        print('Servos', sorted([s.dxl_id for s in self.servos.values()]))
+        for k in sorted(self.status.keys()):
+            print(k, self.status[k])
+
+    # ###########  Wire protocol #############
+
+    def wire_time(self, n_bytes, baud):
+        return n_bytes * 10.0 / baud #8N1
+
+    def transact(self, packet, baud):
+        """Deliver one instruction packet (list of bytes, as sent by the SDK) and return the
+        status packets as a list of (delay_s, bytes) relative to the end of the instruction."""
+        with self.lock:
+            self.update()
+            self.status['n_instruction'] += 1
+            self.status['bytes_tx'] += len(packet)
+            t_wire = self.wire_time(len(packet), baud)
+            self.status['wire_time_s'] += t_wire
+            if not self.realtime:
+                self.t_sim += t_wire
+            p_loss = self.packet_loss + self.packet_loss_at_baud.get(baud, 0.0)
+            if self.rand.random() < p_loss:
+                self.status['n_lost'] += 1
+                return []
+            inst, dxl_id, params, crc_ok = self.parse_instruction(packet)
+            listeners = [s for s in self.servos.values() if s.baud == baud]
+            replies = self.execute(inst, dxl_id, params, crc_ok, listeners)
+            out = []
+            t = 0.0
+            for s, err, data in replies:
+                t += s.get_reg(XL430_ADDR_RETURN_DELAY_TIME) * 2e-6
+                pkt = self.make_status_packet(s.dxl_id, err, data)
+                t += self.wire_time(len(pkt), baud)
+                self.status['wire_time_s'] += self.wire_time(len(pkt), baud)
+                if not self.realtime:
+                    self.t_sim += self.wire_time(len(pkt), baud)
+                if self.rand.random() < p_loss:
+                    self.status['n_lost'] += 1
+                    continue
+                if self.rand.random() < self.packet_corrupt:
+                    self.status['n_corrupt'] += 1
+                    pkt[-1] ^= 0xFF
+                self.status['n_status'] += 1
+                self.status['bytes_rx'] += len(pkt)
+                latency = self.latency_timer_ms / 1000.0 if len(pkt) % 62 else 0.0
+                out.append((t + latency, bytearray(pkt)))
+            return out
+
+    def parse_instruction(self, packet):
+        packet = list(packet)
+        if len(packet) < 10 or packet[0:3] != [0xFF, 0xFF, 0xFD]:
+            return None, None, [], False
+        n = DXL_MAKEWORD(packet[PKT_LENGTH_L], packet[PKT_LENGTH_H]) + 7
+        crc = DXL_MAKEWORD(packet[n - 2], packet[n - 1])
+        crc_ok = self.packet_handler.updateCRC(0, packet, n - 2) == crc
+        packet = self.packet_handler.removeStuffing(packet[:n])
+        n = DXL_MAKEWORD(packet[PKT_LENGTH_L], packet[PKT_LENGTH_H]) + 7
+        return packet[PKT_INSTRUCTION], packet[PKT_ID], packet[PKT_PARAMETER0:n - 2], crc_ok
+
+    def make_status_packet(self, dxl_id, err, data):
+        pkt = [0xFF, 0xFF, 0xFD, 0x00, dxl_id, DXL_LOBYTE(len(data) + 4), DXL_HIBYTE(len(data) + 4), INST_STATUS, err] + list(data) + [0, 0]
+        pkt = self.packet_handler.addStuffing(pkt)
+        n = DXL_MAKEWORD(pkt[PKT_LENGTH_L], pkt[PKT_LENGTH_H]) + 7
+        pkt = pkt[:n]
+        crc = self.packet_handler.updateCRC(0, pkt, n - 2)
+        pkt[n - 2] = DXL_LOBYTE(crc)
+        pkt[n - 1] = DXL_HIBYTE(crc)
+        return pkt
+
+    def execute(self, inst, dxl_id, params, crc_ok, listeners):
+        """Apply an instruction to the listening servos. Returns list of (servo, error, data) replies in bus order"""
+        if inst is None:
+            return []
+        by_id = dict([(s.dxl_id, s) for s in listeners])
+        broadcast = dxl_id == BROADCAST_ID
+        targets = sorted(by_id.values(), key=lambda s: s.dxl_id) if broadcast else ([by_id[dxl_id]] if dxl_id in by_id else [])
+
+        def respond(s, err, data=[], is_read=False):
+            level = s.get_reg(XL430_ADDR_STATUS_RETURN_LEVEL)
+            if inst == INST_PING or level == 2 or (level == 1 and is_read):
+                return [(s, err, data)]
+            return []
+
+        if not crc_ok:
+            self.status['n_crc_error'] += 1
+            return [] if broadcast else sum([respond(s, ERRNUM_CRC) for s in targets], [])
+
+        replies = []
+        if inst == INST_PING:
+            for s in targets:
+                replies += respond(s, ERRNUM_NONE, [DXL_LOBYTE(XL430_MODEL_NUMBER), DXL_HIBYTE(XL430_MODEL_NUMBER), XL430_FIRMWARE_VERSION])
+        elif inst == INST_READ and not broadcast:
+            addr, length = DXL_MAKEWORD(params[0], params[1]), DXL_MAKEWORD(params[2], params[3])
+            for s in targets:
+                err, data = s.read(addr, length)
+                replies += respond(s, err, data, is_read=True)
+        elif inst in (INST_WRITE, INST_REG_WRITE):
+            addr, data = DXL_MAKEWORD(params[0], params[1]), params[2:]
+            for s in targets:
+                if inst == INST_WRITE:
+                    err = s.write(addr, data)
+                else:
+                    s.registered, err = (addr, data), ERRNUM_NONE
+                if not broadcast:
+                    replies += respond(s, err)
+        elif inst == INST_ACTION:
+            for s in targets:
+                err = ERRNUM_NONE
+                if s.registered is not None:
+                    err = s.write(*s.registered)
+                    s.registered = None
+                if not broadcast:
+                    replies += respond(s, err)
+        elif inst == INST_REBOOT:
+            for s in targets:
+                if not broadcast:
+                    replies += respond(s, ERRNUM_NONE)
+                s.reboot()
+        elif inst == INST_CLEAR:
+            for s in targets:
+                err = ERRNUM_ACCESS if s.v != 0.0 else ERRNUM_NONE
+                if params[:1] == [0x01] and not err:
+                    s.clear_multiturn()
+                if not broadcast:
+                    replies += respond(s, err)
+        elif inst == INST_SYNC_READ and broadcast:
+            addr, length = DXL_MAKEWORD(params[0], params[1]), DXL_MAKEWORD(params[2], params[3])
+            for i in params[4:]:
+                if i in by_id:
+                    err, data = by_id[i].read(addr, length)
+                    replies += respond(by_id[i], err, data, is_read=True)
+        elif inst == INST_SYNC_WRITE and broadcast:
+            addr, length = DXL_MAKEWORD(params[0], params[1]), DXL_MAKEWORD(params[2], params[3])
+            p = params[4:]
+            for k in range(0, len(p) - length, length + 1):
+                if p[k] in by_id:
+                    by_id[p[k]].write(addr, p[k + 1:k + 1 + length])
+        elif inst == INST_BULK_READ and broadcast:
+            for k in range(0, len(params) - 4, 5):
+                i, addr, length = params[k], DXL_MAKEWORD(params[k + 1], params[k + 2]), DXL_MAKEWORD(params[k + 3], params[k + 4])
+                if i in by_id:
+                    err, data = by_id[i].read(addr, length)
+                    replies += respond(by_id[i], err, data, is_read=True)
+        elif inst == INST_BULK_WRITE and broadcast:
+            k = 0
+            while k + 5 <= len(params):
+                i, addr, length = params[k], DXL_MAKEWORD(params[k + 1], params[k + 2]), DXL_MAKEWORD(params[k + 3], params[k + 4])
+                if i in by_id:
+                    by_id[i].write(addr, params[k + 5:k + 5 + length])
+                k += 5 + length
+        elif not broadcast:
+            for s in targets:
+                replies += respond(s, ERRNUM_INSTRUCTION)
+        return replies
+
+
+class DynamixelSimSerial():
+    """
+    Stand-in for serial.Serial used by DynamixelSimPortHandler.
+    Instruction packets written are delivered to the bus, status packets are queued until their wire time has elapsed.
+    """
+    def __init__(self, bus, baudrate):
+        self.bus = bus
+        self.baudrate = baudrate
+        self.is_open = True
+        self.tx_buf = bytearray()
+        self.rx_chunks = [] #(ready time, bytearray)
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        self.is_open = False
+
+    def fileno(self):
+        return -1
+
+    def reset_input_buffer(self):
+        self.rx_chunks = []
+
+    def reset_output_buffer(self):
+        self.tx_buf = bytearray()
+
+    def _ready(self):
+        t = time.time()
+        n = 0
+        for ts, c in self.rx_chunks:
+            if self.bus.realtime and ts > t:
+                break
+            n += len(c)
+        return n
+
+    @property
+    def in_waiting(self):
+        return self._ready()
+
+    def inWaiting(self):
+        return self._ready()
+
+    def read(self, size=1):
+        n = min(size, self._ready())
+        out = bytearray()
+        while len(out) < n:
+            ts, c = self.rx_chunks[0]
+            take = n - len(out)
+            out += c[:take]
+            if take >= len(c):
+                self.rx_chunks.pop(0)
+            else:
+                self.rx_chunks[0] = (ts, c[take:])
+        return bytes(out)
+
+    def write(self, data):
+        if not self.is_open:
+            raise serial.SerialException('Attempting to use a port that is not open')
+        self.tx_buf += bytearray(data)
+        while len(self.tx_buf) >= 10:
+            n = DXL_MAKEWORD(self.tx_buf[PKT_LENGTH_L], self.tx_buf[PKT_LENGTH_H]) + 7
+            if len(self.tx_buf) < n:
+                break
+            packet, self.tx_buf = self.tx_buf[:n], self.tx_buf[n:]
+            t = time.time()
+            for delay, pkt in self.bus.transact(packet, self.baudrate):
+                self.rx_chunks.append((t + delay, pkt))
+        return len(data)
+
+
+class DynamixelSimPortHandler(prh.PortHandler):
+    """
+    Dynamixel SDK PortHandler backed by a DynamixelSimBus rather than a serial port
+    """
+    def __init__(self, port_name, bus):
+        prh.PortHandler.__init__(self, port_name)
+        self.bus = bus
+
+    def setupPort(self, cflag_baud):
+        if self.is_open:
+            self.closePort()
+        self.ser = DynamixelSimSerial(self.bus, self.baudrate)
+        self.is_open = True
+        self.ser.reset_input_buffer()
+        self.tx_time_per_byte = (1000.0 / self.baudrate) * 10.0
+        return True
+
+    def getCFlagBaud(self, baudrate):
+        return baudrate if baudrate in BAUD_MAP else -1
+
+
+# ###########  Bus registry #############
+
+def register_sim_bus(usb, bus):
+    """Route all Dynamixel traffic for usb (eg, /dev/hello-dynamixel-head) to bus"""
+    dxl_XL430.sim_buses[usb] = bus
+    return bus
+
+
+def unregister_sim_bus(usb):
+    dxl_XL430.sim_buses.pop(usb, None)
+
+
+def get_sim_bus(usb):
+    return dxl_XL430.sim_buses.get(usb, None)
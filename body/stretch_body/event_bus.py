@@ -0,0 +1,179 @@
+from __future__ import print_function
+import collections
+import logging
+import threading
+import time
+import numpy as np
+
+# Event types
+EVENT_RUNSTOP = 1 #value: 1 activated, 0 deactivated
+EVENT_BASE_CLIFF = 2 #value: 1
+EVENT_BASE_BUMP = 3 #value: bump event count
+EVENT_OVER_TILT = 4 #value: 1
+EVENT_GUARDED_CONTACT = 5 #value: 1
+EVENT_WRIST_SINGLE_TAP = 6 #value: single tap count
+EVENT_LOW_VOLTAGE = 7 #value: voltage (V)
+EVENT_HIGH_CURRENT = 8 #value: current (A)
+EVENT_DYNAMIXEL_OVERHEATING = 9 #value: 1
+EVENT_DYNAMIXEL_OVERLOAD = 10 #value: 1
+
+event_names = {EVENT_RUNSTOP: 'runstop', EVENT_BASE_CLIFF: 'base_cliff', EVENT_BASE_BUMP: 'base_bump', EVENT_OVER_TILT: 'over_tilt',
+               EVENT_GUARDED_CONTACT: 'guarded_contact', EVENT_WRIST_SINGLE_TAP: 'wrist_single_tap', EVENT_LOW_VOLTAGE: 'low_voltage',
+               EVENT_HIGH_CURRENT: 'high_current', EVENT_DYNAMIXEL_OVERHEATING: 'dynamixel_overheating',
+               EVENT_DYNAMIXEL_OVERLOAD: 'dynamixel_overload'}
+
+EVENT_DTYPE = np.dtype([('seq', np.uint64), ('t', np.float64), ('type', np.uint16), ('device', np.uint16), ('value', np.float64)])
+
+Event = collections.namedtuple('Event', ['seq', 't', 'type', 'device', 'value'])
+
+
+def format_event(e):
+    """Human readable description of an Event (as logged by the RobotMonitor)"""
+    d = e.device
+    if e.type == EVENT_RUNSTOP:
+        return 'Runstop activated' if e.value else 'Runstop deactivated'
+    if e.type == EVENT_BASE_CLIFF:
+        return 'Base cliff event'
+    if e.type == EVENT_BASE_BUMP:
+        return 'Base bump event'
+    if e.type == EVENT_OVER_TILT:
+        return 'Over Tilt Alert'
+    if e.type == EVENT_GUARDED_CONTACT:
+        return 'Guarded contact %s' % d
+    if e.type == EVENT_WRIST_SINGLE_TAP:
+        return 'Wrist single tap: %d' % e.value
+    if e.type == EVENT_LOW_VOLTAGE:
+        return 'Low voltage of: %.2f' % e.value
+    if e.type == EVENT_HIGH_CURRENT:
+        return 'High current of: %.2f' % e.value
+    if e.type in (EVENT_DYNAMIXEL_OVERHEATING, EVENT_DYNAMIXEL_OVERLOAD):
+        err = 'overheating_error' if e.type == EVENT_DYNAMIXEL_OVERHEATING else 'overload_error'
+        return 'Dynamixel %s on %s' % (err, d.replace('.', ':'))
+    return '%s %s: %s' % (event_names.get(e.type, 'event %d' % e.type), d, e.value)
+
+
+class EventBus:
+    """
+    Typed events, kept in a bounded log and published to subscribers
+
+    Each event is a fixed layout record (seq, t, type, device, value), stored in a preallocated
+    ring buffer of the last capacity events (a NumPy structured array, see EVENT_DTYPE).
+    Device names are interned to small ids; query returns records with the ids, and get_device_name maps them back.
+    Subscribers are called synchronously on emit with an Event (with the device name), for the types and devices
+    they filter on. Nothing is formatted on emit: sinks such as LoggingSink format events when they handle them.
+    On the Robot, events are emitted from the status thread (NonDXLStatusThread), so subscribers must return
+    quickly and not block. A subscriber that raises is counted (n_errors, per handle) and its first error is logged;
+    the other subscribers and the emitting thread carry on.
+    """
+    def __init__(self, capacity=4096, logger=None):
+        self.capacity = capacity
+        self.log = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.seq = 0 #Number of events emitted
+        self.lock = threading.RLock()
+        self.device_ids = {}
+        self.device_names = []
+        self.subscribers = {}
+        self.n_errors = {}
+        self.next_handle = 0
+        self.logger = logger if logger is not None else logging.getLogger('event_bus')
+
+    def get_device_id(self, device):
+        with self.lock:
+            i = self.device_ids.get(device)
+            if i is None:
+                i = len(self.device_names)
+                self.device_ids[device] = i
+                self.device_names.append(device)
+            return i
+
+    def get_device_name(self, device_id):
+        return self.device_names[device_id]
+
+    def emit(self, type, device='', value=0.0, t=None):
+        """Record an event and publish it to the subscribers. Returns its sequence number"""
+        t = time.time() if t is None else t
+        with self.lock:
+            d = self.get_device_id(device)
+            seq = self.seq
+            self.log[seq % self.capacity] = (seq, t, type, d, value)
+            self.seq = seq + 1
+            subscribers = list(self.subscribers.items())
+        if len(subscribers):
+            e = Event(seq, t, type, device, value)
+            for h, (callback, types, devices) in subscribers:
+                if (types is None or type in types) and (devices is None or device in devices):
+                    try:
+                        callback(e)
+                    except Exception as ex: #A failing subscriber shouldn't stop the others, nor the emitting thread
+                        with self.lock:
+                            self.n_errors[h] = self.n_errors.get(h, 0) + 1
+                            first = self.n_errors[h] == 1
+                        if first:
+                            self.logger.error('Event subscriber %s failed: %s' % (getattr(callback, '__name__', repr(callback)), str(ex)))
+        return seq
+
+    def subscribe(self, callback, types=None, devices=None):
+        """
+        Call callback(event) for each new event, optionally only of the given types / devices (lists)
+        The callback runs in the emitting thread (the status thread on the Robot) and must not block
+        Returns a handle for unsubscribe
+        """
+        with self.lock:
+            h = self.next_handle
+            self.next_handle += 1
+            self.subscribers[h] = (callback, None if types is None else set(types), None if devices is None else set(devices))
+            self.n_errors[h] = 0
+            return h
+
+    def unsubscribe(self, handle):
+        with self.lock:
+            self.subscribers.pop(handle, None)
+            self.n_errors.pop(handle, None)
+
+    def get_n_dropped(self):
+        """Number of events overwritten in the log"""
+        return max(0, self.seq - self.capacity)
+
+    def query(self, t_start=None, t_end=None, types=None, devices=None, since_seq=None):
+        """
+        Events in the log, oldest first, as a structured array of EVENT_DTYPE
+        t_start, t_end: time range (inclusive)
+        types, devices: lists to filter on
+        since_seq: only events after this sequence number (eg, to poll for new events)
+        """
+        with self.lock:
+            n = min(self.seq, self.capacity)
+            start = self.seq - n
+            if since_seq is not None:
+                start = max(start, since_seq + 1)
+            if start >= self.seq:
+                return np.zeros(0, dtype=EVENT_DTYPE)
+            idx = np.arange(start, self.seq) % self.capacity
+            e = self.log[idx]
+            device_ids = None if devices is None else [self.device_ids[d] for d in devices if d in self.device_ids]
+        keep = np.ones(len(e), dtype=bool)
+        if t_start is not None:
+            keep &= e['t'] >= t_start
+        if t_end is not None:
+            keep &= e['t'] <= t_end
+        if types is not None:
+            keep &= np.isin(e['type'], list(types))
+        if device_ids is not None:
+            keep &= np.isin(e['device'], device_ids)
+        return e[keep]
+
+    def get_events(self, **kwargs):
+        """As query, but as a list of Event (with device names)"""
+        return [Event(int(r['seq']), float(r['t']), int(r['type']), self.device_names[r['device']], float(r['value']))
+                for r in self.query(**kwargs)]
+
+
+class LoggingSink:
+    """Subscriber that logs events, formatting them only if the logger would output them"""
+    def __init__(self, logger, level=logging.DEBUG):
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, e):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, format_event(e))
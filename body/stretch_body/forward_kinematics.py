@@ -0,0 +1,268 @@
+from __future__ import print_function
+import hashlib
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+
+from stretch_body.device import Device
+import stretch_body.hello_utils as hello_utils
+
+JOINT_FIXED = 0
+JOINT_REVOLUTE = 1
+JOINT_PRISMATIC = 2
+
+CACHE_VERSION = 1
+
+
+def rpy_to_matrix(rpy):
+    """Rotation matrix for URDF roll-pitch-yaw (fixed axis X, then Y, then Z)"""
+    cr, cp, cy = np.cos(rpy)
+    sr, sp, sy = np.sin(rpy)
+    return np.array([[cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr],
+                     [sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr],
+                     [-sp, cp * sr, cp * cr]])
+
+
+def origin_to_matrix(e):
+    """4x4 transform of a URDF <origin> element (identity if None)"""
+    T = np.eye(4)
+    if e is not None:
+        T[:3, :3] = rpy_to_matrix(np.array([float(v) for v in e.get('rpy', '0 0 0').split()]))
+        T[:3, 3] = [float(v) for v in e.get('xyz', '0 0 0').split()]
+    return T
+
+
+def compile_urdf(urdf_text):
+    """
+    Compile the joint tree of a URDF into flat arrays, one entry per joint in topological order
+
+    Each joint moves its child link relative to its parent link by the fixed origin transform,
+    followed by a rotation (revolute, continuous) or translation (prismatic) along its axis.
+    Joint values are taken from the actuated joint at q_index, scaled by mimic_multiplier
+    and shifted by mimic_offset, so that mimic joints share the value of the joint they follow.
+    Floating and planar joints are treated as fixed.
+    """
+    root = ET.fromstring(urdf_text)
+    links = [l.get('name') for l in root.findall('link')]
+    joints = {}
+    for j in root.findall('joint'):
+        axis = j.find('axis')
+        mimic = j.find('mimic')
+        joints[j.find('child').get('link')] = {
+            'name': j.get('name'),
+            'type': {'revolute': JOINT_REVOLUTE, 'continuous': JOINT_REVOLUTE, 'prismatic': JOINT_PRISMATIC}.get(j.get('type'), JOINT_FIXED),
+            'parent': j.find('parent').get('link'),
+            'origin': origin_to_matrix(j.find('origin')),
+            'axis': np.array([float(v) for v in axis.get('xyz').split()]) if axis is not None else np.array([1.0, 0, 0]),
+            'mimic': None if mimic is None else (mimic.get('joint'), float(mimic.get('multiplier', 1.0)), float(mimic.get('offset', 0.0)))}
+    roots = [l for l in links if l not in joints]
+    if len(roots) != 1:
+        raise ValueError('URDF must have exactly one root link, found %s' % str(roots))
+
+    # Breadth first from the root so parents always come before children
+    order = []
+    frontier = roots
+    while len(frontier):
+        order = order + frontier
+        frontier = [c for c in joints if joints[c]['parent'] in frontier]
+    link_index = dict([(l, i) for i, l in enumerate(order)])
+    child_joints = [joints[l] for l in order[1:]]
+
+    actuated = [j['name'] for j in child_joints if j['type'] != JOINT_FIXED and j['mimic'] is None]
+    by_name = dict([(j['name'], j) for j in child_joints])
+    q_index, mult, offset = [], [], []
+    for j in child_joints:
+        if j['type'] == JOINT_FIXED:
+            q_index.append(-1)
+            mult.append(0.0)
+            offset.append(0.0)
+        elif j['mimic'] is None:
+            q_index.append(actuated.index(j['name']))
+            mult.append(1.0)
+            offset.append(0.0)
+        else:
+            src = by_name.get(j['mimic'][0])
+            if src is None or src['name'] not in actuated:
+                raise ValueError('Joint %s mimics unknown or non actuated joint %s' % (j['name'], j['mimic'][0]))
+            q_index.append(actuated.index(src['name']))
+            mult.append(j['mimic'][1])
+            offset.append(j['mimic'][2])
+    axes = np.array([j['axis'] for j in child_joints]).reshape(-1, 3)
+    norms = np.linalg.norm(axes, axis=1)
+    axes = axes / np.where(norms > 0, norms, 1.0)[:, None]
+    return {'version': np.array(CACHE_VERSION),
+            'link_names': np.array(order),
+            'joint_names': np.array([j['name'] for j in child_joints]),
+            'actuated_joint_names': np.array(actuated),
+            'parent': np.array([link_index[j['parent']] for j in child_joints], dtype=np.int64).reshape(-1),
+            'type': np.array([j['type'] for j in child_joints], dtype=np.int64).reshape(-1),
+            'origin': np.array([j['origin'] for j in child_joints]).reshape(-1, 4, 4),
+            'axis': axes,
+            'q_index': np.array(q_index, dtype=np.int64).reshape(-1),
+            'mimic_multiplier': np.array(mult).reshape(-1),
+            'mimic_offset': np.array(offset).reshape(-1)}
+
+
+class ForwardKinematics(Device):
+    """
+    Batched forward kinematics of the exported URDF, using NumPy only
+
+    The URDF joint tree is compiled once into arrays of fixed transforms and joint axes (see compile_urdf).
+    The compiled tree is cached on disk in cache_dir, keyed by the SHA1 of the URDF, so later loads skip the XML parsing.
+    Poses are evaluated for N configurations at once: each joint along the path to a link is one
+    vectorized (N,4,4) matrix product.
+
+    Configurations are given as a dict of joint name to value (scalar, or array of N values),
+    or as an (N, n) array ordered as actuated_joint_names. Unspecified joints are zero.
+
+        fk = ForwardKinematics()
+        T = fk.link_fk({'joint_lift': 0.5, 'joint_wrist_yaw': [0, 1.57]}, 'link_gripper_fingertip_right', base='link_arm_l0')
+    """
+    def __init__(self, urdf_file=None, cache_dir=None):
+        Device.__init__(self, name='forward_kinematics')
+        self.urdf_file = urdf_file if urdf_file is not None else os.path.join(hello_utils.get_fleet_directory(), self.params['urdf_file'])
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(hello_utils.get_fleet_directory(), self.params['cache_dir'])
+        with open(self.urdf_file, 'rb') as f:
+            urdf_text = f.read()
+        self.urdf_hash = hashlib.sha1(urdf_text).hexdigest()
+        self.from_cache = False
+        chain = self.load_cache()
+        if chain is None:
+            chain = compile_urdf(urdf_text)
+            self.save_cache(chain)
+        self.link_names = [str(l) for l in chain['link_names']]
+        self.joint_names = [str(j) for j in chain['joint_names']]
+        self.actuated_joint_names = [str(j) for j in chain['actuated_joint_names']]
+        self.parent = chain['parent']
+        self.type = chain['type']
+        self.origin = chain['origin']
+        self.axis = chain['axis']
+        self.q_index = chain['q_index']
+        self.mimic_multiplier = chain['mimic_multiplier']
+        self.mimic_offset = chain['mimic_offset']
+        self.link_index = dict([(l, i) for i, l in enumerate(self.link_names)])
+        self.actuated_index = dict([(j, i) for i, j in enumerate(self.actuated_joint_names)])
+        self.paths = {}
+
+    # ###########  Cache #############
+
+    def get_cache_file(self):
+        return os.path.join(self.cache_dir, 'fk_%s.npz' % self.urdf_hash)
+
+    def load_cache(self):
+        fn = self.get_cache_file()
+        if not os.path.isfile(fn):
+            return None
+        try:
+            with np.load(fn) as d:
+                chain = dict([(k, d[k]) for k in d.files])
+            if int(chain['version']) != CACHE_VERSION:
+                return None
+            self.from_cache = True
+            return chain
+        except (IOError, OSError, ValueError, KeyError) as e:
+            self.logger.warning('Ignoring unreadable FK cache %s: %s' % (fn, str(e)))
+            return None
+
+    def save_cache(self, chain):
+        fn = self.get_cache_file()
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp = fn + '.%d.tmp.npz' % os.getpid()
+            np.savez(tmp, **chain)
+            os.rename(tmp, fn) #Atomic, so concurrent loads never see a partial file
+        except (IOError, OSError) as e:
+            self.logger.warning('Unable to write FK cache %s: %s' % (fn, str(e)))
+
+    # ###########  Evaluation #############
+
+    def cfg_to_array(self, cfg):
+        """
+        Convert a configuration to an (N, n) array of actuated joint values
+        Returns the array and whether the configuration was a single (unbatched) one
+        """
+        if not isinstance(cfg, dict):
+            q = np.asarray(cfg, dtype=np.float64)
+            single = q.ndim == 1
+            q = q.reshape(-1, len(self.actuated_joint_names))
+            return q, single
+        vals = dict([(k, np.asarray(v, dtype=np.float64)) for k, v in cfg.items() if k in self.actuated_index])
+        single = all([v.ndim == 0 for v in vals.values()])
+        n = 1 if single else max([v.size for v in vals.values() if v.ndim > 0])
+        q = np.zeros((n, len(self.actuated_joint_names)))
+        for k, v in vals.items():
+            q[:, self.actuated_index[k]] = v
+        return q, single
+
+    def get_path(self, link, base=None):
+        """Joint indices from base down to link, or None if base is not an ancestor of link"""
+        key = (link, base)
+        if key not in self.paths:
+            path = []
+            i = self.link_index[link]
+            stop = 0 if base is None else self.link_index[base]
+            while i != stop:
+                if i == 0:
+                    path = None
+                    break
+                path.append(i - 1) #Joint i-1 has link i as its child
+                i = self.parent[i - 1]
+            self.paths[key] = None if path is None else path[::-1]
+        return self.paths[key]
+
+    def joint_transforms(self, q, joints):
+        """(N,4,4) transform of each joint in joints for the configurations q"""
+        n = q.shape[0]
+        T = {}
+        for j in joints:
+            if self.type[j] == JOINT_FIXED:
+                T[j] = self.origin[j][None, :, :]
+                continue
+            x = q[:, self.q_index[j]] * self.mimic_multiplier[j] + self.mimic_offset[j]
+            M = np.tile(np.eye(4), (n, 1, 1))
+            a = self.axis[j]
+            if self.type[j] == JOINT_PRISMATIC:
+                M[:, :3, 3] = x[:, None] * a
+            else:
+                # Rodrigues: R = I + sin(x) K + (1-cos(x)) K^2
+                K = np.array([[0, -a[2], a[1]], [a[2], 0, -a[0]], [-a[1], a[0], 0]])
+                M[:, :3, :3] = np.eye(3) + np.sin(x)[:, None, None] * K + (1 - np.cos(x))[:, None, None] * K.dot(K)
+            T[j] = np.matmul(self.origin[j], M)
+        return T
+
+    def link_fk(self, cfg, link, base=None):
+        """
+        Pose of link in the frame of base (default: the URDF root)
+        Returns a 4x4 transform, or (N,4,4) if cfg is batched
+        """
+        return self.links_fk(cfg, [link], base)[link]
+
+    def links_fk(self, cfg, links=None, base=None):
+        """
+        Poses of several links (default: all) in the frame of base (default: the URDF root)
+        Returns a dict of link name to 4x4 transform, or (N,4,4) if cfg is batched
+        """
+        q, single = self.cfg_to_array(cfg)
+        links = self.link_names if links is None else links
+        rel_base = base
+        if base is not None and any([self.get_path(l, base) is None for l in links]):
+            rel_base = None #base isn't an ancestor of every link: go through the root
+        paths = dict([(l, self.get_path(l, rel_base)) for l in links + ([base] if base is not None and rel_base is None else [])])
+        T = self.joint_transforms(q, set([j for p in paths.values() for j in p]))
+        poses = {}
+        cache = {}
+        for l in paths:
+            pose = np.tile(np.eye(4), (q.shape[0], 1, 1))
+            for k, j in enumerate(paths[l]):
+                prefix = tuple(paths[l][:k + 1])
+                if prefix not in cache:
+                    cache[prefix] = np.matmul(pose, T[j])
+                pose = cache[prefix]
+            poses[l] = pose
+        if base is not None and rel_base is None:
+            inv = np.linalg.inv(poses[base])
+            poses = dict([(l, np.matmul(inv, poses[l])) for l in links])
+        if single:
+            return dict([(l, poses[l][0]) for l in links])
+        return dict([(l, poses[l]) for l in links])
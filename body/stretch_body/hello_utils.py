@@ -1,10 +1,8 @@
 from __future__ import print_function
-import yaml
 import math
 import os
 import time
 import logging
-import numpy
 
 def print_stretch_re_use():
     print("For use with S T R E T C H (TM) RESEARCH EDITION from Hello Robot Inc.\n")
@@ -72,14 +70,22 @@ def read_fleet_yaml(f):
     dict
         yaml as dictionary if valid file, else empty dict
     """
+    import yaml #Not needed once the params are cached (see robot_params.load_params)
     try:
         with open(get_fleet_directory()+f, 'r') as s:
-            p = yaml.load(s,Loader=yaml.FullLoader)
-            return {} if p is None else p
+            data = s.read()
     except IOError:
         return {}
+    try:
+        # The LibYAML based loader, when PyYAML was built with it, is several times faster
+        p = yaml.load(data, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    except yaml.constructor.ConstructorError:
+        # Written by write_fleet_yaml with Python tags (eg, tuples): only the full loader reads these
+        p = yaml.load(data, Loader=yaml.FullLoader)
+    return {} if p is None else p
 
 def write_fleet_yaml(fn,rp):
+    import yaml
     with open(get_fleet_directory()+fn, 'w') as yaml_file:
         yaml.dump(rp, yaml_file, default_flow_style=False)
 
@@ -164,10 +170,10 @@ class LoopStats():
         self.status['loop_rate_min_hz']=min(self.status['loop_rate_hz'], self.status['loop_rate_min_hz'])
         self.status['loop_rate_max_hz'] = max(self.status['loop_rate_hz'], self.status['loop_rate_max_hz'])
         if type(self.rate_log)==type(None):
-            self.rate_log=numpy.array([self.status['loop_rate_hz']] * self.n_log)
+            self.rate_log=[self.status['loop_rate_hz']] * self.n_log
         self.rate_log[self.log_idx]=self.status['loop_rate_hz']
         self.log_idx=(self.log_idx+1)%self.n_log
-        self.status['loop_rate_avg_hz']=numpy.average(self.rate_log)
+        self.status['loop_rate_avg_hz']=sum(self.rate_log)/len(self.rate_log)
 
         self.sleep_time_s = (1 / self.target_loop_rate) - (self.status['execution_time_ms'] / 1000)
         if self.sleep_time_s < .001:
@@ -1,6 +1,7 @@
 from __future__ import print_function
 from stretch_body.stepper import *
 from stretch_body.device import Device
+from stretch_body.trajectory import StepperTrajectory
 import time
 
 class Lift(Device):
@@ -24,12 +25,25 @@ class Lift(Device):
                                    'current': [self.params['range_m'][0], self.params['range_m'][1]]}
         self.motor.set_motion_limits(self.translate_to_motor_rad(self.soft_motion_limits['current'][0]),
                                      self.translate_to_motor_rad(self.soft_motion_limits['current'][1]))
+        self.trajectory = StepperTrajectory(self)
     # ###########  Device Methods #############
 
     def startup(self):
         return self.motor.startup()
 
+    def apply_params(self):
+        """Recompute the settings derived from params at init (eg, after a reload, see params_watcher.py)"""
+        self.i_feedforward = self.params['i_feedforward']
+        self.vel_r = self.translate_to_motor_rad(self.params['motion']['default']['vel_m'])
+        self.accel_r = self.translate_to_motor_rad(self.params['motion']['default']['accel_m'])
+        self.i_contact_neg = self.translate_force_to_motor_current(self.params['contact_thresh_N'][0])
+        self.i_contact_pos = self.translate_force_to_motor_current(self.params['contact_thresh_N'][1])
+        self.soft_motion_limits['hard'] = [self.params['range_m'][0], self.params['range_m'][1]]
+        self.set_soft_motion_limit_min(self.soft_motion_limits['user'][0])
+        self.set_soft_motion_limit_max(self.soft_motion_limits['user'][1])
+
     def stop(self):
+        self.trajectory.stop()
         self.motor.stop() #Maintain current mode
 
     def pull_status(self):
@@ -38,6 +52,7 @@ class Lift(Device):
         self.status['pos']= self.motor_rad_to_translate_m(self.status['motor']['pos'])
         self.status['vel'] = self.motor_rad_to_translate_m(self.status['motor']['vel'])
         self.status['force'] = self.motor_current_to_translate_force(self.status['motor']['current'])
+        self.notify_status()
 
     def push_command(self):
         self.motor.push_command()
@@ -272,13 +287,7 @@ class Lift(Device):
         return deg_to_rad(ang)
 
     def __wait_for_contact(self, timeout=5.0):
-        ts=time.time()
-        while (time.time()-ts<timeout):
-            self.pull_status()
-            if self.motor.status['in_guarded_event']:
-                return True
-            time.sleep(0.01)
-        return False
+        return self.wait_until(lambda: self.motor.status['in_guarded_event'], timeout=timeout, poll_s=0.01)
 
 
     def home(self, measuring=False):
@@ -317,7 +326,7 @@ class Lift(Device):
         # Down direction
         self.move_to(x_m=0.6, req_calibration=False)
         self.push_command()
-        time.sleep(6.0)
+        self.motor.wait_until_at_setpoint(timeout=6.0)
 
         #Restore default
         if not self.motor.gains['enable_guarded_mode']:
@@ -0,0 +1,157 @@
+"""
+Non-blocking logging for the control threads
+
+When enabled (logging_queue.enabled), the handlers of the root logger (console and file, see the 'logging' params)
+are moved behind a QueueHandler / QueueListener pair. A logger call then only rate limits the record and
+queues it. Formatting and writing happen in the listener thread. The queue is bounded, and drops the oldest
+record when full. Records are rate limited per (logger, message template, with numbers masked) to at most
+rate_limit.max_per_period every rate_limit.period_s. The first record let through afterwards notes how many
+were suppressed.
+Counts of queued, dropped and rate limited records are kept in status, which the Robot reports as status['logging'].
+"""
+from __future__ import print_function
+import atexit
+import collections
+import logging
+import re
+import threading
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError: #Python 2
+    QueueHandler = None
+    QueueListener = None
+
+status = {'enabled': False, 'queued': 0, 'dropped': 0, 'rate_limited': 0, 'max_depth': 0}
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+_number_re = re.compile(r'[-+]?\d+(\.\d*)?')
+
+
+class DropOldestQueue:
+    """Bounded queue that drops its oldest item to make room, rather than blocking or failing"""
+    def __init__(self, maxsize):
+        self.items = collections.deque()
+        self.maxsize = maxsize
+        self.cond = threading.Condition()
+
+    def put_nowait(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                status['dropped'] += 1
+            self.items.append(item)
+            status['max_depth'] = max(status['max_depth'], len(self.items))
+            self.cond.notify()
+
+    put = put_nowait
+
+    def get(self, block=True, timeout=None):
+        with self.cond:
+            while not len(self.items):
+                self.cond.wait()
+            return self.items.popleft()
+
+    def qsize(self):
+        return len(self.items)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most max_per_period records per (logger, message template) every period_s
+    Called from any thread that logs. Windows that have ended are pruned (at most once every period_s), so
+    one-off messages don't accumulate. Their suppressed counts, if any, are then no longer reported.
+    """
+    def __init__(self, period_s, max_per_period):
+        logging.Filter.__init__(self)
+        self.period_s = period_s
+        self.max_per_period = max_per_period
+        self.windows = {} #key: [window start, count, suppressed]
+        self.t_prune = None
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        # Messages are mostly formatted before logging (eg, 'Total Errors 12'), so numbers are masked out of the template
+        key = (record.name, _number_re.sub('#', record.msg) if isinstance(record.msg, str) else id(record.msg))
+        now = record.created
+        with self.lock:
+            w = self.windows.get(key)
+            if w is None or now - w[0] >= self.period_s:
+                suppressed = w[2] if w is not None else 0
+                self._prune(now)
+                self.windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = '%s [%d similar suppressed]' % (record.msg, suppressed)
+                return True
+            if w[1] < self.max_per_period:
+                w[1] += 1
+                return True
+            w[2] += 1
+            status['rate_limited'] += 1
+            return False
+
+    def _prune(self, now):
+        if self.t_prune is not None and now - self.t_prune < self.period_s:
+            return
+        self.t_prune = now
+        for k in [k for k, w in self.windows.items() if now - w[0] >= self.period_s]:
+            del self.windows[k]
+
+
+if QueueHandler is not None:
+    class NonBlockingQueueHandler(QueueHandler):
+        """QueueHandler that leaves formatting to the listener thread"""
+        def prepare(self, record):
+            return record
+
+        def enqueue(self, record):
+            status['queued'] += 1
+            self.queue.put_nowait(record)
+else:
+    NonBlockingQueueHandler = None
+
+
+def start(params):
+    """
+    Move the root logger's handlers behind a queue (params: the logging_queue params)
+    Returns False if not available (Python 2)
+    """
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return True
+        if QueueHandler is None:
+            logging.getLogger().warning('Non-blocking logging requires Python 3. Logging synchronously.')
+            return False
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        q = DropOldestQueue(params['max_size'])
+        _handler = NonBlockingQueueHandler(q)
+        _handler.addFilter(RateLimitFilter(params['rate_limit']['period_s'], params['rate_limit']['max_per_period']))
+        _listener = QueueListener(q, *handlers, respect_handler_level=True)
+        for h in handlers:
+            root.removeHandler(h)
+        root.addHandler(_handler)
+        _listener.start()
+        status['enabled'] = True
+        return True
+
+
+def stop():
+    """Flush the queued records, and return the handlers to the root logger"""
+    global _listener, _handler
+    with _lock:
+        if _listener is None:
+            return
+        root = logging.getLogger()
+        root.removeHandler(_handler)
+        _listener.stop()
+        for h in _listener.handlers:
+            root.addHandler(h)
+        _listener = None
+        _handler = None
+        status['enabled'] = False
+
+
+atexit.register(stop)
@@ -0,0 +1,239 @@
+"""
+Hot reload of the robot params, without restarting the process
+
+The ParamsWatcher polls the files the params are built from (the user and factory YAMLs and the external
+params modules, see robot_params.py). When one changes, the params are merged again and compared, value
+by value, to the previous merge. Only the changed values are written into the live params
+(RobotParams.get_params()), which the devices share, and pushed to the devices that derive settings from them:
+
+* Stepper gains (eg, hello-motor-lift.gains.pKp_d) go to the board through Stepper.set_gains
+* Pimu and Wacc config is marked dirty, so it is sent to the board with the next command
+* Lift, Arm and Base recompute their default motion, contact thresholds and soft limits (apply_params)
+* Collision models are enabled or disabled (eg, collision_arm_camera.enabled)
+* Sentry rules take their new rates (robot_sentry.rate_hz)
+* Other values (eg, robot_sentry and robot_monitor switches) are used as they are read
+
+Changes to a joint (or, for collision models, to any stepper joint) while it is moving are deferred, and
+applied once it has stopped. Changes to values that are only read at startup (eg, usb names, servo ids,
+gear ratios, logging, Dynamixel pid and profile, odometry rate and history) are not applied, and are logged
+as needing a restart. Enable with:
+
+    params_watcher:
+      enabled: 1
+      poll_s: 1.0
+
+Files are polled (by modification time, size and content hash), as there is no portable file change
+notification in the standard library.
+"""
+from __future__ import print_function
+from stretch_body.device import Device
+import stretch_body.robot_params as robot_params
+import threading
+import time
+
+# Params only read at startup: sections, keys (in any section), and paths (and the values under them)
+RESTART_SECTIONS = ['robot', 'logging', 'logging_queue', 'robot_sim', 'robot_startup', 'params_watcher', 'telemetry',
+                    'factory_params', 'params']
+RESTART_KEYS = ['usb_name', 'id', 'baud', 'py_module_name', 'py_class_name', 'gr', 'gr_spur', 'chain_pitch',
+                'chain_sprocket_teeth', 'wheel_diameter_m', 'wheel_separation_m', 'flip_encoder_polarity', 'zero_t',
+                'req_calibration']
+RESTART_PATHS = [('base_odometry', 'rate_hz'), ('base_odometry', 'history_s'), ('base_odometry', 'history_max_rate_hz'),
+                 ('robot_monitor', 'event_log_size'), ('robot_monitor', 'log_events'), ('robot_sentry', 'base_fan_control_rule'),
+                 ('robot_collision', 'models'), ('robot_collision', 'table_dir')]
+# Dynamixel params written to the servo at startup (see DynamixelHelloXL430.startup), and collision model tables
+DYNAMIXEL_RESTART_PATHS = [('pid',), ('pwm_limit',), ('temperature_limit',), ('min_voltage_limit',), ('max_voltage_limit',),
+                           ('return_delay_time',), ('use_multiturn',), ('range_t',), ('motion', 'default')]
+
+
+def flatten_params(params, path=()):
+    """Dict of path (tuple of keys) to value, for each non-dict value of the nested params"""
+    flat = {}
+    for k, v in params.items():
+        if isinstance(v, dict) and len(v):
+            flat.update(flatten_params(v, path + (k,)))
+        else:
+            flat[path + (k,)] = v
+    return flat
+
+
+def set_param(params, path, value):
+    """Set the value at path in the nested params, adding dicts as needed"""
+    d = params
+    for k in path[:-1]:
+        if not isinstance(d.get(k), dict):
+            d[k] = {}
+        d = d[k]
+    d[path[-1]] = value
+
+
+class ParamsWatcher(Device):
+    """
+    Apply changes to the params files to a running Robot
+
+    robot: the Robot whose devices the changes are pushed to. If None, only the live params are updated
+    """
+    def __init__(self, robot=None):
+        Device.__init__(self, 'params_watcher')
+        self.robot = robot
+        self.baseline = None
+        self.target = None
+        self.source_keys = {}
+        self.warned = set()
+        self.changes = []
+        self.thread = None
+        self.shutdown_flag = threading.Event()
+        self.status = {'n_reload': 0, 'n_applied': 0, 'n_restart': 0, 'pending': [], 'timestamp_reload': None}
+
+    # ###########  Device Methods #############
+
+    def startup(self, threaded=True):
+        """Take the current params files as the baseline, and watch them (from a background thread if threaded)"""
+        self.baseline = self.target = self.build()
+        if threaded:
+            self.shutdown_flag.clear()
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+        return True
+
+    def stop(self):
+        if self.thread is not None:
+            self.shutdown_flag.set()
+            self.thread.join(1.0)
+            self.thread = None
+
+    def _run(self):
+        while not self.shutdown_flag.is_set():
+            try:
+                self.step()
+            except Exception as e: #Eg, a YAML caught mid-write. Tried again on the next poll
+                self.logger.warning('Params reload failed: %s' % str(e))
+            self.shutdown_flag.wait(self.params['poll_s'])
+
+    def pretty_print(self):
+        print('----- Params Watcher ------ ')
+        print('Reloads', self.status['n_reload'])
+        print('Values applied', self.status['n_applied'])
+        print('Values needing a restart', self.status['n_restart'])
+        print('Pending (joint moving)', ', '.join(self.status['pending']))
+        for c in self.changes[-10:]:
+            print('%s: %s -> %s (%s)' % (c['param'], c['old'], c['new'], c['result']))
+
+    # ###########  Reload #############
+
+    def build(self):
+        """Merge the params files, and note their state. Returns the flattened params"""
+        user_params, params, sources = robot_params.build_params()
+        self.source_keys = dict([(p, robot_params.get_source_key(p)) for p in sources])
+        return flatten_params(params)
+
+    def is_changed(self):
+        return any([robot_params.get_source_key(p) != k for p, k in self.source_keys.items()])
+
+    def step(self):
+        """
+        Reload the params if a file changed, and apply the changed values that can be
+        Returns the changes made in this step, as dicts of param, old, new and result
+        """
+        if self.is_changed():
+            self.target = self.build()
+            self.status['n_reload'] += 1
+            self.status['timestamp_reload'] = time.time()
+            self.warned = set()
+        diff = [(p, self.baseline.get(p), v) for p, v in self.target.items() if p not in self.baseline or self.baseline[p] != v]
+        groups = {}
+        results = []
+        for path, old, new in sorted(diff, key=lambda d: [str(k) for k in d[0]]):
+            name = '.'.join([str(k) for k in path])
+            if self.needs_restart(path):
+                self.logger.warning('Params change %s: %s -> %s takes effect on restart' % (name, old, new))
+                self.baseline[path] = new
+                self.status['n_restart'] += 1
+                results.append({'param': name, 'old': old, 'new': new, 'result': 'restart'})
+                continue
+            key, is_moving, apply_changes = self.get_handler(path)
+            if is_moving is not None and is_moving():
+                if (name, repr(new)) not in self.warned: #Logged once per value
+                    self.warned.add((name, repr(new)))
+                    self.logger.info('Params change %s: %s -> %s deferred until %s stops' % (name, old, new, key))
+                results.append({'param': name, 'old': old, 'new': new, 'result': 'deferred'})
+                continue
+            groups.setdefault(key, (apply_changes, []))[1].append((path, old, new))
+
+        live = robot_params.RobotParams.get_params()[1]
+        for key, (apply_changes, changes) in groups.items():
+            for path, old, new in changes:
+                set_param(live, path, new)
+                self.baseline[path] = new
+            if apply_changes is not None:
+                apply_changes(changes)
+            for path, old, new in changes:
+                name = '.'.join([str(k) for k in path])
+                self.logger.info('Params change %s: %s -> %s applied' % (name, old, new))
+                results.append({'param': name, 'old': old, 'new': new, 'result': 'applied'})
+            self.status['n_applied'] += len(changes)
+        self.status['pending'] = [r['param'] for r in results if r['result'] == 'deferred']
+        self.changes = (self.changes + [r for r in results if r['result'] != 'deferred'])[-100:]
+        return results
+
+    def needs_restart(self, path):
+        """True if the param at path is only read at startup"""
+        if path[0] in RESTART_SECTIONS or path[-1] in RESTART_KEYS:
+            return True
+        if any([path[:len(p)] == p for p in RESTART_PATHS]):
+            return True
+        section = robot_params.RobotParams.get_params()[1].get(path[0])
+        if isinstance(section, dict) and 'usb_name' in section and 'id' in section: #A Dynamixel servo
+            return any([path[1:1 + len(p)] == p for p in DYNAMIXEL_RESTART_PATHS])
+        return len(path) > 2 and path[1] == 'table' #Collision model limit table, built at startup
+
+    # ###########  Devices #############
+
+    def _steppers_moving(self):
+        r = self.robot
+        return any([s.status['is_moving'] for s in [r.lift.motor, r.arm.motor, r.base.left_wheel, r.base.right_wheel]])
+
+    def get_handler(self, path):
+        """
+        How to apply a change at path: (device name, function returning True while it is unsafe to apply,
+        function applying a list of (path, old, new) once written to the live params). Functions may be None
+        """
+        r = self.robot
+        if r is None:
+            return 'params', None, None
+        steppers = {'hello-motor-lift': r.lift.motor, 'hello-motor-arm': r.arm.motor,
+                    'hello-motor-left-wheel': r.base.left_wheel, 'hello-motor-right-wheel': r.base.right_wheel}
+        section = path[0]
+        if section in steppers and len(path) > 2 and path[1] == 'gains':
+            s = steppers[section]
+            def set_gains(changes):
+                g = s.gains.copy()
+                for p, old, new in changes:
+                    g[p[2]] = new
+                s.set_gains(g)
+            return section, lambda: s.status['is_moving'], set_gains
+        if section in ['lift', 'arm']:
+            j = getattr(r, section)
+            return section, lambda: j.motor.status['is_moving'], lambda changes: j.apply_params()
+        if section == 'base':
+            return section, lambda: r.base.left_wheel.status['is_moving'] or r.base.right_wheel.status['is_moving'], \
+                   lambda changes: r.base.apply_params()
+        if section in ['pimu', 'wacc'] and len(path) > 2 and path[1] == 'config':
+            d = getattr(r, section)
+            def set_dirty(changes):
+                d._dirty_config = True
+            return section, None, set_dirty
+        if path[:2] == ('robot_sentry', 'rate_hz'):
+            def set_rates(changes):
+                for rule in r.sentry.rules:
+                    rule.rate_hz = r.sentry.get_rate(rule.switch if rule.switch is not None else 'custom')
+            return 'sentry', None, set_rates
+        if section in r.collision.models_enabled and path[1:] == ('enabled',):
+            def enable_models(changes):
+                for p, old, new in changes:
+                    if new:
+                        r.collision.enable_model(section)
+                    else:
+                        r.collision.disable_model(section)
+            return 'collision ' + section, self._steppers_moving, enable_models
+        return section, None, None
@@ -4,7 +4,6 @@ from stretch_body.device import Device
 from stretch_body.hello_utils import *
 import textwrap
 import threading
-import psutil
 import logging
 import time
 
@@ -370,6 +369,7 @@ class Pimu(Device):
             self.status['bump_event_cnt'] = unpack_uint16_t(s[sidx:]);sidx += 2
             self.status['debug'] = unpack_float_t(s[sidx:]); sidx += 4
             self.status['cpu_temp']=self.get_cpu_temp()
+            self.notify_status()
             return sidx
 
     def pack_config(self,s,sidx):
@@ -441,6 +441,7 @@ class Pimu(Device):
 
     # ################ Sentry #####################
     def get_cpu_temp(self):
+        import psutil #Slow to import, and only needed here
         cpu_temp = 0
         try:
             t = psutil.sensors_temperatures()['coretemp']
@@ -452,23 +453,32 @@ class Pimu(Device):
 
 
 
-    def step_sentry(self):
-        if self.hw_valid and self.robot_params['robot_sentry']['base_fan_control']:
-            #Manage CPU temp using the mobile base fan
-            #See https://www.intel.com/content/www/us/en/support/articles/000005946/intel-nuc.html
-            cpu_temp=self.get_cpu_temp()
-            if cpu_temp>self.params['base_fan_on']:
-                if self.ts_last_fan_on is None or time.time()-self.ts_last_fan_on>3.0: #Will turn itself off if don't refresh command
-                    self.set_fan_on()
-                    self.push_command()
-                    self.ts_last_fan_on = time.time()
-                if  not self.status['fan_on']:
-                    self.logger.debug('Base fan turned on')
+    def step_sentry(self, robot=None):
+        if self.robot_params['robot_sentry']['base_fan_control']:
+            self.step_fan_control(self.status['fan_on'])
 
-            if self.fan_on_last and not self.status['fan_on']:
-                self.logger.debug('Base fan turned off')
-
-            if cpu_temp<self.params['base_fan_off']and self.status['fan_on']:
-                self.set_fan_off()
+    def step_fan_control(self, fan_on):
+        """Manage CPU temp using the mobile base fan. Returns True if the fan was commanded"""
+        #See https://www.intel.com/content/www/us/en/support/articles/000005946/intel-nuc.html
+        if not self.hw_valid:
+            return False
+        commanded = False
+        cpu_temp=self.get_cpu_temp()
+        if cpu_temp>self.params['base_fan_on']:
+            if self.ts_last_fan_on is None or time.time()-self.ts_last_fan_on>3.0: #Will turn itself off if don't refresh command
+                self.set_fan_on()
                 self.push_command()
-            self.fan_on_last = self.status['fan_on']
+                self.ts_last_fan_on = time.time()
+                commanded = True
+            if  not fan_on:
+                self.logger.debug('Base fan turned on')
+
+        if self.fan_on_last and not fan_on:
+            self.logger.debug('Base fan turned off')
+
+        if cpu_temp<self.params['base_fan_off']and fan_on:
+            self.set_fan_off()
+            self.push_command()
+            commanded = True
+        self.fan_on_last = fan_on
+        return commanded
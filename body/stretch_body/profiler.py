@@ -0,0 +1,189 @@
+"""
+Profiling of named spans of the Robot code
+
+Spans time the sections of interest (eg, 'startup.lift', 'pull_status.pimu', 'rpc.hello-pimu.receive',
+'sentry.base_fan_control', 'collision.<model>', 'monitor.monitor_runstop', 'cycle.non_dxl'):
+
+    with profiler.span('pull_status.pimu'):
+        ...
+
+or, where a with block doesn't fit (eg, consecutive phases):
+
+    t = profiler.begin()
+    ...
+    t = profiler.end('rpc.hello-pimu.send', t) #Returns the end time, the start of the next phase
+
+Profiling is off by default. Then span() returns a shared no-op context and begin() / end() return None, so
+the instrumentation costs a function call. Once enabled, each span is timed with perf_counter_ns and added to
+the per span statistics (count, total, min, max and a log2 histogram for percentiles). The most recent
+max_events spans are kept with their thread to export a Chrome trace (chrome://tracing, or ui.perfetto.dev).
+"""
+from __future__ import print_function
+import collections
+import threading
+import json
+import time
+
+try:
+    _now_ns = time.perf_counter_ns
+except AttributeError: #Before Python 3.7
+    _now_ns = lambda: int(getattr(time, 'perf_counter', time.time)() * 1e9)
+
+N_BUCKETS = 48 #Bucket i holds durations of 2^(i-1) to 2^i ns
+
+enabled = False
+_lock = threading.Lock()
+_stats = {}
+_events = collections.deque(maxlen=100000)
+_thread_names = {}
+_ts_enabled_ns = 0
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    __slots__ = ['name', 't0']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = _now_ns()
+        return self
+
+    def __exit__(self, *args):
+        record(self.name, self.t0, _now_ns())
+        return False
+
+
+def enable(max_events=100000):
+    """Start profiling, clearing the spans recorded so far"""
+    global enabled, _events
+    with _lock:
+        _events = collections.deque(maxlen=max_events)
+    reset()
+    enabled = True
+
+
+def disable():
+    """Stop profiling. The recorded spans are kept"""
+    global enabled
+    enabled = False
+
+
+def reset():
+    global _ts_enabled_ns
+    with _lock:
+        _stats.clear()
+        _events.clear()
+        _thread_names.clear()
+        _ts_enabled_ns = _now_ns()
+
+
+def span(name):
+    """Context that times a span of the given name"""
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def begin():
+    """Start time of a span, or None if not profiling"""
+    return _now_ns() if enabled else None
+
+
+def end(name, t0):
+    """Record the span name from t0 (see begin) to now. Returns now, or None if not profiling"""
+    if t0 is None or not enabled:
+        return None
+    t1 = _now_ns()
+    record(name, t0, t1)
+    return t1
+
+
+def record(name, t0, t1):
+    """Record the span name from t0 to t1 (ns)"""
+    dt = t1 - t0
+    thread = threading.current_thread()
+    with _lock:
+        s = _stats.get(name)
+        if s is None:
+            s = _stats[name] = {'count': 0, 'total_ns': 0, 'min_ns': dt, 'max_ns': dt, 'hist': [0] * N_BUCKETS}
+        s['count'] += 1
+        s['total_ns'] += dt
+        s['min_ns'] = min(s['min_ns'], dt)
+        s['max_ns'] = max(s['max_ns'], dt)
+        s['hist'][min(max(dt, 0).bit_length(), N_BUCKETS - 1)] += 1
+        _events.append((name, thread.ident, t0, dt))
+        if thread.ident not in _thread_names:
+            _thread_names[thread.ident] = thread.name
+
+
+def _percentile_ns(hist, count, p):
+    """The p percentile, interpolated within its histogram bucket"""
+    target = p / 100.0 * count
+    n = 0
+    for i, c in enumerate(hist):
+        if c and n + c >= target:
+            lo = 2 ** (i - 1) if i > 0 else 0
+            return lo + (2 ** i - lo) * (target - n) / float(c)
+        n += c
+    return 2 ** (N_BUCKETS - 1)
+
+
+def get_stats():
+    """
+    Statistics of each span, as name: count, total_ms, mean_us, min_us, p50_us, p95_us and max_us
+    Percentiles are interpolated within their log2 histogram bucket, so are approximate (within a factor of 2)
+    """
+    with _lock:
+        stats = dict([(k, dict(v, hist=list(v['hist']))) for k, v in _stats.items()])
+    out = {}
+    for name, s in stats.items():
+        out[name] = {'count': s['count'], 'total_ms': s['total_ns'] / 1e6, 'mean_us': s['total_ns'] / 1e3 / s['count'],
+                     'min_us': s['min_ns'] / 1e3, 'max_us': s['max_ns'] / 1e3,
+                     'p50_us': min(max(_percentile_ns(s['hist'], s['count'], 50), s['min_ns']), s['max_ns']) / 1e3,
+                     'p95_us': min(max(_percentile_ns(s['hist'], s['count'], 95), s['min_ns']), s['max_ns']) / 1e3}
+    return out
+
+
+def get_summary(top=None):
+    """Text table of the span statistics, ranked by total time"""
+    stats = get_stats()
+    names = sorted(stats, key=lambda k: -stats[k]['total_ms'])[:top]
+    lines = ['%-44s %8s %10s %10s %10s %10s %10s' % ('Span', 'Count', 'Total (ms)', 'Mean (us)', 'p50 (us)', 'p95 (us)', 'Max (us)')]
+    for k in names:
+        s = stats[k]
+        lines.append('%-44s %8d %10.2f %10.1f %10.1f %10.1f %10.1f' % (k, s['count'], s['total_ms'], s['mean_us'], s['p50_us'], s['p95_us'], s['max_us']))
+    return '\n'.join(lines)
+
+
+def get_chrome_trace():
+    """The recorded spans in the Chrome trace event format (complete events, in us from enable)"""
+    with _lock:
+        events = list(_events)
+        thread_names = dict(_thread_names)
+    trace = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': n}} for tid, n in thread_names.items()]
+    for name, tid, t0, dt in events:
+        trace.append({'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': 0, 'tid': tid,
+                      'ts': (t0 - _ts_enabled_ns) / 1e3, 'dur': dt / 1e3})
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(path):
+    with open(path, 'w') as f:
+        json.dump(get_chrome_trace(), f)
+
+
+def pretty_print(top=None):
+    print('----- Profile ------ ')
+    print(get_summary(top))
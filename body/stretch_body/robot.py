@@ -15,23 +15,31 @@ import stretch_body.wacc as wacc
 
 import logging
 import stretch_body.hello_utils as hello_utils
+import stretch_body.logging_queue as logging_queue
+import stretch_body.profiler as profiler
 
 from serial import SerialException
 
 from stretch_body.robot_monitor import RobotMonitor
+from stretch_body.robot_sentry import RobotSentry
 from stretch_body.robot_collision import RobotCollision
+from stretch_body.robot_homing import RobotHoming
+from stretch_body.robot_startup import RobotStartup
+from stretch_body.params_watcher import ParamsWatcher
+from stretch_body.robot_pose_planner import RobotPosePlanner
+from stretch_body.robot_trajectory import RobotTrajectory
 
 
 # #############################################################
 class DXLStatusThread(threading.Thread):
     """
     This thread polls the status data of the Dynamixel devices
-    at 15Hz
+    at robot.dxl_status_rate_hz (15Hz by default)
     """
     def __init__(self,robot):
         threading.Thread.__init__(self)
         self.robot=robot
-        self.robot_update_rate_hz = 15.0  #Hz
+        self.robot_update_rate_hz = robot.params['dxl_status_rate_hz']
         self.stats = hello_utils.LoopStats(loop_name='DXLStatusThread',target_loop_rate=self.robot_update_rate_hz)
         self.shutdown_flag = threading.Event()
         self.first_status=False
@@ -39,7 +47,9 @@ class DXLStatusThread(threading.Thread):
     def run(self):
         while not self.shutdown_flag.is_set():
             self.stats.mark_loop_start()
-            self.robot._pull_status_dynamixel()
+            with profiler.span('cycle.dxl'):
+                self.robot._pull_status_dynamixel()
+                self.robot.notify_status()
             self.first_status=True
             self.stats.mark_loop_end()
             if not self.shutdown_flag.is_set():
@@ -52,6 +62,7 @@ class NonDXLStatusThread(threading.Thread):
     This thread runs at 25Hz.
     It updates the status data of the Devices.
     It also steps the Sentry and Monitor functions
+    The Sentry is stepped on every iteration, and evaluates each of its rules at the rule's own rate
     """
     def __init__(self,robot):
         threading.Thread.__init__(self)
@@ -59,12 +70,13 @@ class NonDXLStatusThread(threading.Thread):
 
         self.robot_update_rate_hz = 25.0  #Hz
         self.monitor_downrate_int = 5  # Step the monitor at every Nth iteration
-        self.collision_downrate_int = 5  # Step the monitor at every Nth iteration
-        self.sentry_downrate_int = 2  # Step the sentry at every Nth iteration
+        self.collision_downrate_int = 2  # Step the collision manager at every Nth iteration
         if self.robot.params['use_monitor']:
             self.robot.monitor.startup()
         if self.robot.params['use_collision_manager']:
             self.robot.collision.startup()
+        if self.robot.params['use_sentry']:
+            self.robot.sentry.startup()
         self.shutdown_flag = threading.Event()
         self.stats = hello_utils.LoopStats(loop_name='NonDXLStatusThread',target_loop_rate=self.robot_update_rate_hz)
         self.titr=0
@@ -73,7 +85,9 @@ class NonDXLStatusThread(threading.Thread):
     def run(self):
         while not self.shutdown_flag.is_set():
             self.stats.mark_loop_start()
+            t = profiler.begin()
             self.robot._pull_status_non_dynamixel()
+            self.robot.notify_status()
             self.first_status = True
 
             if self.robot.params['use_monitor']:
@@ -81,17 +95,43 @@ class NonDXLStatusThread(threading.Thread):
                     self.robot.monitor.step()
 
             if self.robot.params['use_collision_manager']:
+                if (self.titr % self.collision_downrate_int) == 0:
                     self.robot.collision.step()
 
             if self.robot.params['use_sentry']:
-                if (self.titr % self.sentry_downrate_int) == 0:
-                    self.robot._step_sentry()
+                self.robot.sentry.step()
+            self.titr=self.titr+1
+            profiler.end('cycle.non_dxl', t)
             self.stats.mark_loop_end()
             if not self.shutdown_flag.is_set():
                 time.sleep(self.stats.get_loop_sleep_time())
         self.robot.logger.debug('Shutting down NonDXLStatusThread')
 
 
+class OdometryThread(threading.Thread):
+    """
+    This thread pulls the wheel status of the base at base_odometry.rate_hz (100Hz by default)
+    so odometry is integrated at a higher rate than the other Devices are updated
+    """
+    def __init__(self,robot):
+        threading.Thread.__init__(self)
+        self.robot=robot
+        self.robot_update_rate_hz = robot.base.odometry.params['rate_hz']
+        self.stats = hello_utils.LoopStats(loop_name='OdometryThread',target_loop_rate=self.robot_update_rate_hz)
+        self.shutdown_flag = threading.Event()
+
+    def run(self):
+        while not self.shutdown_flag.is_set():
+            self.stats.mark_loop_start()
+            if self.robot.device_startup.is_started('base'):
+                with profiler.span('pull_status.base'):
+                    self.robot.base.pull_status()
+            self.stats.mark_loop_end()
+            if not self.shutdown_flag.is_set():
+                time.sleep(self.stats.get_loop_sleep_time())
+        self.robot.logger.debug('Shutting down OdometryThread')
+
+
 class Robot(Device):
     """
     API to the Stretch RE1 Robot
@@ -99,16 +139,29 @@ class Robot(Device):
     def __init__(self):
         Device.__init__(self, 'robot')
         self.monitor = RobotMonitor(self)
+        self.sentry = RobotSentry(self)
         self.collision = RobotCollision(self)
+        self.homing = RobotHoming(self)
+        self.device_startup = RobotStartup(self)
+        self.params_watcher = ParamsWatcher(self)
+        self.pose_planner = RobotPosePlanner(self)
+        self.trajectory = RobotTrajectory(self)
         self.dirty_push_command = False
         self.lock = threading.RLock() #Prevent status thread from triggering motor sync prematurely
         self.status = {'pimu': {}, 'base': {}, 'lift': {}, 'arm': {}, 'head': {}, 'wacc': {}, 'end_of_arm': {}}
 
+        #Simulated hardware (see robot_sim.py). Must be registered before the devices open their ports
+        self.sim = None
+        if self.robot_params['robot_sim']['enabled']:
+            import stretch_body.robot_sim as robot_sim #Only needed when enabled
+            self.sim = robot_sim.RobotSim().register()
+
         self.pimu=pimu.Pimu()
         self.status['pimu']=self.pimu.status
 
         self.base=base.Base()
         self.status['base']=self.base.status
+        self.base.odometry.set_imu(self.pimu.imu.status)
 
         self.lift=lift.Lift()
         self.status['lift']=self.lift.status
@@ -116,6 +169,11 @@ class Robot(Device):
         self.arm=arm.Arm()
         self.status['arm']=self.arm.status
 
+        #The steppers are in sync mode: streamed trajectory setpoints are held until the Pimu sync
+        for t in [self.lift.trajectory, self.arm.trajectory, self.base.trajectory, self.base.rotation_trajectory]:
+            t.sync_fn = self.pimu.trigger_motor_sync
+            t.push_lock = self.lock
+
         self.head=head.Head()
         self.status['head']=self.head.status
 
@@ -133,10 +191,14 @@ class Robot(Device):
         class_name = self.robot_params[tool_name]['py_class_name']
         self.end_of_arm = getattr(importlib.import_module(module_name), class_name)()
         self.status['end_of_arm'] = self.end_of_arm.status
+        self.status['logging'] = logging_queue.status
 
         self.devices={ 'pimu':self.pimu, 'base':self.base, 'lift':self.lift, 'arm': self.arm, 'head': self.head, 'wacc':self.wacc, 'end_of_arm':self.end_of_arm}
+        if self.sim is not None:
+            self.sim.attach(self)
         self.non_dxl_thread=None
         self.dxl_thread=None
+        self.odometry_thread=None
 
     # ###########  Device Methods #############
 
@@ -144,20 +206,25 @@ class Robot(Device):
         """
         To be called once after class instantiation.
         Prepares devices for communications and motion
+        Devices start concurrently (see robot_startup.py). Returns True if all started. The per device
+        timing report is in device_startup.status
         """
         self.logger.debug('Starting up Robot {0} of batch {1}'.format(self.params['serial_no'], self.params['batch_name']))
+        with profiler.span('startup.devices'):
+            report = self.device_startup.start_devices()
         for k in self.devices.keys():
-            if self.devices[k] is not None:
-                if not self.devices[k].startup():
-                    pass
-                #    print('Startup failure on %s. Exiting.'%k)
-                #    exit()
-
+            if k in report and not report[k]['success']:
+                self.logger.warning('Startup failure on %s: %s' % (k, report[k]['error']))
 
         # Register the signal handlers
         signal.signal(signal.SIGTERM, hello_utils.thread_service_shutdown)
         signal.signal(signal.SIGINT, hello_utils.thread_service_shutdown)
 
+        if self.base.odometry.params['rate_hz'] > 0:
+            self.odometry_thread = OdometryThread(self)
+            self.odometry_thread.setDaemon(True)
+            self.odometry_thread.start()
+
         self.non_dxl_thread = NonDXLStatusThread(self)
         self.non_dxl_thread.setDaemon(True)
         self.non_dxl_thread.start()
@@ -171,6 +238,10 @@ class Robot(Device):
         while not self.non_dxl_thread.first_status and not self.dxl_thread.first_status and time.time()-ts<3.0:
            time.sleep(0.1)
 
+        if self.params_watcher.params['enabled']:
+            self.params_watcher.startup()
+        return report['total']['success']
+
 
     def stop(self):
         """
@@ -178,16 +249,23 @@ class Robot(Device):
         Cleanly stops down motion and communication
         """
         self.logger.debug('---- Shutting down robot ----')
+        self.trajectory.stop()
+        self.params_watcher.stop()
         if self.non_dxl_thread is not None:
             self.non_dxl_thread.shutdown_flag.set()
             self.non_dxl_thread.join(1)
         if self.dxl_thread is not None:
             self.dxl_thread.shutdown_flag.set()
             self.dxl_thread.join(1)
+        if self.odometry_thread is not None:
+            self.odometry_thread.shutdown_flag.set()
+            self.odometry_thread.join(1)
         for k in self.devices.keys():
             if self.devices[k] is not None:
                 self.logger.debug('Shutting down %s'%k)
                 self.devices[k].stop()
+        if self.sim is not None:
+            self.sim.close()
         self.logger.debug('---- Shutdown complete ----')
 
     def get_status(self):
@@ -210,14 +288,16 @@ class Robot(Device):
     def push_command(self):
         """
         Cause all queued up RPC commands to be sent down to Devices
+        In predictive collision mode, the collision limits are first updated for the motion about to be issued
         """
         with self.lock:
-            self.base.push_command()
-            self.arm.push_command()
-            self.lift.push_command()
-            self.pimu.push_command()
-            self.wacc.push_command()
-            self.pimu.trigger_motor_sync()
+            if self.params['use_collision_manager'] and self.collision.params['predictive']['enabled']:
+                self.collision.step()
+            for name in ['base', 'arm', 'lift', 'pimu', 'wacc']:
+                if self.device_startup.is_started(name): #Else still starting, past the startup timeout
+                    self.devices[name].push_command()
+            if self.device_startup.is_started('pimu'):
+                self.pimu.trigger_motor_sync()
 
 # ##################Home and Stow #######################################
 
@@ -232,105 +312,48 @@ class Robot(Device):
             ready = ready and not req
         return ready
 
-    def stow(self):
+    def stow(self, blocking=True):
         """
         Cause the robot to move to its stow position
-        Blocking.
+        Joints move concurrently where the collision ordering allows (see RobotPosePlanner)
+        blocking: If True, wait for the stow and return its timing breakdown
+                  If False, return a PoseTransition handle immediately
         """
-        self.head.move_to('head_pan', self.params['stow']['head_pan'])
-        self.head.move_to('head_tilt',self.params['stow']['head_tilt'])
-
-        lift_stowed=False
-        pos_lift = self.params['stow']['lift']
-        if 'stow' in self.end_of_arm.params:  # Allow tool defined stow position to take precedence
-            if 'lift' in self.end_of_arm.params['stow']:
-                pos_lift = self.end_of_arm.params['stow']['lift']
-        if self.lift.status['pos']<=self.params['stow']['lift']: #Needs to come up before bring in arm
-            print('--------- Stowing Lift ----')
-            self.lift.move_to(pos_lift)
-            self.push_command()
-            time.sleep(0.25)
-            ts = time.time()
-            while not self.lift.motor.status['near_pos_setpoint'] and time.time() - ts < 3.0:
-                time.sleep(0.1)
-            lift_stowed=True
-
-        #Bring in arm before bring down
-        print('--------- Stowing Arm ----')
-        pos_arm = self.params['stow']['arm']
-        if 'stow' in self.end_of_arm.params:  # Allow tool defined stow position to take precedence
-            if 'arm' in self.end_of_arm.params['stow']:
-                pos_arm = self.end_of_arm.params['stow']['arm']
-
-        self.arm.move_to(pos_arm)
-        self.push_command()
-        time.sleep(0.25)
-        ts = time.time()
-        while not self.arm.motor.status['near_pos_setpoint'] and time.time() - ts < 3.0:
-            time.sleep(0.1)
-
-        self.end_of_arm.stow()
-        time.sleep(0.25)
-
-
-        #Now bring lift down
-        if not lift_stowed:
-            print('--------- Stowing Lift ----')
-            self.lift.move_to(pos_lift)
-            self.push_command()
-            time.sleep(0.25)
-            ts = time.time()
-            while not self.lift.motor.status['near_pos_setpoint'] and time.time() - ts < 10.0:
-                time.sleep(0.1)
-
-        #Make sure wrist yaw is done before exiting
-        while self.end_of_arm.motors['wrist_yaw'].motor.is_moving():
-            time.sleep(0.1)
+        t = self.pose_planner.stow()
+        if not blocking:
+            return t
+        return t.wait()
 
     def home(self):
         """
         Cause the robot to home its joints by moving to hardstops
-        Blocking.
+        Independent joints are homed concurrently (see RobotHoming)
+        Blocking. Returns the per joint timing report
         """
-        if self.head is not None:
-            print('--------- Homing Head ----')
-            self.head.home()
-
-        # Home the lift
-        if self.lift is not None:
-            print('--------- Homing Lift ----')
-            self.lift.home()
-
-        # Home the arm
-        if self.arm is not None:
-            print('--------- Homing Arm ----')
-            self.arm.home()
-
-        # Home the end-of-arm
-        if self.end_of_arm is not None:
-            self.end_of_arm.home()
+        report = self.homing.home()
+        self.homing.pretty_print()
         #Let user know it is done
         self.pimu.trigger_beep()
         self.push_command()
+        return report
     # ################ Helpers #################################
 
     def _pull_status_dynamixel(self):
         try:
-            self.end_of_arm.pull_status()
-            self.head.pull_status()
+            for name in ['end_of_arm', 'head']:
+                if self.device_startup.is_started(name): #Else still starting, past the startup timeout
+                    with profiler.span('pull_status.' + name):
+                        self.devices[name].pull_status()
         except SerialException:
             self.logger.warning('Serial Exception on Robot Step_Dynamixel')
 
     def _pull_status_non_dynamixel(self):
-        self.wacc.pull_status()
-        self.base.pull_status()
-        self.lift.pull_status()
-        self.arm.pull_status()
-        self.pimu.pull_status()
+        for name in ['wacc', 'base', 'lift', 'arm', 'pimu']:
+            if name == 'base' and self.odometry_thread is not None:
+                continue #Pulled by the OdometryThread
+            if self.device_startup.is_started(name): #Else still starting, past the startup timeout
+                with profiler.span('pull_status.' + name):
+                    self.devices[name].pull_status()
 
     def _step_sentry(self):
-        self.head.step_sentry(self)
-        self.base.step_sentry(self)
-        self.arm.step_sentry(self)
-        self.lift.step_sentry(self)
-        self.end_of_arm.step_sentry(self)
+        self.sentry.step()
@@ -0,0 +1,252 @@
+"""
+Load and latency benchmark of a running Robot
+
+Works on the hardware or on the simulated backend (see robot_sim.py). While running, it measures:
+
+* Loop rates: the rate each Robot status thread achieved over the run, against its target rate
+* CPU per subsystem: the time spent in each device's pull_status and in the monitor, sentry and
+  collision steps. Reported as CPU time (of the calling thread) and wall time per call, and as a
+  percentage of one core
+* Command latency: the time from issuing a small motion command to the Robot status first showing the
+  joint moving, for the base, lift, arm and head pan. Joints that need homing are skipped until homed
+
+measure_import_time() benchmarks the startup time of a fresh process importing stretch_body.robot, without and
+with the params cache (see robot_params.load_params). get_import_times() lists the modules a fresh process imports
+with a stretch_body module, with their import times from `python -X importtime`.
+"""
+from __future__ import print_function
+import numpy as np
+import subprocess
+import threading
+import time
+import json
+import os
+import sys
+
+#CPU time of the calling thread (Python 3.7+), else wall time
+_thread_time = getattr(time, 'thread_time', time.time)
+
+_IMPORT_TIME_SCRIPT = (
+    "import time, json\n"
+    "ts = time.time()\n"
+    "import %s\n"
+    "dt = time.time() - ts\n"
+    "import stretch_body.robot_params as rp\n"
+    "print(json.dumps({'import_s': dt, 'params_s': rp.cache_status['load_time_s'], 'hit': rp.cache_status['hit']}))\n")
+
+SUBSYSTEMS = ['pimu', 'wacc', 'base', 'lift', 'arm', 'head', 'end_of_arm', 'monitor', 'sentry', 'collision']
+
+
+class RobotBenchmark:
+    """
+    Benchmark a started Robot
+
+    robot: the Robot, after startup()
+    """
+    def __init__(self, robot):
+        self.robot = robot
+        self.lock = threading.Lock()
+        self.wrapped = []
+        self.ts_start = None
+        self.status = {'duration_s': 0.0, 'cpu_percent': 0.0, 'loops': {}, 'subsystems': {}, 'latency': {}}
+
+    # ###########  CPU #############
+
+    def _get_subsystem(self, name):
+        if name in ['monitor', 'sentry', 'collision']:
+            return getattr(self.robot, name), 'step'
+        return self.robot.devices.get(name), 'pull_status'
+
+    def _wrap(self, name, obj, method):
+        f = getattr(obj, method)
+        s = {'calls': 0, 'cpu_s': 0.0, 'wall_s': 0.0}
+        self.status['subsystems'][name] = s
+
+        def timed(*args, **kwargs):
+            ts, tc = time.time(), _thread_time()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                with self.lock:
+                    s['calls'] += 1
+                    s['cpu_s'] += _thread_time() - tc
+                    s['wall_s'] += time.time() - ts
+        self.wrapped.append((obj, method, obj.__dict__.get(method)))
+        setattr(obj, method, timed)
+
+    def start(self):
+        """Start timing the subsystems and loops"""
+        self.status['subsystems'] = {}
+        for name in SUBSYSTEMS:
+            obj, method = self._get_subsystem(name)
+            if obj is not None:
+                self._wrap(name, obj, method)
+        self.loops_start = dict([(k, t.stats.loop_cycles) for k, t in self.get_threads().items()])
+        self.ts_start = time.time()
+        self.tc_start = time.process_time() if hasattr(time, 'process_time') else time.clock()
+
+    def stop(self):
+        """Stop timing, and compute the loop rates and CPU use since start()"""
+        dt = max(time.time() - self.ts_start, 1e-6)
+        tc = time.process_time() if hasattr(time, 'process_time') else time.clock()
+        for obj, method, f in self.wrapped:
+            if f is None:
+                delattr(obj, method) #Back to the class method
+            else:
+                setattr(obj, method, f)
+        self.wrapped = []
+        self.status['duration_s'] = dt
+        self.status['cpu_percent'] = 100.0 * (tc - self.tc_start) / dt
+        for s in self.status['subsystems'].values():
+            n = max(s['calls'], 1)
+            s['rate_hz'] = s['calls'] / dt
+            s['cpu_ms'] = 1000.0 * s['cpu_s'] / n
+            s['wall_ms'] = 1000.0 * s['wall_s'] / n
+            s['cpu_percent'] = 100.0 * s['cpu_s'] / dt
+        self.status['loops'] = {}
+        for k, t in self.get_threads().items():
+            n = t.stats.loop_cycles - self.loops_start.get(k, 0)
+            self.status['loops'][k] = {'target_hz': t.stats.target_loop_rate, 'rate_hz': n / dt,
+                                       'execution_time_ms': t.stats.status['execution_time_ms'],
+                                       'loop_warns': t.stats.status['loop_warns']}
+        return self.status
+
+    def get_threads(self):
+        r = self.robot
+        threads = {'non_dxl': r.non_dxl_thread, 'dxl': r.dxl_thread, 'odometry': r.odometry_thread}
+        return dict([(k, t) for k, t in threads.items() if t is not None])
+
+    # ###########  Latency #############
+
+    def get_latency_tests(self):
+        """
+        Joints to measure, as name: (device notifying its status, position getter, move(sign), wait for the move to end)
+        """
+        r = self.robot
+        tests = {'base': (r.base.left_wheel, lambda: r.base.left_wheel.status['pos'],
+                          lambda d: (r.base.translate_by(0.01 * d), r.push_command()),
+                          lambda: r.base.left_wheel.wait_until_at_setpoint(timeout=2.0))}
+        for name in ['lift', 'arm']:
+            j = getattr(r, name)
+            if j.motor.status['pos_calibrated']:
+                tests[name] = (j.motor, lambda j=j: j.motor.status['pos'],
+                               lambda d, j=j: (j.move_by(0.01 * d), r.push_command()),
+                               lambda j=j: j.motor.wait_until_at_setpoint(timeout=2.0))
+        if 'head_pan' in r.head.motors:
+            m = r.head.motors['head_pan']
+            tests['head_pan'] = (m, lambda: m.status['pos'], lambda d: r.head.move_by('head_pan', 0.05 * d),
+                                 lambda: m.wait_until_stopped(timeout=2.0))
+        return tests
+
+    def measure_latency(self, trials=10, timeout=1.0):
+        """
+        Move each joint back and forth by a small amount trials times
+        Returns per joint latency statistics (ms) from command to the status first showing motion
+        """
+        self.status['latency'] = {}
+        for name, (device, get_pos, move, wait_done) in sorted(self.get_latency_tests().items()):
+            dts = []
+            n_timeout = 0
+            for i in range(trials):
+                x0 = get_pos()
+                ts = time.time()
+                move(1 if i % 2 == 0 else -1)
+                if device.wait_until(lambda: abs(get_pos() - x0) > 1e-4, timeout=timeout, poll_s=timeout):
+                    dts.append(1000.0 * (time.time() - ts))
+                else:
+                    n_timeout += 1
+                wait_done()
+            l = {'trials': trials, 'timeouts': n_timeout}
+            if len(dts):
+                l.update({'mean_ms': float(np.mean(dts)), 'p50_ms': float(np.percentile(dts, 50)),
+                          'p95_ms': float(np.percentile(dts, 95)), 'max_ms': float(np.max(dts))})
+            self.status['latency'][name] = l
+        return self.status['latency']
+
+    # ###########  Run #############
+
+    def run(self, duration_s=10.0, latency_trials=10):
+        """Measure the loop rates and CPU use over duration_s, then the command latency. Returns the status"""
+        self.start()
+        try:
+            time.sleep(duration_s)
+        finally:
+            self.stop()
+        if latency_trials > 0:
+            self.measure_latency(latency_trials)
+        return self.status
+
+    def pretty_print(self):
+        s = self.status
+        print('----- Robot Benchmark ------ ')
+        print('Duration (s) %.1f, process CPU %.1f%%' % (s['duration_s'], s['cpu_percent']))
+        print('%-12s %10s %10s %12s %10s' % ('Loop', 'Target Hz', 'Rate Hz', 'Exec (ms)', 'Warns'))
+        for k in sorted(s['loops']):
+            l = s['loops'][k]
+            print('%-12s %10.1f %10.1f %12.2f %10d' % (k, l['target_hz'], l['rate_hz'], l['execution_time_ms'], l['loop_warns']))
+        print('%-12s %10s %10s %10s %10s' % ('Subsystem', 'Rate Hz', 'CPU (ms)', 'Wall (ms)', 'CPU %'))
+        for k in SUBSYSTEMS:
+            if k in s['subsystems']:
+                u = s['subsystems'][k]
+                print('%-12s %10.1f %10.3f %10.3f %10.2f' % (k, u['rate_hz'], u['cpu_ms'], u['wall_ms'], u['cpu_percent']))
+        if len(s['latency']):
+            print('%-12s %10s %10s %10s %10s %10s' % ('Latency', 'Mean (ms)', 'p50 (ms)', 'p95 (ms)', 'Max (ms)', 'Timeouts'))
+            for k in sorted(s['latency']):
+                l = s['latency'][k]
+                if 'mean_ms' in l:
+                    print('%-12s %10.1f %10.1f %10.1f %10.1f %10d' % (k, l['mean_ms'], l['p50_ms'], l['p95_ms'], l['max_ms'], l['timeouts']))
+                else:
+                    print('%-12s %10s %10s %10s %10s %10d' % (k, '-', '-', '-', '-', l['timeouts']))
+
+
+def measure_import_time(runs=10, module='stretch_body.robot'):
+    """
+    Time the import of module in runs fresh processes each, for the params cache disabled, cold
+    (cleared before each import) and warm. Returns per case statistics (ms) of the import and params load times
+    """
+    import stretch_body.robot_params as robot_params
+    results = {}
+    for case in ['no_cache', 'cold_cache', 'warm_cache']:
+        env = dict(os.environ, HELLO_PARAMS_CACHE='0' if case == 'no_cache' else '1')
+        import_s, params_s, hits = [], [], 0
+        for i in range(runs + (1 if case == 'warm_cache' else 0)):
+            if case == 'cold_cache':
+                robot_params.clear_params_cache()
+            out = subprocess.check_output([sys.executable, '-c', _IMPORT_TIME_SCRIPT % module], env=env)
+            r = json.loads(out.decode().strip().splitlines()[-1])
+            if case == 'warm_cache' and i == 0:
+                continue #Fills the cache
+            import_s.append(r['import_s'])
+            params_s.append(r['params_s'])
+            hits += int(r['hit'])
+        results[case] = {'runs': runs, 'cache_hits': hits,
+                         'import_p50_ms': 1000.0 * float(np.median(import_s)), 'import_min_ms': 1000.0 * float(np.min(import_s)),
+                         'params_p50_ms': 1000.0 * float(np.median(params_s))}
+    return results
+
+
+def get_import_times(module='stretch_body.robot'):
+    """
+    Import module in a fresh process with `python -X importtime`
+    Returns the imported modules as name: (self time, cumulative time) in microseconds
+    """
+    p = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    if p.returncode != 0:
+        raise RuntimeError('Import of %s failed: %s' % (module, err.decode()))
+    times = {}
+    for line in err.decode().splitlines():
+        if line.startswith('import time:') and '|' in line:
+            t_self, t_cumulative, name = line[len('import time:'):].split('|')
+            if t_self.strip().isdigit():
+                times[name.strip()] = (int(t_self), int(t_cumulative))
+    return times
+
+
+def print_import_time(results):
+    print('----- Import Time ------ ')
+    print('%-12s %12s %12s %12s %6s' % ('Params', 'p50 (ms)', 'Min (ms)', 'Params (ms)', 'Hits'))
+    for case in ['no_cache', 'cold_cache', 'warm_cache']:
+        r = results[case]
+        print('%-12s %12.1f %12.1f %12.2f %6d' % (case, r['import_p50_ms'], r['import_min_ms'], r['params_p50_ms'], r['cache_hits']))
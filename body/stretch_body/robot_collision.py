@@ -1,13 +1,27 @@
 #! /usr/bin/env python
 
 from stretch_body.device import Device
+from stretch_body.forward_kinematics import ForwardKinematics
+from stretch_body.robot_collision_table import CollisionLimitTable
+from stretch_body.stepper import MODE_POS_TRAJ
+import stretch_body.hello_utils as hello_utils
+import stretch_body.profiler as profiler
+import os
 import importlib
-import urdfpy
+import time
 import numpy as np
-import os
 
 # #######################################################################
 
+def limit(a,b):
+    """
+    Return the more conservative union of the limits a and b
+    , where a or b is of the form [lower_limit, upper_limit]
+    """
+    lower= b[0] if a[0] is None else (a[0] if b[0] is None else max(a[0],b[0]))
+    upper= b[1] if a[1] is None else (a[1] if b[1] is None else min(a[1],b[1]))
+    return [lower,upper]
+
 class RobotCollisionModel(Device):
     """
     The RobotCollisionModel  is a base class to provide simple self-collision avoidance
@@ -19,10 +33,15 @@ class RobotCollisionModel(Device):
 
     A custom RobotCollisionModel can be instantiated by declaring the class name / Python module name
     in the User YAML file
+
+    A model may set depends_on to the joints whose positions its limits are computed from
+    (eg, ['lift','head_pan']). RobotCollision then only steps the model when one of these joints has moved.
+    Models that leave it as None are stepped every cycle.
     """
     def __init__(self,collision_manager, name):
         Device.__init__(self, name=name)
         self.collision_manager=collision_manager
+        self.depends_on=None
 
     def step(self, status):
         return {'head_pan': [None,None],
@@ -36,9 +55,34 @@ class RobotCollisionModel(Device):
         Utility function. Return the more conservative union of the limits a and b
         , where a or b is of the form [lower_limit, upper_limit]
         """
-        lower= b[0] if a[0] is None else (a[0] if b[0] is None else max(a[0],b[0]))
-        upper= b[1] if a[1] is None else (a[1] if b[1] is None else min(a[1],b[1]))
-        return [lower,upper]
+        return limit(a,b)
+
+    def limit_batch(self,a,b):
+        """
+        Utility function. As limit, for arrays of limits where nan denotes no limit
+        """
+        return [np.fmax(a[0],b[0]),np.fmin(a[1],b[1])]
+
+    def step_batch(self, x):
+        """
+        Step the model over N joint configurations at once (eg, samples along a predicted motion)
+        x: dict of joint name to array of N positions
+        Returns a dict of joint name to [lower, upper], each an array of N limits with nan denoting no limit
+
+        The base class calls step once per sample. Models used in predictive mode should override this with a vectorized version.
+        """
+        status=self.collision_manager.robot.get_status()
+        n=len(list(x.values())[0])
+        w={}
+        for i in range(n):
+            limits=self.step(self.collision_manager.get_sample_status(status,dict([(j,x[j][i]) for j in x])))
+            for joint in limits:
+                if joint not in w:
+                    w[joint]=[np.full(n,np.nan),np.full(n,np.nan)]
+                for k in range(2):
+                    if limits[joint][k] is not None:
+                        w[joint][k][i]=limits[joint][k]
+        return w
 
 
 
@@ -50,14 +94,28 @@ class RobotCollision(Device):
     It is called periodically by the Robot thread.
     Each model computes the acceptible range of motion for a subset of joints given the current kinematic state of the robot.
     The RobotCollision class then sets the joint limits for each joint to the most restrive set of ranges, given all models.
+
+    In predictive mode (robot_collision.predictive.enabled) the models are also stepped over the motion
+    each joint is expected to make in the next horizon_s seconds: the active motion profile of a stepper's move_to,
+    a streaming trajectory, or else the joint's current velocity. The samples are stepped as one vectorized batch (see
+    RobotCollisionModel.step_batch), and the most conservative limit across the horizon is applied. The Robot then
+    also steps the collision manager before each push_command, so limits are tightened before a new motion is issued.
+    Limits from the horizon only restrict further motion: they never move a joint that is outside them.
+
+    A model whose params enable a 'table' is not stepped at run time. Its limits are looked up from a
+    CollisionLimitTable precomputed over the grid of the joints it depends on (built on first use, then cached).
     """
     def __init__(self,robot):
         Device.__init__(self, name='robot_collision')
-        #urdf_file = os.path.join(os.environ['HELLO_FLEET_PATH'], os.environ['HELLO_FLEET_ID'],'exported_urdf/stretch.urdf')
-        #self.robot_model = urdfpy.URDF.load(urdf_file) #Kinematic model available if needed
+        #self.robot_model = ForwardKinematics() #Kinematic model of exported_urdf/stretch.urdf available if needed
         self.robot=robot
         self.models=[]
         self.models_enabled={}
+        self.tables={}
+        self.model_inputs={}
+        self.model_limits={}
+        self.joint_limits={}
+        self.status={'n_step':0, 'n_evaluated':0, 'n_skipped':0, 'n_limits_pushed':0, 'n_conflicts':0}
 
     def startup(self):
         model_names = []
@@ -70,48 +128,197 @@ class RobotCollision(Device):
             class_name = self.robot_params[m]['py_class_name']
             self.models.append(getattr(importlib.import_module(module_name), class_name)(self))
             self.models_enabled[m]=self.robot_params[m]['enabled']
+            table=self.robot_params[m].get('table',{})
+            if table.get('enabled'):
+                if self.models[-1].depends_on is None:
+                    self.logger.warning('Collision model %s does not declare depends_on. Not using a table.'%m)
+                    continue
+                self.tables[m]=CollisionLimitTable.load_or_build(self.models[-1],table['grid'],self.params['max_interp_step'],
+                                                                 os.path.join(hello_utils.get_fleet_directory(),self.params['table_dir']),self.logger)
 
     def enable_model(self,name):
         if name in self.models_enabled:
             self.models_enabled[name]=True
 
     def disable_model(self,name):
-        if name in self.models_enabled:
-            self.models_enabled[name]=False
+        with self.robot.lock:
+            if name in self.models_enabled:
+                self.models_enabled[name]=False
+                self.model_limits.pop(name,None)
+                self.model_inputs.pop(name,None)
+
+    def get_joints(self):
+        return ['lift','arm','head_pan','head_tilt']+list(self.robot.end_of_arm.joints)
 
+    def get_joint(self,joint):
+        if joint in ['lift','arm']:
+            return getattr(self.robot,joint)
+        if joint in ['head_pan','head_tilt']:
+            return self.robot.head.motors[joint]
+        return self.robot.end_of_arm.motors[joint]
+
+    def get_joint_pos(self,joint):
+        return self.get_joint(joint).status['pos']
+
+    def get_sample_status(self,status,pos):
+        """Copy of the robot status with the joint positions replaced by pos"""
+        s=dict(status)
+        for j in pos:
+            if j in ['lift','arm']:
+                s[j]=dict(s[j],pos=pos[j])
+            else:
+                chain='head' if j in ['head_pan','head_tilt'] else 'end_of_arm'
+                s[chain]=dict(s[chain])
+                s[chain][j]=dict(s[chain][j],pos=pos[j])
+        return s
+
+    # ###########  Prediction #############
+
+    def predict_trapezoid(self,x0,v0,x1,v_max,a_max,ts):
+        """
+        Positions at times ts of a joint moving from x0 (at velocity v0) to x1 with velocity limit v_max and acceleration a_max
+        Deceleration into x1 is ignored, so the joint is predicted to get there early, if anything
+        """
+        d=abs(x1-x0)
+        sign=1.0 if x1>=x0 else -1.0
+        v0=min(max(sign*v0,0.0),v_max) if v_max>0 else 0.0
+        t1=(v_max-v0)/a_max if a_max>0 else 0.0
+        reach=np.where(ts<t1,v0*ts+0.5*a_max*ts**2,v0*t1+0.5*a_max*t1**2+v_max*(ts-t1))
+        return x0+sign*np.minimum(reach,d)
+
+    def predict_joint(self,joint,ts_now,ts):
+        """Predicted position of joint at times ts (s, from ts_now)"""
+        j=self.get_joint(joint)
+        if self.robot.trajectory.is_active():
+            x=self.robot.trajectory.predict(joint,ts_now+ts)
+            if x is not None:
+                return x
+        if joint in ['lift','arm']:
+            x=j.trajectory.predict(ts_now+ts)
+            if x is not None:
+                return x
+            cmd=j.motor._command
+            if cmd['mode']==MODE_POS_TRAJ:
+                m_per_rad=1.0/j.translate_to_motor_rad(1.0)
+                return self.predict_trapezoid(j.status['pos'],j.status['vel'],cmd['x_des']*m_per_rad,abs(cmd['v_des']*m_per_rad),abs(cmd['a_des']*m_per_rad),ts)
+        return j.status['pos']+j.status['vel']*ts
+
+    def predict(self):
+        """
+        Sample the motion of every joint over the prediction horizon
+        Returns a dict of joint name to array of n_samples positions. The first sample is the current position.
+        """
+        p=self.params['predictive']
+        ts=np.linspace(0,p['horizon_s'],p['n_samples'])
+        ts_now=time.time()
+        x={}
+        for joint in self.get_joints():
+            x[joint]=np.asarray(self.predict_joint(joint,ts_now,ts),dtype=np.float64)
+            x[joint][0]=self.get_joint_pos(joint)
+        return x
+
+    # ###########  Stepping #############
+
+    def is_dirty(self,m,pos):
+        """True if the model needs stepping, ie it has not been stepped yet or one of its joints moved beyond tolerance"""
+        last=self.model_inputs.get(m.name)
+        if last is None or m.depends_on is None:
+            return True
+        return any([np.max(np.abs(pos[j]-last[j]))>self.params['input_tolerance'] for j in m.depends_on])
+
+    def step_model(self,m,x):
+        """
+        Step the model over the predicted samples x
+        Returns the limits on the current sample, and the most conservative limits over the horizon
+        that don't push a joint out of its current position
+        """
+        w=self.tables[m.name].lookup_batch(x) if m.name in self.tables else m.step_batch(x)
+        now={}
+        horizon={}
+        for joint in w:
+            lo,hi=w[joint]
+            now[joint]=[None if np.isnan(lo[0]) else float(lo[0]),None if np.isnan(hi[0]) else float(hi[0])]
+            pos=x[joint][0] if joint in x else None
+            lo=np.nan if np.all(np.isnan(lo)) else float(np.nanmax(lo))
+            hi=np.nan if np.all(np.isnan(hi)) else float(np.nanmin(hi))
+            if pos is not None:
+                lo=min(lo,pos) if not np.isnan(lo) else lo
+                hi=max(hi,pos) if not np.isnan(hi) else hi
+            horizon[joint]=limit(now[joint],[None if np.isnan(lo) else lo,None if np.isnan(hi) else hi])
+        return now,horizon
 
     def step(self):
         #Compile the list of joints that may be limited
-        #Then compute the limits for each from each model
-        #Take the most conservative limit for each and pass it to the controller
-        status=self.robot.get_status()
+        #Then compute the limits for each from each model whose joints have moved since it was last stepped
+        #Take the most conservative limit for each and pass it to the controller if it has changed
+        with self.robot.lock: #Same lock as Robot.push_command, which may step the collision manager
+            self.status['n_step']+=1
+            predictive=self.params['predictive']['enabled']
+            x=self.predict() if predictive else None
+            status=None
+            for m in self.models:
+                if not self.models_enabled[m.name]:
+                    continue
+                if m.depends_on is None:
+                    pos=None
+                elif predictive:
+                    pos=dict([(j,x[j]) for j in m.depends_on])
+                else:
+                    pos=dict([(j,self.get_joint_pos(j)) for j in m.depends_on])
+                if not self.is_dirty(m,pos):
+                    self.status['n_skipped']+=1
+                    continue
+                t=profiler.begin()
+                if predictive:
+                    self.model_limits[m.name]=self.step_model(m,x)
+                elif m.name in self.tables:
+                    limits=self.tables[m.name].lookup(pos)
+                    self.model_limits[m.name]=(limits,limits)
+                else:
+                    if status is None:
+                        status=self.robot.get_status()
+                    limits=m.step(status)
+                    self.model_limits[m.name]=(limits,limits)
+                profiler.end('collision.'+m.name,t)
+                self.model_inputs[m.name]=pos
+                self.status['n_evaluated']+=1
 
-        target_limits= { 'head_pan': [None,None],'head_tilt': [None,None],'lift': [None,None],'arm': [None,None]}
-        for j in self.robot.end_of_arm.joints:
-            target_limits[j]=[None,None]
+            target_limits={}
+            for joint in ['head_pan','head_tilt','lift','arm']+list(self.robot.end_of_arm.joints):
+                #Choose most conservative value across the models
+                now=[None,None]
+                horizon=[None,None]
+                for limits_now,limits_horizon in self.model_limits.values():
+                    now=limit(now,limits_now.get(joint,[None,None]))
+                    horizon=limit(horizon,limits_horizon.get(joint,[None,None]))
+                if horizon[0] is not None and horizon[1] is not None and horizon[0]>horizon[1]:
+                    self.status['n_conflicts']+=1 #No range is safe over the whole horizon
+                    horizon=now
+                target_limits[joint]=horizon
 
+            for joint in target_limits:
+                if self.joint_limits.get(joint)!=target_limits[joint]:
+                    self.set_joint_limits(joint,target_limits[joint])
+                    self.joint_limits[joint]=target_limits[joint]
+                    self.status['n_limits_pushed']+=1
 
+    def set_joint_limits(self,joint,limits):
+        j=self.get_joint(joint)
+        j.set_soft_motion_limit_min(x=limits[0],limit_type='collision')
+        j.set_soft_motion_limit_max(x=limits[1],limit_type='collision')
+
+    def pretty_print(self):
+        print('----- Robot Collision ------ ')
         for m in self.models:
-            if self.models_enabled[m.name]:
-                new_limits=m.step(status)
-                #Update target limits based on the model, choose most conservative value
-                for joint in new_limits.keys():
-                    if new_limits[joint][0] is not None:
-                        target_limits[joint][0]=new_limits[joint][0] if target_limits[joint][0] is None else max(new_limits[joint][0], target_limits[joint][0])
-                    if new_limits[joint][1] is not None:
-                        target_limits[joint][1]=new_limits[joint][1] if target_limits[joint][1] is None else min(new_limits[joint][1], target_limits[joint][1])
-
-        self.robot.lift.set_soft_motion_limit_min(x=target_limits['lift'][0],limit_type='collision')
-        self.robot.lift.set_soft_motion_limit_max(x=target_limits['lift'][1],limit_type='collision')
-        self.robot.arm.set_soft_motion_limit_min(x=target_limits['arm'][0], limit_type='collision')
-        self.robot.arm.set_soft_motion_limit_max(x=target_limits['arm'][1], limit_type='collision')
-        self.robot.head.motors['head_tilt'].set_soft_motion_limit_min(x=target_limits['head_tilt'][0], limit_type='collision')
-        self.robot.head.motors['head_tilt'].set_soft_motion_limit_max(x=target_limits['head_tilt'][1], limit_type='collision')
-        self.robot.head.motors['head_pan'].set_soft_motion_limit_min(x=target_limits['head_pan'][0],limit_type='collision')
-        self.robot.head.motors['head_pan'].set_soft_motion_limit_max(x=target_limits['head_pan'][1],limit_type='collision')
-        for j in self.robot.end_of_arm.joints:
-            self.robot.end_of_arm.motors[j].set_soft_motion_limit_min(x=target_limits['head_pan'][0],limit_type='collision')
-            self.robot.end_of_arm.motors[j].set_soft_motion_limit_max(x=target_limits['head_pan'][1],limit_type='collision')
+            print('Model %s enabled: %d'%(m.name,self.models_enabled[m.name]))
+            if m.name in self.tables:
+                print('    Table: %s, %.1f MB'%(str(self.tables[m.name].grid),self.tables[m.name].nbytes()/1e6))
+        print('Predictive',self.params['predictive']['enabled'])
+        print('Steps',self.status['n_step'])
+        print('Model evaluations',self.status['n_evaluated'])
+        print('Model evaluations skipped',self.status['n_skipped'])
+        print('Joint limit updates',self.status['n_limits_pushed'])
+        print('Horizon limit conflicts',self.status['n_conflicts'])
 
 
 # #######################################################################
@@ -125,7 +332,7 @@ Helper Classes: Example for EndOfArmForwardKinematics
                 'joint_arm_l3': status['arm']['pos']*0.25,
                 'joint_wrist_yaw': status['end_of_arm']['wrist_yaw']['pos']
             }
-            pose = self.collision_manager.robot_model.link_fk(cfg, 'link_gripper_fingertip_right',use_names=True)
+            pose = self.collision_manager.robot_model.link_fk(cfg, 'link_gripper_fingertip_right')
             tx = pose[0][3]  # Forward
             ty = pose[1][3]  # Height
             tz = pose[2][3]  # Extension direction
@@ -137,39 +344,19 @@ Helper Classes: Example for EndOfArmForwardKinematics
 class EndOfArmForwardKinematics():
     # Compute the FK for a tool link wrt to the fixed end_of_arm frame (link_arm_l0)
     def __init__(self):
-        urdf_file = os.path.join(os.environ['HELLO_FLEET_PATH'], os.environ['HELLO_FLEET_ID'],'exported_urdf/stretch.urdf')
         np.seterr(divide='ignore', invalid='ignore')
-        self.robot_model = urdfpy.URDF.load(urdf_file)
+        self.robot_model = ForwardKinematics()
 
     def tool_fk(self,cfg,link):
         # returns the 4x4 transform from <link> to link_arm_l0
         #cfg: dictionary of joint positions of tool (including wrist yaw). Eg: {'joint_wrist_yaw': 0.1, 'joint_gripper_finger_right': 0.1}
+        #     Values may be arrays of N positions, in which case an (N,4,4) array of transforms is returned
         #link: name of link that is after wrist_yaw in the kinematic chain.Eg 'link_gripper_fingertip_right'
         #For reference, link_arm_l0:
         # Origin Center of first cuff
         # X: parallel to ground, points towards wrist
         # Y: Parallel to graviy, points up
         # Z:  Parallel to arm extension, points towards reach
-
-        joint_cfg = self.robot_model._process_cfg(cfg)
-        link_set = set()
-        link_set.add(self.robot_model._link_map[link])
-
-        # This is a modified version of link_fk of urdfpy
-        # That stops FK at the 'link_arm_l0' of Stretch
-        for lnk in self.robot_model._reverse_topo:
-            if lnk not in link_set:
-                continue
-            pose = np.eye(4, dtype=np.float64)
-            path = self.robot_model._paths_to_base[lnk]
-            for i in range(len(path) - 1):
-                child = path[i]
-                parent = path[i + 1]
-                joint = self.robot_model._G.get_edge_data(child, parent)['joint']
-                cfg = None
-                if joint in joint_cfg:
-                    cfg = joint_cfg[joint]
-                pose = joint.get_child_pose(cfg).dot(pose)
-                if parent.name == 'link_arm_l0':
-                    return pose
-        return None
+        if self.robot_model.get_path(link, 'link_arm_l0') is None:
+            return None
+        return self.robot_model.link_fk(cfg, link, base='link_arm_l0')
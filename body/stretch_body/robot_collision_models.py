@@ -2,6 +2,7 @@
 
 from stretch_body.robot_collision import *
 import math
+import numpy as np
 from stretch_body.hello_utils import *
 
 # #############################################
@@ -10,21 +11,29 @@ class CollisionArmCamera(RobotCollisionModel):
     NOTE: Experimental. You may want to turn this off in the params (enable=0)
     RE1 camera can clip the arm when lift is all the way up
     and the camera is looking parallel to the ground.
+    The geometry is in class attributes, shared by step and step_batch.
     """
+    pan_danger_r = .80          #Camera over the arm for pan within +/- this
+    tilt_danger_r = -.80        #Camera looking parallel to the ground for tilt below this
+    lift_near_danger_m = 0.9    #Enough distance to deccel
+    lift_danger_m = 1.015
+    lift_max_m = 1.02           #Lift limit with the camera in the danger zone
+    tilt_max_r = -0.75          #Tilt limit with the lift in the danger zone
 
     def __init__(self, collision_manager):
         RobotCollisionModel.__init__(self, collision_manager,'collision_arm_camera')
+        self.depends_on=['lift','head_pan','head_tilt']
         self.state={'pan_in_danger_zone':{'ts':None,'near':.05,'duration':1.0, 'triggered':0}}
 
     def pan_in_danger_zone(self,x_pan):
-        return x_pan > -.80 and x_pan < .80
+        return x_pan > -self.pan_danger_r and x_pan < self.pan_danger_r
 
     def tilt_in_danger_zone(self,x_tilt):
-        return x_tilt < -.80
+        return x_tilt < self.tilt_danger_r
     def lift_near_danger_zone(self,x_lift):
-        return x_lift >0.9 #Enough distance to deccel
+        return x_lift >self.lift_near_danger_m
     def lift_in_danger_zone(self,x_lift):
-        return x_lift>1.015
+        return x_lift>self.lift_danger_m
 
     def prevent_lift_raise_into_camera(self,status):
         x_lift=status['lift']['pos']
@@ -36,7 +45,7 @@ class CollisionArmCamera(RobotCollisionModel):
         #print('Lift %f Pan %f Tilt %f'%(x_lift,x_pan,x_tilt))
         if self.pan_in_danger_zone(x_pan) and self.tilt_in_danger_zone(x_tilt):
             #print('Camera in danger zone')
-            return [None,1.02]
+            return [None,self.lift_max_m]
         return [None,None]
 
     def prevent_pan_camera_into_arm(self,status):
@@ -47,9 +56,9 @@ class CollisionArmCamera(RobotCollisionModel):
         if not self.lift_in_danger_zone(x_lift) or not self.tilt_in_danger_zone(x_tilt):
             return [None,None]
         if x_pan<0:
-            return [None,-.80]
+            return [None,-self.pan_danger_r]
         else:
-            return [.80,None]
+            return [self.pan_danger_r,None]
 
 
     def prevent_tilt_camera_into_arm(self,status):
@@ -59,7 +68,7 @@ class CollisionArmCamera(RobotCollisionModel):
         #print('Lift %f Pan %f Tilt %f' % (x_lift, x_pan, x_tilt))
         if not self.lift_in_danger_zone(x_lift) or not self.pan_in_danger_zone(x_pan):
             return [None,None]
-        return [-0.75,None]
+        return [self.tilt_max_r,None]
 
     def step(self, status):
         limits={'lift': [None, None],'head_pan': [None, None],'head_tilt': [None, None]}
@@ -70,6 +79,22 @@ class CollisionArmCamera(RobotCollisionModel):
         #print(limits['head_pan'],status['head']['head_pan']['pos'])
         return limits
 
+    def step_batch(self, x):
+        x_lift = x['lift']
+        x_pan = x['head_pan']
+        x_tilt = x['head_tilt']
+        pan_in_danger_zone = (x_pan > -self.pan_danger_r) & (x_pan < self.pan_danger_r)
+        tilt_in_danger_zone = x_tilt < self.tilt_danger_r
+        lift_in_danger_zone = x_lift > self.lift_danger_m
+        nan = np.full(len(x_lift), np.nan)
+        limits = {}
+        limits['lift'] = [nan, np.where((x_lift > self.lift_near_danger_m) & pan_in_danger_zone & tilt_in_danger_zone, self.lift_max_m, np.nan)]
+        pan_limited = lift_in_danger_zone & tilt_in_danger_zone
+        limits['head_pan'] = [np.where(pan_limited & (x_pan >= 0), self.pan_danger_r, np.nan),
+                              np.where(pan_limited & (x_pan < 0), -self.pan_danger_r, np.nan)]
+        limits['head_tilt'] = [np.where(lift_in_danger_zone & pan_in_danger_zone, self.tilt_max_r, np.nan), nan]
+        return limits
+
 
 # #############################################
 class CollisionStretchGripper(RobotCollisionModel):
@@ -82,19 +107,39 @@ class CollisionStretchGripper(RobotCollisionModel):
     |
     |
     ---> Forward of (direction of reach)
+
+    The geometry and thresholds are in class attributes, shared by step and step_batch.
     """
+    r_gripper_tips = .24            #Yaw axis to fingertips
+    r_puller = .08                  #Yaw axis to puller
+    yaw_forward_of_arm_m = -.01     #Yaw axis forward of base, less arm extension
+    yaw_side_of_base_m = -.065
+    palm_forward_of_arm_m = -.04
+    lift_on_floor_m = 0.1           #Fingertips on the floor below this
+    fingertips_clear_m = 0.1        #Fingertips clear of the base when this far forward (or to the side) of it
+    lift_min_fingertips_side_m = 0.18
+    lift_min_fingertips_m = 0.22
+    lift_low_m = .085               #Tool low enough to hit the base when retracting
+    yaw_into_base_r = 1.57
+    arm_min_fingertips_m = .06
+    arm_min_palm_lower_m = .06      #Palm over the base when retracted past this
+    lift_min_palm_m = .085
+    puller_clear_m = 0.02
+    lift_min_puller_m = .075
+    puller_forward_of_yaw_m = 0.01
+    arm_min_puller_m = .05
+    arm_min_palm_m = .075
 
     def __init__(self, collision_manager):
         RobotCollisionModel.__init__(self, collision_manager, 'collision_stretch_gripper')
+        self.depends_on=['lift','arm','wrist_yaw']
 
     # ###
     def dist_fingertips_forward_of_yaw(self,x_yaw):
-        r_gripper_tips=.24
-        return r_gripper_tips* math.cos(x_yaw)
+        return self.r_gripper_tips* math.cos(x_yaw)
 
     def dist_fingertips_side_of_yaw(self,x_yaw):
-        r_gripper_tips=.24
-        return r_gripper_tips* math.sin(x_yaw)
+        return self.r_gripper_tips* math.sin(x_yaw)
 
     def dist_fingertips_forward_of_base(self,x_arm,x_yaw):
         return self.dist_yaw_forward_of_base(x_arm)+self.dist_fingertips_forward_of_yaw(x_yaw)
@@ -106,64 +151,63 @@ class CollisionStretchGripper(RobotCollisionModel):
         #Return lift limits
         d_fwd=self.dist_fingertips_forward_of_base(x_arm,x_yaw)
         d_side=self.dist_fingertips_side_of_base(x_yaw)
-        if x_lift<0.1: #on floor
+        if x_lift<self.lift_on_floor_m: #on floor
             return [None,None]
-        if d_fwd>0.1:
+        if d_fwd>self.fingertips_clear_m:
             return [None,None]
-        if d_side>0.1:
-            return [0.18, None]
-        return [0.22,None]
+        if d_side>self.fingertips_clear_m:
+            return [self.lift_min_fingertips_side_m, None]
+        return [self.lift_min_fingertips_m,None]
 
     def prevent_fingtips_yaw_into_base(self,x_yaw,x_lift):
         # Return arm limits
-        if x_lift>.085 or x_yaw<1.57:
+        if x_lift>self.lift_low_m or x_yaw<self.yaw_into_base_r:
             return [None,None]
         d=self.dist_fingertips_forward_of_yaw(x_yaw)
         #print('arm limit',.06-d)
-        return[0.06-d,None]
+        return[self.arm_min_fingertips_m-d,None]
     # ###
     
     def dist_puller_forward_of_yaw(self,x_yaw):
-        r_puller=.08
-        return r_puller * math.sin(x_yaw)
+        return self.r_puller * math.sin(x_yaw)
 
     def dist_yaw_forward_of_base(self,x_arm):
-        return x_arm-.01
+        return x_arm+self.yaw_forward_of_arm_m
 
     def dist_yaw_side_of_base(self):
-        return -.065
+        return self.yaw_side_of_base_m
     def dist_puller_past_base(self,x_arm,x_yaw):
         return self.dist_yaw_forward_of_base(x_arm) + self.dist_puller_forward_of_yaw(x_yaw)
 
-    def dist_palm_past_base(selfs,x_arm):
-        return x_arm-.04
+    def dist_palm_past_base(self,x_arm):
+        return x_arm+self.palm_forward_of_arm_m
 
 
 
     def prevent_palm_retract_into_base(self,x_lift):
         # Return arm limits
-        if x_lift>.085:
+        if x_lift>self.lift_low_m:
             return [None,None]
-        return [.075,None]
+        return [self.arm_min_palm_m,None]
 
     def prevent_palm_lower_into_base(self,x_arm):
         # Return lift limits
-        if x_arm<.06:
-            return [.085,None]
+        if x_arm<self.arm_min_palm_lower_m:
+            return [self.lift_min_palm_m,None]
         return [None,None]
 
     def prevent_puller_lower_into_base(self,x_arm,x_yaw):
         # Return lift limits
-        if self.dist_puller_past_base(x_arm,x_yaw)<0.02:
-            return [.075,None]
+        if self.dist_puller_past_base(x_arm,x_yaw)<self.puller_clear_m:
+            return [self.lift_min_puller_m,None]
         return [None,None]
 
     def prevent_puller_retract_into_base(self,x_lift,x_yaw):
         # Return arm limits
         d=self.dist_puller_forward_of_yaw(x_yaw)
-        if x_lift>.085 or d>0.01:
+        if x_lift>self.lift_low_m or d>self.puller_forward_of_yaw_m:
             return [None,None]
-        return [.05-d,None]
+        return [self.arm_min_puller_m-d,None]
 
     
 
@@ -178,3 +222,26 @@ class CollisionStretchGripper(RobotCollisionModel):
         w['arm']=self.limit(self.prevent_fingtips_yaw_into_base(x_yaw,x_lift),self.limit(self.prevent_puller_retract_into_base(x_lift,x_yaw),self.prevent_palm_retract_into_base(x_lift)))
         return w
 
+    def step_batch(self, x):
+        x_arm = x['arm']
+        x_lift = x['lift']
+        x_yaw = x['wrist_yaw']
+        nan = np.full(len(x_arm), np.nan)
+        lift_low = x_lift <= self.lift_low_m
+        d_yaw = x_arm + self.yaw_forward_of_arm_m
+        d_fingertips = self.r_gripper_tips * np.cos(x_yaw)
+        d_fwd = d_yaw + d_fingertips
+        d_side = self.yaw_side_of_base_m + self.r_gripper_tips * np.sin(x_yaw)
+        d_puller = self.r_puller * np.sin(x_yaw)
+        fingertips_lower = np.where((x_lift < self.lift_on_floor_m) | (d_fwd > self.fingertips_clear_m), np.nan,
+                                    np.where(d_side > self.fingertips_clear_m, self.lift_min_fingertips_side_m, self.lift_min_fingertips_m))
+        palm_lower = np.where(x_arm < self.arm_min_palm_lower_m, self.lift_min_palm_m, np.nan)
+        puller_lower = np.where(d_yaw + d_puller < self.puller_clear_m, self.lift_min_puller_m, np.nan)
+        fingertips_yaw = np.where(lift_low & (x_yaw >= self.yaw_into_base_r), self.arm_min_fingertips_m - d_fingertips, np.nan)
+        puller_retract = np.where(lift_low & (d_puller <= self.puller_forward_of_yaw_m), self.arm_min_puller_m - d_puller, np.nan)
+        palm_retract = np.where(lift_low, self.arm_min_palm_m, np.nan)
+        w = {'lift': [np.fmax(fingertips_lower, np.fmax(palm_lower, puller_lower)), nan],
+             'arm': [np.fmax(fingertips_yaw, np.fmax(puller_retract, palm_retract)), nan],
+             'wrist_yaw': [nan, nan]}
+        return w
+
@@ -0,0 +1,224 @@
+from __future__ import print_function
+import hashlib
+import inspect
+import itertools
+import math
+import os
+import numpy as np
+
+import stretch_body.hello_utils as hello_utils
+
+TABLE_VERSION = 1
+
+
+class CollisionLimitTable:
+    """
+    Precomputed joint limits of a RobotCollisionModel, sampled over a grid of the joints it depends on
+
+    The table is built offline by stepping the model (step_batch) on every point of a uniform grid,
+    eg grid={'lift': [0.0, 1.1, 56], 'arm': [0.0, 0.52, 53], 'wrist_yaw': [-1.75, 4.0, 231]} (min, max, number of points).
+    A lookup then costs the same whatever the model's geometry: the limits at the 2^d corners of the grid cell
+    are blended with multilinear interpolation where they change smoothly (by no more than max_interp_step),
+    and otherwise the most conservative corner is taken, so limits that step (eg, entering a danger zone) err on the safe side.
+    Queries outside the grid are clamped to it.
+
+    The limits are stored as one (number of grid points, number of limits) array, so each corner is a single row read.
+    Tables are cached in the fleet directory, keyed by a hash of the model source and the grid, so a model
+    change or new grid rebuilds them.
+    """
+    def __init__(self, name, joints, grid, columns, table, max_interp_step):
+        self.name = name
+        self.joints = joints #Order of the grid axes
+        self.grid = grid
+        self.columns = columns #(joint, 0 for lower or 1 for upper) of each table column. Limits that are never set aren't stored.
+        self.table = table #Limit of each column at each grid point (row major), nan for no limit
+        self.max_interp_step = max_interp_step
+        self.shape = [int(grid[j][2]) for j in joints]
+        self.strides = [int(np.prod(self.shape[k + 1:])) for k in range(len(joints))]
+        self.corners = list(itertools.product([0, 1], repeat=len(joints)))
+        self.corner_offsets_list = [sum([c[k] * self.strides[k] for k in range(len(c))]) for c in self.corners]
+        self.corner_offsets = np.array(self.corner_offsets_list)
+        self.lower = np.array([c[1] == 0 for c in columns], dtype=bool)
+
+    # ###########  Building #############
+
+    @staticmethod
+    def build(model, grid, max_interp_step):
+        """Sample model.step_batch over the grid (dict of joint to [min, max, n]). Axes are ordered as model.depends_on"""
+        joints = list(model.depends_on)
+        grid = dict([(j, [float(grid[j][0]), float(grid[j][1]), int(grid[j][2])]) for j in joints])
+        axes = [np.linspace(grid[j][0], grid[j][1], grid[j][2]) for j in joints]
+        mesh = np.meshgrid(*axes, indexing='ij')
+        w = model.step_batch(dict([(j, m.ravel()) for j, m in zip(joints, mesh)]))
+        columns = []
+        data = []
+        for joint in sorted(w.keys()):
+            for k in range(2):
+                if not np.all(np.isnan(w[joint][k])):
+                    columns.append((joint, k))
+                    data.append(np.asarray(w[joint][k], dtype=np.float32))
+        table = np.array(data).T.reshape(-1, len(columns))
+        return CollisionLimitTable(model.name, joints, grid, columns, table, max_interp_step)
+
+    @staticmethod
+    def get_key(model, grid):
+        try:
+            src = inspect.getsource(model.__class__)
+        except (IOError, OSError, TypeError):
+            src = model.__class__.__name__
+        h = hashlib.sha1((src + str([(j, [float(g) for g in grid[j]]) for j in model.depends_on])).encode('utf-8'))
+        return '%s_%s' % (model.name, h.hexdigest()[:16])
+
+    @staticmethod
+    def load_or_build(model, grid, max_interp_step, table_dir=None, logger=None):
+        """Load the model's table from table_dir, building and saving it if not found"""
+        table_dir = table_dir if table_dir is not None else os.path.join(hello_utils.get_fleet_directory(), 'collision_tables')
+        fn = os.path.join(table_dir, CollisionLimitTable.get_key(model, grid) + '.npz')
+        if os.path.isfile(fn):
+            try:
+                return CollisionLimitTable.load(fn, max_interp_step)
+            except (IOError, OSError, ValueError, KeyError) as e:
+                if logger is not None:
+                    logger.warning('Rebuilding unreadable collision table %s: %s' % (fn, str(e)))
+        t = CollisionLimitTable.build(model, grid, max_interp_step)
+        try:
+            t.save(fn)
+        except (IOError, OSError) as e:
+            if logger is not None:
+                logger.warning('Unable to save collision table %s: %s' % (fn, str(e)))
+        return t
+
+    def save(self, fn):
+        d = os.path.dirname(fn)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        tmp = fn + '.%d.tmp.npz' % os.getpid()
+        np.savez_compressed(tmp, #Piecewise constant limits compress well
+                            version=np.array(TABLE_VERSION), name=np.array(self.name), joints=np.array(self.joints),
+                            grid=np.array([self.grid[j] for j in self.joints], dtype=np.float64),
+                            column_joints=np.array([c[0] for c in self.columns]), column_sides=np.array([c[1] for c in self.columns]),
+                            table=self.table)
+        os.rename(tmp, fn)
+
+    @staticmethod
+    def load(fn, max_interp_step):
+        with np.load(fn) as d:
+            if int(d['version']) != TABLE_VERSION:
+                raise ValueError('table version %d' % int(d['version']))
+            joints = [str(j) for j in d['joints']]
+            grid = dict([(j, [float(g[0]), float(g[1]), int(g[2])]) for j, g in zip(joints, d['grid'])])
+            columns = [(str(j), int(k)) for j, k in zip(d['column_joints'], d['column_sides'])]
+            return CollisionLimitTable(str(d['name']), joints, grid, columns, d['table'], max_interp_step)
+
+    def nbytes(self):
+        return self.table.nbytes
+
+    def check(self, model, n=10000, tolerance=0.01, seed=0):
+        """
+        Compare lookups against the model at n random configurations within the grid
+
+        Returns
+        -------
+        dict
+            max_error: largest difference between a looked up and a model limit, where both are limited
+            n_unsafe: number of limits that are looser than the model by more than tolerance (including missing limits)
+            n_over_tolerance: number of limits that differ from the model by more than tolerance, in either direction
+        """
+        rng = np.random.RandomState(seed)
+        x = dict([(j, rng.uniform(self.grid[j][0], self.grid[j][1], n)) for j in self.joints])
+        expected = model.step_batch(x)
+        got = self.lookup_batch(x)
+        result = {'max_error': 0.0, 'n_unsafe': 0, 'n_over_tolerance': 0}
+        for joint in expected:
+            for k in range(2):
+                e = expected[joint][k]
+                g = got[joint][k] if joint in got else np.full(n, np.nan)
+                both = ~np.isnan(e) & ~np.isnan(g)
+                err = np.where(both, g - e, 0.0) * (1 if k == 0 else -1) #Positive when more conservative
+                if np.any(both):
+                    result['max_error'] = max(result['max_error'], float(np.max(np.abs(err))))
+                missing = ~np.isnan(e) & np.isnan(g)
+                extra = np.isnan(e) & ~np.isnan(g)
+                result['n_unsafe'] += int(np.sum(missing) + np.sum(err < -tolerance))
+                result['n_over_tolerance'] += int(np.sum(missing) + np.sum(extra) + np.sum(np.abs(err) > tolerance))
+        return result
+
+    # ###########  Lookup #############
+
+    def _cell(self, x):
+        """Row of the lower corner of the grid cell of each of the N configurations x, and the multilinear weights of the corners"""
+        base = 0
+        frac = []
+        for k, j in enumerate(self.joints):
+            lo, hi, n = self.grid[j]
+            f = (np.clip(x[j], lo, hi) - lo) / (hi - lo) * (n - 1)
+            i = np.minimum(np.floor(f), n - 2)
+            base = base + i.astype(np.int64) * self.strides[k]
+            frac.append(f - i)
+        weights = np.ones((len(self.corners), len(base)))
+        for c, corner in enumerate(self.corners):
+            for k in range(len(corner)):
+                weights[c] *= frac[k] if corner[k] else 1 - frac[k]
+        return base, weights
+
+    def _blend(self, x):
+        """(N, number of columns) limits for the N configurations x"""
+        base, weights = self._cell(x)
+        v = self.table[base[None, :] + self.corner_offsets[:, None]].astype(np.float64) #corners, N, columns
+        safe = np.where(self.lower, np.fmax.reduce(v, axis=0), np.fmin.reduce(v, axis=0)) #nan only if no corner is limited
+        valid = ~np.any(np.isnan(v), axis=0)
+        vv = np.where(valid, v, 0.0)
+        smooth = valid & (vv.max(axis=0) - vv.min(axis=0) <= self.max_interp_step)
+        return np.where(smooth, np.einsum('cn,cnk->nk', weights, vv), safe)
+
+    def lookup_batch(self, x):
+        """
+        Limits for N configurations
+        x: dict of joint name to array of N positions (must include the table's joints)
+        Returns a dict of joint name to [lower, upper], each an array of N limits with nan for no limit, as RobotCollisionModel.step_batch
+        """
+        x = dict([(j, np.asarray(x[j], dtype=np.float64).reshape(-1)) for j in self.joints])
+        v = self._blend(x)
+        n = v.shape[0]
+        w = {}
+        for i, (joint, k) in enumerate(self.columns):
+            if joint not in w:
+                w[joint] = [np.full(n, np.nan), np.full(n, np.nan)]
+            w[joint][k] = v[:, i]
+        return w
+
+    def lookup(self, pos):
+        """
+        Limits for a single configuration
+        pos: dict of joint name to position
+        Returns a dict of joint name to [lower, upper], with None for no limit, as RobotCollisionModel.step
+        """
+        #Plain Python, as NumPy call overhead dominates for a single configuration
+        base = 0
+        frac = []
+        for k, j in enumerate(self.joints):
+            lo, hi, n = self.grid[j]
+            f = (min(max(float(pos[j]), lo), hi) - lo) / (hi - lo) * (n - 1)
+            i = min(int(math.floor(f)), n - 2)
+            base = base + i * self.strides[k]
+            frac.append(f - i)
+        rows = self.table[[base + o for o in self.corner_offsets_list]].tolist()
+        weights = []
+        for corner in self.corners:
+            w = 1.0
+            for k in range(len(corner)):
+                w = w * (frac[k] if corner[k] else 1 - frac[k])
+            weights.append(w)
+        limits = {}
+        for i, (joint, side) in enumerate(self.columns):
+            if joint not in limits:
+                limits[joint] = [None, None]
+            v = [r[i] for r in rows]
+            limited = [x for x in v if not math.isnan(x)]
+            if not len(limited):
+                continue
+            if len(limited) == len(v) and max(v) - min(v) <= self.max_interp_step:
+                limits[joint][side] = sum([x * w for x, w in zip(v, weights)])
+            else:
+                limits[joint][side] = max(limited) if side == 0 else min(limited)
+        return limits
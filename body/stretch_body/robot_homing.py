@@ -0,0 +1,98 @@
+from __future__ import print_function
+import threading
+import time
+
+from stretch_body.device import Device
+
+
+class RobotHoming(Device):
+    """
+    Home the robot's joints concurrently, subject to dependency constraints
+
+    Each device (head, lift, arm, end_of_arm) is homed in its own thread once all the devices
+    it depends on have finished homing. The dependencies are set in the robot_homing params, eg:
+
+        robot_homing:
+          dependencies: {head: [], lift: [], arm: [lift], end_of_arm: [arm]}
+
+    By default the head and lift home together, the arm homes once the lift is up,
+    and the end-of-arm once the arm is retracted.
+    A device is not homed if any device it depends on failed to home.
+    Devices not present on the robot are treated as already homed.
+    """
+    def __init__(self, robot):
+        Device.__init__(self, name='robot_homing')
+        self.robot = robot
+        self.status = {}
+
+    def get_devices(self):
+        devices = {}
+        for name in self.params['dependencies']:
+            d = getattr(self.robot, name, None)
+            if d is not None:
+                devices[name] = d
+        return devices
+
+    def home(self):
+        """
+        Home all devices. Blocking.
+        Returns the per device timing report (see status)
+        """
+        devices = self.get_devices()
+        deps = self.params['dependencies']
+        for name in devices:
+            for d in deps[name]:
+                if d not in deps:
+                    self.logger.warning('Unknown homing dependency %s for %s. Ignoring.' % (d, name))
+        done = dict([(name, threading.Event()) for name in deps])
+        self.status = dict([(name, {'start': None, 'end': None, 'duration': None, 'success': False, 'skipped': False}) for name in devices])
+        for name in deps:
+            if name not in devices:
+                done[name].set()
+
+        ts = time.time()
+        threads = [threading.Thread(target=self._home_device, args=(name, devices[name], [done[d] for d in deps[name] if d in done],
+                                                                      [d for d in deps[name] if d in devices], done[name], ts))
+                   for name in devices]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.status['total'] = {'duration': time.time() - ts,
+                                'success': all([self.status[n]['success'] for n in devices])}
+        return self.status
+
+    def _home_device(self, name, device, dep_events, dep_names, done, ts):
+        for e in dep_events:
+            e.wait()
+        try:
+            if not all([self.status[d]['success'] for d in dep_names]):
+                self.logger.warning('Not homing %s as a dependency failed to home' % name)
+                self.status[name]['skipped'] = True
+                return
+            print('--------- Homing %s ----\n' % name.replace('_', ' ').title(), end='') #Single write as threads print concurrently
+            self.status[name]['start'] = time.time() - ts
+            device.home()
+            self.status[name]['success'] = True
+        except Exception as e:
+            self.logger.error('Failed to home %s: %s' % (name, str(e)))
+        finally:
+            if self.status[name]['start'] is not None:
+                self.status[name]['end'] = time.time() - ts
+                self.status[name]['duration'] = self.status[name]['end'] - self.status[name]['start']
+            done.set()
+
+    def pretty_print(self):
+        print('----- Robot Homing ------ ')
+        for name in self.status:
+            if name == 'total':
+                continue
+            s = self.status[name]
+            if s['skipped']:
+                print('%-12s skipped' % name)
+            elif s['start'] is None:
+                print('%-12s not started' % name)
+            else:
+                print('%-12s start %6.2fs  end %6.2fs  duration %6.2fs  %s' % (name, s['start'], s['end'], s['duration'], 'OK' if s['success'] else 'FAILED'))
+        if 'total' in self.status:
+            print('Total: %.2fs %s' % (self.status['total']['duration'], 'OK' if self.status['total']['success'] else 'FAILED'))
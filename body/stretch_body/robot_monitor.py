@@ -1,5 +1,12 @@
 from __future__ import print_function
 from stretch_body.device import Device
+from stretch_body.event_bus import *
+import stretch_body.profiler as profiler
+
+# Checks in the order they are stepped, each enabled by the robot_monitor param of its name
+MONITOR_CHECKS = [(c, 'monitor.' + c) for c in ['monitor_voltage', 'monitor_current', 'monitor_runstop', 'monitor_dynamixel_flags',
+                                                 'monitor_guarded_contact', 'monitor_wrist_single_tap', 'monitor_base_cliff_event',
+                                                 'monitor_base_bump_event', 'monitor_over_tilt_alert']]
 
 
 class RobotMonitor(Device):
@@ -9,10 +16,17 @@ class RobotMonitor(Device):
     The events to be monitored may be turned on/off/configured via YAML
     The RobotMonitor is managed by the Robot class
     It runs at 5Hz
+
+    Events are emitted on the EventBus self.events (see event_bus.py). The last robot_monitor.event_log_size
+    events can be queried from it by time range, type and device, and callbacks subscribed to them.
+    Events are logged by a LoggingSink if robot_monitor.log_events is set.
     """
     def __init__(self, robot):
         Device.__init__(self, 'robot_monitor')
         self.robot=robot
+        self.events=EventBus(capacity=self.params.get('event_log_size',4096),logger=self.logger)
+        if self.params.get('log_events',1):
+            self.events.subscribe(LoggingSink(self.logger))
 
     def startup(self):
         if self.robot.wacc is not None:
@@ -35,52 +49,38 @@ class RobotMonitor(Device):
         return True
 
     def step(self):
-        if self.params['monitor_voltage']:
-            self.monitor_voltage()
-        if self.params['monitor_current']:
-            self.monitor_current()
-        if self.params['monitor_runstop']:
-            self.monitor_runstop()
-        if self.params['monitor_dynamixel_flags']:
-            self.monitor_dynamixel_flags()
-        if self.params['monitor_guarded_contact']:
-            self.monitor_guarded_contact()
-        if self.params['monitor_wrist_single_tap']:
-            self.monitor_wrist_single_tap()
-        if self.params['monitor_base_cliff_event']:
-            self.monitor_base_cliff_event()
-        if self.params['monitor_base_bump_event']:
-            self.monitor_base_bump_event()
-        if self.params['monitor_over_tilt_alert']:
-            self.monitor_over_tilt_alert()
+        for check, span_name in MONITOR_CHECKS:
+            if self.params[check]:
+                with profiler.span(span_name):
+                    getattr(self, check)()
 
 
     # ##################################
     def monitor_base_cliff_event(self):
         if self.robot.pimu is not None:
             if self.robot.pimu.status['cliff_event'] and  self.monitor_history['monitor_base_cliff_event']==0:
-                self.logger.debug("Base cliff event")
+                self.events.emit(EVENT_BASE_CLIFF,'pimu',1)
             self.monitor_history['monitor_base_cliff_event'] = self.robot.pimu.status['cliff_event']
 
     # ##################################
     def monitor_base_bump_event(self):
         if self.robot.pimu is not None:
             if self.robot.pimu.status['bump_event_cnt'] != self.monitor_history['monitor_base_bump_event']:
-                self.logger.debug("Base bump event")
+                self.events.emit(EVENT_BASE_BUMP,'pimu',self.robot.pimu.status['bump_event_cnt'])
             self.monitor_history['monitor_base_bump_event'] = self.robot.pimu.status['bump_event_cnt']
 
     # ##################################
     def monitor_over_tilt_alert(self):
         if self.robot.pimu is not None:
             if self.robot.pimu.status['over_tilt_alert'] and self.monitor_history['monitor_over_tilt_alert'] == 0:
-                self.logger.debug("Over Tilt Alert")
+                self.events.emit(EVENT_OVER_TILT,'pimu',1)
             self.monitor_history['monitor_over_tilt_alert'] = self.robot.pimu.status['over_tilt_alert']
 
     # ##################################
     def monitor_wrist_single_tap(self):
         if self.robot.wacc is not None:
             if self.robot.wacc.status['single_tap_count']!=self.monitor_history['monitor_wrist_single_tap']:
-                self.logger.debug("Wrist single tap: %d" % self.robot.wacc.status['single_tap_count'])
+                self.events.emit(EVENT_WRIST_SINGLE_TAP,'wacc',self.robot.wacc.status['single_tap_count'])
             self.monitor_history['monitor_wrist_single_tap']=self.robot.wacc.status['single_tap_count']
 
     # ##################################
@@ -93,7 +93,7 @@ class RobotMonitor(Device):
                     self.monitor_history[mn][j.name] = 0
                 if j is not None:
                     if self.monitor_history[mn][j.name]==0 and j.motor.status['in_guarded_event']:
-                        self.logger.debug("Guarded contact %s"%j.name)
+                        self.events.emit(EVENT_GUARDED_CONTACT,j.name,1)
                 self.monitor_history[mn][j.name] =j.motor.status['in_guarded_event']
 
     # ##################################
@@ -114,16 +114,13 @@ class RobotMonitor(Device):
                 for k in c.motors.keys():
                     for e in errs:
                         if c.motors[k].status[e] and not self.monitor_history[mn][c.name][k][e]:
-                            self.logger.debug("Dynamixel %s on %s:%s"%(e,c.name,k))
+                            self.events.emit(EVENT_DYNAMIXEL_OVERHEATING if e=='overheating_error' else EVENT_DYNAMIXEL_OVERLOAD,'%s.%s'%(c.name,k),1)
                         self.monitor_history[mn][c.name][k][e] = c.motors[k].status[e]
 
     # ##################################
     def monitor_runstop(self):
         if self.robot.status['pimu']['runstop_event'] != self.monitor_history['monitor_runstop']:
-            if self.robot.status['pimu']['runstop_event']:
-                self.logger.debug("Runstop activated")
-            else:
-                self.logger.debug("Runstop deactivated")
+            self.events.emit(EVENT_RUNSTOP,'pimu',1 if self.robot.status['pimu']['runstop_event'] else 0)
         self.monitor_history['monitor_runstop']=self.robot.status['pimu']['runstop_event']
 
     # ##################################
@@ -131,7 +128,7 @@ class RobotMonitor(Device):
         v=self.robot.pimu.status['voltage']
         if v < self.robot.pimu.config['low_voltage_alert']:
             if v-self.monitor_history['monitor_voltage']<-0.5:#every 0.5V of drop allow to report
-                self.logger.debug('Low voltage of: %.2f'%v)
+                self.events.emit(EVENT_LOW_VOLTAGE,'pimu',v)
                 self.monitor_history['monitor_voltage']=v
         else:
             self.monitor_history['monitor_voltage'] =v
@@ -141,7 +138,7 @@ class RobotMonitor(Device):
         i=self.robot.pimu.status['current']
         if i > self.robot.pimu.config['high_current_alert']:
             if i-self.monitor_history['monitor_current']>0.25:#every 0.25A of rise allow to report
-                self.logger.debug('High current of: %.2f'%i)
+                self.events.emit(EVENT_HIGH_CURRENT,'pimu',i)
                 self.monitor_history['monitor_current']=i
         else:
             self.monitor_history['monitor_current'] =i
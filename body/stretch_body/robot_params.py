@@ -1,6 +1,12 @@
 import stretch_body.hello_utils as hello_utils
 import importlib
+import hashlib
+import copy
 import logging
+import os
+import pickle
+import sys
+import time
 
 # Do not override factory params here
 factory_params = {
@@ -9,9 +15,16 @@ factory_params = {
         "warn_above_rate":0.1,
         'verbose':0
     },
+    "dxl_status_scheduler":{
+        'max_reads_per_cycle': 1,
+        'effort': {'max_age_s': 0.2, 'max_age_active_s': 0.0},
+        'temp': {'max_age_s': 2.0, 'max_age_active_s': 0.2, 'warn_margin_C': 10.0},
+        'hardware_error': {'max_age_s': 0.2, 'max_age_active_s': 0.0}
+    },
     "robot": {
         "tool": "tool_stretch_gripper",
         "use_collision_manager": 0,
+        "dxl_status_rate_hz": 15.0,
     },
     "robot_sentry": {
         "dynamixel_stop_on_runstop": 1,
@@ -20,9 +33,61 @@ factory_params = {
         "stretch_gripper_overload": 1,
         "wrist_yaw_overload": 1,
         "stepper_is_moving_filter": 1,
+        "base_fan_control_rule": 0, #Run base_fan_control in the Robot (it wasn't before the rule engine)
+        "rate_hz": {
+            "default": 12.5,
+            "dynamixel_stop_on_runstop": 25.0,
+            "base_fan_control": 1.0,
+            "base_max_velocity": 12.5,
+            "stepper_is_moving_filter": 12.5,
+            "stretch_gripper_overload": 12.5,
+            "wrist_yaw_overload": 12.5,
+            "custom": 12.5
+        }
+    },
+    "robot_monitor": {
+        'event_log_size': 4096,
+        'log_events': 1
     },
     "robot_collision": {
-        'models': ['collision_arm_camera']
+        'models': ['collision_arm_camera'],
+        'input_tolerance': 0.001,
+        'table_dir': 'collision_tables',
+        'max_interp_step': 0.01,
+        'predictive': {
+            'enabled': 0,
+            'horizon_s': 0.5,
+            'n_samples': 25
+        }
+    },
+    "forward_kinematics": {
+        'urdf_file': 'exported_urdf/stretch.urdf',
+        'cache_dir': 'exported_urdf/fk_cache'
+    },
+    "stepper_trajectory": {
+        'rate_hz': 50.0,
+        'vel_margin': 0.2
+    },
+    "robot_trajectory": {
+        'rate_hz': 30.0,
+        'vel_margin': 0.2,
+        'max_issue_latency_ms': 10.0
+    },
+    "robot_pose_planner": {
+        'stow': {'timeout_head': 3.0, 'timeout_lift_up': 3.0, 'timeout_arm': 3.0, 'timeout_end_of_arm': 3.0,
+                 'timeout_lift_down': 10.0, 'dxl_start_timeout': 0.25}
+    },
+    "robot_homing": {
+        'dependencies': {'head': [], 'lift': [], 'arm': ['lift'], 'end_of_arm': ['arm']}
+    },
+    "robot_startup": {
+        'parallel': 1,
+        'max_workers': 8,
+        'timeout_s': 30.0
+    },
+    "params_watcher": {
+        'enabled': 0,
+        'poll_s': 1.0
     },
     'hello-motor-arm':{
         'gains': {'vel_near_setpoint_d': 3.5}
@@ -36,17 +101,28 @@ factory_params = {
     'hello-motor-left-wheel':{
         'gains': {'vel_near_setpoint_d': 3.5}
     },
+    "dxl_bus_tuner": {
+        'bauds': [57600, 115200, 1000000, 2000000, 3000000, 4000000],
+        'max_error_rate': 0.001,
+        'test_duration_s': 3.0,
+        'rollback_attempts': 5,
+        'return_delay_time': 0,
+        'usb_latency_timer_ms': 1,
+        'status_rate_margin': 0.5
+    },
     "head": {
         "use_group_sync_read": 1,
         "retry_on_comm_failure": 1,
         "baud": 57600,
-        "dxl_latency_timer":64
+        "dxl_latency_timer":64,
+        "usb_latency_timer_ms": 0
     },
     "end_of_arm": {
         "use_group_sync_read": 1,
         "retry_on_comm_failure": 1,
         "baud": 57600,
         "dxl_latency_timer": 64,
+        "usb_latency_timer_ms": 0,
         'stow': {'wrist_yaw': 3.4},
         'devices': {
             'wrist_yaw': {
@@ -84,11 +160,26 @@ factory_params = {
             "min_wrist_yaw_rad": 2.54,
         }
     },
+    "base_odometry": {
+        'rate_hz': 100.0,
+        'history_s': 10.0,
+        'history_max_rate_hz': 200.0,
+        'max_extrapolation_s': 0.1,
+        'imu': {
+            'enabled': 1,
+            'gyro_weight': 0.75,
+            'max_age_s': 0.1,
+            'heading_gain': 0.0,
+            'still_vel_m': 0.002,
+            'bias_tau_s': 10.0
+        }
+    },
     "tool_none": {
         'use_group_sync_read': 1,
         'retry_on_comm_failure': 1,
         'baud':57600,
         "dxl_latency_timer": 64,
+        "usb_latency_timer_ms": 0,
         'py_class_name': 'ToolNone',
         'py_module_name': 'stretch_body.end_of_arm_tools',
         'stow': {'wrist_yaw': 3.4},
@@ -104,6 +195,7 @@ factory_params = {
         'retry_on_comm_failure': 1,
         'baud':57600,
         "dxl_latency_timer": 64,
+        "usb_latency_timer_ms": 0,
         'py_class_name': 'ToolStretchGripper',
         'py_module_name': 'stretch_body.end_of_arm_tools',
         'stow': {'stretch_gripper': 0, 'wrist_yaw': 3.4},
@@ -122,12 +214,45 @@ factory_params = {
     "collision_arm_camera": {
         'enabled': 1,
         'py_class_name': 'CollisionArmCamera',
-        'py_module_name': 'stretch_body.robot_collision_models'
+        'py_module_name': 'stretch_body.robot_collision_models',
+        'table': {
+            'enabled': 0,
+            'grid': {'lift': [0.0, 1.1, 111], 'head_pan': [-4.0, 1.8, 59], 'head_tilt': [-1.6, 0.8, 25]}
+        }
     },
     "collision_stretch_gripper": {
         'enabled': 1,
         'py_class_name': 'CollisionStretchGripper',
         'py_module_name': 'stretch_body.robot_collision_models',
+        'table': {
+            'enabled': 0,
+            'grid': {'lift': [0.0, 1.1, 56], 'arm': [0.0, 0.52, 53], 'wrist_yaw': [-1.75, 4.0, 231]}
+        }
+    },
+    "telemetry": {
+        'rate_hz': 100.0,
+        'chunk_rows': 6000,
+        'compress': 0,
+        'log_dir': 'log/telemetry'
+    },
+    "robot_sim": {
+        'enabled': 0,
+        'time_scale': 1.0,
+        'rpc_time_s': 0.001,
+        'step_s': 0.005,
+        'calibrated': 0,
+        'initial_pos': {'lift': 0.5, 'arm': 0.1},
+        'stop_margin_m': 0.005,
+        'stop_accel': 20.0,
+        'dxl_stop_margin_t': 50,
+        'current': {'idle_A': 1.5, 'friction_A': 0.2, 'A_per_accel': 0.02, 'ohms': 0.05},
+        'voltage_V': 12.5,
+        'temp_C': 30.0
+    },
+    "logging_queue": {
+        'enabled': 0,
+        'max_size': 1000,
+        'rate_limit': {'period_s': 1.0, 'max_per_period': 10}
     },
     "logging": {
         "version": 1,
@@ -165,6 +290,116 @@ factory_params = {
     },
 }
 
+# ###########  Params cache #############
+# Parsing the YAMLs and merging the params is a large part of the time to import stretch_body.
+# The merged params are pickled to the cache directory, along with the modification time, size and content
+# hash of every file they were built from: the user and factory YAMLs, the external params modules and this
+# module. The cache is used only if all of these are unchanged, else it is rebuilt. Set the environment
+# variable HELLO_PARAMS_CACHE=0 to always build the params.
+
+PARAMS_CACHE_VERSION = 1
+USER_PARAMS_FILE = 'stretch_re1_user_params.yaml'
+
+cache_status = {'path': None, 'enabled': False, 'hit': False, 'load_time_s': 0.0}
+
+
+def get_params_cache_path():
+    return hello_utils.get_stretch_directory('cache/') + 'robot_params_%s_py%d.pickle' % (hello_utils.get_fleet_id(), sys.version_info[0])
+
+
+def get_source_key(path):
+    """Modification time, size and SHA1 of a source file, or None if it can't be read"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        return (os.path.getmtime(path), len(data), hashlib.sha1(data).hexdigest())
+    except (IOError, OSError):
+        return None
+
+
+def _source_file(module):
+    f = getattr(module, '__file__', None)
+    if f is not None and f.endswith('.pyc'):
+        f = f[:-1]
+    return f
+
+
+def _get_log_filename(robot_params):
+    return robot_params.get('logging', {}).get('handlers', {}).get('file_handler', {}).get('filename')
+
+
+def build_params():
+    """Merge the params (see RobotParams). Returns user params, robot params and the list of source files"""
+    user_params = hello_utils.read_fleet_yaml(USER_PARAMS_FILE)
+    robot_params = hello_utils.read_fleet_yaml(user_params.get('factory_params', ''))
+    # Copies, as the merge adds their dicts into robot_params, and the user params then overwrite those in place
+    hello_utils.overwrite_dict(robot_params, copy.deepcopy(factory_params))
+    sources = [hello_utils.get_fleet_directory() + USER_PARAMS_FILE,
+               hello_utils.get_fleet_directory() + user_params.get('factory_params', ''),
+               _source_file(sys.modules[__name__])]
+    for external_params_module in user_params.get('params', []):
+        m = importlib.import_module(external_params_module)
+        hello_utils.overwrite_dict(robot_params, copy.deepcopy(getattr(m, 'params')))
+        sources.append(_source_file(m))
+    hello_utils.overwrite_dict(robot_params, user_params)
+    return user_params, robot_params, [f for f in sources if f is not None]
+
+
+def load_params(use_cache=None):
+    """
+    The merged params, from the cache if it is valid, else built (and cached)
+    Returns user params and robot params
+    """
+    ts = time.time()
+    if use_cache is None:
+        use_cache = os.environ.get('HELLO_PARAMS_CACHE', '1') != '0'
+    path = get_params_cache_path()
+    cache_status.update({'path': path, 'enabled': use_cache, 'hit': False})
+    if use_cache:
+        try:
+            with open(path, 'rb') as f:
+                c = pickle.load(f)
+            if c['version'] == PARAMS_CACHE_VERSION and all(get_source_key(p) == k for p, k in c['sources']):
+                user_params, robot_params = c['params']
+                fh = robot_params.get('logging', {}).get('handlers', {}).get('file_handler', {})
+                if fh.get('filename') == c['log_filename']:
+                    fh['filename'] = _get_log_filename(factory_params) #New log file for each session
+                cache_status.update({'hit': True, 'load_time_s': time.time() - ts})
+                return user_params, robot_params
+        except Exception:
+            pass #Missing, stale or unreadable cache: rebuild it
+    user_params, robot_params, sources = build_params()
+    if use_cache:
+        _save_cache(path, user_params, robot_params, sources)
+    cache_status['load_time_s'] = time.time() - ts
+    return user_params, robot_params
+
+
+def _save_cache(path, user_params, robot_params, sources):
+    c = {'version': PARAMS_CACHE_VERSION,
+         'sources': [(p, get_source_key(p)) for p in sources],
+         'log_filename': _get_log_filename(robot_params),
+         'params': (user_params, robot_params)}
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(tmp, 'wb') as f:
+            pickle.dump(c, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path) #Atomic, so concurrent processes never read a partial cache
+    except Exception:
+        #The cache is an optimization only (eg, read only directory, params that can't be pickled)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def clear_params_cache():
+    try:
+        os.remove(get_params_cache_path())
+    except OSError:
+        pass
+
+
 class RobotParams:
     """Build the parameter dictionary that is availale as stretch_body.Device().robot_params.
 
@@ -173,13 +408,10 @@ class RobotParams:
     2. stretch_body.robot_params.factory_params | Factory Python settings (Common across robots. Factory may modify these via Pip updates)
     3. Outside parameters | (eg, from stretch_tool_share.stretch_dex_wrist.params)
     4. stretch_re1_user_params.yaml | Place to override factory defaults
+
+    The merged dictionary is cached between processes (see load_params)
     """
-    _user_params = hello_utils.read_fleet_yaml('stretch_re1_user_params.yaml')
-    _robot_params = hello_utils.read_fleet_yaml(_user_params.get('factory_params', ''))
-    hello_utils.overwrite_dict(_robot_params, factory_params)
-    for external_params_module in _user_params.get('params', []):
-        hello_utils.overwrite_dict(_robot_params, getattr(importlib.import_module(external_params_module), 'params'))
-    hello_utils.overwrite_dict(_robot_params, _user_params)
+    _user_params, _robot_params = load_params()
 
     @classmethod
     def get_params(cls):
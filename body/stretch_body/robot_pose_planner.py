@@ -0,0 +1,170 @@
+from __future__ import print_function
+import threading
+import time
+
+from stretch_body.device import Device
+
+
+class PoseTransition:
+    """
+    Handle to a pose transition running in the background (eg, from RobotPosePlanner.stow)
+
+    Poll done() or block on wait(). The status holds the per step timing breakdown:
+    start / end / duration (s, relative to the start of the transition), success, and
+    whether the step timed out. status['total'] also records 'serial_duration', the sum of the
+    step durations, ie roughly the time the transition would take if run one step at a time.
+    """
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = steps
+        self.status = dict([(s['name'], {'start': None, 'end': None, 'duration': None, 'success': False, 'timed_out': False}) for s in steps])
+        self._done = dict([(s['name'], threading.Event()) for s in steps])
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        self._threads = []
+        self.ts_start = None
+
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the transition completes, or timeout (s)
+        Returns the timing breakdown, or None on timeout
+        """
+        if not self._finished.wait(timeout):
+            return None
+        return self.status
+
+    def cancel(self):
+        """
+        Don't start any steps that haven't started yet. Steps in motion run to completion
+        """
+        self._cancel.set()
+
+    def succeeded(self):
+        return self.done() and self.status['total']['success']
+
+    def pretty_print(self):
+        print('----- Pose Transition: %s ------ ' % self.name)
+        for s in self.steps:
+            r = self.status[s['name']]
+            if r['start'] is None:
+                print('%-12s not started' % s['name'])
+            else:
+                print('%-12s start %6.2fs  end %6.2fs  duration %6.2fs  %s' % (s['name'], r['start'], r['end'], r['duration'],
+                                                                               'OK' if r['success'] else ('TIMEOUT' if r['timed_out'] else 'FAILED')))
+        if 'total' in self.status:
+            print('Total: %.2fs (serial %.2fs)' % (self.status['total']['duration'], self.status['total']['serial_duration']))
+
+
+class RobotPosePlanner(Device):
+    """
+    Run multi joint pose transitions (eg, stow) with each joint moving as soon as its preconditions hold
+
+    A transition is a list of steps. Each step commands a motion, then waits on status events
+    until the motion completes (or times out). A step starts once every step in its 'after' list
+    has completed, so collision ordering constraints (eg, lift up before the arm retracts)
+    are kept while unconstrained joints (eg, the head) move in parallel.
+    A step that times out still releases the steps that follow it, as the serial stow always has.
+    """
+    def __init__(self, robot):
+        Device.__init__(self, name='robot_pose_planner')
+        self.robot = robot
+
+    # ###########  Steps #############
+
+    def _stepper_step(self, name, joint, x_m, after, timeout):
+        def move():
+            joint.move_to(x_m)
+            self.robot.push_command()
+        def wait():
+            m = joint.motor
+            return m.wait_until(lambda: m.status['near_pos_setpoint'] and not m.status['waiting_on_sync'], timeout=timeout)
+        return {'name': name, 'after': after, 'move': move, 'wait': wait}
+
+    def _dynamixel_step(self, name, chain, joints, move, after, timeout):
+        def wait():
+            ts = time.time()
+            for j in joints:
+                if not chain.motors[j].wait_until_stopped(timeout=max(0.0, timeout - (time.time() - ts)), start_timeout=self.params['stow']['dxl_start_timeout']):
+                    return False
+            return True
+        return {'name': name, 'after': after, 'move': move, 'wait': wait}
+
+    def plan_stow(self):
+        """
+        Build the stow steps from the current robot state
+        """
+        r = self.robot
+        p = self.params['stow']
+        stow = dict(r.params['stow'])
+        if 'stow' in r.end_of_arm.params:  # Allow tool defined stow position to take precedence
+            for k in ['lift', 'arm']:
+                if k in r.end_of_arm.params['stow']:
+                    stow[k] = r.end_of_arm.params['stow'][k]
+
+        steps = [self._dynamixel_step('head_pan', r.head, ['head_pan'], lambda: r.head.move_to('head_pan', stow['head_pan']), [], p['timeout_head']),
+                 self._dynamixel_step('head_tilt', r.head, ['head_tilt'], lambda: r.head.move_to('head_tilt', stow['head_tilt']), [], p['timeout_head'])]
+        lift_up = r.lift.status['pos'] <= r.params['stow']['lift']  # Needs to come up before bring in arm
+        if lift_up:
+            steps.append(self._stepper_step('lift', r.lift, stow['lift'], [], p['timeout_lift_up']))
+        steps.append(self._stepper_step('arm', r.arm, stow['arm'], ['lift'] if lift_up else [], p['timeout_arm']))
+        steps.append(self._dynamixel_step('end_of_arm', r.end_of_arm, r.end_of_arm.joints, r.end_of_arm.stow, ['arm'], p['timeout_end_of_arm']))
+        if not lift_up:  # Bring lift down once arm and tool are in
+            steps.append(self._stepper_step('lift', r.lift, stow['lift'], ['arm', 'end_of_arm'], p['timeout_lift_down']))
+        return steps
+
+    # ###########  Execution #############
+
+    def run(self, name, steps):
+        """
+        Start the steps in the background
+        Returns a PoseTransition handle
+        """
+        t = PoseTransition(name, steps)
+        t.ts_start = time.time()
+        t._threads = [threading.Thread(target=self._run_step, args=(t, s)) for s in steps]
+        for th in t._threads:
+            th.daemon = True
+            th.start()
+        threading.Thread(target=self._finish, args=(t,)).start()
+        return t
+
+    def stow(self):
+        """
+        Start moving to the stow pose
+        Returns a PoseTransition handle
+        """
+        return self.run('stow', self.plan_stow())
+
+    def _run_step(self, t, step):
+        r = t.status[step['name']]
+        for a in step['after']:
+            t._done[a].wait()
+        try:
+            if t._cancel.is_set():
+                return
+            r['start'] = time.time() - t.ts_start
+            step['move']()
+            r['success'] = step['wait']()
+            r['timed_out'] = not r['success']
+            if r['timed_out']:
+                self.logger.warning('Timeout waiting for %s to reach pose %s' % (step['name'], t.name))
+        except Exception as e:
+            self.logger.error('Failed to move %s to pose %s: %s' % (step['name'], t.name, str(e)))
+        finally:
+            if r['start'] is not None:
+                r['end'] = time.time() - t.ts_start
+                r['duration'] = r['end'] - r['start']
+            t._done[step['name']].set()
+
+    def _finish(self, t):
+        for th in t._threads:
+            th.join()
+        steps = [t.status[s['name']] for s in t.steps]
+        t.status['total'] = {'duration': time.time() - t.ts_start,
+                             'serial_duration': sum([s['duration'] for s in steps if s['duration'] is not None]),
+                             'success': all([s['success'] for s in steps])}
+        self.logger.debug('Pose %s took %.2fs (%.2fs if serial)' % (t.name, t.status['total']['duration'], t.status['total']['serial_duration']))
+        t._finished.set()
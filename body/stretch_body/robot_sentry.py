@@ -0,0 +1,172 @@
+from __future__ import print_function
+from stretch_body.device import Device
+from stretch_body.dynamixel_hello_XL430 import DynamixelHelloXL430
+from stretch_body.dynamixel_X_chain import DynamixelXChain
+from stretch_body.wrist_yaw import WristYaw
+from stretch_body.stretch_gripper import StretchGripper
+import stretch_body.profiler as profiler
+import time
+
+
+def _method_function(cls, name):
+    m = getattr(cls, name)
+    return getattr(m, '__func__', m) #Unbound method in Python 2
+
+
+class SentryRule:
+    """
+    A sentry rule, evaluated by the RobotSentry
+
+    name: unique name of the rule
+    switch: robot_sentry param that enables the rule (eg, 'base_max_velocity'), or None if always enabled
+    rate_hz: rate to evaluate the rule at (up to the rate the sentry is stepped at)
+    fields: status fields the rule reads, as paths into Robot.status (eg, 'end_of_arm.wrist_yaw.pos')
+    action: function of the dict of field to value, read from the status snapshot of the sentry step.
+            Returns True if the rule triggered (took action)
+    """
+    def __init__(self, name, switch, rate_hz, fields, action):
+        self.name = name
+        self.switch = switch
+        self.rate_hz = rate_hz
+        self.fields = fields
+        self.action = action
+        self.span_name = 'sentry.' + name #See profiler.py
+        self.ts_next = 0
+        self.status = {'n_eval': 0, 'n_trigger': 0, 'n_error': 0, 'time_ms_last': 0.0, 'time_ms_max': 0.0, 'time_ms_total': 0.0}
+
+
+class RobotSentry(Device):
+    """
+    The RobotSentry evaluates the sentry rules that keep the robot operating within a safe regime
+    (eg, limiting base velocity when the lift is high, backing off a stalled gripper, and stopping the servos at runstop)
+
+    Each rule declares the status fields it reads, its rate and its action. On each step, the rules that are due
+    are evaluated in one pass over a single snapshot of the fields they read.
+    The rules are enabled by the robot_sentry switches, and their rates set by robot_sentry.rate_hz.
+    Per rule evaluation and trigger counts, and evaluation times, are kept in the rule's status.
+    Rules may be added with add_rule. Dynamixel servos with their own step_sentry (eg, from an external tool)
+    are stepped as they are through a generic rule.
+    The RobotSentry is managed by the Robot class and stepped by its status thread.
+    """
+    def __init__(self, robot):
+        Device.__init__(self, 'robot_sentry')
+        self.robot = robot
+        self.rules = []
+        self.status = {'n_step': 0, 'n_eval': 0, 'time_ms_last': 0.0}
+        self.ts_last_step = None
+
+    def startup(self):
+        self.rules = []
+        r = self.robot
+        self.add_rule(SentryRule('base_max_velocity', 'base_max_velocity', self.get_rate('base_max_velocity'),
+                                 ['lift.pos', 'arm.pos', 'end_of_arm.wrist_yaw.pos'],
+                                 lambda v: r.base.step_fast_motion_allowed(v['lift.pos'], v['arm.pos'], v['end_of_arm.wrist_yaw.pos'])))
+        if self.params['base_fan_control_rule']: #Opt in: commands the Pimu fan from the status thread
+            def fan_control(v):
+                with r.lock:
+                    return r.pimu.step_fan_control(v['pimu.fan_on'])
+            self.add_rule(SentryRule('base_fan_control', 'base_fan_control', self.get_rate('base_fan_control'), ['pimu.fan_on'], fan_control))
+        for path, stepper in [('lift.motor', r.lift.motor), ('arm.motor', r.arm.motor), ('base.left_wheel', r.base.left_wheel), ('base.right_wheel', r.base.right_wheel)]:
+            self.add_rule(SentryRule('%s.stepper_is_moving_filter' % path, 'stepper_is_moving_filter', self.get_rate('stepper_is_moving_filter'),
+                                     [path + '.is_moving'], lambda v, s=stepper, f=path + '.is_moving': s.step_is_moving_filter(v[f])))
+        for chain_name in ['head', 'end_of_arm']:
+            self.add_chain_rules(chain_name, getattr(r, chain_name))
+        return True
+
+    def add_chain_rules(self, chain_name, chain):
+        r = self.robot
+        if _method_function(type(chain), 'step_sentry') is not _method_function(DynamixelXChain, 'step_sentry'):
+            self.add_rule(SentryRule('%s.step_sentry' % chain_name, None, self.get_rate('custom'), [],
+                                     lambda v, c=chain: c.step_sentry(r)))
+            return
+        for name, m in chain.motors.items():
+            path = '%s.%s' % (chain_name, name)
+            f = _method_function(type(m), 'step_sentry')
+            if f not in [_method_function(c, 'step_sentry') for c in [DynamixelHelloXL430, WristYaw, StretchGripper]]:
+                self.add_rule(SentryRule('%s.step_sentry' % path, None, self.get_rate('custom'), [],
+                                         lambda v, d=m: d.step_sentry(r)))
+                continue
+            self.add_rule(SentryRule('%s.dynamixel_stop_on_runstop' % path, 'dynamixel_stop_on_runstop', self.get_rate('dynamixel_stop_on_runstop'),
+                                     ['pimu.runstop_event'], lambda v, d=m: d.step_runstop(v['pimu.runstop_event'])))
+            for cls, switch in [(WristYaw, 'wrist_yaw_overload'), (StretchGripper, 'stretch_gripper_overload')]:
+                if f is _method_function(cls, 'step_sentry'):
+                    self.add_rule(SentryRule('%s.%s' % (path, switch), switch, self.get_rate(switch), [path + '.stall_overload', path + '.effort'],
+                                             lambda v, d=m, p=path: d.step_stall_backoff(v[p + '.stall_overload'], v[p + '.effort'])))
+
+    def add_rule(self, rule):
+        self.rules = [x for x in self.rules if x.name != rule.name] + [rule]
+
+    def get_rule(self, name):
+        for x in self.rules:
+            if x.name == name:
+                return x
+        return None
+
+    def get_rate(self, name):
+        return self.params.get('rate_hz', {}).get(name, self.params.get('rate_hz', {}).get('default', 12.5))
+
+    def read_field(self, field):
+        s = self.robot.status
+        for k in field.split('.'):
+            s = s[k]
+        return s
+
+    def step(self, now=None):
+        """Evaluate the rules that are due"""
+        now = time.time() if now is None else now
+        ts = time.time()
+        due = []
+        # Rules are due up to half a step early, so loop jitter doesn't skip a cycle
+        early = 0.5 * (now - self.ts_last_step) if self.ts_last_step is not None else 0.0
+        self.ts_last_step = now
+        for rule in self.rules:
+            if rule.switch is not None and not self.params[rule.switch]:
+                continue
+            period = 1.0 / rule.rate_hz
+            if now >= rule.ts_next - min(early, 0.25 * period):
+                due.append(rule)
+                rule.ts_next = rule.ts_next + period
+                if rule.ts_next < now - period:
+                    rule.ts_next = now + period
+        self.status['n_step'] += 1
+        if not len(due):
+            return
+        snapshot = {}
+        missing = set()
+        for rule in due:
+            for f in rule.fields:
+                if f not in snapshot and f not in missing:
+                    try:
+                        snapshot[f] = self.read_field(f)
+                    except (KeyError, TypeError):
+                        missing.add(f)
+        for rule in due:
+            t0 = time.time()
+            t = profiler.begin()
+            try:
+                if missing.intersection(rule.fields):
+                    raise KeyError('status field %s' % ', '.join(missing.intersection(rule.fields)))
+                if rule.action(snapshot):
+                    rule.status['n_trigger'] += 1
+            except Exception as e: #A failing rule shouldn't stop the others
+                rule.status['n_error'] += 1
+                if rule.status['n_error'] == 1:
+                    self.logger.error('Sentry rule %s failed: %s' % (rule.name, str(e)))
+            profiler.end(rule.span_name, t)
+            dt = (time.time() - t0) * 1000.0
+            rule.status['n_eval'] += 1
+            rule.status['time_ms_last'] = dt
+            rule.status['time_ms_max'] = max(rule.status['time_ms_max'], dt)
+            rule.status['time_ms_total'] += dt
+        self.status['n_eval'] += len(due)
+        self.status['time_ms_last'] = (time.time() - ts) * 1000.0
+
+    def pretty_print(self):
+        print('----- Robot Sentry ------ ')
+        print('Steps', self.status['n_step'])
+        print('Rule evaluations', self.status['n_eval'])
+        print('%-55s %6s %8s %8s %8s %10s %10s' % ('Rule', 'On', 'Rate', 'Evals', 'Triggers', 'Mean (ms)', 'Max (ms)'))
+        for rule in self.rules:
+            s = rule.status
+            print('%-55s %6d %8.1f %8d %8d %10.3f %10.3f' % (rule.name, rule.switch is None or self.params[rule.switch], rule.rate_hz, s['n_eval'], s['n_trigger'],
+                                                             s['time_ms_total'] / max(1, s['n_eval']), s['time_ms_max']))
@@ -0,0 +1,472 @@
+"""
+Simulated hardware for the Robot
+
+A RobotSim stands in for every board of a Robot, so a full Robot (startup, homing, stow, status threads,
+monitor, sentry, odometry) runs without any /dev/hello-* device. It is selected by the robot_sim.enabled
+param, or directly:
+
+    sim = RobotSim()
+    robot = sim.make_robot()
+    robot.startup()
+    ...
+    robot.stop()
+
+* Pimu, Wacc and the four steppers talk to the sim through their Transport (see transport.rpc_backends).
+  RPCs are decoded and replied to byte for byte as the firmware would, so the device packing and unpacking
+  code runs unmodified. Each RPC takes robot_sim.rpc_time_s, as a USB round trip would.
+* Each stepper has a trapezoidal motion generator that tracks its commands perfectly, except at its hard stops.
+  Pushing against a stop saturates the motor current, which is what guarded mode and homing rely on.
+  Sync mode, runstop, position marking and calibration behave as on the stepper firmware.
+* The Dynamixel chains run on simulated buses (see dynamixel_sim.py), with hard stops just beyond range_t.
+
+The sim runs on its own clock, time_scale times faster than real time, to shorten homing and long motions.
+With robot_sim.calibrated, the joints start out calibrated and homing is not needed.
+"""
+from __future__ import print_function
+import stretch_body.transport as transport
+import stretch_body.dynamixel_sim as dxl_sim
+from stretch_body.dynamixel_XL430 import XL430_ADDR_HOMING_OFFSET, XL430_ADDR_HELLO_CALIBRATED
+from stretch_body.robot_params import RobotParams
+import stretch_body.stepper as stepper
+import stretch_body.pimu as pimu
+import stretch_body.wacc as wacc
+import threading
+import logging
+import struct
+import math
+import time
+
+STEPPER_USBS = ['/dev/hello-motor-lift', '/dev/hello-motor-arm', '/dev/hello-motor-left-wheel', '/dev/hello-motor-right-wheel']
+PIMU_USB = '/dev/hello-pimu'
+WACC_USB = '/dev/hello-wacc'
+
+POS_MODES = [stepper.MODE_POS_PID, stepper.MODE_POS_TRAJ, stepper.MODE_POS_TRAJ_INCR]
+VEL_MODES = [stepper.MODE_VEL_PID, stepper.MODE_VEL_TRAJ]
+A_PER_EFFORT = ((3300 / 255) / (10 * 0.1)) / 1000.0 #As Stepper.effort_to_current
+
+GRAVITY = 9.80665
+
+
+def _board_info(reply_id, device, name):
+    """Board info reply, with the firmware protocol that device expects"""
+    fw = ('%s.sim.%s' % (name, device.valid_firmware_protocol)).encode('utf-8')
+    return bytearray(struct.pack('<B20s20s', reply_id, ('%s.sim' % name).encode('utf-8'), fw))
+
+
+class SimStepper:
+    """
+    A simulated stepper board
+
+    pos: physical position (rad). The reported position is pos + offset (set by TRIGGER_MARK_POS)
+    stops: physical position of the hard stops [neg, pos] (rad), or None
+    """
+    def __init__(self, usb, params):
+        self.usb = usb
+        self.params = params
+        self.stops = None
+        self.pos = 0.0
+        self.t_us = 0
+        self.reset()
+
+    def reset(self):
+        self.offset = 0.0
+        self.vel = 0.0
+        self.accel = 0.0
+        self.current = 0.0
+        self.x_target = self.pos
+        self.mode = stepper.MODE_SAFETY
+        self.command = {'mode': stepper.MODE_SAFETY, 'x_des': 0.0, 'v_des': 0.0, 'a_des': 0.0, 'stiffness': 1.0,
+                        'i_feedforward': 0.0, 'i_contact_pos': 0.0, 'i_contact_neg': 0.0, 'incr_trigger': 0}
+        self.pending = None
+        self.gains = {'iMax_pos': 3.0, 'iMax_neg': -3.0, 'pos_near_setpoint_d': 1.0, 'vel_near_setpoint_d': 3.5,
+                      'i_safety_feedforward': 0.0}
+        self.config = 0
+        self.gains_payload = None
+        self.pos_calibrated = False
+        self.runstop_on = False
+        self.in_guarded_event = False
+        self.guarded_event = 0
+        self.at_current_limit = False
+
+    def get_pos(self):
+        return self.pos + self.offset
+
+    # ###########  Commands #############
+
+    def set_command(self, c):
+        x = self.get_pos()
+        if c['mode'] in [stepper.MODE_POS_PID, stepper.MODE_POS_TRAJ]:
+            self.x_target = c['x_des']
+        elif c['mode'] == stepper.MODE_POS_TRAJ_INCR:
+            if self.mode != stepper.MODE_POS_TRAJ_INCR:
+                self.x_target = x
+            if c['incr_trigger'] != self.command['incr_trigger']:
+                self.x_target += c['x_des']
+        else:
+            self.x_target = x
+        self.mode = c['mode']
+        self.command = c
+        self.in_guarded_event = False
+
+    def sync(self):
+        if self.pending is not None:
+            self.set_command(self.pending)
+            self.pending = None
+
+    def trigger(self, t, data):
+        if t & stepper.TRIGGER_BOARD_RESET:
+            self.reset()
+        if t & stepper.TRIGGER_MARK_POS and self.mode == stepper.MODE_SAFETY:
+            self.offset = data - self.pos
+            self.x_target = data
+        if t & stepper.TRIGGER_RESET_MOTION_GEN:
+            self.x_target = self.get_pos()
+            self.vel = 0.0
+        if t & stepper.TRIGGER_RESET_POS_CALIBRATED:
+            self.pos_calibrated = False
+        if t & stepper.TRIGGER_POS_CALIBRATED:
+            self.pos_calibrated = True
+
+    def rpc(self, data, device):
+        """Reply to the RPC data (bytearray) of device"""
+        r = data[0] + 1
+        if data[0] == stepper.RPC_GET_STATUS:
+            return self.pack_status(r)
+        if data[0] == stepper.RPC_SET_COMMAND:
+            c = dict(zip(['mode', 'x_des', 'v_des', 'a_des', 'stiffness', 'i_feedforward', 'i_contact_pos', 'i_contact_neg', 'incr_trigger'],
+                         struct.unpack_from('<B7fB', data, 1)))
+            if self.config & stepper.CONFIG_ENABLE_SYNC_MODE:
+                self.pending = c
+            else:
+                self.set_command(c)
+        elif data[0] == stepper.RPC_SET_GAINS:
+            g = struct.unpack_from('<20fB', data, 1)
+            for k, i in [('iMax_pos', 11), ('iMax_neg', 12), ('pos_near_setpoint_d', 14), ('vel_near_setpoint_d', 15), ('i_safety_feedforward', 19)]:
+                self.gains[k] = g[i]
+            self.config = g[20]
+            self.gains_payload = bytearray(data[1:82])
+            if not self.config & stepper.CONFIG_ENABLE_SYNC_MODE:
+                self.sync()
+        elif data[0] == stepper.RPC_SET_TRIGGER:
+            self.trigger(*struct.unpack_from('<If', data, 1))
+        elif data[0] == stepper.RPC_READ_GAINS_FROM_FLASH:
+            if self.gains_payload is None:
+                self.gains_payload = bytearray(81)
+                device.pack_gains(self.gains_payload, 0)
+            return bytearray([r]) + self.gains_payload
+        elif data[0] == stepper.RPC_GET_STEPPER_BOARD_INFO:
+            return _board_info(r, device, 'Stepper')
+        elif data[0] == stepper.RPC_LOAD_TEST:
+            return bytearray([r]) + data[2:] + data[1:2]
+        return bytearray([r])
+
+    # ###########  Motion model #############
+
+    def step(self, dt):
+        """Advance the motion model by dt seconds"""
+        c = self.command
+        x = self.get_pos()
+        a_max = max(abs(c['a_des']), 1e-3)
+        if self.runstop_on and self.mode in POS_MODES:
+            self.x_target = x
+        if self.mode in POS_MODES:
+            err = self.x_target - x
+            v_des = math.copysign(min(abs(c['v_des']), math.sqrt(2 * a_max * abs(err))), err)
+        elif self.mode in VEL_MODES and not self.runstop_on:
+            v_des = c['v_des']
+        else:
+            v_des = 0.0
+            a_max = self.params['stop_accel']
+        dv = max(-a_max * dt, min(a_max * dt, v_des - self.vel))
+        self.accel = dv / dt
+        self.vel += dv
+        if self.mode in POS_MODES and abs(self.vel * dt) >= abs(self.x_target - x) and (self.x_target - x) * self.vel >= 0:
+            self.pos += self.x_target - x #Don't overshoot the target
+            self.vel = 0.0
+        else:
+            self.pos += self.vel * dt
+
+        # Hard stops
+        pushing = 0
+        if self.stops is not None:
+            if self.pos < self.stops[0]:
+                self.pos, self.vel, pushing = self.stops[0], 0.0, -1
+            elif self.pos > self.stops[1]:
+                self.pos, self.vel, pushing = self.stops[1], 0.0, 1
+
+        # Current
+        i = self.params['current']
+        if pushing:
+            self.current = self.gains['iMax_pos'] if pushing > 0 else self.gains['iMax_neg']
+        elif self.mode in POS_MODES + VEL_MODES or self.mode == stepper.MODE_CURRENT:
+            self.current = c['i_feedforward'] + i['A_per_accel'] * self.accel + math.copysign(i['friction_A'], self.vel) * (self.vel != 0)
+        else:
+            self.current = self.gains['i_safety_feedforward']
+        self.at_current_limit = self.current >= self.gains['iMax_pos'] or self.current <= self.gains['iMax_neg']
+
+        # Guarded contact: stop and drop to safety, as the firmware does
+        if self.config & stepper.CONFIG_ENABLE_GUARDED_MODE and self.mode in POS_MODES + VEL_MODES:
+            if self.current > c['i_contact_pos'] or self.current < c['i_contact_neg']:
+                self.guarded_event += 1
+                self.in_guarded_event = True
+                self.mode = stepper.MODE_SAFETY
+                self.x_target = self.get_pos()
+
+    def pack_status(self, reply_id):
+        x = self.get_pos()
+        near_pos = abs(self.x_target - x) < math.radians(self.gains['pos_near_setpoint_d'])
+        vel_thresh = math.radians(self.gains['vel_near_setpoint_d'])
+        v_des = self.command['v_des'] if self.mode in VEL_MODES else 0.0
+        diag = 0
+        for bit, on in [(stepper.DIAG_POS_CALIBRATED, self.pos_calibrated),
+                        (stepper.DIAG_RUNSTOP_ON, self.runstop_on),
+                        (stepper.DIAG_NEAR_POS_SETPOINT, near_pos),
+                        (stepper.DIAG_NEAR_VEL_SETPOINT, abs(self.vel - v_des) < vel_thresh),
+                        (stepper.DIAG_IS_MOVING, abs(self.vel) > vel_thresh),
+                        (stepper.DIAG_AT_CURRENT_LIMIT, self.at_current_limit),
+                        (stepper.DIAG_IS_MG_ACCELERATING, abs(self.accel) > 0),
+                        (stepper.DIAG_IS_MG_MOVING, abs(self.vel) > 0),
+                        (stepper.DIAG_IN_GUARDED_EVENT, self.in_guarded_event),
+                        (stepper.DIAG_IN_SAFETY_EVENT, self.runstop_on),
+                        (stepper.DIAG_WAITING_ON_SYNC, self.pending is not None)]:
+            if on:
+                diag |= bit
+        err = self.x_target - x if self.mode in POS_MODES else 0.0
+        return bytearray(struct.pack('<BBfdffIIfI', reply_id, self.mode, self.current / A_PER_EFFORT, x, self.vel, err, diag,
+                                     self.t_us, 0.0, self.guarded_event & 0xFFFFFFFF))
+
+
+class SimPimu:
+    """A simulated Pimu: the IMU, power, cliff sensors, runstop and the motor sync line"""
+    def __init__(self, sim):
+        self.sim = sim
+        self.params = sim.params
+        self.runstop_event = False
+        self.cliff_event = False
+        self.fan_on = False
+        self.buzzer_on = False
+        self.heading = 0.0
+        self.gz = 0.0
+        self.bump_event_cnt = 0
+
+    def rpc(self, data, device):
+        r = data[0] + 1
+        if data[0] == pimu.RPC_GET_PIMU_STATUS:
+            return self.pack_status(r)
+        if data[0] == pimu.RPC_SET_PIMU_TRIGGER:
+            t = struct.unpack_from('<I', data, 1)[0]
+            if t & pimu.TRIGGER_RUNSTOP_RESET:
+                self.runstop_event = False
+            if t & pimu.TRIGGER_RUNSTOP_ON:
+                self.runstop_event = True
+            if t & pimu.TRIGGER_CLIFF_EVENT_RESET:
+                self.cliff_event = False
+            if t & pimu.TRIGGER_FAN_ON:
+                self.fan_on = True
+            if t & pimu.TRIGGER_FAN_OFF:
+                self.fan_on = False
+            if t & pimu.TRIGGER_BUZZER_ON:
+                self.buzzer_on = True
+            if t & pimu.TRIGGER_BUZZER_OFF:
+                self.buzzer_on = False
+            if t & pimu.TRIGGER_IMU_RESET:
+                self.heading = 0.0
+            return bytearray(struct.pack('<BI', r, t))
+        if data[0] == pimu.RPC_SET_MOTOR_SYNC:
+            for s in self.sim.steppers.values():
+                s.sync()
+        elif data[0] == pimu.RPC_GET_PIMU_BOARD_INFO:
+            return _board_info(r, device, 'Pimu')
+        return bytearray([r])
+
+    def step(self, dt):
+        base = self.sim.base_geometry
+        if base is not None:
+            l = self.sim.steppers['/dev/hello-motor-left-wheel']
+            r = self.sim.steppers['/dev/hello-motor-right-wheel']
+            self.gz = (r.vel - l.vel) * base[0] / base[1]
+            self.heading = math.atan2(math.sin(self.heading + self.gz * dt), math.cos(self.heading + self.gz * dt))
+
+    def pack_status(self, reply_id):
+        p = self.params
+        current = p['current']['idle_A'] + sum([abs(s.current) for s in self.sim.steppers.values()])
+        voltage = p['voltage_V'] - p['current']['ohms'] * current
+        state = 0
+        for bit, on in [(pimu.STATE_RUNSTOP_EVENT, self.runstop_event), (pimu.STATE_CLIFF_EVENT, self.cliff_event),
+                        (pimu.STATE_FAN_ON, self.fan_on), (pimu.STATE_BUZZER_ON, self.buzzer_on)]:
+            if on:
+                state |= bit
+        h = math.degrees(self.heading)
+        imu = struct.pack('<17fI', 0.0, 0.0, GRAVITY, 0.0, 0.0, self.gz, 0.0, 0.0, 0.0, 0.0, 0.0, h,
+                          math.cos(self.heading / 2), 0.0, 0.0, math.sin(self.heading / 2), 0.0, self.sim.t_us)
+        # Raw ADC readings, as inverted by Pimu.get_voltage, get_current and get_temp
+        raw = struct.pack('<3f4fIIHf', voltage * 1024 / 20.0, current * 0.408 * 1024 / 3.3, (p['temp_C'] * 19.5 + 400) * 1024 / 3300.0,
+                          0.0, 0.0, 0.0, 0.0, state, self.sim.t_us, self.bump_event_cnt, 0.0)
+        return bytearray([reply_id]) + bytearray(imu) + bytearray(raw)
+
+
+class SimWacc:
+    """A simulated Wacc: the accelerometer at rest and the digital IO"""
+    def __init__(self, sim):
+        self.sim = sim
+        self.d = [0, 0, 0, 0]
+        self.a0 = 0
+        self.single_tap_count = 0
+
+    def rpc(self, data, device):
+        r = data[0] + 1
+        if data[0] == wacc.RPC_GET_WACC_STATUS:
+            return bytearray(struct.pack('<B3fh4BIIII', r, 0.0, 0.0, GRAVITY, self.a0, self.d[0], self.d[1], self.d[2], self.d[3],
+                                         self.single_tap_count, 0, self.sim.t_us, 0))
+        if data[0] == wacc.RPC_SET_WACC_COMMAND:
+            self.d[2], self.d[3] = struct.unpack_from('<BB', data, len(data) - 6) #Custom command data comes first
+        elif data[0] == wacc.RPC_GET_WACC_BOARD_INFO:
+            return _board_info(r, device, 'Wacc')
+        return bytearray([r])
+
+
+class SimDynamixelBus(dxl_sim.DynamixelSimBus):
+    """A DynamixelSimBus whose motion model runs on the clock of a RobotSim"""
+    def __init__(self, clock, **kwargs):
+        self.clock = clock
+        dxl_sim.DynamixelSimBus.__init__(self, realtime=True, **kwargs)
+
+    def now(self):
+        return self.clock()
+
+
+class RobotSim:
+    """
+    Simulated hardware for all the boards of a Robot (see module docstring)
+    Parameters are from robot_sim
+    """
+    def __init__(self):
+        self.params = RobotParams.get_params()[1]['robot_sim']
+        self.time_scale = self.params['time_scale']
+        self.lock = threading.RLock()
+        self.logger = logging.getLogger('robot_sim')
+        self.ts_start = time.time()
+        self.t_last = 0.0
+        self.t_us = 0
+        self.steppers = dict([(usb, SimStepper(usb, self.params)) for usb in STEPPER_USBS])
+        self.pimu = SimPimu(self)
+        self.wacc = SimWacc(self)
+        self.boards = dict(self.steppers, **{PIMU_USB: self.pimu, WACC_USB: self.wacc})
+        self.buses = {}
+        self.base_geometry = None
+        self.robot = None
+        self.status = {'time_s': 0.0, 'n_rpc': dict([(usb, 0) for usb in self.boards])}
+
+    # ###########  Robot #############
+
+    def make_robot(self):
+        """A Robot whose hardware is this sim. Call startup() on it as for any Robot"""
+        import stretch_body.robot as robot #Not at module level, as the Robot uses this module
+        self.register()
+        r = robot.Robot()
+        r.sim = self
+        return self.attach(r)
+
+    def register(self):
+        """Route the devices created from here on to the sim (by their usb names)"""
+        for usb in self.boards:
+            transport.register_rpc_backend(usb, self)
+        robot_params = RobotParams.get_params()[1]
+        m = self.params['dxl_stop_margin_t']
+        for name, p in robot_params.items():
+            if isinstance(p, dict) and 'usb_name' in p and 'id' in p:
+                usb = p['usb_name']
+                if usb not in self.buses:
+                    self.buses[usb] = SimDynamixelBus(self.get_time, baud=p.get('baud', 57600))
+                stops = [p['range_t'][0] - m, p['range_t'][1] + m] if 'range_t' in p else None
+                offset = m if self.params['calibrated'] and p.get('req_calibration') else 0
+                servo = self.buses[usb].add_servo(p['id'], baud=p.get('baud', 57600), pos_ticks=p.get('zero_t', 0) - offset, hard_stops=stops)
+                if offset: # The first hard stop reads zero, as after homing
+                    servo.set_reg(XL430_ADDR_HOMING_OFFSET, offset)
+                    servo.table[XL430_ADDR_HELLO_CALIBRATED] = 1
+                    servo.update_present()
+        for usb, bus in self.buses.items():
+            dxl_sim.register_sim_bus(usb, bus)
+        return self
+
+    def attach(self, robot):
+        """Place the hard stops and starting positions of the steppers, in joint units of robot"""
+        self.robot = robot
+        with self.lock:
+            m = self.params['stop_margin_m']
+            for joint in [robot.lift, robot.arm]:
+                s = self.steppers[joint.motor.usb]
+                r = joint.params['range_m']
+                s.stops = [joint.translate_to_motor_rad(r[0] - m), joint.translate_to_motor_rad(r[1] + m)]
+                s.pos = s.x_target = joint.translate_to_motor_rad(self.params['initial_pos'][joint.name])
+                s.pos_calibrated = bool(self.params['calibrated'])
+            self.base_geometry = (robot.base.meters_per_motor_rad, robot.base.wheel_separation_m)
+        return robot
+
+    def close(self):
+        for usb in self.boards:
+            if transport.rpc_backends.get(usb) is self:
+                transport.unregister_rpc_backend(usb)
+        for usb in self.buses:
+            dxl_sim.unregister_sim_bus(usb)
+        self.buses = {}
+
+    # ###########  Clock #############
+
+    def get_time(self):
+        """Sim time (s), time_scale times real time since the sim was created"""
+        return (time.time() - self.ts_start) * self.time_scale
+
+    def update(self):
+        """Advance the boards to the current sim time"""
+        with self.lock:
+            t = self.get_time()
+            dt = t - self.t_last
+            n = int(math.ceil(dt / self.params['step_s']))
+            for i in range(n):
+                for s in self.steppers.values():
+                    s.runstop_on = self.pimu.runstop_event and bool(s.config & stepper.CONFIG_ENABLE_RUNSTOP)
+                    s.step(dt / n)
+                self.pimu.step(dt / n)
+            self.t_last = t
+            self.t_us = int(t * 1e6) & 0xFFFFFFFF
+            for s in self.steppers.values():
+                s.t_us = self.t_us
+            self.status['time_s'] = t
+
+    # ###########  Sim controls #############
+
+    def set_runstop(self, on=True):
+        """Press (or release) the runstop button"""
+        with self.lock:
+            self.pimu.runstop_event = on
+
+    def get_stepper(self, usb):
+        return self.steppers[usb]
+
+    def get_servo(self, name):
+        p = RobotParams.get_params()[1][name]
+        return self.buses[p['usb_name']].get_servo(p['id'])
+
+    # ###########  Transport backend #############
+
+    def step_rpc(self, transport, rpc, reply_callback):
+        """Handle an RPC of a device Transport (see transport.rpc_backends)"""
+        ts = time.time()
+        with self.lock:
+            self.update()
+            self.status['n_rpc'][transport.usb] += 1
+            reply = self.boards[transport.usb].rpc(bytearray(rpc), getattr(reply_callback, '__self__', None))
+        dt = self.params['rpc_time_s'] - (time.time() - ts)
+        if dt > 0:
+            time.sleep(dt)
+        reply_callback(reply)
+
+    def pretty_print(self):
+        print('----- Robot Sim ------ ')
+        print('Sim time (s) %.3f at %.1fx' % (self.status['time_s'], self.time_scale))
+        for usb in sorted(self.boards):
+            print('%s RPCs %d' % (usb, self.status['n_rpc'][usb]))
+        for usb in STEPPER_USBS:
+            s = self.steppers[usb]
+            print('%s pos %.3f vel %.3f current %.2f mode %d' % (usb, s.get_pos(), s.vel, s.current, s.mode))
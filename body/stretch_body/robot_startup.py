@@ -0,0 +1,163 @@
+from __future__ import print_function
+import threading
+import time
+
+from stretch_body.device import Device
+import stretch_body.profiler as profiler
+
+
+def get_ports(device):
+    """Ports (usb names) of a device, found on the device and its steppers / motor"""
+    ports = set()
+    for d in [device] + [getattr(device, a) for a in ['motor', 'left_wheel', 'right_wheel'] if hasattr(device, a)]:
+        usb = getattr(d, 'usb', None)
+        if usb is None and hasattr(d, 'transport'):
+            usb = getattr(d.transport, 'usb', None)
+        if usb is not None:
+            ports.add(usb)
+    return ports
+
+
+def get_jobs(devices):
+    """
+    Group the devices (dict of name: device) that share a port
+    Returns lists of device names. The devices of a list must start one after the other
+    """
+    jobs = []
+    for name, device in devices.items():
+        ports = get_ports(device)
+        shared = [j for j in jobs if j[1] & ports]
+        job = [[name], set(ports)]
+        for j in shared:
+            job[0] = j[0] + job[0]
+            job[1] |= j[1]
+            jobs.remove(j)
+        jobs.append(job)
+    return [j[0] for j in jobs]
+
+
+def start_devices(devices, parallel=True, max_workers=8, timeout=None, logger=None):
+    """
+    Call startup() on each device (dict of name: device), concurrently for devices on independent ports
+    A device that returns False, raises, or is still starting after timeout (s) fails without holding up the others
+    When starting in parallel, devices not yet started at the timeout are not started
+    Returns the per device report: start, end, duration (s from the call), success, error and timed_out
+    (still starting at the timeout. The rest of the report is updated when it completes)
+    """
+    status = dict([(name, {'start': None, 'end': None, 'duration': None, 'success': False, 'error': None, 'timed_out': False})
+                   for name in devices])
+    jobs = get_jobs(devices) if parallel else [[name] for name in devices]
+    lock = threading.Lock()
+    ts = time.time()
+
+    def start(name):
+        s = status[name]
+        s['start'] = time.time() - ts
+        success, error = False, None
+        try:
+            with profiler.span('startup.%s' % name):
+                success = bool(devices[name].startup())
+            if not success:
+                error = 'startup failed'
+        except Exception as e:
+            error = '%s: %s' % (type(e).__name__, str(e))
+            if logger is not None:
+                logger.error('Failed to start %s: %s' % (name, error))
+        with lock: #Set together, so the timeout check sees the device either starting or done
+            s['success'], s['error'] = success, error
+            s['end'] = time.time() - ts
+            s['duration'] = s['end'] - s['start']
+            late = s['timed_out']
+        if late and logger is not None: #Reported as timed out, and left alone by the Robot until now
+            logger.warning('Startup of %s completed after the timeout (%s)' % (name, 'OK' if success else 'FAILED: %s' % error))
+
+    deadline = ts + timeout if parallel and timeout is not None else None
+
+    def worker():
+        while True:
+            with lock:
+                if not len(jobs):
+                    return
+                job = jobs.pop(0)
+            for name in job:
+                if deadline is not None and time.time() > deadline: #Reported as not started: left alone
+                    break
+                start(name)
+
+    if not parallel:
+        worker()
+    else:
+        threads = [threading.Thread(target=worker) for i in range(max(1, min(max_workers, len(jobs))))]
+        for t in threads:
+            t.daemon = True #A device stuck past the timeout does not keep the process alive
+            t.start()
+        for t in threads:
+            t.join(None if timeout is None else max(0.0, ts + timeout - time.time()))
+    for name in devices:
+        with lock:
+            s = status[name]
+            incomplete = s['end'] is None
+            if incomplete:
+                s['timed_out'] = s['start'] is not None
+                s['error'] = 'timeout' if s['timed_out'] else 'not started'
+        if incomplete and logger is not None:
+            logger.error('Startup of %s did not complete within %.1fs' % (name, timeout))
+    status['total'] = {'duration': time.time() - ts, 'parallel': parallel,
+                       'success': all([status[n]['success'] for n in devices])}
+    return status
+
+
+class RobotStartup(Device):
+    """
+    Start the robot's devices concurrently
+
+    Devices on independent ports (the Pimu, the Wacc, each stepper board and each Dynamixel chain) start
+    in a pool of threads, so bring-up takes about as long as the slowest device rather than the sum of them.
+    Devices that share a port start one after the other. Set in the robot_startup params:
+
+        robot_startup:
+          parallel: 1        #0: start the devices one at a time
+          max_workers: 8     #Threads in the pool
+          timeout_s: 30.0    #Devices not started by then are reported as failed
+
+    A device that fails to start, raises, or times out is reported and logged, and the others start as usual.
+    A device that times out is still starting in its thread: until its startup() returns, is_started() is False, and
+    the Robot doesn't pull its status or push its commands, so its port is left to the startup.
+    """
+    def __init__(self, robot):
+        Device.__init__(self, name='robot_startup')
+        self.robot = robot
+        self.status = {}
+
+    def start_devices(self):
+        """
+        Start the Robot devices. Blocking.
+        Returns the per device timing report (see status)
+        """
+        devices = dict([(k, d) for k, d in self.robot.devices.items() if d is not None])
+        self.status = start_devices(devices, parallel=bool(self.params['parallel']), max_workers=self.params['max_workers'],
+                                    timeout=self.params['timeout_s'], logger=self.logger)
+        for name in devices:
+            self.logger.debug('Startup of %s: %s in %.3fs' % (name, 'OK' if self.status[name]['success'] else 'FAILED',
+                                                               self.status[name]['duration'] or 0.0))
+        return self.status
+
+    def is_started(self, name):
+        """False if the startup() of device name hasn't completed (eg, still running past the timeout)"""
+        s = self.status.get(name)
+        return s is None or s['end'] is not None
+
+    def pretty_print(self):
+        print('----- Robot Startup ------ ')
+        for name in self.status:
+            if name == 'total':
+                continue
+            s = self.status[name]
+            if s['end'] is None:
+                print('%-12s %s' % (name, s['error']))
+            else:
+                print('%-12s start %6.2fs  end %6.2fs  duration %6.2fs  %s' % (name, s['start'], s['end'], s['duration'],
+                                                                           'OK' if s['success'] else 'FAILED (%s)' % s['error']))
+        if 'total' in self.status:
+            print('Total: %.2fs %s%s' % (self.status['total']['duration'], 'OK' if self.status['total']['success'] else 'FAILED',
+                                         '' if self.status['total']['parallel'] else ' (serial)'))
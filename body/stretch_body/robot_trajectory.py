@@ -0,0 +1,274 @@
+from __future__ import print_function
+import threading
+import time
+import numpy as np
+
+from stretch_body.device import Device
+from stretch_body.stepper import MODE_POS_TRAJ_INCR
+from stretch_body.trajectory import Spline, StepperJointAdapter, TrackingError
+
+
+class RobotTrajectory(Device):
+    """
+    Execute one time-synchronized trajectory across any subset of the robot's joints
+
+    Joints: lift, arm (m), base_translate (m), base_rotate (rad), head_pan, head_tilt, wrist_yaw (rad)
+    and stretch_gripper (pct). Base motion is relative to the pose at the start of execution.
+
+    Each joint's waypoints are splined and sampled at rate_hz on a common time base. Every tick,
+    the stepper increments are pushed (held by the steppers until the sync pulse) and the Dynamixel goals
+    are staged with REG_WRITE. The tick is then fired all at once: Pimu.trigger_motor_sync for the steppers and
+    a broadcast ACTION on each Dynamixel chain. The time from the start of firing to each joint's fire call
+    returning is recorded as its issue latency, and ticks with a latency over max_issue_latency_ms are counted.
+    This is host side latency only: when each joint starts to move after its call also depends on the bus,
+    and isn't measured.
+
+    Steppers not in sync mode start on their own push, so firing doesn't synchronize them.
+    The sent setpoints keep each joint's stiffness, feedforward and contact thresholds (see StepperJointAdapter).
+    """
+    def __init__(self, robot):
+        Device.__init__(self, name='robot_trajectory')
+        self.robot = robot
+        self.lock = threading.RLock()
+        self.thread = None
+        self.shutdown_flag = threading.Event()
+        self.status = {'active': False, 'n_ticks': 0, 'n_late': 0, 'n_issue_latency_exceeded': 0, 'issue_latency_ms': {}, 'tracking_error': {}}
+        self.tracking_error = {}
+        self.offset = {}
+        self.plan = None
+
+    # ###########  Joints #############
+
+    def get_stepper_joint(self, name):
+        r = self.robot
+        if name in ['lift', 'arm']:
+            return StepperJointAdapter.from_joint(getattr(r, name))
+        if name == 'base_translate':
+            return StepperJointAdapter.from_base(r.base, rotate=False)
+        if name == 'base_rotate':
+            return StepperJointAdapter.from_base(r.base, rotate=True)
+        return None
+
+    def get_dynamixel_joint(self, name):
+        """Returns (chain, motor), or None"""
+        for chain in [self.robot.head, self.robot.end_of_arm]:
+            if chain is not None and chain.get_motor(name) is not None:
+                return chain, chain.get_motor(name)
+        return None
+
+    # ###########  Trajectory interface #############
+
+    def execute(self, trajectory, blocking=False):
+        """
+        trajectory: dict of joint name to waypoints, eg {'lift': {'t': [0, 2.0], 'x': [0.5, 0.6]}, 'wrist_yaw': {...}}
+                    Each joint may also give 'v' and 'a' (see Spline). Times are from the start of execution.
+                    A joint whose waypoints start after t=0 starts from its current position.
+        blocking: wait for the trajectory to finish before returning
+        Returns False if the trajectory can't be executed
+        """
+        if self.is_active():
+            self.logger.warning('Trajectory already executing. Stop it first.')
+            return False
+        steppers = {}
+        dxls = {}
+        for name in trajectory:
+            j = self.get_stepper_joint(name)
+            if j is not None:
+                steppers[name] = j
+                continue
+            j = self.get_dynamixel_joint(name)
+            if j is not None:
+                dxls[name] = j
+                continue
+            self.logger.error('Unknown joint %s in trajectory' % name)
+            return False
+
+        # Starting positions, for waypoints that begin after t=0
+        x0 = {}
+        self.offset = {}
+        for name, j in steppers.items():
+            x0[name] = j.measure()[0]
+            if j.limits is None: #Base motion is relative
+                self.offset[name] = x0[name]
+                x0[name] = 0.0
+        for name, (chain, m) in dxls.items():
+            x0[name] = m.status['pos_pct'] if 'pos_pct' in m.status else m.status['pos']
+        try:
+            splines = dict([(name, self._spline(trajectory[name], x0[name])) for name in trajectory])
+        except ValueError as e:
+            self.logger.error('Invalid trajectory: %s' % str(e))
+            return False
+
+        duration = max([s.t[-1] for s in splines.values()])
+        ts = np.arange(0, duration + 1e-9, 1.0 / self.params['rate_hz'])
+        if ts[-1] < duration:
+            ts = np.append(ts, duration)
+        samples = {}
+        for name in splines:
+            xs, vs, acs = splines[name].evaluate(ts)
+            if name in steppers and steppers[name].limits is not None:
+                lim = steppers[name].limits()
+                xs = np.clip(xs, lim[0], lim[1])
+            samples[name] = (xs, vs)
+        self.plan = {'ts_start': time.time(), 'ts': ts, 'x': dict([(name, samples[name][0] + self.offset.get(name, 0.0)) for name in samples])}
+        if self.robot.params['use_collision_manager'] and self.robot.collision.params['predictive']['enabled']:
+            self.robot.collision.step() #Tighten the collision limits over the trajectory before it starts
+
+        for m in set([m for j in steppers.values() for m, sign in j.motors]):
+            if not m.gains['enable_sync_mode']:
+                self.logger.warning('%s is not in sync mode. It will not be synchronized with the other joints.' % m.name)
+        with self.lock:
+            self.status = {'active': True, 'n_ticks': 0, 'n_late': 0, 'n_issue_latency_exceeded': 0,
+                           'issue_latency_ms': dict([(name, {'last': 0.0, 'max': 0.0, 'mean': 0.0}) for name in trajectory]),
+                           'tracking_error': {}}
+            self.tracking_error = dict([(name, TrackingError()) for name in trajectory])
+            for name in trajectory:
+                self.status['tracking_error'][name] = self.tracking_error[name].status
+            self.shutdown_flag.clear()
+            self.thread = threading.Thread(target=self._run, args=(ts, samples, steppers, dxls, x0))
+            self.thread.daemon = True
+            self.thread.start()
+        if blocking:
+            self.wait()
+        return True
+
+    def _spline(self, w, x0):
+        t, x = list(w['t']), list(w['x'])
+        v = None if w.get('v') is None else list(w['v'])
+        a = None if w.get('a') is None else list(w['a'])
+        if t[0] > 0:
+            t.insert(0, 0.0)
+            x.insert(0, x0)
+            if v is not None:
+                v.insert(0, 0.0)
+            if a is not None:
+                a.insert(0, 0.0)
+        return Spline(t, x, v, a)
+
+    def predict(self, name, ts):
+        """
+        Planned position of joint name at the absolute times ts (eg, for predictive collision checking)
+        Returns None if the joint isn't part of the executing trajectory
+        """
+        plan = self.plan
+        if plan is None or name not in plan['x']:
+            return None
+        return np.interp(np.asarray(ts) - plan['ts_start'], plan['ts'], plan['x'][name])
+
+    def is_active(self):
+        with self.lock:
+            return self.thread is not None and self.thread.is_alive()
+
+    def wait(self, timeout=None):
+        """Block until the trajectory has executed. Returns False on timeout"""
+        if self.thread is not None:
+            self.thread.join(timeout)
+        return not self.is_active()
+
+    def stop(self):
+        """Stop streaming. Joints hold the last setpoint sent"""
+        self.shutdown_flag.set()
+        self.wait()
+
+    def pretty_print(self):
+        print('----- Robot Trajectory ------ ')
+        print('Active', self.status['active'])
+        print('Ticks', self.status['n_ticks'])
+        print('Late ticks', self.status['n_late'])
+        print('Ticks over max issue latency (%.1f ms)' % self.params['max_issue_latency_ms'], self.status['n_issue_latency_exceeded'])
+        for name in self.status['issue_latency_ms']:
+            s = self.status['issue_latency_ms'][name]
+            e = self.status['tracking_error'][name]
+            print('%-16s issue latency (ms) last %6.2f max %6.2f mean %6.2f | tracking error last %f max %f rms %f' % (name, s['last'], s['max'], s['mean'],
+                                                                                                                      e['last'], e['max'], e['rms']))
+
+    # ###########  Streaming #############
+
+    def _run(self, ts, samples, steppers, dxls, x0):
+        r = self.robot
+        rate = self.params['rate_hz']
+        motors = list(set([m for j in steppers.values() for m, sign in j.motors]))
+        args = {} #Per motor, from the first joint driving it (base translate and rotate share the wheels)
+        limit_motion = {}
+        for j in steppers.values():
+            for (m, sign), a in zip(j.motors, j.get_command_args()):
+                args.setdefault(m, a)
+                limit_motion.setdefault(m, j.limit_motion)
+        chains = list(set([c for c, m in dxls.values()]))
+        x_sent = dict([(name, x0[name]) for name in steppers])
+        for m in motors:
+            m.set_command(mode=MODE_POS_TRAJ_INCR, x_des=0, **args[m]) #As enable_pos_traj_incr, keeping the feedforward
+        for c, m in dxls.values():
+            m.set_motion_params(m.params['motion']['max']['vel'], m.params['motion']['max']['accel'])
+        ts_start = time.time()
+        self.plan['ts_start'] = ts_start
+        k = 0
+        while not self.shutdown_flag.is_set() and k < len(ts):
+            with r.lock: #Keep other pushes from triggering the sync mid tick
+                # Stage
+                incr = dict([(m, [0.0, 0.0, 0.0]) for m in motors])
+                for name, j in steppers.items():
+                    x, v = samples[name][0][k], samples[name][1][k]
+                    dx = x - x_sent[name]
+                    x_sent[name] = x
+                    for m, sign in j.motors:
+                        incr[m][0] += sign * j.to_motor_rad(dx)
+                        incr[m][1] += abs(j.to_motor_rad(v)) * (1 + self.params['vel_margin']) + abs(j.to_motor_rad(dx)) * rate
+                        incr[m][2] += abs(j.to_motor_rad(j.max_accel))
+                for m in motors:
+                    v_mr, a_mr = incr[m][1], incr[m][2]
+                    if limit_motion[m] is not None:
+                        v_mr, a_mr = limit_motion[m](v_mr, a_mr)
+                    m.set_command(mode=MODE_POS_TRAJ_INCR, x_des=incr[m][0], v_des=v_mr, a_des=a_mr, **args[m])
+                    m.push_command()
+                for name, (c, m) in dxls.items():
+                    x = samples[name][0][k]
+                    m.stage_move_to(m.pct_to_world_rad(x) if hasattr(m, 'pct_to_world_rad') else x)
+                # Fire
+                fire = {}
+                t_fire = time.time()
+                if len(motors):
+                    r.pimu.trigger_motor_sync()
+                    t = time.time()
+                    for name in steppers:
+                        fire[name] = t
+                for c in chains:
+                    c.action()
+                    t = time.time()
+                    for name, (cc, m) in dxls.items():
+                        if cc is c:
+                            fire[name] = t
+            self._update(t_fire, fire, ts_start, ts, samples, steppers, dxls, x0)
+            k_next = int((time.time() - ts_start) * rate) + 1
+            if k_next > k + 1:
+                self.status['n_late'] += 1
+            k = max(k + 1, min(k_next, len(ts) - 1)) #Skip ahead if late. Increments still sum to the spline
+            dt = ts_start + k / float(rate) - time.time()
+            if dt > 0:
+                time.sleep(dt)
+        for c, m in dxls.values():
+            m.set_motion_params()
+        with self.lock:
+            self.plan = None
+            self.status['active'] = False
+
+    def _update(self, t_fire, fire, ts_start, ts, samples, steppers, dxls, x0):
+        self.status['n_ticks'] += 1
+        exceeded = False
+        for name in fire:
+            s = self.status['issue_latency_ms'][name]
+            s['last'] = (fire[name] - t_fire) * 1000.0
+            s['max'] = max(s['max'], s['last'])
+            s['mean'] = s['mean'] + (s['last'] - s['mean']) / self.status['n_ticks']
+            exceeded = exceeded or s['last'] > self.params['max_issue_latency_ms']
+        if exceeded:
+            self.status['n_issue_latency_exceeded'] += 1
+        for name in samples:
+            if name in steppers:
+                x, ts_meas = steppers[name].measure()
+                x = x - self.offset.get(name, 0.0)
+            else:
+                m = dxls[name][1]
+                x, ts_meas = m.status['pos_pct'] if 'pos_pct' in m.status else m.status['pos'], m.status['timestamp_pc']
+            if ts_meas and ts_meas >= ts_start:
+                self.tracking_error[name].add(float(np.interp(ts_meas - ts_start, ts, samples[name][0])) - x)
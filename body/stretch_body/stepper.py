@@ -222,10 +222,18 @@ class Stepper(Device):
         print('Firmware version:', self.board_info['firmware_version'])
 
     def step_sentry(self, robot):
-        if self.hw_valid and self.robot_params['robot_sentry']['stepper_is_moving_filter']:
+        if self.robot_params['robot_sentry']['stepper_is_moving_filter']:
+            self.step_is_moving_filter(self.status['is_moving'])
+
+    def step_is_moving_filter(self, is_moving):
+        """Majority vote over the recent is_moving samples. Returns True if is_moving_filtered changed"""
+        if self.hw_valid:
+            was_moving = self.status['is_moving_filtered']
             self.is_moving_history.pop(0)
-            self.is_moving_history.append(self.status['is_moving'])
+            self.is_moving_history.append(is_moving)
             self.status['is_moving_filtered'] = max(set(self.is_moving_history), key=self.is_moving_history.count)
+            return self.status['is_moving_filtered'] != was_moving
+        return False
     # ###########################################################################
     # ###########################################################################
 
@@ -395,11 +403,11 @@ class Stepper(Device):
 
 
     def wait_until_at_setpoint(self,timeout=15.0):
-        ts = time.time()
-        self.pull_status()
-        while not self.status['near_pos_setpoint'] and time.time() - ts < timeout:
-            time.sleep(0.1)
-            self.pull_status()
+        """
+        Block until the motor reaches the commanded position (or timeout)
+        Returns False on timeout
+        """
+        return self.wait_until(lambda: self.status['near_pos_setpoint'] and not self.status['waiting_on_sync'], timeout=timeout)
 
     def current_to_effort(self,i_A):
         mA_per_tick = (3300 / 255) / (10 * 0.1)
@@ -566,6 +574,7 @@ class Stepper(Device):
             self.status['in_guarded_event'] = self.status['diag'] & DIAG_IN_GUARDED_EVENT > 0
             self.status['in_safety_event'] = self.status['diag'] & DIAG_IN_SAFETY_EVENT > 0
             self.status['waiting_on_sync'] = self.status['diag'] & DIAG_WAITING_ON_SYNC > 0
+            self.notify_status()
             return sidx
 
 
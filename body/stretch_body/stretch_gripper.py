@@ -76,8 +76,13 @@ class StretchGripper(DynamixelHelloXL430):
         commanded current. The gripper's spring design allows it to retain its grasp despite the backoff.
         """
         DynamixelHelloXL430.step_sentry(self, robot)
-        if self.hw_valid and self.robot_params['robot_sentry']['stretch_gripper_overload'] and not self.is_homing:
-            if self.status['stall_overload']:
-                if self.status['effort'] < 0: #Only backoff in open direction
-                    self.logger.debug('Backoff at stall overload')
-                    self.move_by(self.params['stall_backoff'])
+        if self.robot_params['robot_sentry']['stretch_gripper_overload']:
+            self.step_stall_backoff(self.status['stall_overload'], self.status['effort'])
+
+    def step_stall_backoff(self, stall_overload, effort):
+        """Back off the grasp if stall_overload. Returns True if it backed off"""
+        if self.hw_valid and not self.is_homing and stall_overload and effort < 0: #Only backoff in open direction
+            self.logger.debug('Backoff at stall overload')
+            self.move_by(self.params['stall_backoff'])
+            return True
+        return False
@@ -0,0 +1,361 @@
+"""
+Binary telemetry of the Robot status
+
+The TelemetryRecorder samples a nested status dict (eg, Robot.status) from a background thread, and appends each
+sample as a row to chunked column files:
+
+    <dir>/schema.json       Columns, chunk size and metadata (written at start)
+    <dir>/index.json        Rows and time range of each chunk (rewritten as each chunk is closed, and at stop)
+    <dir>/chunk_000000.npy  Chunk of chunk_rows rows, as a (n_columns, chunk_rows) float64 array.
+                            Each column is contiguous, so a column range is a single slice.
+    <dir>/chunk_000000.npz  A closed chunk, compressed (if compress is set). Chunks are compressed by a
+                            separate thread, so sampling isn't held up, and replace the .npy once written
+
+The schema is made once, from the first sample: each numeric field of the status (including items of lists of
+numbers) is a column, named by its path (eg, 'pimu.imu.ax', 'pimu.cliff_range.0'). Fields that aren't numbers
+(or are None) at the first sample aren't recorded. Column '_t' is the sample time.
+All values are stored as float64. The kind of each column ('b' bool, 'i' int, 'f' float) is kept in the schema.
+The open chunk is a memory mapped .npy file that rows are written into in place, so recording is a few
+dict lookups and one array write per sample.
+
+TelemetryReader reads a recording. Uncompressed chunks are memory mapped, so reading a column range only
+touches the rows read.
+"""
+from __future__ import print_function
+from stretch_body.device import Device
+import stretch_body.hello_utils as hello_utils
+import stretch_body.version as version
+import numpy as np
+import itertools
+import operator
+import threading
+import json
+import glob
+import time
+import os
+try:
+    import queue
+except ImportError: #Python 2
+    import Queue as queue
+
+SCHEMA_VERSION = 1
+
+
+def flatten_status(status, path=()):
+    """
+    The numeric fields of a nested status dict, as a list of (path, kind), in a fixed order
+    path: tuple of keys (and list indices) from the status root
+    """
+    fields = []
+    items = sorted(status.items(), key=lambda x: str(x[0])) if isinstance(status, dict) else enumerate(status)
+    for k, v in items:
+        if isinstance(v, (dict, list, tuple)):
+            fields = fields + flatten_status(v, path + (k,))
+        elif isinstance(v, (bool, np.bool_)):
+            fields.append((path + (k,), 'b'))
+        elif isinstance(v, (int, np.integer)):
+            fields.append((path + (k,), 'i'))
+        elif isinstance(v, (float, np.floating)):
+            fields.append((path + (k,), 'f'))
+    return fields
+
+
+def _make_getter(keys):
+    if len(keys) == 1:
+        k = keys[0]
+        return lambda d: (d[k],)
+    return operator.itemgetter(*keys)
+
+
+class StatusSampler:
+    """
+    Reads the fields of a schema from a status dict into a row
+
+    Fields are grouped by the dict (or list) they are in, so a row is read with one walk to each of these,
+    and one itemgetter call.
+    A group that can't be read (eg, a device status that has changed shape) is filled with NaN.
+    """
+    def __init__(self, fields):
+        self.n = len(fields)
+        self.groups = []
+        for path, kind in fields:
+            parent = path[:-1]
+            if not len(self.groups) or self.groups[-1][0] != parent:
+                self.groups.append((parent, []))
+            self.groups[-1][1].append(path[-1])
+        self.groups = [(parent, _make_getter(keys), len(keys)) for parent, keys in self.groups]
+
+    def sample(self, status):
+        """The fields of status, as a float64 array"""
+        parts = []
+        for parent, getter, n in self.groups:
+            try:
+                d = status
+                for k in parent:
+                    d = d[k]
+                parts.append(getter(d))
+            except (KeyError, IndexError, TypeError):
+                parts.append((np.nan,) * n)
+        values = itertools.chain.from_iterable(parts)
+        try:
+            return np.fromiter(values, dtype=np.float64, count=self.n)
+        except (ValueError, TypeError): #A field is no longer a number
+            return np.array([x if isinstance(x, (bool, int, float, np.number)) else np.nan for x in itertools.chain.from_iterable(parts)])
+
+
+class TelemetryRecorder(Device):
+    """
+    Record a status dict (eg, Robot.status) to binary column files at telemetry.rate_hz, from a background thread
+
+    status: nested status dict to record
+    path: directory to record to (default: a new directory under the log directory)
+    metadata: dict of user metadata (json serializable) to store in the schema
+    """
+    def __init__(self, status, path=None, metadata=None):
+        Device.__init__(self, 'telemetry')
+        self.status_source = status
+        if path is None:
+            path = hello_utils.get_stretch_directory(self.params['log_dir'] + '/') + 'telemetry_' + hello_utils.create_time_string()
+        self.path = path
+        self.metadata = {} if metadata is None else metadata
+        self.chunk_rows = int(self.params['chunk_rows'])
+        self.schema = None
+        self.sampler = None
+        self.chunk = None
+        self.chunk_id = 0
+        self.row = 0
+        self.index = []
+        self.thread = None
+        self.compress_queue = queue.Queue()
+        self.compress_thread = None
+        self.shutdown_flag = threading.Event()
+        self.lock = threading.Lock()
+        self.status = {'n_rows': 0, 'n_chunks': 0, 'n_columns': 0, 'n_late': 0, 'time_ms_last': 0.0, 'time_ms_max': 0.0, 'cpu_percent': 0.0}
+
+    # ###########  Device Methods #############
+
+    def startup(self, threaded=True):
+        """Make the schema from the current status, and start recording (from a background thread if threaded)"""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fields = [(('_t',), 'f')] + flatten_status(self.status_source)
+        self.sampler = StatusSampler(fields[1:])
+        self.schema = {'version': SCHEMA_VERSION,
+                       'columns': [{'name': '.'.join([str(k) for k in p]), 'kind': kind} for p, kind in fields],
+                       'chunk_rows': self.chunk_rows,
+                       'rate_hz': self.params['rate_hz'],
+                       'compress': self.params['compress'],
+                       'start_time': time.time(),
+                       'stretch_body_version': version.__version__,
+                       'metadata': self.metadata}
+        with open(os.path.join(self.path, 'schema.json'), 'w') as f:
+            json.dump(self.schema, f, indent=1)
+        self.status['n_columns'] = len(fields)
+        self._open_chunk()
+        if threaded:
+            self.shutdown_flag.clear()
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+        return True
+
+    def stop(self):
+        """Stop recording, close the open chunk, and wait for the closed chunks to be compressed"""
+        if self.thread is not None:
+            self.shutdown_flag.set()
+            self.thread.join(1)
+            self.thread = None
+        with self.lock:
+            if self.chunk is not None:
+                self._close_chunk()
+        if self.compress_thread is not None:
+            self.compress_queue.put(None)
+            self.compress_thread.join()
+            self.compress_thread = None
+
+    def pretty_print(self):
+        print('----- Telemetry Recorder ------ ')
+        print('Path', self.path)
+        print('Columns', self.status['n_columns'])
+        print('Rows', self.status['n_rows'])
+        print('Chunks', self.status['n_chunks'])
+        print('Late samples', self.status['n_late'])
+        print('Sample time (ms) last %.3f max %.3f' % (self.status['time_ms_last'], self.status['time_ms_max']))
+        print('CPU (%%) %.2f' % self.status['cpu_percent'])
+
+    # ###########  Recording #############
+
+    def step(self, t=None):
+        """Append a sample of the status as a row"""
+        ts = time.time()
+        t = ts if t is None else t
+        row = self.sampler.sample(self.status_source)
+        with self.lock:
+            if self.chunk is None:
+                return
+            self.chunk[0, self.row] = t
+            self.chunk[1:, self.row] = row
+            self.row += 1
+            self.status['n_rows'] += 1
+            if self.row == self.chunk_rows:
+                self._close_chunk()
+                self._open_chunk()
+        dt = (time.time() - ts) * 1000.0
+        self.status['time_ms_last'] = dt
+        self.status['time_ms_max'] = max(self.status['time_ms_max'], dt)
+
+    def _run(self):
+        period = 1.0 / self.params['rate_hz']
+        ts_next = time.time()
+        ts_cpu = time.time()
+        cpu = time.process_time() if hasattr(time, 'process_time') else time.clock()
+        while not self.shutdown_flag.is_set():
+            self.step()
+            ts_next = ts_next + period
+            now = time.time()
+            if now > ts_next:
+                self.status['n_late'] += 1
+                ts_next = now
+            if now - ts_cpu > 5.0: #Thread CPU is not available on all platforms: report the process CPU spent while recording
+                c = time.process_time() if hasattr(time, 'process_time') else time.clock()
+                self.status['cpu_percent'] = 100.0 * (c - cpu) / (now - ts_cpu)
+                cpu, ts_cpu = c, now
+            self.shutdown_flag.wait(ts_next - now)
+
+    def _chunk_file(self, chunk_id, ext):
+        return os.path.join(self.path, 'chunk_%06d.%s' % (chunk_id, ext))
+
+    def _open_chunk(self):
+        self.chunk = np.lib.format.open_memmap(self._chunk_file(self.chunk_id, 'npy'), mode='w+', dtype=np.float64,
+                                               shape=(len(self.schema['columns']), self.chunk_rows))
+        self.chunk[0, :] = np.nan
+        self.row = 0
+
+    def _close_chunk(self):
+        n = self.row
+        t = self.chunk[0, :n]
+        entry = {'chunk': self.chunk_id, 'n_rows': n, 't_start': float(t[0]) if n else None, 't_end': float(t[-1]) if n else None}
+        self.chunk.flush()
+        if self.params['compress']: #Compressing takes ~1s for a full chunk, so it is left to the compress thread
+            if self.compress_thread is None:
+                self.compress_thread = threading.Thread(target=self._run_compress)
+                self.compress_thread.daemon = True
+                self.compress_thread.start()
+            self.compress_queue.put((self.chunk_id, self.chunk, n))
+        self.chunk = None
+        self.index.append(entry)
+        self.chunk_id += 1
+        self.status['n_chunks'] = len(self.index)
+        with open(os.path.join(self.path, 'index.json'), 'w') as f:
+            json.dump({'chunks': self.index}, f, indent=1)
+
+
+    def _run_compress(self):
+        while True:
+            job = self.compress_queue.get()
+            if job is None:
+                return
+            chunk_id, chunk, n = job
+            fn = self._chunk_file(chunk_id, 'npy')
+            tmp = self._chunk_file(chunk_id, 'tmp.npz')
+            np.savez_compressed(tmp, data=np.array(chunk[:, :n]))
+            del chunk, job #Release the memory map before removing the file
+            os.rename(tmp, self._chunk_file(chunk_id, 'npz'))
+            os.remove(fn)
+
+
+class TelemetryReader:
+    """
+    Read a recording made by the TelemetryRecorder
+
+    read returns the rows of the columns requested. A range within a single uncompressed chunk is returned as a
+    view of the memory mapped file (no copy). Compressed chunks are loaded whole on first use.
+    Chunks missing from the index (eg, the open chunk of a recording that didn't stop cleanly) are recovered
+    from their sample times.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'schema.json')) as f:
+            self.schema = json.load(f)
+        self.columns = [c['name'] for c in self.schema['columns']]
+        self.kinds = dict([(c['name'], c['kind']) for c in self.schema['columns']])
+        self.column_index = dict([(c, i) for i, c in enumerate(self.columns)])
+        self.metadata = self.schema['metadata']
+        index = []
+        if os.path.isfile(os.path.join(path, 'index.json')):
+            with open(os.path.join(path, 'index.json')) as f:
+                index = json.load(f)['chunks']
+        n_rows = dict([(c['chunk'], c['n_rows']) for c in index])
+        self.chunks = []
+        self.loaded = {}
+        files = {}
+        for fn in sorted(glob.glob(os.path.join(path, 'chunk_*.np[yz]'))): #Sorted, so a chunk's .npz (once written) is used over its .npy
+            if not fn.endswith('.tmp.npz'):
+                files[int(os.path.basename(fn)[6:12])] = fn
+        for chunk_id, fn in sorted(files.items()):
+            if chunk_id not in n_rows:
+                t = self._load(fn)[0]
+                n_rows[chunk_id] = int(np.sum(~np.isnan(t)))
+            self.chunks.append((chunk_id, fn, n_rows[chunk_id]))
+        self.chunk_start = np.cumsum([0] + [c[2] for c in self.chunks])
+        self.n_rows = int(self.chunk_start[-1])
+
+    def _load(self, fn):
+        if fn not in self.loaded:
+            if fn.endswith('.npz'):
+                self.loaded[fn] = np.load(fn)['data']
+            else:
+                try:
+                    self.loaded[fn] = np.load(fn, mmap_mode='r')
+                except (IOError, OSError): #Compressed (and removed) since listed
+                    self.loaded[fn] = np.load(fn[:-1] + 'z')['data']
+        return self.loaded[fn]
+
+    def read(self, columns=None, start=0, stop=None):
+        """
+        Rows [start, stop) of the columns (list of names, or None for all)
+        Returns a dict of column name to float64 array
+        """
+        columns = self.columns if columns is None else columns
+        stop = self.n_rows if stop is None else min(stop, self.n_rows)
+        start = max(0, start)
+        idx = [self.column_index[c] for c in columns]
+        parts = []
+        for i, (chunk_id, fn, n) in enumerate(self.chunks):
+            c0 = self.chunk_start[i]
+            r0, r1 = max(start, c0) - c0, min(stop, c0 + n) - c0
+            if r1 <= r0:
+                continue
+            d = self._load(fn)
+            if len(idx) and idx == list(range(idx[0], idx[0] + len(idx))):
+                parts.append(d[idx[0]:idx[0] + len(idx), r0:r1])
+            else:
+                parts.append(d[idx, r0:r1])
+        if not len(parts):
+            data = np.zeros((len(idx), 0))
+        elif len(parts) == 1:
+            data = parts[0]
+        else:
+            data = np.concatenate(parts, axis=1)
+        return dict([(c, data[i]) for i, c in enumerate(columns)])
+
+    def get_row(self, i):
+        """All the columns of row i, as a float64 array"""
+        if i < 0 or i >= self.n_rows:
+            raise IndexError('Row %d of %d' % (i, self.n_rows))
+        c = int(np.searchsorted(self.chunk_start, i, side='right')) - 1
+        return self._load(self.chunks[c][1])[:, i - self.chunk_start[c]]
+
+    def column(self, name, start=0, stop=None):
+        return self.read([name], start, stop)[name]
+
+    def get_time(self, start=0, stop=None):
+        return self.column('_t', start, stop)
+
+    def find_row(self, t):
+        """Index of the first row sampled at or after time t"""
+        for i, (chunk_id, fn, n) in enumerate(self.chunks):
+            ts = self._load(fn)[0, :n]
+            if n and ts[-1] >= t:
+                return int(self.chunk_start[i] + np.searchsorted(ts, t))
+        return self.n_rows
@@ -0,0 +1,251 @@
+"""
+Replay of telemetry recordings (see telemetry.py) as the hardware of a Robot
+
+A TelemetryReplay stands in for the hardware of every Robot device, so a full Robot, with its status threads,
+monitor, sentry, collision models and odometry, runs on a recorded session without hardware:
+
+    replay = TelemetryReplay('/path/to/recording', speed=4.0)
+    robot = replay.make_robot()
+    robot.startup()
+    ...
+    robot.stop()
+    replay.close()
+
+* Pimu, Wacc and the steppers talk to the replay through their Transport (see transport.rpc_backends).
+  Status RPCs write the recorded status into the device's status dict. Other RPCs are captured as commands.
+* The Dynamixel chains run on a simulated bus (see dynamixel_sim.py), so their startup and commands work unmodified.
+  pull_status writes the recorded status, and the command methods of the servos are captured as they are called.
+
+Only the status of these hardware devices is replayed. What the Robot derives from them (eg, Lift position,
+base odometry) is computed again by the Robot, so changes to that code can be tested against recordings.
+
+The recording plays at speed times real time from the first status pull, or in stepped mode one row per step().
+Captured commands are in commands, as dicts of 't' (recording time), 'device', 'name' and 'data'.
+"""
+from __future__ import print_function
+from stretch_body.telemetry import TelemetryReader
+import stretch_body.transport as transport
+import stretch_body.dynamixel_sim as dxl_sim
+from stretch_body.robot_params import RobotParams
+import numpy as np
+import threading
+import logging
+import time
+
+TRANSPORT_USBS = ['/dev/hello-pimu', '/dev/hello-wacc', '/dev/hello-motor-lift', '/dev/hello-motor-arm',
+                  '/dev/hello-motor-left-wheel', '/dev/hello-motor-right-wheel']
+
+DXL_COMMANDS = ['move_to', 'move_by', 'set_motion_params', 'enable_torque', 'disable_torque', 'quick_stop',
+                'enable_pos', 'enable_pwm', 'set_pwm', 'mark_zero', 'reboot']
+
+
+def _find_path(status, target, path=()):
+    """Path of the dict target within the nested status dict (by identity), or None"""
+    for k, v in status.items():
+        if v is target:
+            return path + (k,)
+        if isinstance(v, dict):
+            p = _find_path(v, target, path + (k,))
+            if p is not None:
+                return p
+    return None
+
+
+class TelemetryReplay:
+    """
+    Replay a recording made by the TelemetryRecorder as the hardware of a Robot
+
+    path: directory of the recording
+    speed: replay speed, as a multiple of real time
+    stepped: if True, the replay advances one row per call to step() instead of with time
+    """
+    def __init__(self, path, speed=1.0, stepped=False):
+        self.reader = TelemetryReader(path)
+        if self.reader.n_rows == 0:
+            raise ValueError('Recording %s has no rows' % path)
+        self.t = np.array(self.reader.get_time())
+        self.speed = speed
+        self.stepped = stepped
+        self.row = 0
+        self.ts_start = None
+        self.robot = None
+        self.commands = []
+        self.writers = {}
+        self.paths = {}
+        self.dxl_usbs = []
+        self.lock = threading.RLock()
+        self.logger = logging.getLogger('telemetry_replay')
+        self.status = {'row': 0, 'n_rows': self.reader.n_rows, 'n_commands': 0, 'done': False}
+
+    # ###########  Robot #############
+
+    def make_robot(self):
+        """A Robot whose hardware is this replay. Call startup() on it as for any Robot"""
+        import stretch_body.robot as robot #Not at module level, as the Robot may use this module
+        self.register()
+        return self.attach(robot.Robot())
+
+    def register(self):
+        """Route the devices created from here on to the replay (by their usb names)"""
+        for usb in TRANSPORT_USBS:
+            transport.register_rpc_backend(usb, self)
+        robot_params = RobotParams.get_params()[1]
+        row = self.reader.get_row(0)
+        buses = {}
+        for name, p in robot_params.items():
+            if isinstance(p, dict) and 'usb_name' in p and 'id' in p:
+                usb = p['usb_name']
+                if usb not in buses:
+                    buses[usb] = dxl_sim.DynamixelSimBus(baud=p.get('baud', 57600), realtime=False)
+                pos_ticks = p.get('zero_t', 0)
+                for c in self.reader.columns:
+                    if c.endswith('.%s.pos_ticks' % name) and not np.isnan(row[self.reader.column_index[c]]):
+                        pos_ticks = int(row[self.reader.column_index[c]])
+                buses[usb].add_servo(p['id'], baud=p.get('baud', 57600), pos_ticks=pos_ticks)
+        for usb, bus in buses.items():
+            dxl_sim.register_sim_bus(usb, bus)
+        self.dxl_usbs = list(buses.keys())
+
+    def attach(self, robot):
+        """Replay the status of the Dynamixel chains of robot, and capture the commands to their servos"""
+        self.robot = robot
+        for name in ['head', 'end_of_arm']:
+            chain = getattr(robot, name)
+            chain.pull_status = lambda c=chain: self.pull_status(c)
+            for mk, m in chain.motors.items():
+                m.pull_status = lambda data=None, d=m: self.pull_status(d)
+                for cmd in DXL_COMMANDS:
+                    if hasattr(m, cmd):
+                        setattr(m, cmd, self._capture(getattr(m, cmd), '%s.%s' % (name, mk), cmd))
+        return robot
+
+    def close(self):
+        for usb in TRANSPORT_USBS:
+            if transport.rpc_backends.get(usb) is self:
+                transport.unregister_rpc_backend(usb)
+        for usb in self.dxl_usbs:
+            dxl_sim.unregister_sim_bus(usb)
+        self.dxl_usbs = []
+
+    def _capture(self, f, device, name):
+        def command(*args, **kwargs):
+            self.add_command(device, name, {'args': args, 'kwargs': kwargs})
+            return f(*args, **kwargs)
+        return command
+
+    # ###########  Clock #############
+
+    def get_row(self):
+        """Row of the recording being replayed"""
+        with self.lock:
+            if not self.stepped:
+                if self.ts_start is None:
+                    self.ts_start = time.time()
+                t = self.t[0] + (time.time() - self.ts_start) * self.speed
+                self.row = max(0, min(int(np.searchsorted(self.t, t, side='right')) - 1, self.reader.n_rows - 1))
+            self.status['row'] = self.row
+            self.status['done'] = self.row == self.reader.n_rows - 1
+            return self.row
+
+    def get_time(self):
+        """Recording time of the row being replayed"""
+        return float(self.t[self.get_row()])
+
+    def step(self, n=1):
+        """
+        Advance n rows (stepped mode), and pull the status of the Robot
+        Returns False once at the last row
+        """
+        with self.lock:
+            self.row = min(self.row + n, self.reader.n_rows - 1)
+        if self.robot is not None:
+            self.robot._pull_status_non_dynamixel()
+            if self.robot.odometry_thread is not None: #Else pulled with the other devices
+                self.robot.base.pull_status()
+            self.robot._pull_status_dynamixel()
+            self.robot.notify_status()
+        return self.row < self.reader.n_rows - 1
+
+    def is_done(self):
+        return self.get_row() == self.reader.n_rows - 1
+
+    # ###########  Devices #############
+
+    def get_path(self, device):
+        """Path of the status of device in the Robot status (eg, ('lift', 'motor'))"""
+        p = self.paths.get(id(device))
+        if p is None and self.robot is not None:
+            p = _find_path(self.robot.status, device.status)
+            self.paths[id(device)] = p
+            if p is None:
+                self.logger.warning('Status of %s not found in the Robot status. Not replayed.' % device.name)
+        return p
+
+    def write_status(self, status, path):
+        """Write the fields of the row being replayed under path (tuple) into status"""
+        writer = self.writers.get(path)
+        if writer is None:
+            prefix = '.'.join(path) + '.'
+            writer = []
+            for i, c in enumerate(self.reader.columns):
+                if c.startswith(prefix):
+                    keys = c[len(prefix):].split('.')
+                    writer.append((keys[:-1], keys[-1], i, self.reader.kinds[c]))
+            self.writers[path] = writer
+        values = self.reader.get_row(self.get_row())
+        for parent, key, i, kind in writer:
+            v = values[i]
+            if np.isnan(v):
+                continue
+            try:
+                d = status
+                for k in parent:
+                    d = d[int(k)] if isinstance(d, list) else d[k]
+                if isinstance(d, list):
+                    key = int(key)
+                #Fields set to an int before they get their first reading (eg, 'pos': 0) are recorded as int
+                d[key] = bool(v) if kind == 'b' else (int(v) if kind == 'i' and v == int(v) else float(v))
+            except (KeyError, IndexError, TypeError, ValueError):
+                pass
+
+    def pull_status(self, device):
+        path = self.get_path(device)
+        if path is not None:
+            self.write_status(device.status, path)
+        device.notify_status()
+
+    def add_command(self, device, name, data):
+        with self.lock:
+            self.commands.append({'t': float(self.t[self.row]), 'device': device, 'name': name, 'data': data})
+            self.status['n_commands'] = len(self.commands)
+
+    def get_commands(self, device=None, name=None):
+        """Captured commands, optionally only of a device / name"""
+        with self.lock:
+            return [c for c in self.commands if (device is None or c['device'] == device) and (name is None or c['name'] == name)]
+
+    def step_rpc(self, transport, rpc, reply_callback):
+        """Handle an RPC of a device Transport (see transport.rpc_backends)"""
+        device = getattr(reply_callback, '__self__', None)
+        name = reply_callback.__name__
+        if name.startswith('rpc_'):
+            name = name[4:]
+        if name.endswith('_reply'):
+            name = name[:-6]
+        if name == 'status':
+            self.pull_status(device)
+        elif name == 'board_info':
+            device.board_info = {'board_version': 'replay', 'firmware_version': 'replay', 'protocol_version': device.valid_firmware_protocol}
+        elif name != 'read_gains_from_flash':
+            data = {'rpc': rpc[0], 'payload': bytearray(rpc[1:])}
+            if name == 'command' and hasattr(device, '_command'):
+                data['command'] = dict(device._command)
+            path = self.get_path(device)
+            self.add_command('.'.join(path) if path is not None else transport.usb, name, data)
+
+    def pretty_print(self):
+        print('----- Telemetry Replay ------ ')
+        print('Recording', self.reader.path)
+        print('Mode', 'stepped' if self.stepped else '%.1fx' % self.speed)
+        print('Row %d of %d' % (self.status['row'], self.status['n_rows']))
+        print('Commands', self.status['n_commands'])
@@ -0,0 +1,403 @@
+from __future__ import print_function
+import threading
+import time
+import math
+#numpy is imported where used, so importing the joints (lift.py, arm.py) doesn't load it
+
+from stretch_body.device import Device
+from stretch_body.stepper import MODE_POS_TRAJ_INCR
+
+
+class Spline:
+    """
+    Piecewise cubic (or quintic) spline through time-stamped waypoints, evaluated vectorized
+
+    t: waypoint times (s), increasing
+    x: waypoint positions
+    v: waypoint velocities. If None, interior velocities are estimated from the neighbouring
+       segments and the end velocities are zero
+    a: waypoint accelerations. If given the spline is quintic, otherwise cubic
+    """
+    def __init__(self, t, x, v=None, a=None):
+        import numpy as np
+        self.t = np.asarray(t, dtype=float)
+        self.x = np.asarray(x, dtype=float)
+        if len(self.t) < 2 or len(self.t) != len(self.x):
+            raise ValueError('Spline requires at least two waypoints with matching times')
+        if np.any(np.diff(self.t) <= 0):
+            raise ValueError('Spline waypoint times must be increasing')
+        self.v = self.estimate_velocities(self.t, self.x) if v is None else np.asarray(v, dtype=float)
+        self.quintic = a is not None
+        self.a = np.zeros(len(self.t)) if a is None else np.asarray(a, dtype=float)
+        self.coeffs = self._quintic_coeffs() if self.quintic else self._cubic_coeffs()
+
+    @staticmethod
+    def estimate_velocities(t, x):
+        import numpy as np
+        v = np.zeros(len(t))
+        if len(t) > 2:
+            s = np.diff(x) / np.diff(t)
+            v[1:-1] = np.where(s[:-1] * s[1:] > 0, (s[:-1] + s[1:]) / 2.0, 0.0) #Zero at extrema to avoid overshoot
+        return v
+
+    def _cubic_coeffs(self):
+        import numpy as np
+        h = np.diff(self.t)
+        x0, x1, v0, v1 = self.x[:-1], self.x[1:], self.v[:-1], self.v[1:]
+        c2 = (3 * (x1 - x0) / h - 2 * v0 - v1) / h
+        c3 = (2 * (x0 - x1) / h + v0 + v1) / h ** 2
+        return np.vstack([x0, v0, c2, c3, np.zeros(len(h)), np.zeros(len(h))])
+
+    def _quintic_coeffs(self):
+        import numpy as np
+        h = np.diff(self.t)
+        x0, x1, v0, v1, a0, a1 = self.x[:-1], self.x[1:], self.v[:-1], self.v[1:], self.a[:-1], self.a[1:]
+        c3 = (20 * (x1 - x0) - (8 * v1 + 12 * v0) * h - (3 * a0 - a1) * h ** 2) / (2 * h ** 3)
+        c4 = (30 * (x0 - x1) + (14 * v1 + 16 * v0) * h + (3 * a0 - 2 * a1) * h ** 2) / (2 * h ** 4)
+        c5 = (12 * (x1 - x0) - 6 * (v1 + v0) * h - (a0 - a1) * h ** 2) / (2 * h ** 5)
+        return np.vstack([x0, v0, a0 / 2.0, c3, c4, c5])
+
+    def duration(self):
+        return self.t[-1] - self.t[0]
+
+    def evaluate(self, ts):
+        """
+        Evaluate at times ts (clamped to the spline's time range)
+        Returns arrays of position, velocity and acceleration
+        """
+        import numpy as np
+        ts = np.clip(np.asarray(ts, dtype=float), self.t[0], self.t[-1])
+        idx = np.clip(np.searchsorted(self.t, ts, side='right') - 1, 0, len(self.t) - 2)
+        c = self.coeffs[:, idx]
+        d = ts - self.t[idx]
+        x = c[0] + d * (c[1] + d * (c[2] + d * (c[3] + d * (c[4] + d * c[5]))))
+        v = c[1] + d * (2 * c[2] + d * (3 * c[3] + d * (4 * c[4] + d * 5 * c[5])))
+        a = 2 * c[2] + d * (6 * c[3] + d * (12 * c[4] + d * 20 * c[5]))
+        return x, v, a
+
+
+class TrackingError:
+    """
+    Running statistics of the error between a trajectory and the measured joint position
+    """
+    def __init__(self):
+        self.status = {'last': 0.0, 'max': 0.0, 'rms': 0.0, 'n': 0}
+        self.err_sq = 0.0
+
+    def add(self, e):
+        self.status['last'] = e
+        self.status['n'] += 1
+        self.status['max'] = max(self.status['max'], abs(e))
+        self.err_sq += e * e
+        self.status['rms'] = math.sqrt(self.err_sq / self.status['n'])
+
+
+class StepperJointAdapter:
+    """
+    Map a joint (in joint units, eg meters) onto the stepper(s) that drive it
+
+    motors: list of (Stepper, sign)
+    to_motor_rad: joint units to motor radians
+    measure: returns the measured joint position (joint units)
+    command_args: returns, for each motor, the stiffness, i_feedforward, i_contact_pos and i_contact_neg
+                  to send with each setpoint (as the joint's own move_to / translate_by send them)
+    limit_motion: returns (v, a) in motor radians, capped (eg, by the base max velocity sentry)
+    """
+    def __init__(self, name, motors, to_motor_rad, measure, max_accel, limits=None, push_command=None,
+                 command_args=None, limit_motion=None):
+        self.name = name
+        self.motors = motors
+        self.to_motor_rad = to_motor_rad
+        self.measure = measure
+        self.max_accel = max_accel
+        self.limits = limits
+        self.push_command = push_command
+        self.command_args = command_args
+        self.limit_motion = limit_motion
+
+    def get_command_args(self):
+        """List of dicts of set_command arguments, one per motor. Read each setpoint, so reloaded params apply"""
+        if self.command_args is None:
+            return [{} for m in self.motors]
+        return self.command_args()
+
+    @staticmethod
+    def from_joint(joint):
+        """Adapter for a Lift or Arm"""
+        return StepperJointAdapter(joint.name, [(joint.motor, 1)], joint.translate_to_motor_rad,
+                                   lambda: (joint.status['pos'], joint.status['timestamp_pc']),
+                                   joint.params['motion']['max']['accel_m'],
+                                   limits=lambda: joint.soft_motion_limits['current'],
+                                   push_command=joint.push_command,
+                                   command_args=lambda: [{'stiffness': joint.stiffness, 'i_feedforward': joint.i_feedforward,
+                                                          'i_contact_pos': joint.i_contact_pos, 'i_contact_neg': joint.i_contact_neg}])
+
+    @staticmethod
+    def from_base(base, rotate=False):
+        """Adapter for base translation (m) or rotation (rad), relative to the pose at the start of streaming"""
+        if rotate:
+            to_mr = base.rotate_to_motor_rad
+            meas = lambda: (base.motor_rad_to_rotate((base.status['right_wheel']['pos'] - base.status['left_wheel']['pos']) / 2.0), base.status['timestamp_pc'])
+            motors = [(base.left_wheel, -1), (base.right_wheel, 1)]
+            max_accel = base.translation_to_rotation(base.params['motion']['max']['accel_m'])
+        else:
+            to_mr = base.translate_to_motor_rad
+            meas = lambda: (base.motor_rad_to_translate((base.status['left_wheel']['pos'] + base.status['right_wheel']['pos']) / 2.0), base.status['timestamp_pc'])
+            motors = [(base.left_wheel, 1), (base.right_wheel, 1)]
+            max_accel = base.params['motion']['max']['accel_m']
+        command_args = lambda: [{'stiffness': base.stiffness, 'i_feedforward': 0, 'i_contact_pos': i, 'i_contact_neg': -1 * i}
+                                for i in [base.i_contact_l, base.i_contact_r]]
+        def limit_motion(v_mr, a_mr):
+            if not base.fast_motion_allowed: #As translate_by and rotate_by
+                v_mr = min(base.translate_to_motor_rad(base.params['sentry_max_velocity']['limit_vel_m']), v_mr)
+                a_mr = min(base.translate_to_motor_rad(base.params['sentry_max_velocity']['limit_accel_m']), a_mr)
+            return v_mr, a_mr
+        return StepperJointAdapter('base_rotate' if rotate else 'base_translate', motors, to_mr, meas, max_accel,
+                                   push_command=base.push_command, command_args=command_args, limit_motion=limit_motion)
+
+
+class StepperTrajectory(Device):
+    """
+    Stream a time-stamped waypoint trajectory to a stepper joint (Lift, Arm or Base)
+
+    The spline is sampled ahead of time at rate_hz. A streaming thread then sends one
+    MODE_POS_TRAJ_INCR setpoint per tick, each the increment from the previously sent setpoint
+    to the spline, so the motion generator target never drifts from the spline.
+    The motion generator smooths between ticks using the spline velocity as its speed limit.
+
+    Waypoints are in joint units (m, or rad for base rotation), relative times from the trajectory
+    start, and absolute positions (except the base, which is relative to where streaming begins).
+    A trajectory may be queued behind the running one, or preempt it. A trajectory that doesn't start at
+    t=0 is started from the current setpoint, so preemption is smooth.
+
+    sync_fn: called after each push (eg, robot.pimu.trigger_motor_sync) for steppers in sync mode
+    push_lock: held over each push and sync_fn (eg, robot.lock, so other pushes don't trigger the sync mid push)
+    """
+    def __init__(self, joint, sync_fn=None, push_lock=None):
+        Device.__init__(self, name='stepper_trajectory')
+        self.joint = StepperJointAdapter.from_joint(joint) if not isinstance(joint, StepperJointAdapter) else joint
+        self.sync_fn = sync_fn
+        self.push_lock = push_lock if push_lock is not None else threading.RLock()
+        self.lock = threading.RLock()
+        self.queue = []
+        self.active = None
+        self.thread = None
+        self.streaming = False
+        self.shutdown_flag = threading.Event()
+        self.x_sent = None
+        self.v_sent = 0.0
+        self.x_offset = 0.0
+        self.tracking_error = TrackingError()
+        self.status = {'active': False, 'queue_depth': 0, 'n_queued': 0, 'n_setpoints': 0, 'n_late': 0, 'n_preempted': 0,
+                       'tracking_error': self.tracking_error.status}
+
+    # ###########  Trajectory interface #############
+
+    def add(self, t, x, v=None, a=None, preempt=False):
+        """
+        Queue a trajectory, or replace the running trajectory and queue if preempt is True
+        t: waypoint times (s) from the start of the trajectory
+        x: waypoint positions (joint units)
+        v, a: optional waypoint velocities and accelerations (see Spline)
+        """
+        with self.lock:
+            if preempt:
+                if self.active is not None or len(self.queue):
+                    self.status['n_preempted'] += 1
+                self.queue = []
+                self.active = None
+            self.queue.append((t, x, v, a))
+            self.status['n_queued'] = len(self.queue)
+        self._start_thread()
+
+    def stop(self):
+        """
+        Abandon the running and queued trajectories. The joint holds the last setpoint sent.
+        """
+        with self.lock:
+            self.queue = []
+            self.active = None
+        self.shutdown_flag.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def is_active(self):
+        with self.lock: #Streaming covers a trajectory taken off the queue but not yet active
+            return self.streaming or self.active is not None or len(self.queue) > 0
+
+    def predict(self, ts):
+        """
+        Planned joint positions at the absolute times ts (eg, for predictive collision checking)
+        Times past the running trajectory hold its final position. Returns None if no trajectory is running.
+        """
+        import numpy as np
+        with self.lock:
+            traj = self.active
+        if traj is None or self.x_sent is None:
+            return None
+        return np.interp(np.asarray(ts) - traj['ts_start'], traj['ts'], traj['xs']) + self.x_offset
+
+    def wait(self, timeout=None):
+        """
+        Block until all trajectories have been streamed. Returns False on timeout
+        """
+        ts = time.time()
+        while self.is_active():
+            if timeout is not None and time.time() - ts > timeout:
+                return False
+            time.sleep(1.0 / self.params['rate_hz'])
+        return True
+
+    def pretty_print(self):
+        print('----- Stepper Trajectory %s ------ ' % self.joint.name)
+        print('Active', self.status['active'])
+        print('Queue depth (setpoints)', self.status['queue_depth'])
+        print('Queued trajectories', self.status['n_queued'])
+        print('Setpoints sent', self.status['n_setpoints'])
+        print('Late ticks', self.status['n_late'])
+        print('Preempted', self.status['n_preempted'])
+        e = self.status['tracking_error']
+        print('Tracking error: last %f max %f rms %f (n=%d)' % (e['last'], e['max'], e['rms'], e['n']))
+
+    # ###########  Streaming #############
+
+    def _start_thread(self):
+        with self.lock:
+            if self.streaming:
+                return
+            self.streaming = True
+        if self.thread is not None:
+            self.thread.join()
+        self.shutdown_flag.clear()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _sample(self, t, x, v, a):
+        """Sample the spline at rate_hz. Returns times relative to the trajectory start and the samples"""
+        import numpy as np
+        t = list(t)
+        x = list(x)
+        v = None if v is None else list(v)
+        a = None if a is None else list(a)
+        if t[0] > 0: #Start from where the joint is commanded to be
+            t.insert(0, 0.0)
+            x.insert(0, self.x_sent)
+            if v is not None:
+                v.insert(0, self.v_sent)
+            if a is not None:
+                a.insert(0, 0.0)
+        s = Spline(t, x, v, a)
+        ts = np.arange(0, s.duration() + 1e-9, 1.0 / self.params['rate_hz'])
+        if ts[-1] < s.duration():
+            ts = np.append(ts, s.duration())
+        xs, vs, acs = s.evaluate(ts)
+        return ts, xs, vs
+
+    def _next_trajectory(self, ts_now):
+        import numpy as np
+        with self.lock:
+            if not len(self.queue):
+                self.active = None
+                self.streaming = False
+                return None
+            t, x, v, a = self.queue.pop(0)
+            self.status['n_queued'] = len(self.queue)
+        try:
+            ts, xs, vs = self._sample(t, x, v, a)
+        except ValueError as e:
+            self.logger.error('Invalid trajectory for %s: %s' % (self.joint.name, str(e)))
+            return self._next_trajectory(ts_now)
+        if self.joint.limits is not None:
+            lim = self.joint.limits()
+            if np.any(xs < lim[0]) or np.any(xs > lim[1]):
+                self.logger.warning('Trajectory for %s exceeds soft motion limits. Clipping.' % self.joint.name)
+                xs = np.clip(xs, lim[0], lim[1])
+        traj = {'ts_start': ts_now, 'ts': ts, 'xs': xs, 'vs': vs, 'idx': 0}
+        with self.lock:
+            self.active = traj
+        return traj
+
+    def _run(self):
+        rate = self.params['rate_hz']
+        x0, _ = self.joint.measure()
+        self.x_sent = x0 #Switching to MODE_POS_TRAJ_INCR holds the current position
+        self.v_sent = 0.0
+        self.x_offset = 0.0
+        if self.joint.limits is None: #Base: positions are relative to the start of streaming
+            self.x_sent = 0.0
+            self.x_offset = x0
+        for (m, sign), args in zip(self.joint.motors, self.joint.get_command_args()):
+            m.set_command(mode=MODE_POS_TRAJ_INCR, x_des=0, **args) #As enable_pos_traj_incr, keeping the feedforward
+        self._push()
+        traj = None
+        ts_tick = time.time()
+        while not self.shutdown_flag.is_set():
+            with self.lock:
+                if self.active is None or self.active is not traj:
+                    traj = None
+            if traj is None:
+                traj = self._next_trajectory(ts_tick)
+                if traj is None:
+                    break
+            k = int((time.time() - traj['ts_start']) * rate)
+            if k > traj['idx'] + 1:
+                self.status['n_late'] += 1
+            k = min(max(k, traj['idx']), len(traj['ts']) - 1)
+            traj['idx'] = k + 1
+            self._send(traj['xs'][k], traj['vs'][k])
+            self._update_tracking_error(traj)
+            remaining = len(traj['ts']) - traj['idx']
+            with self.lock:
+                self.status['queue_depth'] = remaining + sum([int(math.ceil(q[0][-1] * rate)) + 1 for q in self.queue])
+                self.status['active'] = True
+            if remaining == 0:
+                with self.lock:
+                    if self.active is traj:
+                        self.active = None
+                traj = None
+            ts_tick = ts_tick + 1.0 / rate
+            dt = ts_tick - time.time()
+            if dt > 0:
+                time.sleep(dt)
+            else:
+                ts_tick = time.time()
+        with self.lock:
+            if self.shutdown_flag.is_set():
+                self.streaming = False
+            if not self.streaming: #Else a new stream is already being started
+                self.status['active'] = False
+                self.status['queue_depth'] = 0
+
+    def _send(self, x, v):
+        dx = x - self.x_sent
+        v_mr = abs(self.joint.to_motor_rad(v)) * (1 + self.params['vel_margin']) + abs(self.joint.to_motor_rad(dx)) * self.params['rate_hz']
+        a_mr = abs(self.joint.to_motor_rad(self.joint.max_accel))
+        if self.joint.limit_motion is not None:
+            v_mr, a_mr = self.joint.limit_motion(v_mr, a_mr)
+        for (m, sign), args in zip(self.joint.motors, self.joint.get_command_args()):
+            m.set_command(mode=MODE_POS_TRAJ_INCR, x_des=sign * self.joint.to_motor_rad(dx), v_des=v_mr, a_des=a_mr, **args)
+        self.x_sent = x
+        self.v_sent = v
+        self.status['n_setpoints'] += 1
+        self._push()
+
+    def _push(self):
+        with self.push_lock:
+            if self.joint.push_command is not None:
+                self.joint.push_command()
+            else:
+                for m, sign in self.joint.motors:
+                    m.push_command()
+            if self.sync_fn is not None:
+                self.sync_fn()
+
+    def _update_tracking_error(self, traj):
+        """Error between the spline (at the time of the last status) and the measured position"""
+        import numpy as np
+        x, ts_meas = self.joint.measure()
+        if not ts_meas or ts_meas < traj['ts_start']:
+            return
+        x = x - self.x_offset
+        self.tracking_error.add(float(np.interp(ts_meas - traj['ts_start'], traj['ts'], traj['xs'])) - x)
@@ -4,6 +4,7 @@ import time
 import struct
 import array as arr
 import stretch_body.cobbs_framing as cobbs_framing
+import stretch_body.profiler as profiler
 import copy
 import fcntl
 import logging
@@ -52,6 +53,18 @@ RPC_DATA_SIZE = 1024
 
 dbg_on = 0
 
+# RPC backends registered against a usb name (eg, /dev/hello-motor-lift) handle the RPCs of the Transport
+# of that device in place of the serial port (eg, to replay recorded telemetry, see telemetry_replay.py).
+# A backend implements step_rpc(transport, rpc, reply_callback).
+rpc_backends = {}
+
+def register_rpc_backend(usb, backend):
+    rpc_backends[usb] = backend
+    return backend
+
+def unregister_rpc_backend(usb):
+    rpc_backends.pop(usb, None)
+
 
 class Transport():
     """
@@ -71,10 +84,13 @@ class Transport():
         self.itr = 0
         self.itr_time = 0
         self.tlast = 0
+        #Profiler spans of the RPC phases: initiate, send the blocks, receive the blocks, handle the reply (or the backend)
+        self.span_names = dict([(p, 'rpc.%s.%s' % (usb.split('/')[-1], p)) for p in ['new', 'send', 'receive', 'reply', 'backend']])
         self.logger.debug('Starting TransportConnection on: ' + self.usb)
+        self.backend = rpc_backends.get(usb)
         try:
-            self.ser = serial.Serial(self.usb, write_timeout=1.0)#PosixPollSerial(self.usb)#Serial(self.usb)# 115200)  # , write_timeout=1.0)  # Baud not important since USB comms
-            if self.ser.isOpen():
+            self.ser = None if self.backend is not None else serial.Serial(self.usb, write_timeout=1.0)#PosixPollSerial(self.usb)#Serial(self.usb)# 115200)  # , write_timeout=1.0)  # Baud not important since USB comms
+            if self.ser is not None and self.ser.isOpen():
                 try:
                     fcntl.flock(self.ser.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
                 except IOError:
@@ -84,14 +100,14 @@ class Transport():
         except serial.SerialException as e:
             self.logger.error("SerialException({0}): {1}".format(e.errno, e.strerror))
             self.ser = None
-        if self.ser==None:
+        if self.ser==None and self.backend is None:
             self.logger.warning('Unable to open serial port for device %s'%self.usb)
         self.framer=cobbs_framing.CobbsFraming( )
         self.status={'rate':0,'read_error':0,'write_error':0,'itr':0,'transaction_time_avg':0,'transaction_time_max':0,'timestamp_pc':0}
 
 
     def startup(self):
-        return self.ser is not None #return if hardware connection valid
+        return self.ser is not None or self.backend is not None #return if hardware connection valid
 
     def stop(self):
         if self.ser:
@@ -100,14 +116,18 @@ class Transport():
             self.ser = None
 
     def queue_rpc(self,n,reply_callback):
-        if self.ser:
+        if self.ser or self.backend:
             self.rpc_queue.append((copy.copy(self.payload_out[:n]),reply_callback))
 
     def queue_rpc2(self,n,reply_callback):
-        if self.ser:
+        if self.ser or self.backend:
             self.rpc_queue2.append((copy.copy(self.payload_out[:n]),reply_callback))
 
     def step_rpc(self,rpc,rpc_callback): #Handle a single RPC transaction
+        if self.backend is not None:
+            with profiler.span(self.span_names['backend']):
+                self.backend.step_rpc(self, rpc, rpc_callback)
+            return
         if not self.ser:
             self.logger.debug('Transport Serial not present for: %s' % self.usb)
             return
@@ -115,6 +135,7 @@ class Transport():
         dbg_buf = ''
         try:
             ts = time.time()
+            t = profiler.begin()
             if dbg_on:
                 dbg_buf=dbg_buf+'--------------- New RPC -------------------------\n'
             ########## Initiate new RPC
@@ -134,6 +155,7 @@ class Transport():
                 raise TransportError
             #if dbg_on:
             #    print('New RPC initiated, len',len(rpc))
+            t = profiler.end(self.span_names['new'], t)
             ########### Send all blocks
             ntx=0
             while ntx<len(rpc):
@@ -180,6 +202,7 @@ class Transport():
                     if crc!=1 or self.buf[0]!=RPC_ACK_SEND_BLOCK_MORE:
                         self.logger.error('Transport RX Error on RPC_ACK_SEND_BLOCK_MORE {0} {1} {2}'.format(crc, nr, self.buf[0]))
                         raise TransportError
+            t = profiler.end(self.span_names['send'], t)
             ########### Receive all blocks
             reply = arr.array('B')
             #if dbg_on:
@@ -203,7 +226,9 @@ class Transport():
             #if dbg_on:
             #    print('Got reply',len(reply))
             #print('---------------------- RPC complete, elapsed time------------------:',time.time()-ts)
+            t = profiler.end(self.span_names['receive'], t)
             rpc_callback(reply)
+            profiler.end(self.span_names['reply'], t)
         except TransportError as e:
             if dbg_on:
                 print('---- Debug Exception')
@@ -229,9 +254,9 @@ class Transport():
         return self.rt.dirty_step2==False
 
     def step(self,exiting=False):
-        if not self.ser:
+        if not self.ser and not self.backend:
             return
-        if exiting:
+        if exiting and self.ser:
             time.sleep(0.1) #May have been a hard exit, give time for bad data to land, remove, do final RPC
             self.ser.reset_output_buffer()
             self.ser.reset_input_buffer()
@@ -259,9 +284,9 @@ class Transport():
         self.status['itr'] = self.itr
 
     def step2(self,exiting=False):
-        if not self.ser:
+        if not self.ser and not self.backend:
             return
-        if exiting:
+        if exiting and self.ser:
             time.sleep(0.1)  # May have been a hard exit, give time for bad data to land, remove, do final RPC
             self.ser.reset_output_buffer()
             self.ser.reset_input_buffer()
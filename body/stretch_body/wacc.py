@@ -185,6 +185,7 @@ class Wacc(Device):
             self.status['state'] = unpack_uint32_t(s[sidx:]); sidx += 4
             self.status['timestamp'] = self.timestamp.set(unpack_uint32_t(s[sidx:]));sidx += 4
             self.status['debug'] = unpack_uint32_t(s[sidx:]);sidx += 4
+            self.notify_status()
             return sidx
 
     def pack_command(self,s,sidx):
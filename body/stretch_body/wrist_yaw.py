@@ -19,7 +19,7 @@ class WristYaw(DynamixelHelloXL430):
         Home to hardstops
         """
         DynamixelHelloXL430.home(self,single_stop=True)
-        time.sleep(2.0) #extra time to get back
+        self.wait_until_at_pos(0, timeout=2.0) #extra time to get back
 
     def pose(self,p,v_r=None,a_r=None):
         """
@@ -36,11 +36,17 @@ class WristYaw(DynamixelHelloXL430):
         state error of the PID controller.
         """
         DynamixelHelloXL430.step_sentry(self, robot)
-        if self.hw_valid and self.robot_params['robot_sentry']['wrist_yaw_overload']:
-            if self.status['stall_overload']:
-                if self.status['effort']>0:
-                    self.move_by(self.params['stall_backoff'])
-                    self.logger.debug('Backoff at stall overload')
-                else:
-                    self.move_by(-1*self.params['stall_backoff'])
-                    self.logger.debug('Backoff at stall overload')
+        if self.robot_params['robot_sentry']['wrist_yaw_overload']:
+            self.step_stall_backoff(self.status['stall_overload'], self.status['effort'])
+
+    def step_stall_backoff(self, stall_overload, effort):
+        """Back off the commanded position if stall_overload. Returns True if it backed off"""
+        if self.hw_valid and stall_overload:
+            if effort>0:
+                self.move_by(self.params['stall_backoff'])
+                self.logger.debug('Backoff at stall overload')
+            else:
+                self.move_by(-1*self.params['stall_backoff'])
+                self.logger.debug('Backoff at stall overload')
+            return True
+        return False
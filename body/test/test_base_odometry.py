@@ -0,0 +1,180 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import math
+import numpy as np
+import stretch_body.base_odometry
+from stretch_body.base_odometry import BaseOdometry
+
+
+class TestBaseOdometry(unittest.TestCase):
+
+    def drive(self, o, v_left, v_right, duration, rate_hz, t0=0.0, left0=0.0, right0=0.0, clock_offset=100.0, imu=None, gz=None):
+        """Step o with constant wheel velocities, readings arriving clock_offset (plus jitter) after they are stamped"""
+        rng = np.random.RandomState(0)
+        n = int(round(duration * rate_hz))
+        for i in range(1, n + 1):
+            t = t0 + i / float(rate_hz)
+            if imu is not None:
+                imu['timestamp'] = t
+                imu['gz'] = gz
+            o.step(t, left0 + v_left * (t - t0), t, right0 + v_right * (t - t0), t_pc=t + clock_offset + rng.uniform(0, 0.003))
+        return t0 + n / float(rate_hz)
+
+    def test_arc(self):
+        """Integration along an arc matches the closed form, at any rate"""
+        for rate_hz in [25.0, 100.0, 300.0]:
+            o = BaseOdometry(0.3)
+            o.step(0.0, 0.0, 0.0, 0.0, t_pc=100.0)
+            self.drive(o, 0.1, 0.2, 2.0, rate_hz)
+            w = (0.2 - 0.1) / 0.3
+            r = 0.15 / w
+            self.assertAlmostEqual(o.status['theta'], 2.0 * w, places=9)
+            self.assertAlmostEqual(o.status['x'], r * math.sin(2.0 * w), places=9)
+            self.assertAlmostEqual(o.status['y'], r * (1 - math.cos(2.0 * w)), places=9)
+            self.assertAlmostEqual(o.status['x_vel'], 0.15, places=9)
+            self.assertAlmostEqual(o.status['theta_vel'], w, places=9)
+            self.assertAlmostEqual(o.status['rate_hz'], rate_hz, places=3)
+
+        # Straight and in place rotation
+        o = BaseOdometry(0.3)
+        o.step(0.0, 0.0, 0.0, 0.0, t_pc=100.0)
+        self.drive(o, 0.2, 0.2, 1.0, 100.0)
+        self.assertAlmostEqual(o.status['x'], 0.2, places=9)
+        self.assertAlmostEqual(o.status['y'], 0.0, places=9)
+        self.drive(o, -0.15, 0.15, 1.0, 100.0, t0=1.0, left0=0.2, right0=0.2)
+        self.assertAlmostEqual(o.status['x'], 0.2, places=9)
+        self.assertAlmostEqual(o.status['theta'], 1.0, places=9)
+
+        # No new readings: nothing to integrate
+        self.assertFalse(o.step(2.0, 0.05, 2.0, 0.35, t_pc=102.0))
+
+    def test_imu_fusion(self):
+        """The gyro rate is blended into theta while fresh, and ignored once stale"""
+        o = BaseOdometry(0.3)
+        imu = {'timestamp': 0.0, 'gz': 0.0, 'heading': 0.0}
+        o.set_imu(imu)
+        o.step(0.0, 0.0, 0.0, 0.0, t_pc=100.0)
+        # Wheels slipping: they report a turn of 0.5 rad/s but the base only turns at 0.4 rad/s
+        self.drive(o, -0.075, 0.075, 1.0, 100.0, imu=imu, gz=0.4)
+        w = o.params['imu']['gyro_weight']
+        self.assertAlmostEqual(o.status['theta'], w * 0.4 + (1 - w) * 0.5, places=9)
+        self.assertEqual(o.status['n_imu_fused'], 100)
+
+        # IMU stops updating: wheels only once its reading is older than max_age_s
+        theta = o.status['theta']
+        for i in range(1, 101):
+            t = 1.0 + i / 100.0
+            o.step(t, -0.075 * t, t, 0.075 * t, t_pc=t + 100.0)
+        n_fresh = int(o.params['imu']['max_age_s'] * 100)
+        self.assertAlmostEqual(o.status['theta'], theta + (w * 0.4 + (1 - w) * 0.5) * n_fresh / 100.0 + 0.5 * (100 - n_fresh) / 100.0, places=6)
+
+    def test_imu_bias(self):
+        """With the wheels still the gyro bias doesn't turn the base, and is removed once moving"""
+        o = BaseOdometry(0.3)
+        imu = {'timestamp': 0.0, 'gz': 0.0, 'heading': 0.0}
+        o.set_imu(imu)
+        o.step(0.0, 0.0, 0.0, 0.0, t_pc=100.0)
+        t = self.drive(o, 0.0, 0.0, 60.0, 100.0, imu=imu, gz=1e-3)
+        self.assertEqual(o.status['theta'], 0.0)
+        self.assertEqual(o.status['n_imu_fused'], 0)
+        self.assertAlmostEqual(o.status['gz_bias'], 1e-3, places=5)
+
+        # Driving straight: the gyro reads only its bias, so theta stays (nearly) put. Without removing it, 7.5e-4 rad
+        self.drive(o, 0.1, 0.1, 1.0, 100.0, t0=t, imu=imu, gz=1e-3)
+        self.assertEqual(o.status['n_imu_fused'], 100)
+        self.assertAlmostEqual(o.status['theta'], 0.0, places=5)
+        self.assertAlmostEqual(o.status['x'], 0.1, places=6)
+
+    def test_pose_at(self):
+        """Poses are interpolated on the PC clock, extrapolated a little, and kept for history_s"""
+        o = BaseOdometry(0.3)
+        o.step(0.0, 0.0, 0.0, 0.0, t_pc=100.0)
+        self.drive(o, 0.2, 0.2, 1.0, 100.0, clock_offset=100.0)
+
+        # Device clock is mapped to the PC clock to within the least transport delay
+        x, y, theta = o.pose_at(100.505)
+        self.assertAlmostEqual(x, 0.101, delta=0.0003)
+        self.assertAlmostEqual(y, 0.0)
+        self.assertTrue(o.pose_at(99.5) is None)
+        self.assertAlmostEqual(o.pose_at(101.05)[0], 0.21, delta=0.001)
+        self.assertTrue(o.pose_at(101.0 + 2 * o.params['max_extrapolation_s']) is None)
+
+        # Theta is interpolated through the wrap at 2pi
+        o.reset()
+        o.step(0.0, 0.0, 0.0, 0.0, t_pc=0.0)
+        o.step(1.0, -0.15 * 1.0, 1.0, 0.15 * 1.0, t_pc=1.0)
+        o.step(2.0, -0.15 * 2 * math.pi, 2.0, 0.15 * 2 * math.pi, t_pc=2.0)
+        self.assertAlmostEqual(o.status['theta'], 0.0, places=9)
+        self.assertAlmostEqual(o.pose_at(1.5)[2], (1.0 + 2 * math.pi) / 2, places=9)
+
+        # History is a ring buffer
+        o.reset()
+        o.step(0.0, 0.0, 0.0, 0.0, t_pc=0.0)
+        t_end = self.drive(o, 0.2, 0.2, 3 * o.params['history_s'], o.params['history_max_rate_hz'], clock_offset=0.0)
+        t, x, y, theta = o.get_history()
+        self.assertEqual(len(t), o.n_history)
+        self.assertTrue(np.all(np.diff(t) > 0))
+        self.assertAlmostEqual(o.get_history_span(), o.params['history_s'], delta=0.01)
+        self.assertTrue(o.pose_at(t_end - 1.1 * o.params['history_s']) is None)
+        self.assertAlmostEqual(o.pose_at(t_end - 0.5 * o.params['history_s'])[0], 0.2 * (t_end - 0.5 * o.params['history_s']), delta=0.002)
+
+    def recording(self, n, rng):
+        """Wheel status as pulled: jittered timestamps, with some readings repeated on one wheel or both"""
+        t_left = np.cumsum(rng.uniform(0.008, 0.012, n))
+        t_right = t_left + rng.uniform(0, 0.001, n)
+        stale = rng.uniform(size=n) < 0.05
+        t_left[stale] = np.concatenate([[t_left[0]], t_left[:-1]])[stale]
+        stale = rng.uniform(size=n) < 0.05
+        t_right[stale] = np.concatenate([[t_right[0]], t_right[:-1]])[stale]
+        t_left = np.maximum.accumulate(t_left)
+        t_right = np.maximum.accumulate(t_right)
+        v = np.cumsum(rng.normal(0, 0.5, n)) #Motor rad/s, random walk
+        w = np.cumsum(rng.normal(0, 0.5, n))
+        return t_left, np.cumsum((v - w) * 0.01), t_right, np.cumsum((v + w) * 0.01)
+
+    def test_batch_odometry(self):
+        """The vectorized integration matches stepping BaseOdometry, including skipped readings"""
+        rng = np.random.RandomState(2)
+        t_left, pos_left, t_right, pos_right = self.recording(5000, rng)
+        mpr = 0.1016 / 2 / 3.4
+        o = BaseOdometry(0.3153)
+        poses = []
+        for i in range(len(t_left)):
+            if o.step(t_left[i], pos_left[i] * mpr, t_right[i], pos_right[i] * mpr, t_pc=1000.0 + t_left[i]):
+                poses.append((i, o.x, o.y, o.theta))
+        b = stretch_body.base_odometry.batch_odometry(t_left, pos_left, t_right, pos_right, mpr, 0.3153)
+        poses = np.array(poses)
+        self.assertTrue(len(poses) < len(t_left))
+        self.assertTrue(np.array_equal(b['index'], poses[:, 0].astype(int)))
+        for k, c in [('x', 1), ('y', 2), ('theta', 3)]:
+            self.assertTrue(np.allclose(b[k], poses[:, c], rtol=0, atol=1e-9), k)
+
+        # Many geometries at once
+        bb = stretch_body.base_odometry.batch_odometry(t_left, pos_left, t_right, pos_right, [mpr, 1.1 * mpr], [0.3153, 0.3])
+        self.assertEqual(bb['x'].shape, (2, len(poses)))
+        self.assertTrue(np.allclose(bb['x'][0], b['x'], rtol=0, atol=1e-12))
+
+    def test_sweep_odometry(self):
+        """The geometry the ground truth was made with has the least error"""
+        rng = np.random.RandomState(3)
+        t_left, pos_left, t_right, pos_right = self.recording(20000, rng)
+        gr = 3.4
+        true_d, true_s = 0.1016, 0.3153
+        truth = stretch_body.base_odometry.batch_odometry(t_left, pos_left, t_right, pos_right, true_d / 2 / gr, true_s)
+        # Ground truth is in another frame, sampled at 10Hz
+        i = np.arange(0, len(truth['t']), 10)
+        c, s = math.cos(0.7), math.sin(0.7)
+        tx = 2.0 + c * truth['x'][i] - s * truth['y'][i]
+        ty = -1.0 + s * truth['x'][i] + c * truth['y'][i]
+        diameters = np.linspace(true_d - 0.0025, true_d + 0.0025, 11)
+        separations = np.linspace(true_s - 0.005, true_s + 0.005, 11)
+        r = stretch_body.base_odometry.sweep_odometry(t_left, pos_left, t_right, pos_right, gr, diameters, separations,
+                                                       truth['t'][i], tx, ty, truth['theta'][i] + 0.7, max_elements=100000)
+        self.assertEqual(r['pos_rms_m'].shape, (11, 11))
+        self.assertAlmostEqual(r['best'][0], true_d, places=9)
+        self.assertAlmostEqual(r['best'][1], true_s, places=9)
+        self.assertLess(r['pos_rms_m'].min(), 1e-9)
+        self.assertLess(r['theta_rms_rad'][5, 5], 1e-9)
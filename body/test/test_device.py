@@ -18,3 +18,40 @@ class TestDevice(unittest.TestCase):
         d2.logger.info('hi')
         # TODO: capture logging with https://testfixtures.readthedocs.io/en/latest/logging.html
         #       verify output is '[INFO][wrist_yaw]hi\n[INFO][stretch_gripper]hi\n'
+
+    def test_wait_until(self):
+        """Verify wait_until wakes on status updates from another thread, and times out.
+        """
+        import threading, time
+        d = stretch_body.device.Device('wrist_yaw')
+        d.status = {'n': 0}
+        def updater():
+            for i in range(5):
+                time.sleep(0.02)
+                d.status['n'] += 1
+                d.notify_status()
+        t = threading.Thread(target=updater)
+        t.start()
+        ts = time.time()
+        self.assertTrue(d.wait_until(lambda: d.status['n'] >= 3, timeout=2.0))
+        self.assertTrue(time.time() - ts < 1.0)
+        t.join()
+        ts = time.time()
+        self.assertFalse(d.wait_until(lambda: d.status['n'] > 5, timeout=0.3))
+        self.assertTrue(time.time() - ts >= 0.3)
+
+    def test_wait_until_pulls_status(self):
+        """Verify wait_until pulls the status itself when no other thread updates it.
+        """
+        import time
+        d = stretch_body.device.Device('wrist_yaw')
+        d.status = {'n': 0}
+        def pull_status():
+            d.status['n'] += 1
+        d.pull_status = pull_status
+        ts = time.time()
+        self.assertTrue(d.wait_until(lambda: d.status['n'] >= 3, timeout=2.0, poll_s=0.01))
+        self.assertEqual(d.status['n'], 3)
+        self.assertTrue(time.time() - ts < 1.0)
+        self.assertFalse(d.wait_until(lambda: d.status['n'] < 0, timeout=0.1, poll_s=0.01))
+        self.assertTrue(d.status['n'] > 3)
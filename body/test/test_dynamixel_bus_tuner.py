@@ -0,0 +1,92 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import os
+import shutil
+import tempfile
+import stretch_body.hello_utils as hello_utils
+import stretch_body.dynamixel_sim as dxl_sim
+from stretch_body.dynamixel_bus_tuner import DynamixelBusTuner
+from stretch_body.dynamixel_XL430 import DynamixelXL430
+
+
+class TestDynamixelBusTuner(unittest.TestCase):
+
+    def setUp(self):
+        p = stretch_body.robot_params.RobotParams.get_params()[1]
+        self.usb = p['head_pan']['usb_name']
+        self.ids = [p['head_pan']['id'], p['head_tilt']['id']]
+        self.add_bus(realtime=True)
+
+    def add_bus(self, realtime):
+        self.bus = dxl_sim.register_sim_bus(self.usb, dxl_sim.DynamixelSimBus(baud=57600, latency_timer_ms=16, seed=0, realtime=realtime))
+        for i in self.ids:
+            self.bus.add_servo(i, return_delay_time=250)
+
+    def tearDown(self):
+        dxl_sim.unregister_sim_bus(self.usb)
+
+    def get_tuner(self):
+        t = DynamixelBusTuner('head', ['head_pan', 'head_tilt'])
+        t.params = dict(t.params, test_duration_s=0.25, max_error_rate=0.05) #Tolerate timeouts from test machine scheduling jitter
+        return t
+
+    def test_tune_to_highest_reliable_baud(self):
+        """Verify the chain is stepped up until the bus becomes unreliable.
+        """
+        print('Testing Tune To Highest Reliable Baud')
+        self.bus.packet_loss_at_baud = {3000000: 0.2, 4000000: 0.2}
+        t = self.get_tuner()
+        s = t.tune(save=False)
+        self.assertIsNotNone(s)
+        self.assertEqual(s['baud'], 2000000)
+        self.assertTrue(s['results'][2000000]['rate_hz'] > s['results'][57600]['rate_hz'])
+        self.assertEqual(self.bus.latency_timer_ms, t.params['usb_latency_timer_ms'])
+        for i in self.ids:
+            self.assertEqual(DynamixelXL430.identify_baud_rate(i, self.usb), 2000000)
+            self.assertEqual(self.bus.get_servo(i).table[9], t.params['return_delay_time'])
+
+    def test_rollback_on_lost_servo(self):
+        """Verify servos are recovered to the last good rate when a baud change drops packets.
+        """
+        print('Testing Rollback On Lost Servo')
+        self.add_bus(realtime=False) #Only injected loss, no timeouts from scheduling jitter
+        self.bus.packet_loss_at_baud = {1000000: 0.15}
+        t = self.get_tuner()
+        s = t.tune(save=False)
+        self.assertIsNotNone(s)
+        self.assertEqual(s['baud'], 115200)
+        for i in self.ids:
+            self.assertEqual(DynamixelXL430.identify_baud_rate(i, self.usb), 115200)
+
+    def test_save(self):
+        """Verify the tuned settings are saved, and the status rate is set once the head and tool chains are measured.
+        """
+        print('Testing Save')
+        fleet_path = os.environ['HELLO_FLEET_PATH']
+        tmp = tempfile.mkdtemp()
+        shutil.copytree(hello_utils.get_fleet_directory(), os.path.join(tmp, hello_utils.get_fleet_id()))
+        os.environ['HELLO_FLEET_PATH'] = tmp
+        try:
+            t = self.get_tuner()
+            t.status = dict(t.status, baud=1000000, usb_latency_timer_ms=1, return_delay_time=0,
+                            results={1000000: {'rate_hz': 200.0, 'error_rate': 0.0}})
+            t.save()
+            up = hello_utils.read_fleet_yaml('stretch_re1_user_params.yaml')
+            self.assertEqual(up['head']['baud'], 1000000)
+            self.assertEqual(up['head']['measured_status_rate_hz'], 200.0)
+            self.assertEqual(up['head_pan']['return_delay_time'], 0)
+            self.assertFalse('dxl_status_rate_hz' in up.get('robot', {})) #Tool chain not measured yet
+
+            tool = t.robot_params['robot']['tool']
+            t.chain_name = tool
+            t.status['results'] = {1000000: {'rate_hz': 100.0, 'error_rate': 0.0}}
+            t.save()
+            up = hello_utils.read_fleet_yaml('stretch_re1_user_params.yaml')
+            self.assertEqual(up[tool]['measured_status_rate_hz'], 100.0)
+            self.assertAlmostEqual(up['robot']['dxl_status_rate_hz'], round(t.params['status_rate_margin'] / (1 / 200.0 + 1 / 100.0), 1))
+        finally:
+            os.environ['HELLO_FLEET_PATH'] = fleet_path
+            shutil.rmtree(tmp)
@@ -301,3 +301,51 @@ class TestDynamixelHelloXL430(unittest.TestCase):
         self.assertNotEqual(move1_accel_ticks, move2_accel_ticks)
 
         servo.stop()
+
+    def test_status_scheduler(self):
+        """Verify slow registers are read according to motor state, on a simulated bus.
+        """
+        print('test_status_scheduler')
+        import stretch_body.dynamixel_sim as dxl_sim
+        from stretch_body.dynamixel_XL430 import XL430_ADDR_PRESENT_TEMPERATURE
+        p = stretch_body.robot_params.RobotParams.get_params()[1]['head_pan']
+        bus = dxl_sim.register_sim_bus(p['usb_name'], dxl_sim.DynamixelSimBus(baud=p['baud']))
+        sim_servo = bus.add_servo(p['id'], pos_ticks=p['zero_t'])
+        try:
+            servo = stretch_body.dynamixel_hello_XL430.DynamixelHelloXL430(name="head_pan", chain=None)
+            self.assertTrue(servo.startup())
+            sched = servo.status_scheduler
+
+            # Idle and cool: temp is read rarely once every field has been read
+            for i in range(len(sched.fields)):
+                servo.pull_status()
+            n_temp = sched.status['n_read']['temp']
+            for i in range(20):
+                servo.pull_status()
+                time.sleep(0.02)
+            self.assertEqual(sched.status['n_read']['temp'], n_temp)
+            self.assertTrue(servo.status['staleness']['effort'] <= sched.params['effort']['max_age_s'] + 0.1)
+
+            # Near the temperature limit: temp is read often
+            sim_servo.table[XL430_ADDR_PRESENT_TEMPERATURE] = p['temperature_limit'] - 2
+            time.sleep(sched.params['temp']['max_age_s'])
+            for i in range(len(sched.fields)):
+                servo.pull_status()
+            self.assertEqual(servo.status['temp'], p['temperature_limit'] - 2)
+            n_temp = sched.status['n_read']['temp']
+            for i in range(20):
+                servo.pull_status()
+                time.sleep(0.02)
+            self.assertTrue(sched.status['n_read']['temp'] - n_temp >= 2)
+
+            # Moving: effort is read every cycle
+            servo.move_by(1.0)
+            time.sleep(0.1)
+            servo.pull_status()
+            n_effort = sched.status['n_read']['effort']
+            for i in range(5):
+                servo.pull_status()
+            self.assertEqual(sched.status['n_read']['effort'] - n_effort, 5)
+            servo.stop()
+        finally:
+            dxl_sim.unregister_sim_bus(p['usb_name'])
@@ -0,0 +1,109 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import stretch_body.dynamixel_sim as dxl_sim
+from stretch_body.dynamixel_XL430 import *
+import dynamixel_sdk.group_sync_read as gsr
+
+import logging
+
+
+class TestDynamixelSim(unittest.TestCase):
+
+    def setUp(self):
+        self.usb = '/dev/hello-dynamixel-sim'
+        self.bus = dxl_sim.register_sim_bus(self.usb, dxl_sim.DynamixelSimBus(baud=57600, realtime=False, seed=0))
+        self.bus.add_servo(11, pos_ticks=1000, hard_stops=[-500, 3000])
+        self.bus.add_servo(12, pos_ticks=2048)
+
+    def tearDown(self):
+        dxl_sim.unregister_sim_bus(self.usb)
+
+    def test_ping_read_write(self):
+        """Verify the SDK talks to virtual servos through the simulated port.
+        """
+        print('Testing Ping Read Write')
+        servo = DynamixelXL430(dxl_id=11, usb=self.usb, baud=57600, logger=logging.getLogger("test_dynamixel_sim"))
+        self.assertTrue(servo.startup())
+        self.assertTrue(servo.do_ping(verbose=False))
+        self.assertEqual(servo.get_id(), 11)
+        self.assertEqual(servo.get_pos(), 1000)
+        servo.disable_torque()
+        servo.set_homing_offset(100)
+        self.assertEqual(servo.get_homing_offset(), 100)
+        self.assertEqual(servo.get_pos(), 1100)
+        servo.enable_torque()
+        servo.set_homing_offset(0) #EEPROM is locked with torque enabled
+        self.assertEqual(servo.get_homing_offset(), 100)
+        servo.go_to_pos(2000)
+        self.bus.step(5.0)
+        self.assertEqual(servo.get_pos(), 2000)
+        self.assertEqual(servo.is_moving(), 0)
+        servo.stop()
+
+    def test_identify_baud_rate(self):
+        """Verify a servo only answers at its own baud rate.
+        """
+        print('Testing Identify Baud Rate')
+        self.bus.add_servo(13, baud=115200)
+        self.assertEqual(DynamixelXL430.identify_baud_rate(13, self.usb), 115200)
+        self.assertEqual(DynamixelXL430.identify_baud_rate(12, self.usb), 57600)
+        self.assertEqual(DynamixelXL430.identify_baud_rate(20, self.usb), -1)
+
+    def test_group_sync_read(self):
+        """Verify group sync read returns data for each servo on the chain.
+        """
+        print('Testing Group Sync Read')
+        servo = DynamixelXL430(dxl_id=11, usb=self.usb, baud=57600, logger=logging.getLogger("test_dynamixel_sim"))
+        reader = gsr.GroupSyncRead(servo.port_handler, servo.packet_handler, XL430_ADDR_PRESENT_POSITION, 4)
+        self.assertTrue(reader.addParam(11))
+        self.assertTrue(reader.addParam(12))
+        self.assertEqual(reader.txRxPacket(), COMM_SUCCESS)
+        self.assertEqual(reader.getData(11, XL430_ADDR_PRESENT_POSITION, 4), 1000)
+        self.assertEqual(reader.getData(12, XL430_ADDR_PRESENT_POSITION, 4), 2048)
+        self.assertEqual(self.bus.status['n_status'], 2)
+
+    def test_hard_stop(self):
+        """Verify PWM motion stalls against the hard stop.
+        """
+        print('Testing Hard Stop')
+        servo = DynamixelXL430(dxl_id=11, usb=self.usb, baud=57600, logger=logging.getLogger("test_dynamixel_sim"))
+        self.assertTrue(servo.startup())
+        servo.disable_torque()
+        servo.enable_pwm()
+        servo.enable_torque()
+        servo.set_pwm(-300)
+        self.bus.step(0.1)
+        self.assertEqual(servo.is_moving(), 1)
+        self.bus.step(5.0)
+        self.assertEqual(servo.is_moving(), 0)
+        self.assertEqual(servo.get_pos(), -500)
+        self.assertTrue(servo.get_load() < -300)
+
+    def test_packet_loss(self):
+        """Verify injected packet loss surfaces as comm errors.
+        """
+        print('Testing Packet Loss')
+        servo = DynamixelXL430(dxl_id=12, usb=self.usb, baud=57600, logger=logging.getLogger("test_dynamixel_sim"))
+        self.bus.packet_loss = 1.0
+        self.assertFalse(servo.do_ping(verbose=False))
+        self.assertEqual(servo.comm_errors, 1)
+        self.bus.packet_loss = 0.0
+        self.bus.packet_corrupt = 1.0
+        self.assertRaises(DynamixelCommError, servo.get_id)
+        self.bus.packet_corrupt = 0.0
+        self.assertEqual(servo.get_id(), 12)
+
+    def test_reboot(self):
+        """Verify reboot clears RAM (calibrated flag) but retains EEPROM.
+        """
+        print('Testing Reboot')
+        servo = DynamixelXL430(dxl_id=12, usb=self.usb, baud=57600, logger=logging.getLogger("test_dynamixel_sim"))
+        servo.set_homing_offset(-48)
+        servo.set_calibrated(1)
+        self.assertEqual(servo.is_calibrated(), 1)
+        self.assertTrue(servo.do_reboot())
+        self.assertEqual(servo.is_calibrated(), 0)
+        self.assertEqual(servo.get_homing_offset(), -48)
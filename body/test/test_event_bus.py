@@ -0,0 +1,97 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import logging
+import numpy as np
+import stretch_body.event_bus as eb
+
+
+class TestEventBus(unittest.TestCase):
+
+    def test_log(self):
+        """Events are kept in a bounded log, and queried by time range, type and device"""
+        print('test_log')
+        b = eb.EventBus(capacity=8)
+        for i in range(20):
+            b.emit(eb.EVENT_GUARDED_CONTACT if i % 2 else eb.EVENT_LOW_VOLTAGE, 'lift' if i % 2 else 'pimu', 11.0 - i * 0.01, t=100.0 + i)
+        self.assertEqual(b.get_n_dropped(), 12)
+        e = b.query()
+        self.assertEqual(list(e['seq']), list(range(12, 20)))
+        self.assertEqual(list(b.query(t_start=115.0, t_end=117.0)['seq']), [15, 16, 17])
+        self.assertEqual(list(b.query(types=[eb.EVENT_GUARDED_CONTACT])['seq']), [13, 15, 17, 19])
+        self.assertEqual(list(b.query(devices=['pimu'], t_end=115.0)['seq']), [12, 14])
+        self.assertEqual(len(b.query(devices=['arm'])), 0)
+        self.assertEqual(list(b.query(since_seq=17)['seq']), [18, 19])
+        self.assertEqual(len(b.query(since_seq=19)), 0)
+        self.assertEqual(b.get_device_name(e['device'][0]), 'pimu')
+        events = b.get_events(types=[eb.EVENT_LOW_VOLTAGE], t_start=118.0)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].device, 'pimu')
+        self.assertAlmostEqual(events[0].value, 10.82)
+        self.assertEqual(eb.format_event(events[0]), 'Low voltage of: 10.82')
+
+    def test_subscribe(self):
+        """Subscribers get the events they filter on, and formatting is left to the sink"""
+        print('test_subscribe')
+        b = eb.EventBus()
+        got = []
+        h = b.subscribe(got.append, types=[eb.EVENT_DYNAMIXEL_OVERLOAD], devices=['end_of_arm.wrist_yaw'])
+        b.emit(eb.EVENT_DYNAMIXEL_OVERLOAD, 'end_of_arm.wrist_yaw', 1)
+        b.emit(eb.EVENT_DYNAMIXEL_OVERLOAD, 'head.head_pan', 1)
+        b.emit(eb.EVENT_RUNSTOP, 'pimu', 1)
+        self.assertEqual([(e.seq, e.device) for e in got], [(0, 'end_of_arm.wrist_yaw')])
+        self.assertEqual(eb.format_event(got[0]), 'Dynamixel overload_error on end_of_arm:wrist_yaw')
+        b.unsubscribe(h)
+        b.emit(eb.EVENT_DYNAMIXEL_OVERLOAD, 'end_of_arm.wrist_yaw', 1)
+        self.assertEqual(len(got), 1)
+
+        logger = logging.getLogger('test_event_bus')
+        b.subscribe(eb.LoggingSink(logger))
+        with self.assertLogs(logger, level='DEBUG') as cm:
+            b.emit(eb.EVENT_RUNSTOP, 'pimu', 0)
+        self.assertEqual(cm.output, ['DEBUG:test_event_bus:Runstop deactivated'])
+
+    def test_failing_subscriber(self):
+        """A subscriber that raises is counted and logged once, and the others still get the event"""
+        print('test_failing_subscriber')
+        logger = logging.getLogger('test_event_bus')
+        b = eb.EventBus(logger=logger)
+        def fail(e):
+            raise ValueError('bad subscriber')
+        got = []
+        h = b.subscribe(fail)
+        b.subscribe(got.append)
+        with self.assertLogs(logger, level='ERROR') as cm:
+            b.emit(eb.EVENT_RUNSTOP, 'pimu', 1)
+            b.emit(eb.EVENT_RUNSTOP, 'pimu', 0)
+        self.assertEqual(cm.output, ['ERROR:test_event_bus:Event subscriber fail failed: bad subscriber'])
+        self.assertEqual(b.n_errors[h], 2)
+        self.assertEqual(len(got), 2)
+        self.assertEqual(b.seq, 2)
+
+    def test_robot_monitor(self):
+        """The RobotMonitor emits edges of the status as events"""
+        print('test_robot_monitor')
+        import stretch_body.robot
+        r = stretch_body.robot.Robot() # Not started: no hardware needed
+        m = r.monitor
+        for k in m.params:
+            if k.startswith('monitor_'):
+                m.params[k] = 1
+        r.pimu.status['voltage'] = 12.0
+        r.pimu.status['current'] = 1.0
+        m.startup()
+        m.step()
+        self.assertEqual(len(m.events.query()), 0)
+        r.pimu.status['runstop_event'] = True
+        r.lift.motor.status['in_guarded_event'] = 1
+        m.step()
+        m.step()
+        e = m.events.get_events()
+        self.assertEqual(sorted([(x.type, x.device) for x in e]), [(eb.EVENT_RUNSTOP, 'pimu'), (eb.EVENT_GUARDED_CONTACT, 'lift')])
+        r.pimu.status['runstop_event'] = False
+        m.step()
+        e = m.events.get_events(types=[eb.EVENT_RUNSTOP])
+        self.assertEqual([x.value for x in e], [1, 0])
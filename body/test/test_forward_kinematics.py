@@ -0,0 +1,108 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import urdfpy
+from stretch_body.forward_kinematics import ForwardKinematics
+
+# Stretch like chain: lift, telescoping arm, wrist yaw and mimic fingers
+URDF = """<?xml version="1.0"?>
+<robot name="stretch">
+  <link name="base_link"/><link name="link_mast"/><link name="link_lift"/>
+  <link name="link_arm_l4"/><link name="link_arm_l3"/><link name="link_arm_l2"/><link name="link_arm_l1"/><link name="link_arm_l0"/>
+  <link name="link_wrist_yaw"/><link name="link_gripper"/>
+  <link name="link_gripper_finger_left"/><link name="link_gripper_fingertip_left"/>
+  <link name="link_gripper_finger_right"/><link name="link_gripper_fingertip_right"/>
+  <link name="link_head"/><link name="link_head_pan"/>
+  <joint name="joint_mast" type="fixed"><origin xyz="-0.07 0.13 0.03" rpy="1.57 0 0.03"/><parent link="base_link"/><child link="link_mast"/></joint>
+  <joint name="joint_lift" type="prismatic"><origin xyz="-0.03 0.2 0.08" rpy="-1.57 -1.56 0"/><axis xyz="0 0 1"/><limit lower="0" upper="1.1" effort="100" velocity="1"/><parent link="link_mast"/><child link="link_lift"/></joint>
+  <joint name="joint_arm_l4" type="fixed"><origin xyz="-0.25 0 0" rpy="1.57 0 -1.57"/><parent link="link_lift"/><child link="link_arm_l4"/></joint>
+  <joint name="joint_arm_l3" type="prismatic"><origin xyz="0 0 0.013" rpy="0 0 0"/><axis xyz="0 0 1"/><limit lower="0" upper="0.13" effort="100" velocity="1"/><parent link="link_arm_l4"/><child link="link_arm_l3"/></joint>
+  <joint name="joint_arm_l2" type="prismatic"><origin xyz="0 0 0.013" rpy="0 0 0"/><axis xyz="0 0 1"/><limit lower="0" upper="0.13" effort="100" velocity="1"/><parent link="link_arm_l3"/><child link="link_arm_l2"/></joint>
+  <joint name="joint_arm_l1" type="prismatic"><origin xyz="0 0 0.013" rpy="0 0 0"/><axis xyz="0 0 1"/><limit lower="0" upper="0.13" effort="100" velocity="1"/><parent link="link_arm_l2"/><child link="link_arm_l1"/></joint>
+  <joint name="joint_arm_l0" type="prismatic"><origin xyz="0 0 -0.014" rpy="0 0 0"/><axis xyz="0 0 1"/><limit lower="0" upper="0.13" effort="100" velocity="1"/><parent link="link_arm_l1"/><child link="link_arm_l0"/></joint>
+  <joint name="joint_wrist_yaw" type="revolute"><origin xyz="0.083 -0.03 0" rpy="1.57 0 3.14"/><axis xyz="0 0 -1"/><limit lower="-1.75" upper="4" effort="100" velocity="1"/><parent link="link_arm_l0"/><child link="link_wrist_yaw"/></joint>
+  <joint name="joint_gripper" type="fixed"><origin xyz="0 0 -0.04" rpy="1.57 -0.01 -3.1"/><parent link="link_wrist_yaw"/><child link="link_gripper"/></joint>
+  <joint name="joint_gripper_finger_left" type="revolute"><origin xyz="-0.047 -0.009 -0.17" rpy="3.05 0.47 -1.5"/><axis xyz="0 0 1"/><limit lower="-0.6" upper="0.6" effort="100" velocity="1"/><parent link="link_gripper"/><child link="link_gripper_finger_left"/></joint>
+  <joint name="joint_gripper_fingertip_left" type="fixed"><origin xyz="-0.19 -0.015 0" rpy="-1.57 0 -2.04"/><parent link="link_gripper_finger_left"/><child link="link_gripper_fingertip_left"/></joint>
+  <joint name="joint_gripper_finger_right" type="revolute"><origin xyz="-0.047 0.009 -0.17" rpy="-0.09 -0.47 -1.6"/><axis xyz="0 0 -1"/><limit lower="-0.6" upper="0.6" effort="100" velocity="1"/><mimic joint="joint_gripper_finger_left" multiplier="1.0" offset="0.01"/><parent link="link_gripper"/><child link="link_gripper_finger_right"/></joint>
+  <joint name="joint_gripper_fingertip_right" type="fixed"><origin xyz="0.19 -0.015 0" rpy="1.57 0 1.1"/><parent link="link_gripper_finger_right"/><child link="link_gripper_fingertip_right"/></joint>
+  <joint name="joint_head" type="fixed"><origin xyz="0 1.33 0" rpy="1.57 -1.57 3.14"/><parent link="link_mast"/><child link="link_head"/></joint>
+  <joint name="joint_head_pan" type="continuous"><origin xyz="0.14 0.07 -0.01" rpy="0 0 1.57"/><axis xyz="0 0 1"/><parent link="link_head"/><child link="link_head_pan"/></joint>
+</robot>
+"""
+
+
+class TestForwardKinematics(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.urdf_file = os.path.join(self.dir, 'stretch.urdf')
+        self.cache_dir = os.path.join(self.dir, 'fk_cache')
+        with open(self.urdf_file, 'w') as f:
+            f.write(URDF)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def random_cfgs(self, n):
+        rng = np.random.RandomState(0)
+        arm = rng.uniform(0, 0.5, n)
+        cfgs = {'joint_lift': rng.uniform(0, 1.1, n),
+                'joint_wrist_yaw': rng.uniform(-1.75, 4, n),
+                'joint_gripper_finger_left': rng.uniform(-0.6, 0.6, n),
+                'joint_head_pan': rng.uniform(-4, 2, n)}
+        for j in ['joint_arm_l0', 'joint_arm_l1', 'joint_arm_l2', 'joint_arm_l3']:
+            cfgs[j] = arm / 4
+        return cfgs
+
+    def test_matches_urdfpy(self):
+        """Batched and single poses match urdfpy, including mimic joints and poses relative to link_arm_l0"""
+        fk = ForwardKinematics(urdf_file=self.urdf_file, cache_dir=self.cache_dir)
+        model = urdfpy.URDF.load(self.urdf_file)
+        cfgs = self.random_cfgs(20)
+        links = ['link_lift', 'link_arm_l0', 'link_gripper_fingertip_left', 'link_gripper_fingertip_right', 'link_head_pan']
+        batch = fk.links_fk(cfgs, links=links)
+        tool = fk.link_fk(cfgs, 'link_gripper_fingertip_right', base='link_arm_l0')
+        head = fk.link_fk(cfgs, 'link_head_pan', base='link_arm_l0') #Not a descendant of base
+        self.assertEqual(batch['link_lift'].shape, (20, 4, 4))
+        for i in range(20):
+            cfg = dict([(k, v[i]) for k, v in cfgs.items()])
+            expected = dict([(l.name, p) for l, p in model.link_fk(cfg=cfg).items()])
+            single = fk.links_fk(cfg, links=links)
+            for l in links:
+                self.assertEqual(single[l].shape, (4, 4))
+                self.assertTrue(np.allclose(batch[l][i], expected[l], atol=1e-9), l)
+                self.assertTrue(np.allclose(single[l], expected[l], atol=1e-9), l)
+            arm_inv = np.linalg.inv(expected['link_arm_l0'])
+            self.assertTrue(np.allclose(tool[i], arm_inv.dot(expected['link_gripper_fingertip_right']), atol=1e-9))
+            self.assertTrue(np.allclose(head[i], arm_inv.dot(expected['link_head_pan']), atol=1e-9))
+
+        # Array configurations are ordered as actuated_joint_names
+        q = np.array([cfgs[j] for j in fk.actuated_joint_names]).T
+        self.assertNotIn('joint_gripper_finger_right', fk.actuated_joint_names)
+        self.assertTrue(np.allclose(fk.link_fk(q, 'link_gripper_fingertip_right'), batch['link_gripper_fingertip_right']))
+
+    def test_cache(self):
+        """The compiled chain is cached by URDF hash and reused"""
+        fk = ForwardKinematics(urdf_file=self.urdf_file, cache_dir=self.cache_dir)
+        self.assertFalse(fk.from_cache)
+        self.assertTrue(os.path.isfile(fk.get_cache_file()))
+        fk2 = ForwardKinematics(urdf_file=self.urdf_file, cache_dir=self.cache_dir)
+        self.assertTrue(fk2.from_cache)
+        cfg = {'joint_lift': 0.3, 'joint_wrist_yaw': 1.0}
+        self.assertTrue(np.allclose(fk.link_fk(cfg, 'link_gripper'), fk2.link_fk(cfg, 'link_gripper')))
+        self.assertEqual(fk.link_names, fk2.link_names)
+
+        # Editing the URDF (eg, a new calibration) invalidates the cache
+        with open(self.urdf_file, 'w') as f:
+            f.write(URDF.replace('xyz="-0.03 0.2 0.08"', 'xyz="-0.03 0.2 0.09"'))
+        fk3 = ForwardKinematics(urdf_file=self.urdf_file, cache_dir=self.cache_dir)
+        self.assertFalse(fk3.from_cache)
+        self.assertNotEqual(fk3.urdf_hash, fk.urdf_hash)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
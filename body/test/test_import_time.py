@@ -0,0 +1,55 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import os
+import subprocess
+import sys
+import stretch_body.hello_utils as hello_utils
+from stretch_body.robot_benchmark import get_import_times
+
+HEAVY_MODULES = ['numpy', 'yaml', 'psutil', 'urdfpy', 'scipy', 'matplotlib']
+
+
+class TestImportTime(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Params cache warm, as on a robot after the first run
+        subprocess.check_call([sys.executable, '-c', 'import stretch_body.robot_params'])
+
+    def assertNotImported(self, times, modules):
+        for m in modules:
+            self.assertNotIn(m, times)
+
+    def test_device_modules(self):
+        """Device modules, and what they are built on, import no heavy dependencies"""
+        print('test_device_modules')
+        for module in ['stretch_body.hello_utils', 'stretch_body.device', 'stretch_body.pimu', 'stretch_body.wacc',
+                       'stretch_body.stepper', 'stretch_body.dynamixel_hello_XL430', 'stretch_body.lift', 'stretch_body.arm']:
+            times = get_import_times(module)
+            print('%s: %.1f ms' % (module, times[module][1] / 1000.0))
+            self.assertNotImported(times, HEAVY_MODULES)
+
+    def test_robot(self):
+        """The Robot imports numpy (odometry), but not the optional subsystems"""
+        print('test_robot')
+        times = get_import_times('stretch_body.robot')
+        print('stretch_body.robot: %.1f ms' % (times['stretch_body.robot'][1] / 1000.0))
+        self.assertNotImported(times, ['yaml', 'psutil', 'urdfpy', 'matplotlib', 'stretch_body.robot_sim',
+                                       'stretch_body.telemetry'])
+
+    def test_no_import_side_effects(self):
+        """Logging is configured by the first Device, not on import"""
+        print('test_no_import_side_effects')
+        log_dir = hello_utils.get_stretch_directory('log/')
+        n_logs = len(os.listdir(log_dir)) if os.path.isdir(log_dir) else 0
+        script = ("import logging, stretch_body.robot\n"
+                  "assert not logging.getLogger().handlers\n"
+                  "import stretch_body.device\n"
+                  "assert not stretch_body.device._logging_configured\n"
+                  "stretch_body.device.Device('lift')\n"
+                  "assert stretch_body.device._logging_configured and logging.getLogger().handlers\n")
+        subprocess.check_call([sys.executable, '-c', script])
+        self.assertEqual(len(os.listdir(log_dir)), n_logs + 1)
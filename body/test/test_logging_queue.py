@@ -0,0 +1,109 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import logging
+import threading
+import time
+import stretch_body.logging_queue as logging_queue
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+        self.threads = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+        self.threads.append(threading.current_thread().name)
+
+
+class TestLoggingQueue(unittest.TestCase):
+
+    def test_drop_oldest(self):
+        """The queue never blocks, and drops its oldest records when full"""
+        print('test_drop_oldest')
+        q = logging_queue.DropOldestQueue(3)
+        n_dropped = logging_queue.status['dropped']
+        for i in range(5):
+            q.put_nowait(i)
+        self.assertEqual(logging_queue.status['dropped'], n_dropped + 2)
+        self.assertEqual([q.get() for i in range(3)], [2, 3, 4])
+
+    def test_rate_limit(self):
+        """Records are rate limited per logger and message template"""
+        print('test_rate_limit')
+        f = logging_queue.RateLimitFilter(period_s=1.0, max_per_period=2)
+
+        def record(name, msg, t):
+            r = logging.LogRecord(name, logging.DEBUG, __file__, 0, msg, (), None)
+            r.created = t
+            return r
+        n_limited = logging_queue.status['rate_limited']
+        passed = [f.filter(record('lift', 'Pos %f', 100.0 + 0.1 * i)) for i in range(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+        self.assertTrue(f.filter(record('arm', 'Pos %f', 100.5)))
+        self.assertTrue(f.filter(record('lift', 'Vel %f', 100.5)))
+        self.assertTrue(f.filter(record('head', 'Comm error on ID 11. Total Errors 1.', 100.0)))
+        self.assertTrue(f.filter(record('head', 'Comm error on ID 11. Total Errors 2.', 100.1)))
+        self.assertFalse(f.filter(record('head', 'Comm error on ID 11. Total Errors 3.', 100.2)))
+        r = record('lift', 'Pos %f', 101.0)
+        self.assertTrue(f.filter(r))
+        self.assertEqual(r.msg, 'Pos %f [3 similar suppressed]')
+        self.assertEqual(logging_queue.status['rate_limited'], n_limited + 4)
+
+    def test_rate_limit_prune(self):
+        """Ended windows are pruned, and the filter can be called from many threads"""
+        print('test_rate_limit_prune')
+        f = logging_queue.RateLimitFilter(period_s=1.0, max_per_period=2)
+
+        def record(msg, t):
+            r = logging.LogRecord('lift', logging.DEBUG, __file__, 0, msg, (), None)
+            r.created = t
+            return r
+        errors = [ValueError('error %d' % i) for i in range(100)]
+        for i in range(100):
+            f.filter(record(errors[i], 100.0 + 0.01 * i)) #Not str: keyed by id
+        self.assertEqual(len(f.windows), 100)
+        self.assertTrue(f.filter(record('Pos %f', 101.5)))
+        self.assertEqual(len(f.windows), 50)
+        self.assertTrue(f.filter(record('Vel %f', 102.6)))
+        self.assertEqual(len(f.windows), 1)
+
+        n_limited = logging_queue.status['rate_limited']
+        passed = []
+        def run():
+            passed.extend([f.filter(record('Pos %f', 110.0)) for i in range(1000)])
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(passed.count(True), 2)
+        self.assertEqual(logging_queue.status['rate_limited'], n_limited + 3998)
+
+    def test_queue_logging(self):
+        """Root handlers are moved behind the queue, and written by the listener thread"""
+        print('test_queue_logging')
+        root = logging.getLogger()
+        h = ListHandler()
+        h.setFormatter(logging.Formatter('%(name)s: %(message)s'))
+        root.addHandler(h)
+        try:
+            self.assertTrue(logging_queue.start({'max_size': 100, 'rate_limit': {'period_s': 10.0, 'max_per_period': 3}}))
+            self.assertTrue(logging_queue.status['enabled'])
+            self.assertNotIn(h, root.handlers)
+            logger = logging.getLogger('test_logging_queue')
+            logger.setLevel(logging.DEBUG)
+            for i in range(10):
+                logger.info('Step %d', i)
+            logging_queue.stop()
+            self.assertFalse(logging_queue.status['enabled'])
+            self.assertIn(h, root.handlers)
+            self.assertEqual(h.messages, ['test_logging_queue: Step 0', 'test_logging_queue: Step 1', 'test_logging_queue: Step 2'])
+            self.assertNotIn(threading.current_thread().name, h.threads)
+        finally:
+            logging_queue.stop()
+            root.removeHandler(h)
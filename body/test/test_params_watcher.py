@@ -0,0 +1,109 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import copy
+import os
+import shutil
+import tempfile
+import time
+import stretch_body.hello_utils as hello_utils
+from stretch_body.robot_sim import RobotSim
+from stretch_body.params_watcher import ParamsWatcher, flatten_params, set_param
+
+
+class TestParamsWatcher(unittest.TestCase):
+
+    def setUp(self):
+        #Edit a copy of the fleet directory. The live params were loaded from the original, with the same content
+        self.fleet_path = os.environ['HELLO_FLEET_PATH']
+        self.tmp = tempfile.mkdtemp()
+        shutil.copytree(hello_utils.get_fleet_directory(), os.path.join(self.tmp, hello_utils.get_fleet_id()))
+        os.environ['HELLO_FLEET_PATH'] = self.tmp
+        self.robot = None
+        self.live = stretch_body.robot_params.RobotParams.get_params()[1]
+        self.saved = flatten_params(copy.deepcopy(self.live))
+
+    def tearDown(self):
+        if self.robot is not None:
+            self.robot.stop()
+        for path, value in self.saved.items(): #In place, as the devices hold references into the live params
+            set_param(self.live, path, value)
+        os.environ['HELLO_FLEET_PATH'] = self.fleet_path
+        shutil.rmtree(self.tmp)
+
+    def edit_user_params(self, params):
+        fn = stretch_body.robot_params.USER_PARAMS_FILE
+        up = hello_utils.read_fleet_yaml(fn)
+        hello_utils.overwrite_dict(up, params)
+        time.sleep(0.01) #Distinct mtime
+        hello_utils.write_fleet_yaml(fn, up)
+
+    def test_flatten(self):
+        self.assertEqual(flatten_params({'a': {'b': 1, 'c': [1, 2]}, 'd': {}}), {('a', 'b'): 1, ('a', 'c'): [1, 2], ('d',): {}})
+
+    def test_reload(self):
+        """Changed params reach the live devices, and changes to a moving joint wait for it to stop"""
+        sim = RobotSim()
+        sim.params = dict(sim.params, calibrated=1)
+        sim.time_scale = 5.0
+        r = self.robot = sim.make_robot()
+        r.startup()
+        w = r.params_watcher
+        w.startup(threaded=False)
+        self.assertEqual(w.step(), [])
+
+        i_contact_pos = r.lift.i_contact_pos
+        sentry = r.sentry.params['base_max_velocity']
+        self.edit_user_params({'lift': {'contact_thresh_N': [-60.0, 80.0]},
+                               'hello-motor-arm': {'gains': {'pKp_d': 11.0}},
+                               'pimu': {'config': {'bump_thresh': 25.0}},
+                               'robot_sentry': {'base_max_velocity': int(not sentry), 'rate_hz': {'base_max_velocity': 2.0}},
+                               'head_pan': {'id': 20, 'pid': [700, 0, 0]},
+                               'base_odometry': {'history_s': 5.0}})
+        r.pimu._dirty_config = False
+        results = dict([(c['param'], c['result']) for c in w.step()])
+        self.assertEqual(results, {'lift.contact_thresh_N': 'applied', 'hello-motor-arm.gains.pKp_d': 'applied',
+                                   'pimu.config.bump_thresh': 'applied', 'robot_sentry.base_max_velocity': 'applied',
+                                   'robot_sentry.rate_hz.base_max_velocity': 'applied', 'head_pan.id': 'restart',
+                                   'head_pan.pid': 'restart', 'base_odometry.history_s': 'restart'})
+        self.assertEqual(w.status['n_reload'], 1)
+        self.assertEqual(r.lift.params['contact_thresh_N'], [-60.0, 80.0])
+        self.assertNotEqual(r.lift.i_contact_pos, i_contact_pos)
+        self.assertAlmostEqual(r.lift.i_contact_pos, r.lift.translate_force_to_motor_current(80.0))
+        self.assertEqual(r.arm.motor.gains['pKp_d'], 11.0)
+        self.assertEqual(r.pimu.config['bump_thresh'], 25.0)
+        self.assertTrue(r.pimu._dirty_config)
+        self.assertEqual(r.sentry.params['base_max_velocity'], int(not sentry))
+        self.assertEqual(r.sentry.get_rule('base_max_velocity').rate_hz, 2.0)
+        self.assertNotEqual(r.base.odometry.params['history_s'], 5.0)
+        self.assertNotEqual(r.head.motors['head_pan'].params['id'], 20)
+        self.assertEqual(w.step(), [])
+
+        r.arm.move_to(0.5)
+        r.push_command()
+        self.assertTrue(r.arm.motor.wait_until(lambda: r.arm.motor.status['is_moving'], timeout=1.0))
+        self.edit_user_params({'arm': {'contact_thresh_N': [-70.0, 70.0]}})
+        self.assertEqual(w.step()[0]['result'], 'deferred')
+        self.assertEqual(w.status['pending'], ['arm.contact_thresh_N'])
+        self.assertNotEqual(r.arm.params['contact_thresh_N'], [-70.0, 70.0])
+        self.assertTrue(r.arm.motor.wait_until_at_setpoint(timeout=5.0))
+        self.assertTrue(r.arm.motor.wait_until(lambda: not r.arm.motor.status['is_moving'], timeout=1.0))
+        self.assertEqual(w.step()[0]['result'], 'applied')
+        self.assertEqual(r.arm.params['contact_thresh_N'], [-70.0, 70.0])
+        self.assertEqual(w.status['pending'], [])
+
+    def test_thread(self):
+        """Without a Robot, the watcher thread updates the live params"""
+        w = ParamsWatcher()
+        w.params = dict(w.params, poll_s=0.02)
+        w.startup()
+        try:
+            self.edit_user_params({'base_odometry': {'imu': {'gyro_weight': 0.5}}})
+            ts = time.time()
+            while w.status['n_applied'] == 0 and time.time() - ts < 2.0:
+                time.sleep(0.02)
+            self.assertEqual(stretch_body.robot_params.RobotParams.get_params()[1]['base_odometry']['imu']['gyro_weight'], 0.5)
+        finally:
+            w.stop()
@@ -0,0 +1,91 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import json
+import os
+import tempfile
+import time
+import stretch_body.profiler as profiler
+from stretch_body.robot_sim import RobotSim
+
+
+class TestProfiler(unittest.TestCase):
+
+    def tearDown(self):
+        profiler.disable()
+        profiler.reset()
+
+    def test_disabled(self):
+        """Spans are not recorded, and cost about a function call, when profiling is off"""
+        print('test_disabled')
+        profiler.disable()
+        n = 100000
+        ts = time.time()
+        for i in range(n):
+            with profiler.span('test.span'):
+                pass
+            profiler.end('test.phase', profiler.begin())
+        dt = (time.time() - ts) / n
+        print('Disabled span cost (us): %.3f' % (dt * 1e6))
+        self.assertTrue(dt < 5e-6)
+        self.assertEqual(profiler.get_stats(), {})
+
+    def test_spans(self):
+        """Spans are aggregated per name, and exported as a Chrome trace"""
+        print('test_spans')
+        profiler.enable()
+        for i in range(10):
+            with profiler.span('test.outer'):
+                t = profiler.begin()
+                time.sleep(0.002)
+                t = profiler.end('test.phase_a', t)
+                time.sleep(0.001)
+                profiler.end('test.phase_b', t)
+        profiler.disable()
+        with profiler.span('test.outer'):
+            pass
+        s = profiler.get_stats()
+        self.assertEqual(sorted(s.keys()), ['test.outer', 'test.phase_a', 'test.phase_b'])
+        self.assertEqual(s['test.outer']['count'], 10)
+        self.assertTrue(s['test.phase_a']['min_us'] >= 2000.0)
+        self.assertTrue(s['test.phase_a']['min_us'] <= s['test.phase_a']['p50_us'] <= s['test.phase_a']['max_us'])
+        self.assertTrue(s['test.outer']['total_ms'] >= s['test.phase_a']['total_ms'] + s['test.phase_b']['total_ms'])
+        summary = profiler.get_summary()
+        self.assertTrue(summary.splitlines()[1].startswith('test.outer'))
+
+        path = os.path.join(tempfile.mkdtemp(), 'trace.json')
+        profiler.write_chrome_trace(path)
+        with open(path) as f:
+            trace = json.load(f)
+        events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual(len(events), 30)
+        outer = [e for e in events if e['name'] == 'test.outer'][0]
+        a = [e for e in events if e['name'] == 'test.phase_a'][0]
+        self.assertTrue(outer['ts'] <= a['ts'] and a['ts'] + a['dur'] <= outer['ts'] + outer['dur'])
+        self.assertTrue(any([e['ph'] == 'M' and e['args']['name'] == 'MainThread' for e in trace['traceEvents']]))
+        os.remove(path)
+
+    def test_robot(self):
+        """The Robot startup, status loops, transport, monitor and sentry are instrumented"""
+        print('test_robot')
+        sim = RobotSim()
+        sim.params = dict(sim.params, calibrated=1)
+        sim.time_scale = 5.0
+        profiler.enable()
+        r = sim.make_robot()
+        try:
+            r.startup()
+            time.sleep(1.0)
+        finally:
+            r.stop()
+        profiler.disable()
+        profiler.pretty_print(20)
+        s = profiler.get_stats()
+        for name in ['startup.devices', 'startup.lift', 'startup.left_wheel', 'startup.head', 'pull_status.pimu',
+                     'pull_status.base', 'pull_status.head', 'rpc.hello-motor-lift.backend', 'cycle.non_dxl', 'cycle.dxl',
+                     'monitor.monitor_runstop', 'sentry.base_max_velocity']:
+            self.assertIn(name, s)
+        self.assertEqual(s['startup.lift']['count'], 1)
+        self.assertTrue(s['pull_status.pimu']['count'] > 10)
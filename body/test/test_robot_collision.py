@@ -0,0 +1,276 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+import stretch_body.robot_collision
+from stretch_body.robot_collision_table import CollisionLimitTable
+from stretch_body.stepper import MODE_POS_TRAJ, MODE_POS_PID
+
+
+class JointStub:
+    def __init__(self, pos):
+        self.status = {'pos': pos, 'vel': 0.0}
+        self.limits = [None, None]
+        self.n_set = 0
+
+    def set_soft_motion_limit_min(self, x, limit_type='user'):
+        self.limits[0] = x
+        self.n_set += 1
+
+    def set_soft_motion_limit_max(self, x, limit_type='user'):
+        self.limits[1] = x
+        self.n_set += 1
+
+
+class MotorStub:
+    def __init__(self):
+        self._command = {'mode': MODE_POS_PID, 'x_des': 0, 'v_des': 0, 'a_des': 0}
+
+
+class TrajectoryStub:
+    def is_active(self):
+        return False
+
+    def predict(self, *args):
+        return None
+
+
+class StepperJointStub(JointStub):
+    def __init__(self, pos):
+        JointStub.__init__(self, pos)
+        self.motor = MotorStub()
+        self.trajectory = TrajectoryStub()
+
+    def translate_to_motor_rad(self, x):
+        return x * 10.0
+
+    def move_to(self, x, v, a):
+        self.motor._command = {'mode': MODE_POS_TRAJ, 'x_des': x * 10.0, 'v_des': v * 10.0, 'a_des': a * 10.0}
+
+
+class ChainStub:
+    def __init__(self, motors, params={}):
+        self.motors = motors
+        self.joints = list(motors.keys())
+        self.params = params
+
+
+class RobotStub:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.trajectory = TrajectoryStub()
+        self.lift = StepperJointStub(0.5)
+        self.arm = StepperJointStub(0.2)
+        self.head = ChainStub({'head_pan': JointStub(0.0), 'head_tilt': JointStub(0.0)})
+        self.end_of_arm = ChainStub({'wrist_yaw': JointStub(0.0), 'stretch_gripper': JointStub(0.0)},
+                                    {'collision_models': ['collision_stretch_gripper']})
+
+    def get_status(self):
+        return {'lift': self.lift.status, 'arm': self.arm.status,
+                'head': dict([(k, m.status) for k, m in self.head.motors.items()]),
+                'end_of_arm': dict([(k, m.status) for k, m in self.end_of_arm.motors.items()])}
+
+
+class TestRobotCollision(unittest.TestCase):
+
+    def test_dirty_tracking(self):
+        """Verify models are only stepped when their joints move, and limits are only pushed when they change.
+        """
+        print('test_dirty_tracking')
+        r = RobotStub()
+        c = stretch_body.robot_collision.RobotCollision(r)
+        c.startup()
+        self.assertEqual(len(c.models), 2)
+        c.step()
+        self.assertEqual(c.status['n_evaluated'], 2)
+        n_set = r.lift.n_set
+        self.assertTrue(n_set > 0)
+
+        c.step()
+        self.assertEqual(c.status['n_evaluated'], 2)
+        self.assertEqual(c.status['n_skipped'], 2)
+        self.assertEqual(r.lift.n_set, n_set)
+
+        # Below tolerance: skipped
+        r.head.motors['head_pan'].status['pos'] = c.params['input_tolerance'] / 2
+        c.step()
+        self.assertEqual(c.status['n_skipped'], 4)
+
+        # The lift comes up into the camera. Both models depend on the lift.
+        r.head.motors['head_tilt'].status['pos'] = -1.0
+        r.lift.status['pos'] = 1.0
+        n_pushed = c.status['n_limits_pushed']
+        c.step()
+        self.assertEqual(c.status['n_evaluated'], 4)
+        self.assertEqual(r.lift.limits[1], 1.02)
+        self.assertEqual(c.status['n_limits_pushed'], n_pushed + 1)
+
+        # Arm only moves the gripper model
+        r.arm.status['pos'] = 0.3
+        c.step()
+        self.assertEqual(c.status['n_evaluated'], 5)
+        self.assertEqual(c.status['n_skipped'], 5)
+
+        # Disabling a model drops its limits
+        c.disable_model('collision_arm_camera')
+        c.step()
+        self.assertEqual(r.lift.limits[1], None)
+        c.enable_model('collision_arm_camera')
+        c.step()
+        self.assertEqual(r.lift.limits[1], 1.02)
+        c.pretty_print()
+
+    def test_matches_full_evaluation(self):
+        """Verify the incremental limits match stepping every model on every cycle.
+        """
+        print('test_matches_full_evaluation')
+        r = RobotStub()
+        c = stretch_body.robot_collision.RobotCollision(r)
+        c.startup()
+        for x_lift, x_arm, x_yaw in [(0.5, 0.2, 0.0), (0.2, 0.0, 3.0), (0.05, 0.05, 3.0), (0.05, 0.3, 3.0), (0.3, 0.3, 0.0)]:
+            r.lift.status['pos'] = x_lift
+            r.arm.status['pos'] = x_arm
+            r.end_of_arm.motors['wrist_yaw'].status['pos'] = x_yaw
+            c.step()
+            s = r.get_status()
+            for joint, j in [('lift', r.lift), ('arm', r.arm)]:
+                expected = [None, None]
+                for m in c.models:
+                    expected = m.limit(expected, m.step(s).get(joint, [None, None]))
+                self.assertEqual(j.limits, expected)
+
+    def test_step_batch(self):
+        """Verify the vectorized models match stepping them one configuration at a time.
+        """
+        print('test_step_batch')
+        r = RobotStub()
+        c = stretch_body.robot_collision.RobotCollision(r)
+        c.startup()
+        rng = np.random.RandomState(0)
+        n = 2000
+        x = {'lift': rng.uniform(0, 1.1, n), 'arm': rng.uniform(0, 0.52, n), 'head_pan': rng.uniform(-4, 1.7, n),
+             'head_tilt': rng.uniform(-1.5, 0.5, n), 'wrist_yaw': rng.uniform(-1.75, 4, n), 'stretch_gripper': np.zeros(n)}
+        # Include the zone boundaries
+        x['lift'][:4] = [0.085, 0.1, 0.9, 1.015]
+        x['head_pan'][:4] = [-.8, .8, 0.0, -0.0]
+        x['wrist_yaw'][:4] = [1.57, 0.0, 3.14, 1.57]
+        status = r.get_status()
+        for m in c.models:
+            w = m.step_batch(x)
+            w_loop = stretch_body.robot_collision.RobotCollisionModel.step_batch(m, x)
+            for joint in w_loop:
+                for k in range(2):
+                    self.assertTrue(np.allclose(w[joint][k], w_loop[joint][k], equal_nan=True), '%s %s' % (m.name, joint))
+            for i in [0, 1, 2, 3]:
+                expected = m.step(c.get_sample_status(status, dict([(j, x[j][i]) for j in x])))
+                for joint in expected:
+                    got = [None if np.isnan(v) else v for v in [w[joint][0][i], w[joint][1][i]]]
+                    self.assertEqual(got, expected[joint])
+
+    def test_predictive(self):
+        """Verify limits are tightened for a commanded motion before the joint gets near the danger zone.
+        """
+        print('test_predictive')
+        r = RobotStub()
+        c = stretch_body.robot_collision.RobotCollision(r)
+        c.startup()
+        r.head.motors['head_tilt'].status['pos'] = -1.0  # Camera looking down at the arm
+        r.lift.status['pos'] = 0.8
+        r.lift.move_to(1.1, 0.3, 2.0)  # Reaches 0.93 m in the horizon
+        c.params['predictive']['enabled'] = 0
+        c.step()
+        self.assertEqual(r.lift.limits[1], None)
+        c.params['predictive']['enabled'] = 1
+        c.step()
+        self.assertEqual(r.lift.limits[1], 1.02)
+        self.assertEqual(c.status['n_conflicts'], 0)
+
+        # The trapezoid accelerates from the current velocity, up to v_max, and stops at the goal
+        x = c.predict_trapezoid(0.0, 0.1, 1.0, 0.3, 1.0, np.array([0, 0.1, 0.2, 0.5, 10.0]))
+        self.assertTrue(np.allclose(x, [0, 0.015, 0.04, 0.1 * 0.2 + 0.5 * 0.04 + 0.3 * 0.3, 1.0]))
+
+        # Arm retracting toward the base with the gripper yawed in: the lift can't be lowered onto it,
+        # but isn't pushed up from where it is
+        r.lift.move_to(0.2, 0.3, 0.5)
+        r.lift.status['pos'] = 0.2
+        r.arm.status['pos'] = 0.4
+        r.end_of_arm.motors['wrist_yaw'].status['pos'] = 3.0
+        r.arm.move_to(0.0, 0.6, 2.0)
+        c.step()
+        self.assertEqual(r.lift.limits[0], 0.2)
+        r.arm.move_to(0.4, 0.6, 2.0)  # Change of plan
+        c.step()
+        self.assertEqual(r.lift.limits[0], None)
+
+    def test_predictive_benchmark(self):
+        """Verify a predictive step over a horizon of tens of samples fits in the loop budget.
+        """
+        print('test_predictive_benchmark')
+        r = RobotStub()
+        c = stretch_body.robot_collision.RobotCollision(r)
+        c.startup()
+        c.params['predictive']['enabled'] = 1
+        c.params['predictive']['n_samples'] = 50
+        budget_s = 1 / 25.0  # NonDXLStatusThread loop period
+        ts = []
+        for i in range(200):
+            r.lift.status['pos'] = 0.2 + 0.001 * i  # Keep every model dirty
+            r.lift.move_to(1.1, 0.3, 0.5)
+            t = time.time()
+            c.step()
+            ts.append(time.time() - t)
+        print('Predictive step, %d samples: mean %.3f ms, max %.3f ms (budget %.1f ms)' % (c.params['predictive']['n_samples'], 1000 * np.mean(ts),
+                                                                                           1000 * np.max(ts), 1000 * budget_s))
+        self.assertEqual(c.status['n_skipped'], 0)
+        self.assertLess(np.mean(ts), 0.1 * budget_s)
+
+    def test_tables(self):
+        """Verify table lookups are never looser than the models, and a table enabled model gets its limits from it.
+        """
+        print('test_tables')
+        r = RobotStub()
+        c = stretch_body.robot_collision.RobotCollision(r)
+        table_dir = tempfile.mkdtemp()
+        try:
+            c.params['table_dir'] = table_dir
+            for m in ['collision_arm_camera', 'collision_stretch_gripper']:
+                c.robot_params[m]['table']['enabled'] = 1
+            c.startup()
+            self.assertEqual(len(c.tables), 2)
+            self.assertEqual(len(os.listdir(table_dir)), 2)
+            for m in c.models:
+                t = c.tables[m.name]
+                result = t.check(m, n=20000, tolerance=c.params['max_interp_step'])
+                self.assertEqual(result['n_unsafe'], 0)
+                self.assertLess(result['n_over_tolerance'], 0.1 * 20000)
+
+                # Scalar and batch lookups agree, and the table survives a save / load
+                loaded = CollisionLimitTable.load(os.path.join(table_dir, CollisionLimitTable.get_key(m, t.grid) + '.npz'), t.max_interp_step)
+                self.assertEqual(loaded.columns, t.columns)
+                rng = np.random.RandomState(1)
+                x = dict([(j, rng.uniform(t.grid[j][0], t.grid[j][1], 50)) for j in t.joints])
+                w = loaded.lookup_batch(x)
+                for i in range(50):
+                    limits = t.lookup(dict([(j, x[j][i]) for j in t.joints]))
+                    for joint in limits:
+                        got = [None if np.isnan(v) else v for v in [w[joint][0][i], w[joint][1][i]]]
+                        for a, b in zip(got, limits[joint]):
+                            self.assertTrue(a == b or abs(a - b) < 1e-9, '%s %s' % (m.name, joint))
+
+            # Same scenario as test_dirty_tracking, looked up rather than stepped
+            r.head.motors['head_tilt'].status['pos'] = -1.0
+            r.lift.status['pos'] = 1.0
+            c.step()
+            self.assertAlmostEqual(r.lift.limits[1], 1.02, places=5)
+            c.pretty_print()
+        finally:
+            for m in ['collision_arm_camera', 'collision_stretch_gripper']:
+                c.robot_params[m]['table']['enabled'] = 0
+            shutil.rmtree(table_dir)
@@ -0,0 +1,60 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import stretch_body.robot_homing
+import time
+
+
+class HomingStub:
+    def __init__(self, duration, fail=False):
+        self.duration = duration
+        self.fail = fail
+
+    def home(self):
+        time.sleep(self.duration)
+        if self.fail:
+            raise Exception('hardstop not found')
+
+
+class RobotStub:
+    pass
+
+
+class TestRobotHoming(unittest.TestCase):
+
+    def test_dependencies(self):
+        """Verify independent devices home concurrently and dependents wait.
+        """
+        print('test_dependencies')
+        r = RobotStub()
+        r.head = HomingStub(0.3)
+        r.lift = HomingStub(0.2)
+        r.arm = HomingStub(0.1)
+        r.end_of_arm = None
+        h = stretch_body.robot_homing.RobotHoming(r)
+        report = h.home()
+        h.pretty_print()
+        self.assertTrue(report['total']['success'])
+        self.assertNotIn('end_of_arm', report)
+        self.assertTrue(report['head']['start'] < 0.05 and report['lift']['start'] < 0.05)
+        self.assertTrue(report['arm']['start'] >= report['lift']['end'])
+        self.assertTrue(report['total']['duration'] < 0.5)
+
+    def test_failed_dependency(self):
+        """Verify a device is skipped if a device it depends on fails to home.
+        """
+        print('test_failed_dependency')
+        r = RobotStub()
+        r.head = HomingStub(0.0)
+        r.lift = HomingStub(0.0, fail=True)
+        r.arm = HomingStub(0.0)
+        r.end_of_arm = HomingStub(0.0)
+        h = stretch_body.robot_homing.RobotHoming(r)
+        report = h.home()
+        self.assertFalse(report['total']['success'])
+        self.assertTrue(report['head']['success'])
+        self.assertFalse(report['lift']['success'])
+        self.assertTrue(report['arm']['skipped'])
+        self.assertTrue(report['end_of_arm']['skipped'])
@@ -1,4 +1,9 @@
 import unittest
+import os
+import shutil
+import tempfile
+import time
+import stretch_body.hello_utils as hello_utils
 import stretch_body.robot_params
 
 
@@ -51,3 +56,56 @@ class TestRobotParams(unittest.TestCase):
     def test_logging_filename_param(self):
         _, rp = stretch_body.robot_params.RobotParams.get_params()
         self.assertTrue(rp['logging']['handlers']['file_handler']['filename'].endswith('.log'))
+
+    def test_params_cache(self):
+        """The merged params are cached, and rebuilt when a source file changes"""
+        rp_module = stretch_body.robot_params
+        fleet_path = os.environ['HELLO_FLEET_PATH']
+        tmp = tempfile.mkdtemp()
+        try:
+            shutil.copytree(hello_utils.get_fleet_directory(), os.path.join(tmp, hello_utils.get_fleet_id()))
+            os.environ['HELLO_FLEET_PATH'] = tmp
+            up, rp = rp_module.load_params()
+            self.assertFalse(rp_module.cache_status['hit'])
+            self.assertTrue(os.path.isfile(rp_module.get_params_cache_path()))
+            self.assertTrue(rp_module.get_params_cache_path().startswith(tmp))
+
+            up2, rp2 = rp_module.load_params()
+            self.assertTrue(rp_module.cache_status['hit'])
+            self.assertEqual(up, up2)
+            self.assertEqual(rp['wrist_yaw'], rp2['wrist_yaw'])
+            self.assertEqual(rp['logging']['handlers']['console_handler'], rp2['logging']['handlers']['console_handler'])
+
+            time.sleep(0.01) #Distinct mtime
+            with open(hello_utils.get_fleet_directory() + rp_module.USER_PARAMS_FILE, 'a') as f:
+                f.write('\nrobot_sim:\n  time_scale: 3.0\n')
+            up3, rp3 = rp_module.load_params()
+            self.assertFalse(rp_module.cache_status['hit'])
+            self.assertEqual(rp3['robot_sim']['time_scale'], 3.0)
+            self.assertEqual(rp3['robot_sim']['step_s'], rp['robot_sim']['step_s'])
+            rp_module.load_params()
+            self.assertTrue(rp_module.cache_status['hit'])
+
+            with open(rp_module.get_params_cache_path(), 'wb') as f:
+                f.write(b'corrupt')
+            up4, rp4 = rp_module.load_params()
+            self.assertFalse(rp_module.cache_status['hit'])
+            self.assertEqual(rp4['robot_sim']['time_scale'], 3.0)
+
+            rp_module.load_params(use_cache=False)
+            self.assertFalse(rp_module.cache_status['hit'])
+            rp_module.clear_params_cache()
+            self.assertFalse(os.path.exists(rp_module.get_params_cache_path()))
+        finally:
+            os.environ['HELLO_FLEET_PATH'] = fleet_path
+            shutil.rmtree(tmp)
+
+    def test_import_time(self):
+        """A fresh process importing stretch_body.robot loads the params from the cache"""
+        from stretch_body.robot_benchmark import measure_import_time, print_import_time
+        r = measure_import_time(runs=2)
+        print_import_time(r)
+        self.assertEqual(r['no_cache']['cache_hits'], 0)
+        self.assertEqual(r['cold_cache']['cache_hits'], 0)
+        self.assertEqual(r['warm_cache']['cache_hits'], 2)
+        self.assertTrue(r['warm_cache']['params_p50_ms'] < r['no_cache']['params_p50_ms'])
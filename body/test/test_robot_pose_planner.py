@@ -0,0 +1,96 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import stretch_body.robot_pose_planner
+from stretch_body.device import Device
+import threading
+import time
+
+
+class MotorStub(Device):
+    """Joint that reaches its goal duration seconds after being commanded"""
+    def __init__(self, duration):
+        Device.__init__(self, name='motor_stub')
+        self.duration = duration
+        self.status = {'pos': 0.0, 'stalled': True, 'near_pos_setpoint': True, 'waiting_on_sync': False}
+
+    def move_to(self, x):
+        def motion():
+            self.status.update({'stalled': False, 'near_pos_setpoint': False})
+            self.notify_status()
+            time.sleep(self.duration)
+            self.status.update({'pos': x, 'stalled': True, 'near_pos_setpoint': True})
+            self.notify_status()
+        threading.Thread(target=motion).start()
+
+    def wait_until_stopped(self, timeout=15.0, start_timeout=0.25):
+        time.sleep(0.01)
+        return self.wait_until(lambda: self.status['stalled'], timeout=timeout)
+
+
+class StepperJointStub:
+    def __init__(self, duration, pos):
+        self.motor = MotorStub(duration)
+        self.motor.status['pos'] = pos
+        self.status = self.motor.status
+
+    def move_to(self, x):
+        self.motor.move_to(x)
+
+
+class ChainStub:
+    def __init__(self, durations):
+        self.motors = dict([(j, MotorStub(d)) for j, d in durations.items()])
+        self.joints = list(durations.keys())
+        self.params = {}
+
+    def move_to(self, j, x):
+        self.motors[j].move_to(x)
+
+    def stow(self):
+        for j in self.joints:
+            self.motors[j].move_to(0.0)
+
+
+class RobotStub:
+    def __init__(self, lift_pos):
+        self.params = stretch_body.robot_params.RobotParams.get_params()[1]['robot']
+        self.head = ChainStub({'head_pan': 0.3, 'head_tilt': 0.3})
+        self.lift = StepperJointStub(0.2, lift_pos)
+        self.arm = StepperJointStub(0.2, 0.3)
+        self.end_of_arm = ChainStub({'wrist_yaw': 0.1})
+
+    def push_command(self):
+        pass
+
+
+class TestRobotPosePlanner(unittest.TestCase):
+
+    def test_stow_lift_up(self):
+        """Verify the arm only retracts once the lift is up, while the head moves in parallel.
+        """
+        print('test_stow_lift_up')
+        r = RobotStub(lift_pos=0.0)
+        p = stretch_body.robot_pose_planner.RobotPosePlanner(r)
+        t = p.stow()
+        self.assertFalse(t.done())
+        report = t.wait(timeout=5.0)
+        t.pretty_print()
+        self.assertTrue(t.succeeded())
+        self.assertTrue(report['arm']['start'] >= report['lift']['end'])
+        self.assertTrue(report['end_of_arm']['start'] >= report['arm']['end'])
+        self.assertTrue(report['head_pan']['start'] < 0.1)
+        self.assertTrue(report['total']['duration'] < report['total']['serial_duration'])
+
+    def test_stow_lift_down(self):
+        """Verify the lift only comes down once the arm and tool are in.
+        """
+        print('test_stow_lift_down')
+        r = RobotStub(lift_pos=1.0)
+        p = stretch_body.robot_pose_planner.RobotPosePlanner(r)
+        report = p.stow().wait(timeout=5.0)
+        self.assertTrue(report['total']['success'])
+        self.assertTrue(report['arm']['start'] < 0.1)
+        self.assertTrue(report['lift']['start'] >= max(report['arm']['end'], report['end_of_arm']['end']))
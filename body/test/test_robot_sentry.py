@@ -0,0 +1,122 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import stretch_body.robot
+from stretch_body.robot_sentry import SentryRule
+from stretch_body.wrist_yaw import WristYaw
+
+
+class CustomWristYaw(WristYaw):
+    def __init__(self):
+        WristYaw.__init__(self)
+        self.n_sentry = 0
+
+    def step_sentry(self, robot):
+        self.n_sentry += 1
+
+
+class TestRobotSentry(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.r = stretch_body.robot.Robot() # Not started: no hardware needed
+        for c in [cls.r.head, cls.r.end_of_arm]:
+            for k in c.motors:
+                c.status[k] = c.motors[k].status
+
+    def setUp(self):
+        self.switches = dict([(k, v) for k, v in self.r.sentry.params.items() if k != 'rate_hz'])
+        self.r.sentry.startup()
+        self.r.sentry.ts_last_step = None
+
+    def tearDown(self):
+        self.r.sentry.params.update(self.switches)
+
+    def run_sentry(self, duration, rate_hz=25.0, t0=1000.0):
+        for i in range(int(duration * rate_hz)):
+            self.r.sentry.step(now=t0 + i / rate_hz)
+
+    def test_rules(self):
+        """Verify rules are made for each sentry, and are evaluated at their own rates.
+        """
+        print('test_rules')
+        s = self.r.sentry
+        names = [x.name for x in s.rules]
+        for n in ['base_max_velocity', 'lift.motor.stepper_is_moving_filter', 'base.right_wheel.stepper_is_moving_filter',
+                  'head.head_tilt.dynamixel_stop_on_runstop', 'end_of_arm.wrist_yaw.wrist_yaw_overload',
+                  'end_of_arm.stretch_gripper.stretch_gripper_overload']:
+            self.assertIn(n, names)
+        self.assertNotIn('base_fan_control', names) #Opt in, as the Robot didn't run it before
+        s.params['base_fan_control_rule'] = 1
+        s.params['base_fan_control'] = 1
+        s.startup()
+        n_step = s.status['n_step']
+        self.run_sentry(4.0)
+        self.assertEqual(s.get_rule('head.head_pan.dynamixel_stop_on_runstop').status['n_eval'], 100)
+        self.assertEqual(s.get_rule('base_max_velocity').status['n_eval'], 50)
+        self.assertEqual(s.get_rule('base_fan_control').status['n_eval'], 4)
+        self.assertEqual(s.status['n_step'], n_step + 100)
+
+        # Switches turn rules off (and on) at run time
+        s.params['base_max_velocity'] = 0
+        self.run_sentry(1.0, t0=1004.0)
+        self.assertEqual(s.get_rule('base_max_velocity').status['n_eval'], 50)
+        self.assertEqual(s.get_rule('head.head_pan.dynamixel_stop_on_runstop').status['n_eval'], 125)
+        s.pretty_print()
+
+    def test_actions(self):
+        """Verify rule actions act on the snapshot, and triggers are counted.
+        """
+        print('test_actions')
+        s = self.r.sentry
+        s.params['base_max_velocity'] = 1
+        self.r.lift.status['pos'] = 0.1
+        self.r.arm.status['pos'] = 0.0
+        self.r.end_of_arm.motors['wrist_yaw'].status['pos'] = 3.0
+        self.r.base.fast_motion_allowed = False
+        self.run_sentry(0.2)
+        self.assertTrue(self.r.base.fast_motion_allowed)
+        self.r.lift.status['pos'] = 0.9
+        self.run_sentry(0.2, t0=1001.0)
+        self.assertFalse(self.r.base.fast_motion_allowed)
+        self.assertEqual(s.get_rule('base_max_velocity').status['n_trigger'], 2)
+
+        # Runstop disables the servos once, then re-enables them on release
+        head_pan = self.r.head.motors['head_pan']
+        calls = []
+        head_pan.hw_valid = True
+        head_pan.disable_torque = lambda: calls.append('disable')
+        head_pan.enable_torque = lambda: calls.append('enable')
+        s.params['dynamixel_stop_on_runstop'] = 1
+        self.r.pimu.status['runstop_event'] = True
+        self.run_sentry(0.4, t0=1002.0)
+        self.r.pimu.status['runstop_event'] = False
+        self.run_sentry(0.4, t0=1003.0)
+        self.assertEqual(calls, ['disable', 'enable'])
+        head_pan.hw_valid = False
+        del head_pan.disable_torque
+        del head_pan.enable_torque
+
+    def test_custom_and_failing_rules(self):
+        """Verify servos with their own step_sentry still run, and a failing rule doesn't stop the others.
+        """
+        print('test_custom_and_failing_rules')
+        s = self.r.sentry
+        wrist_yaw = self.r.end_of_arm.motors['wrist_yaw']
+        custom = CustomWristYaw()
+        self.r.end_of_arm.motors['wrist_yaw'] = custom
+        try:
+            s.startup()
+            self.assertTrue(s.get_rule('end_of_arm.wrist_yaw.wrist_yaw_overload') is None)
+            s.add_rule(SentryRule('broken', None, 25.0, ['pimu.no_such_field'], lambda v: True))
+            s.add_rule(SentryRule('failing', None, 25.0, [], lambda v: 1 / 0))
+            self.run_sentry(1.0)
+        finally:
+            self.r.end_of_arm.motors['wrist_yaw'] = wrist_yaw
+        self.assertEqual(custom.n_sentry, 13)
+        self.assertEqual(s.get_rule('failing').status['n_error'], 25)
+        self.assertEqual(s.get_rule('broken').status['n_error'], 25)
+        self.assertEqual(s.get_rule('head.head_pan.dynamixel_stop_on_runstop').status['n_eval'], 25)
+        self.assertEqual(s.get_rule('end_of_arm.wrist_yaw.step_sentry').status['n_eval'], 13)
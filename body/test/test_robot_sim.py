@@ -0,0 +1,130 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import time
+import stretch_body.transport as transport
+import stretch_body.stepper as stepper
+from stretch_body.robot_sim import RobotSim
+from stretch_body.robot_benchmark import RobotBenchmark
+
+
+class TestRobotSim(unittest.TestCase):
+
+    def make_robot(self, calibrated):
+        self.sim = RobotSim()
+        self.sim.params = dict(self.sim.params, calibrated=calibrated)
+        self.sim.time_scale = 5.0
+        self.robot = self.sim.make_robot()
+        self.robot.startup()
+        return self.robot
+
+    def tearDown(self):
+        self.robot.stop()
+        self.assertNotIn('/dev/hello-motor-lift', transport.rpc_backends)
+
+    def test_home_and_stow(self):
+        """Startup, homing and stow run as on the hardware"""
+        print('test_home_and_stow')
+        r = self.make_robot(calibrated=0)
+        for d in [r.pimu, r.wacc, r.lift.motor, r.arm.motor, r.base.left_wheel, r.base.right_wheel]:
+            self.assertTrue(d.hw_valid)
+        self.assertTrue(r.head.motors['head_pan'].hw_valid)
+        self.assertAlmostEqual(r.pimu.imu.status['az'], 9.81, places=2)
+        self.assertTrue(11.0 < r.pimu.status['voltage'] < 13.0)
+        self.assertFalse(r.is_calibrated())
+
+        report = r.home()
+        self.assertTrue(report['total']['success'])
+        self.assertTrue(r.is_calibrated())
+        self.assertAlmostEqual(r.lift.status['pos'], 0.6, places=3)
+        self.assertEqual(r.lift.motor.status['guarded_event'], 1)
+
+        report = r.stow()
+        self.assertTrue(report['total']['success'])
+        time.sleep(0.1)
+        self.assertAlmostEqual(r.lift.status['pos'], r.params['stow']['lift'], places=3)
+        self.assertAlmostEqual(r.arm.status['pos'], r.params['stow']['arm'], places=3)
+
+    def test_sync_and_runstop(self):
+        """Stepper commands wait for the motor sync, and the runstop stops the joints"""
+        print('test_sync_and_runstop')
+        r = self.make_robot(calibrated=1)
+        self.assertTrue(r.is_calibrated())
+        r.lift.move_to(0.6)
+        r.lift.push_command()
+        self.assertTrue(r.lift.motor.wait_until(lambda: r.lift.motor.status['waiting_on_sync'], timeout=1.0))
+        r.push_command()
+        self.assertTrue(r.lift.motor.wait_until_at_setpoint(timeout=5.0))
+        self.assertAlmostEqual(r.lift.status['pos'], 0.6, places=3)
+        self.assertTrue(1.0 < r.lift.motor.status['current'] < 1.5) #Holding against gravity
+
+        r.base.rotate_by(0.5)
+        r.push_command()
+        self.assertTrue(r.base.left_wheel.wait_until_at_setpoint(timeout=5.0))
+        time.sleep(0.1)
+        self.assertAlmostEqual(r.base.status['theta'], 0.5, delta=0.05)
+
+        r.arm.move_to(0.5)
+        r.push_command()
+        self.assertTrue(r.arm.motor.wait_until(lambda: r.arm.motor.status['is_moving'], timeout=1.0))
+        self.sim.set_runstop(True)
+        self.assertTrue(r.arm.motor.wait_until(lambda: r.arm.motor.status['runstop_on'] and not r.arm.motor.status['is_moving'], timeout=1.0))
+        x = r.arm.status['pos']
+        self.assertTrue(0.1 < x < 0.5)
+        time.sleep(0.2)
+        self.assertTrue(r.pimu.status['runstop_event'])
+        self.assertAlmostEqual(r.arm.status['pos'], x)
+        r.pimu.runstop_event_reset()
+        r.push_command()
+        self.assertTrue(r.arm.motor.wait_until(lambda: not r.arm.motor.status['runstop_on'], timeout=1.0))
+
+    def test_benchmark(self):
+        print('test_benchmark')
+        r = self.make_robot(calibrated=1)
+        b = RobotBenchmark(r)
+        s = b.run(duration_s=1.0, latency_trials=2)
+        b.pretty_print()
+        self.assertTrue(s['loops']['non_dxl']['rate_hz'] > 15.0)
+        self.assertTrue(s['subsystems']['lift']['calls'] > 10)
+        self.assertEqual(sorted(s['latency'].keys()), ['arm', 'base', 'head_pan', 'lift'])
+        for l in s['latency'].values():
+            self.assertEqual(l['timeouts'], 0)
+        self.assertFalse('pull_status' in r.lift.__dict__)
+        self.assertEqual(r.lift.motor.status['mode'], stepper.MODE_POS_TRAJ_INCR)
+
+    def test_joint_trajectory(self):
+        """A trajectory streamed to a joint of the Robot (in sync mode) moves the joint"""
+        print('test_joint_trajectory')
+        r = self.make_robot(calibrated=1)
+        self.assertTrue(r.lift.motor.gains['enable_sync_mode'])
+        x0 = r.lift.status['pos']
+        r.lift.trajectory.add([0, 0.5], [x0, x0 + 0.1])
+        self.assertTrue(r.lift.trajectory.wait(timeout=5.0))
+        self.assertTrue(r.lift.motor.wait_until_at_setpoint(timeout=5.0))
+        self.assertFalse(r.lift.motor.status['waiting_on_sync'])
+        self.assertAlmostEqual(r.lift.status['pos'], x0 + 0.1, places=3)
+
+        x0 = r.base.status['left_wheel']['pos']
+        r.base.trajectory.add([0, 0.5], [0, 0.05])
+        self.assertTrue(r.base.trajectory.wait(timeout=5.0))
+        self.assertTrue(r.base.left_wheel.wait_until_at_setpoint(timeout=5.0))
+        self.assertAlmostEqual(r.base.motor_rad_to_translate(r.base.status['left_wheel']['pos'] - x0), 0.05, places=3)
+
+    def test_wait_until_at_setpoint(self):
+        """A stepper waiting on the motor sync is not at its setpoint, and waits time out"""
+        print('test_wait_until_at_setpoint')
+        r = self.make_robot(calibrated=1)
+        x0 = r.lift.status['pos']
+        r.lift.move_to(x0 + 0.05)
+        r.lift.push_command() #Without the sync, the lift holds the command
+        ts = time.time()
+        self.assertFalse(r.lift.motor.wait_until_at_setpoint(timeout=0.3))
+        self.assertTrue(time.time() - ts >= 0.3)
+        self.assertTrue(r.lift.motor.status['waiting_on_sync'])
+        self.assertAlmostEqual(r.lift.status['pos'], x0, places=3)
+        r.pimu.trigger_motor_sync()
+        self.assertTrue(r.lift.motor.wait_until_at_setpoint(timeout=5.0))
+        self.assertAlmostEqual(r.lift.status['pos'], x0 + 0.05, places=3)
+        self.assertFalse(r.lift._Lift__wait_for_contact(timeout=0.2)) #No contact in free motion
@@ -0,0 +1,127 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import logging
+import threading
+import time
+import stretch_body.robot_startup as robot_startup
+from stretch_body.robot_sim import RobotSim
+
+
+class FakeDevice:
+    def __init__(self, usb, delay=0.0, result=True):
+        self.usb = usb
+        self.delay = delay
+        self.result = result
+
+    def startup(self):
+        time.sleep(self.delay)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class TestRobotStartup(unittest.TestCase):
+
+    def test_jobs(self):
+        """Devices that share a port are started in the same job"""
+        print('test_jobs')
+        devices = {'a': FakeDevice('/dev/a'), 'b': FakeDevice('/dev/b'), 'c': FakeDevice('/dev/a'), 'd': FakeDevice(None)}
+        jobs = sorted(robot_startup.get_jobs(devices))
+        self.assertEqual(jobs, [['a', 'c'], ['b'], ['d']])
+
+    def test_isolation(self):
+        """Devices start concurrently, and a failing or hung device does not hold up the others"""
+        print('test_isolation')
+        devices = {'ok': FakeDevice('/dev/a', delay=0.2), 'fail': FakeDevice('/dev/b', delay=0.2, result=False),
+                   'raise': FakeDevice('/dev/c', result=ValueError('no reply')), 'hang': FakeDevice('/dev/d', delay=2.0)}
+        ts = time.time()
+        s = robot_startup.start_devices(devices, timeout=0.5)
+        self.assertTrue(time.time() - ts < 1.0)
+        self.assertTrue(s['ok']['success'])
+        self.assertTrue(s['ok']['duration'] < 0.3)
+        self.assertEqual(s['fail']['error'], 'startup failed')
+        self.assertEqual(s['raise']['error'], 'ValueError: no reply')
+        self.assertEqual(s['hang']['error'], 'timeout')
+        self.assertTrue(s['hang']['timed_out'])
+        self.assertFalse(s['ok']['timed_out'])
+        self.assertFalse(s['total']['success'])
+
+        s = robot_startup.start_devices(dict([(k, devices[k]) for k in ['ok', 'fail']]), parallel=False)
+        self.assertTrue(s['fail']['start'] >= s['ok']['end'])
+        self.assertTrue(s['total']['duration'] >= 0.4)
+
+    def test_late_failure(self):
+        """A device that fails after the timeout is logged as completing late, with its error"""
+        print('test_late_failure')
+        logger = logging.getLogger('test_robot_startup')
+        devices = {'ok': FakeDevice('/dev/a'), 'late': FakeDevice('/dev/b', delay=0.5, result=False)}
+        with self.assertLogs(logger, level='WARNING') as cm:
+            s = robot_startup.start_devices(devices, timeout=0.2, logger=logger)
+            self.assertEqual(s['late']['error'], 'timeout')
+            time.sleep(0.5)
+        self.assertTrue(s['late']['timed_out'])
+        self.assertEqual(s['late']['error'], 'startup failed')
+        self.assertIn('WARNING:test_robot_startup:Startup of late completed after the timeout (FAILED: startup failed)', cm.output)
+
+    def start_robot(self, parallel):
+        sim = RobotSim()
+        sim.params = dict(sim.params, rpc_time_s=0.02, calibrated=1)
+        r = sim.make_robot()
+        r.device_startup.params = dict(r.device_startup.params, parallel=parallel)
+        r.robot_params['robot_startup']['parallel'] = parallel #Read by the Base
+        try:
+            self.assertTrue(r.startup())
+            r.device_startup.pretty_print()
+            return r.device_startup.status
+        finally:
+            r.robot_params['robot_startup']['parallel'] = 1
+            r.stop()
+
+    def test_robot(self):
+        """Robot bring-up takes about as long as its slowest device"""
+        print('test_robot')
+        serial = self.start_robot(parallel=0)
+        parallel = self.start_robot(parallel=1)
+        for k in ['pimu', 'base', 'lift', 'arm', 'head', 'wacc', 'end_of_arm']:
+            self.assertTrue(parallel[k]['success'])
+        slowest = max([parallel[k]['duration'] for k in parallel if k != 'total'])
+        self.assertTrue(parallel['total']['duration'] < 1.5 * slowest)
+        self.assertTrue(parallel['total']['duration'] < 0.6 * serial['total']['duration'])
+
+    def test_robot_timeout(self):
+        """The Robot leaves a device that is still starting past the timeout alone until its startup completes"""
+        print('test_robot_timeout')
+        sim = RobotSim()
+        sim.params = dict(sim.params, calibrated=1)
+        r = sim.make_robot()
+        r.device_startup.params = dict(r.device_startup.params, timeout_s=0.5)
+        starting = []
+        wacc_startup, wacc_pull_status = r.wacc.startup, r.wacc.pull_status
+        def slow_startup():
+            starting.append(threading.current_thread())
+            time.sleep(1.0)
+            ok = wacc_startup()
+            starting.pop()
+            return ok
+        pulls = {'starting': 0, 'started': 0}
+        def pull_status():
+            if threading.current_thread() not in starting: #Wacc.startup pulls the status itself
+                pulls['starting' if len(starting) else 'started'] += 1
+            wacc_pull_status()
+        r.wacc.startup, r.wacc.pull_status = slow_startup, pull_status
+        try:
+            self.assertFalse(r.startup())
+            self.assertEqual(r.device_startup.status['wacc']['error'], 'timeout')
+            self.assertFalse(r.device_startup.is_started('wacc'))
+            self.assertTrue(r.device_startup.status['lift']['success'])
+            r.push_command()
+            time.sleep(1.0)
+            self.assertEqual(pulls['starting'], 0)
+            self.assertTrue(r.device_startup.is_started('wacc'))
+            self.assertTrue(r.device_startup.status['wacc']['success'])
+            self.assertTrue(pulls['started'] > 0)
+        finally:
+            r.stop()
@@ -0,0 +1,77 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import stretch_body.robot_trajectory
+import stretch_body.dynamixel_sim as dxl_sim
+import stretch_body.lift
+import stretch_body.head
+from stretch_body.stepper import MODE_POS_TRAJ_INCR
+import threading
+import time
+
+
+class PimuStub:
+    def __init__(self):
+        self.n_sync = 0
+
+    def trigger_motor_sync(self):
+        self.n_sync += 1
+
+
+class RobotStub:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.params = {'use_collision_manager': 0}
+        self.pimu = PimuStub()
+        self.lift = stretch_body.lift.Lift()
+        self.arm = None
+        self.base = None
+        self.head = stretch_body.head.Head()
+        self.end_of_arm = None
+
+
+class TestRobotTrajectory(unittest.TestCase):
+
+    def test_synchronized_execution(self):
+        """Verify stepper and Dynamixel joints are fired together each tick and reach the trajectory end.
+        """
+        print('test_synchronized_execution')
+        p = stretch_body.robot_params.RobotParams.get_params()[1]
+        usb = p['head_pan']['usb_name']
+        bus = dxl_sim.register_sim_bus(usb, dxl_sim.DynamixelSimBus(baud=p['head']['baud']))
+        bus.add_servo(p['head_pan']['id'], pos_ticks=p['head_pan']['zero_t'])
+        bus.add_servo(p['head_tilt']['id'], pos_ticks=p['head_tilt']['zero_t'])
+        try:
+            r = RobotStub()
+            self.assertTrue(r.head.startup())
+            sent = []
+            set_command = r.lift.motor.set_command
+            def spy(**kwargs):
+                sent.append(kwargs)
+                set_command(**kwargs)
+            r.lift.motor.set_command = spy
+
+            traj = stretch_body.robot_trajectory.RobotTrajectory(r)
+            self.assertFalse(traj.execute({'wrist_pitch': {'t': [0, 1], 'x': [0, 1]}}))
+            self.assertTrue(traj.execute({'lift': {'t': [0.2, 0.6], 'x': [0.1, 0.2]},
+                                          'head_pan': {'t': [0.0, 0.6], 'x': [0.0, -0.5]}}, blocking=True))
+            traj.pretty_print()
+            n_ticks = traj.status['n_ticks']
+            self.assertTrue(n_ticks >= 0.6 * traj.params['rate_hz'])
+            self.assertEqual(r.pimu.n_sync, n_ticks)
+            incr = [c['x_des'] for c in sent if c['mode'] == MODE_POS_TRAJ_INCR]
+            self.assertAlmostEqual(sum(incr), r.lift.translate_to_motor_rad(0.2), places=6)
+            for c in sent: #The lift's gravity feedforward and contact thresholds are kept
+                self.assertEqual((c['stiffness'], c['i_feedforward'], c['i_contact_pos'], c['i_contact_neg']),
+                                 (r.lift.stiffness, r.lift.i_feedforward, r.lift.i_contact_pos, r.lift.i_contact_neg))
+            latency = traj.status['issue_latency_ms']
+            self.assertTrue(latency['head_pan']['max'] > 0.0)
+            self.assertTrue(latency['head_pan']['mean'] >= latency['lift']['mean']) #Fired after the steppers
+            time.sleep(0.5)
+            r.head.pull_status()
+            self.assertAlmostEqual(r.head.status['head_pan']['pos'], -0.5, places=2)
+            r.head.stop()
+        finally:
+            dxl_sim.unregister_sim_bus(usb)
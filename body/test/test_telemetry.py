@@ -0,0 +1,106 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import stretch_body.robot
+from stretch_body.telemetry import TelemetryRecorder, TelemetryReader, flatten_status
+
+
+class TestTelemetry(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.r = stretch_body.robot.Robot() # Not started: no hardware needed
+        for c in [cls.r.head, cls.r.end_of_arm]:
+            for k in c.motors:
+                c.status[k] = c.motors[k].status
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def record(self, n, chunk_rows=100, compress=0, stop=True):
+        t = TelemetryRecorder(self.r.status, path=os.path.join(self.dir, 'rec'), metadata={'run': 'test'})
+        t.params = dict(t.params, chunk_rows=chunk_rows, compress=compress)
+        t.chunk_rows = chunk_rows
+        t.startup(threaded=False)
+        for i in range(n):
+            self.r.lift.status['pos'] = 0.001 * i
+            self.r.pimu.status['runstop_event'] = bool(i % 2)
+            self.r.end_of_arm.motors['wrist_yaw'].status['pos'] = -0.01 * i
+            t.step(t=1000.0 + 0.01 * i)
+        if stop:
+            t.stop()
+        return t
+
+    def check(self, n):
+        rd = TelemetryReader(os.path.join(self.dir, 'rec'))
+        self.assertEqual(rd.n_rows, n)
+        self.assertEqual(rd.metadata, {'run': 'test'})
+        self.assertEqual(rd.kinds['pimu.runstop_event'], 'b')
+        d = rd.read(['_t', 'lift.pos', 'pimu.runstop_event'], start=95, stop=205)
+        self.assertTrue(np.allclose(d['_t'], 1000.0 + 0.01 * np.arange(95, 205)))
+        self.assertTrue(np.allclose(d['lift.pos'], 0.001 * np.arange(95, 205)))
+        self.assertEqual(list(d['pimu.runstop_event'][:3]), [1.0, 0.0, 1.0])
+        self.assertTrue(np.allclose(rd.column('end_of_arm.wrist_yaw.pos'), -0.01 * np.arange(n)))
+        self.assertEqual(rd.find_row(1001.005), 101)
+        return rd
+
+    def test_schema(self):
+        """Every numeric status field is a column, named by its path"""
+        print('test_schema')
+        names = ['.'.join([str(k) for k in p]) for p, kind in flatten_status(self.r.status)]
+        for n in ['pimu.imu.ax', 'pimu.cliff_range.0', 'lift.motor.pos', 'base.x', 'head.head_pan.pos', 'logging.dropped']:
+            self.assertIn(n, names)
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_record_and_read(self):
+        """Rows are read back across chunks, lazily from the memory mapped chunk files"""
+        print('test_record_and_read')
+        t = self.record(250)
+        self.assertEqual(t.status['n_chunks'], 3)
+        rd = self.check(250)
+        self.assertTrue(isinstance(rd.column('lift.pos', start=10, stop=20), np.memmap))
+        self.assertTrue(isinstance(rd.read(['lift.pos', 'pimu.imu.ax'], start=10, stop=20)['lift.pos'], np.ndarray))
+
+    def test_compressed(self):
+        """Closed chunks are compressed by a separate thread, and read back while and after it compresses"""
+        print('test_compressed')
+        t = self.record(250, compress=1, stop=False)
+        self.assertTrue(t.compress_thread.is_alive())
+        t.chunk.flush()
+        self.check(250)
+        t.stop()
+        self.assertTrue(t.compress_thread is None)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.dir, 'rec')))[:3], ['chunk_000000.npz', 'chunk_000001.npz', 'chunk_000002.npz'])
+        self.check(250)
+
+    def test_recover_open_chunk(self):
+        """A recording that wasn't stopped is read up to its last row"""
+        print('test_recover_open_chunk')
+        t = self.record(250, stop=False)
+        t.chunk.flush()
+        self.check(250)
+        t.stop()
+
+    def test_sample_time(self):
+        """Recording a sample of the full Robot status stays well under 1% of a 100Hz period"""
+        print('test_sample_time')
+        t = TelemetryRecorder(self.r.status, path=os.path.join(self.dir, 'rec'))
+        t.startup(threaded=False)
+        n = 2000
+        ts = time.time()
+        for i in range(n):
+            t.step()
+        dt = (time.time() - ts) / n
+        t.stop()
+        print('%d columns: %.1f us per sample, %.2f%% CPU at 100Hz' % (t.status['n_columns'], dt * 1e6, dt * 100 * 100))
+        self.assertLess(dt, 0.0001)
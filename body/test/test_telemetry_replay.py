@@ -0,0 +1,93 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import stretch_body.robot
+import stretch_body.transport as transport
+from stretch_body.stepper import MODE_POS_TRAJ
+from stretch_body.telemetry import TelemetryRecorder
+from stretch_body.telemetry_replay import TelemetryReplay
+
+
+class TestTelemetryReplay(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Record a 2s session of the lift rising, the base driving forward and a runstop"""
+        cls.dir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.dir, 'rec')
+        r = stretch_body.robot.Robot() # Not started: no hardware needed
+        for c in [r.head, r.end_of_arm]:
+            for k in c.motors:
+                c.status[k] = c.motors[k].status
+        rec = TelemetryRecorder(r.status, path=cls.path)
+        rec.startup(threaded=False)
+        for i in range(200):
+            t = 1000.0 + 0.01 * i
+            r.lift.motor.status['pos'] = 0.01 * i
+            r.lift.motor.status['pos_calibrated'] = True
+            for w in [r.base.left_wheel, r.base.right_wheel]:
+                w.status['pos'] = 0.02 * i
+                w.status['timestamp'] = t
+            r.pimu.status['runstop_event'] = i >= 100
+            r.head.motors['head_pan'].status['pos'] = -0.001 * i
+            rec.step(t=t)
+        rec.stop()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def test_stepped(self):
+        """The Robot status follows the recording, derived status is computed again, and commands are captured"""
+        print('test_stepped')
+        replay = TelemetryReplay(self.path, stepped=True)
+        robot = replay.make_robot()
+        try:
+            robot.startup()
+            self.assertTrue(robot.lift.motor.hw_valid)
+            self.assertFalse(robot.pimu.status['runstop_event'])
+            self.assertTrue(replay.step(150))
+            self.assertEqual(replay.get_time(), 1001.5)
+            self.assertAlmostEqual(robot.lift.motor.status['pos'], 1.5)
+            self.assertAlmostEqual(robot.lift.status['pos'], robot.lift.motor_rad_to_translate_m(1.5))
+            self.assertTrue(robot.pimu.status['runstop_event'])
+            self.assertAlmostEqual(robot.head.status['head_pan']['pos'], -0.15)
+            self.assertAlmostEqual(robot.base.status['x'], 3.0 * robot.base.meters_per_motor_rad, places=6)
+
+            robot.lift.move_to(0.3)
+            robot.push_command()
+            robot.head.move_to('head_pan', 0.2)
+            c = replay.get_commands(device='lift.motor', name='command')[-1]
+            self.assertEqual(c['t'], 1001.5)
+            self.assertEqual(c['data']['command']['mode'], MODE_POS_TRAJ)
+            self.assertAlmostEqual(c['data']['command']['x_des'], robot.lift.translate_to_motor_rad(0.3))
+            c = replay.get_commands(device='head.head_pan', name='move_to')[-1]
+            self.assertEqual(c['data']['args'][0], 0.2)
+            self.assertFalse(replay.step(100))
+            self.assertTrue(replay.is_done())
+            replay.pretty_print()
+        finally:
+            robot.stop()
+            replay.close()
+        self.assertNotIn('/dev/hello-motor-lift', transport.rpc_backends)
+
+    def test_speed(self):
+        """The recording plays at a multiple of real time"""
+        print('test_speed')
+        replay = TelemetryReplay(self.path, speed=2.0)
+        robot = replay.make_robot()
+        try:
+            robot.startup()
+            time.sleep(0.5)
+            row = replay.get_row()
+            self.assertTrue(80 < row < 150)
+            self.assertAlmostEqual(robot.lift.motor.status['pos'], 0.01 * row, delta=0.2)
+        finally:
+            robot.stop()
+            replay.close()
@@ -0,0 +1,103 @@
+# Logging level must be set before importing any stretch_body class
+import stretch_body.robot_params
+stretch_body.robot_params.RobotParams.set_logging_level("DEBUG")
+
+import unittest
+import stretch_body.trajectory
+import stretch_body.lift
+import stretch_body.base
+from stretch_body.stepper import MODE_POS_TRAJ_INCR
+import numpy as np
+import time
+
+
+class TestTrajectory(unittest.TestCase):
+
+    def test_cubic_spline(self):
+        """Verify the cubic spline passes through the waypoints with continuous velocity.
+        """
+        print('test_cubic_spline')
+        s = stretch_body.trajectory.Spline([0.0, 1.0, 2.5, 3.0], [0.0, 0.4, 0.1, 0.1])
+        x, v, a = s.evaluate(s.t)
+        self.assertTrue(np.allclose(x, s.x))
+        self.assertTrue(np.allclose(v, [0, 0, 0, 0])) #Interior extrema and ends have zero velocity
+        eps = 1e-6
+        xl, vl, al = s.evaluate(s.t[1:-1] - eps)
+        xr, vr, ar = s.evaluate(s.t[1:-1] + eps)
+        self.assertTrue(np.allclose(vl, vr, atol=1e-4))
+        self.assertRaises(ValueError, stretch_body.trajectory.Spline, [0.0, 0.0], [0.0, 1.0])
+
+    def test_quintic_spline(self):
+        """Verify the quintic spline meets waypoint position, velocity and acceleration.
+        """
+        print('test_quintic_spline')
+        t = [0.0, 0.5, 1.5]
+        s = stretch_body.trajectory.Spline(t, [0.0, 0.2, 0.3], v=[0.0, 0.3, 0.0], a=[0.0, -0.1, 0.0])
+        x, v, a = s.evaluate(t)
+        self.assertTrue(np.allclose(x, [0.0, 0.2, 0.3]))
+        self.assertTrue(np.allclose(v, [0.0, 0.3, 0.0]))
+        self.assertTrue(np.allclose(a, [0.0, -0.1, 0.0]))
+
+    def test_stream_and_preempt(self):
+        """Verify incremental setpoints sum to the trajectory, and a preempting trajectory takes over.
+        """
+        print('test_stream_and_preempt')
+        l = stretch_body.lift.Lift()
+        sent = []
+        set_command = l.motor.set_command
+        def spy(**kwargs):
+            sent.append(kwargs)
+            set_command(**kwargs)
+        l.motor.set_command = spy
+        traj = l.trajectory
+        rate = traj.params['rate_hz']
+
+        traj.add([0.1, 0.5], [0.3, 0.5])
+        time.sleep(0.05)
+        self.assertTrue(traj.status['active'])
+        self.assertTrue(traj.status['queue_depth'] > 0)
+        self.assertTrue(traj.wait(timeout=2.0))
+        incr = [c['x_des'] for c in sent if c['mode'] == MODE_POS_TRAJ_INCR]
+        self.assertAlmostEqual(sum(incr), l.translate_to_motor_rad(0.5), places=6)
+        for c in sent: #The lift's gravity feedforward and contact thresholds are kept
+            self.assertEqual((c['stiffness'], c['i_feedforward'], c['i_contact_pos'], c['i_contact_neg']),
+                             (l.stiffness, l.i_feedforward, l.i_contact_pos, l.i_contact_neg))
+        self.assertNotEqual(l.i_feedforward, 0)
+        self.assertTrue(abs(traj.status['n_setpoints'] - (0.5 * rate + 1)) <= 2)
+
+        sent[:] = []
+        l.status['pos'] = 0.5 #As if the lift followed
+        traj.add([0.0, 2.0], [0.5, 0.1])
+        time.sleep(0.2)
+        traj.add([0.5], [0.4], preempt=True)
+        self.assertTrue(traj.wait(timeout=2.0))
+        incr = [c['x_des'] for c in sent if c['mode'] == MODE_POS_TRAJ_INCR]
+        self.assertEqual(traj.status['n_preempted'], 1)
+        self.assertAlmostEqual(sum(incr), l.translate_to_motor_rad(0.4 - 0.5), places=6)
+        self.assertTrue(traj.status['tracking_error']['n'] == 0) #No status from hardware
+        l.stop()
+
+    def test_base_stream(self):
+        """Verify the base stream sends the contact thresholds, and is slowed while fast motion isn't allowed.
+        """
+        print('test_base_stream')
+        b = stretch_body.base.Base()
+        sent = {'left': [], 'right': []}
+        for side, m in [('left', b.left_wheel), ('right', b.right_wheel)]:
+            def spy(set_command=m.set_command, side=side, **kwargs):
+                sent[side].append(kwargs)
+                set_command(**kwargs)
+            m.set_command = spy
+        b.fast_motion_allowed = False
+        b.trajectory.add([0, 0.5], [0, 0.2])
+        self.assertTrue(b.trajectory.wait(timeout=2.0))
+        v_max = b.translate_to_motor_rad(b.params['sentry_max_velocity']['limit_vel_m'])
+        a_max = b.translate_to_motor_rad(b.params['sentry_max_velocity']['limit_accel_m'])
+        for side, i_contact in [('left', b.i_contact_l), ('right', b.i_contact_r)]:
+            incr = [c for c in sent[side] if c['mode'] == MODE_POS_TRAJ_INCR]
+            self.assertAlmostEqual(sum([c['x_des'] for c in incr]), b.translate_to_motor_rad(0.2), places=6)
+            for c in incr[1:]:
+                self.assertTrue(c['v_des'] <= v_max and c['a_des'] <= a_max)
+                self.assertEqual((c['stiffness'], c['i_feedforward'], c['i_contact_pos'], c['i_contact_neg']),
+                                 (b.stiffness, 0, i_contact, -1 * i_contact))
+        b.stop()
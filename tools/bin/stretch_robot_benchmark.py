@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+from __future__ import print_function
+from stretch_body.robot_params import RobotParams
+from stretch_body.hello_utils import *
+import argparse
+import sys
+print_stretch_re_use()
+
+parser=argparse.ArgumentParser(description='Measure the loop rates, command latency and CPU use per subsystem of the Robot (see stretch_body.robot_benchmark)')
+parser.add_argument("--hardware", help="Run on the robot hardware (default: the simulated hardware of stretch_body.robot_sim)",action="store_true")
+parser.add_argument("--duration", help="Seconds to measure loop rates and CPU use over",type=float,default=10.0)
+parser.add_argument("--trials", help="Number of moves per joint to measure the command latency (0 to skip). Joints move by 1cm / 0.05rad",type=int,default=10)
+parser.add_argument("--home", help="Home the robot first, so the lift and arm are included in the latency",action="store_true")
+parser.add_argument("--time_scale", help="Speed of the simulated hardware, as a multiple of real time",type=float,default=1.0)
+parser.add_argument("--rpc_time", help="Round trip time of each simulated board RPC (s)",type=float,default=None)
+parser.add_argument("--import_time", help="Only measure the time to import stretch_body.robot, with and without the params cache, over N processes",type=int,metavar='N',default=0)
+args=parser.parse_args()
+
+if args.import_time>0:
+    from stretch_body.robot_benchmark import measure_import_time, print_import_time
+    print_import_time(measure_import_time(runs=args.import_time))
+    sys.exit(0)
+
+if not args.hardware:
+    sim_params={'enabled':1,'time_scale':args.time_scale,'calibrated':int(not args.home)}
+    if args.rpc_time is not None:
+        sim_params['rpc_time_s']=args.rpc_time
+    RobotParams.add_params({'robot_sim':sim_params})
+
+from stretch_body.robot import Robot
+from stretch_body.robot_benchmark import RobotBenchmark
+
+r=Robot()
+r.startup()
+try:
+    if args.home:
+        r.home()
+    b=RobotBenchmark(r)
+    print('Measuring for %.1fs...'%args.duration)
+    b.run(duration_s=args.duration,latency_trials=args.trials)
+    b.pretty_print()
+    if r.sim is not None:
+        r.sim.pretty_print()
+except (KeyboardInterrupt, SystemExit,ThreadServiceExit):
+    pass
+r.stop()
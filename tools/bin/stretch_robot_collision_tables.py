@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+from __future__ import print_function
+from stretch_body.robot_collision_table import CollisionLimitTable
+from stretch_body.robot_params import RobotParams
+import stretch_body.hello_utils as hu
+import argparse
+import importlib
+import os
+import time
+hu.print_stretch_re_use()
+
+parser=argparse.ArgumentParser(description='Precompute the joint limit lookup tables of the collision models and check them against the models. '
+                                           'Tables are used at run time by models with table enabled in their params.')
+parser.add_argument("--rebuild", help="Rebuild tables that are already cached",action="store_true")
+parser.add_argument("--n_check", help="Number of random configurations to check each table at",type=int,default=100000)
+args=parser.parse_args()
+
+robot_params=RobotParams.get_params()[1]
+model_names=robot_params['robot_collision']['models']+robot_params[robot_params['robot']['tool']].get('collision_models',[])
+table_dir=os.path.join(hu.get_fleet_directory(),robot_params['robot_collision']['table_dir'])
+tolerance=robot_params['robot_collision']['max_interp_step']
+
+for name in model_names:
+    p=robot_params[name]
+    model=getattr(importlib.import_module(p['py_module_name']),p['py_class_name'])(None)
+    if 'table' not in p or model.depends_on is None:
+        print('%s: no table grid, or the model does not declare depends_on. Skipping.'%name)
+        continue
+    fn=os.path.join(table_dir,CollisionLimitTable.get_key(model,p['table']['grid'])+'.npz')
+    if args.rebuild and os.path.isfile(fn):
+        os.remove(fn)
+    ts=time.time()
+    t=CollisionLimitTable.load_or_build(model,p['table']['grid'],robot_params['robot_collision']['max_interp_step'],table_dir)
+    dt=time.time()-ts
+    r=t.check(model,n=args.n_check,tolerance=tolerance)
+    print('---- %s ----'%name)
+    print('Table', fn)
+    print('Enabled', p['table']['enabled'])
+    print('Grid', ', '.join(['%s [%.3f, %.3f] x %d'%(j,t.grid[j][0],t.grid[j][1],t.grid[j][2]) for j in t.joints]))
+    print('Size (MB) %.2f, load / build time (s) %.2f'%(t.nbytes()/1e6,dt))
+    print('Check at %d configurations: max error %.4f, looser than the model %d, over tolerance (%.3f) %d'%(args.n_check,r['max_error'],r['n_unsafe'],tolerance,r['n_over_tolerance']))
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+from __future__ import print_function
+from stretch_body.dynamixel_bus_tuner import DynamixelBusTuner
+from stretch_body.robot_params import RobotParams
+import argparse
+import stretch_body.hello_utils as hu
+hu.print_stretch_re_use()
+
+parser=argparse.ArgumentParser(description='Find the fastest reliable baud rate and latency settings for the Dynamixel chains and save them to the user YAML. '
+                                           'Servos are torque disabled while tuning. Stop all other robot processes first.')
+parser.add_argument("--head", help="Tune the head chain",action="store_true")
+parser.add_argument("--wrist", help="Tune the end of arm chain (current tool)",action="store_true")
+parser.add_argument("--no_save", help="Report results but don't write the user YAML",action="store_true")
+args=parser.parse_args()
+
+robot_params=RobotParams.get_params()[1]
+chains=[]
+if args.head:
+    chains.append(('head',['head_pan','head_tilt']))
+if args.wrist:
+    tool=robot_params['robot']['tool']
+    chains.append((tool,list(robot_params[tool]['devices'].keys())))
+if not len(chains):
+    parser.print_help()
+    exit()
+
+for chain_name, motor_names in chains:
+    print('---- Tuning %s ----'%chain_name)
+    t=DynamixelBusTuner(chain_name,motor_names)
+    if t.tune(save=not args.no_save) is None:
+        print('Unable to tune %s. See log for details.'%chain_name)
+    else:
+        t.pretty_print()
+print('')
+print('The Dynamixel status thread runs at robot.dxl_status_rate_hz (%.1f Hz before tuning).'%robot_params['robot']['dxl_status_rate_hz'])
+print('Once the head and tool chains are both tuned and saved, it is set in the user YAML from their measured rates.')
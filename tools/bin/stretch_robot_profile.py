@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+from __future__ import print_function
+from stretch_body.robot_params import RobotParams
+from stretch_body.hello_utils import *
+import stretch_body.profiler as profiler
+import argparse
+import time
+print_stretch_re_use()
+
+parser=argparse.ArgumentParser(description='Profile the Robot startup and status loops, as time per named span (see stretch_body.profiler)')
+parser.add_argument("--hardware", help="Run on the robot hardware (default: the simulated hardware of stretch_body.robot_sim)",action="store_true")
+parser.add_argument("--duration", help="Seconds to profile the status loops for, after startup",type=float,default=10.0)
+parser.add_argument("--home", help="Home the robot after startup (profiled as well)",action="store_true")
+parser.add_argument("--time_scale", help="Speed of the simulated hardware, as a multiple of real time",type=float,default=1.0)
+parser.add_argument("--top", help="Number of spans to list, by total time",type=int,default=40)
+parser.add_argument("--trace", help="Chrome trace JSON to write (default: under the stretch_user log directory)",type=str,default=None)
+parser.add_argument("--max_events", help="Number of most recent spans kept for the trace",type=int,default=200000)
+args=parser.parse_args()
+
+if not args.hardware:
+    RobotParams.add_params({'robot_sim':{'enabled':1,'time_scale':args.time_scale,'calibrated':int(not args.home)}})
+
+from stretch_body.robot import Robot
+
+profiler.enable(max_events=args.max_events)
+r=Robot()
+try:
+    r.startup()
+    r.device_startup.pretty_print()
+    if args.home:
+        r.home()
+    print('Profiling for %.1fs...'%args.duration)
+    time.sleep(args.duration)
+except (KeyboardInterrupt, SystemExit,ThreadServiceExit):
+    pass
+profiler.disable()
+r.stop()
+profiler.pretty_print(args.top)
+trace=args.trace if args.trace is not None else get_stretch_directory('log/')+'stretch_profile_%s.json'%create_time_string()
+profiler.write_chrome_trace(trace)
+print('Chrome trace written to %s (open in chrome://tracing or ui.perfetto.dev)'%trace)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+from __future__ import print_function
+from stretch_body.robot import Robot
+from stretch_body.telemetry import TelemetryRecorder, TelemetryReader
+from stretch_body.hello_utils import *
+import argparse
+import time
+print_stretch_re_use()
+
+parser=argparse.ArgumentParser(description='Record the full Robot status to binary telemetry files (see stretch_body.telemetry). Ctrl-C to stop')
+parser.add_argument("--path", help="Directory to record to (default: under the telemetry log_dir)",type=str,default=None)
+parser.add_argument("--duration", help="Seconds to record for (default: until Ctrl-C)",type=float,default=None)
+parser.add_argument("--compress", help="Compress chunks as they are closed",action="store_true")
+args=parser.parse_args()
+
+r=Robot()
+r.startup()
+rec=TelemetryRecorder(r.status,path=args.path,metadata={'serial_no':r.params['serial_no'],'batch_name':r.params['batch_name']})
+if args.compress:
+    rec.params['compress']=1
+rec.startup()
+print('Recording to %s. Ctrl-C to exit'%rec.path)
+ts=time.time()
+try:
+    while args.duration is None or time.time()-ts<args.duration:
+        time.sleep(1.0)
+        print('Rows %d, chunks %d, late samples %d, CPU %.2f%%'%(rec.status['n_rows'],rec.status['n_chunks'],rec.status['n_late'],rec.status['cpu_percent']))
+except (KeyboardInterrupt, SystemExit,ThreadServiceExit):
+    pass
+rec.stop()
+r.stop()
+rec.pretty_print()
+rd=TelemetryReader(rec.path)
+print('Recorded %d rows of %d columns'%(rd.n_rows,len(rd.columns)))
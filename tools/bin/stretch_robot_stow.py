@@ -6,5 +6,7 @@ hu.print_stretch_re_use()
 
 robot = rb.Robot()
 robot.startup()
-robot.stow()
+t=robot.stow(blocking=False)
+t.wait()
+t.pretty_print()
 robot.stop()
@@ -4,11 +4,13 @@ import math
 import yaml
 import pathlib
 import urdfpy
+import numpy as np
 import pyrender
 import warnings
 
 from hello_helpers.gripper_conversion import GripperConversion
 import stretch_body.robot
+from stretch_body.forward_kinematics import ForwardKinematics
 import stretch_body.hello_utils as hu
 hu.print_stretch_re_use()
 warnings.filterwarnings("ignore")
@@ -20,12 +22,34 @@ class URDFVisualizer:
     in review.
     """
 
-    def __init__(self, urdf):
+    def __init__(self, urdf, fk=None):
         self.urdf = urdf
+        self.fk = fk
         self.nodes = None
+        self.node_links = None
         self.scene = None
         self.viewer = None
 
+    def get_meshes(self, use_collision=False):
+        """List of (trimesh, link name, 4x4 pose of the mesh in the link frame), in the order of
+        `urdfpy.URDF.visual_trimesh_fk` / `collision_trimesh_fk`
+        """
+        meshes = []
+        for link in self.urdf.links:
+            if use_collision:
+                if link.collision_mesh is not None:
+                    meshes.append((link.collision_mesh, link.name, np.eye(4)))
+                continue
+            for visual in link.visuals:
+                for mesh in visual.geometry.meshes:
+                    pose = visual.origin
+                    if visual.geometry.mesh is not None and visual.geometry.mesh.scale is not None:
+                        S = np.eye(4, dtype=np.float64)
+                        S[:3, :3] = np.diag(visual.geometry.mesh.scale)
+                        pose = pose.dot(S)
+                    meshes.append((mesh, link.name, pose))
+        return meshes
+
     def show(self, cfg=None, use_collision=False):
         """Visualize the URDF in a given configuration.
         Parameters
@@ -40,30 +64,27 @@ class URDFVisualizer:
             If True, the collision geometry is visualized instead of
             the visual geometry.
         """
-        if use_collision:
-            fk = self.urdf.collision_trimesh_fk(cfg=cfg)
-        else:
-            fk = self.urdf.visual_trimesh_fk(cfg=cfg)
-
+        lfk = dict([(link.name, pose) for link, pose in self.urdf.link_fk(cfg=cfg).items()])
         self.scene = pyrender.Scene()
         self.nodes = []
-        for tm in fk:
-            pose = fk[tm]
+        self.node_links = []
+        for tm, link_name, offset in self.get_meshes(use_collision):
             mesh = pyrender.Mesh.from_trimesh(tm, smooth=False)
-            mesh_node = self.scene.add(mesh, pose=pose)
+            mesh_node = self.scene.add(mesh, pose=lfk[link_name].dot(offset))
             self.nodes.append(mesh_node)
+            self.node_links.append((link_name, offset))
         self.viewer = pyrender.Viewer(self.scene, run_in_thread=True, use_raymond_lighting=True)
 
     def update_pose(self, cfg=None, use_collision=False):
-        if use_collision:
-            fk = self.urdf.collision_trimesh_fk(cfg=cfg)
+        """Move the meshes to a new configuration. Uses the batched NumPy FK if available, as it is much faster than urdfpy"""
+        if self.fk is not None:
+            lfk = self.fk.links_fk(cfg if cfg is not None else {}, links=list(set([l for l, o in self.node_links])))
         else:
-            fk = self.urdf.visual_trimesh_fk(cfg=cfg)
+            lfk = dict([(link.name, pose) for link, pose in self.urdf.link_fk(cfg=cfg).items()])
 
         self.viewer.render_lock.acquire()
-        for i, tm in enumerate(fk):
-            pose = fk[tm]
-            self.scene.set_pose(self.nodes[i], pose=pose)
+        for i, (link_name, offset) in enumerate(self.node_links):
+            self.scene.set_pose(self.nodes[i], pose=lfk[link_name].dot(offset))
         self.viewer.render_lock.release()
 
 class StretchState:
@@ -149,7 +170,7 @@ if __name__ == "__main__":
     urdf_path = calibration_dir / 'stretch.urdf'
     controller_params_path = calibration_dir / 'controller_calibration_head.yaml'
     urdf = urdfpy.URDF.load(str(urdf_path.absolute()))
-    viz = URDFVisualizer(urdf)
+    viz = URDFVisualizer(urdf, ForwardKinematics(urdf_file=str(urdf_path.absolute())))
     with open(str(controller_params_path.absolute()), 'r') as f:
         controller_params = yaml.load(f, Loader=yaml.FullLoader)
 
@@ -26,7 +26,7 @@ def run(cmd, timeout_sec):
 tools=['stretch_about.py','stretch_arm_home.py -h','stretch_arm_jog.py','stretch_audio_test.py',
         'stretch_base_jog.py','stretch_gripper_home.py -h', 'stretch_gripper_jog.py','stretch_hardware_echo.py',
         'stretch_head_jog.py','stretch_lift_home.py -h','stretch_lift_jog.py', 'stretch_params.py','stretch_pimu_jog.py',
-        'stretch_pimu_scope.py --ax','stretch_respeaker_test.py', 'stretch_robot_battery_check.py','stretch_robot_dynamixel_reboot.py',
+        'stretch_pimu_scope.py --ax','stretch_respeaker_test.py', 'stretch_robot_battery_check.py','stretch_robot_dynamixel_reboot.py','stretch_robot_dynamixel_tune.py',
         'stretch_robot_home.py -h','stretch_robot_jog.py','stretch_robot_keyboard_teleop.py','stretch_robot_monitor.py',
         'stretch_robot_system_check.py','stretch_rp_lidar_jog.py --range',
         'stretch_wacc_jog.py','stretch_wacc_scope.py','stretch_wrist_yaw_jog.py','stretch_xbox_controller_teleop.py']